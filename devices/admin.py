@@ -2,6 +2,10 @@ from django.contrib import admin
 from django.contrib import messages
 from django.conf import settings
 from django import forms
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
 from .models import DeviceType, Device, System, Unit, GatewayIOT
 from .simulator_control import start_simulator, stop_simulator
 from .thingsboard_gateway import test_gateway_connection
@@ -16,14 +20,90 @@ class GatewayIOTAdminForm(forms.ModelForm):
             'api_key': forms.PasswordInput(render_value=True),
         }
 
+# Above this many rows an unfiltered changelist shows PostgreSQL's row estimate instead of COUNT(*)
+ESTIMATED_COUNT_THRESHOLD = 100000
+# The unit filter lists the units of the selected system only, and only up to this many
+UNIT_FILTER_MAX_CHOICES = 200
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= ESTIMATED_COUNT_THRESHOLD:
+                return row[0]
+        return super().count
+
+
+class UnitListFilter(admin.SimpleListFilter):
+    title = 'unit'
+    parameter_name = 'unit__id__exact'
+
+    def lookups(self, request, model_admin):
+        # every unit of a large fleet would make the sidebar the slowest part of the page
+        system = request.GET.get('system__id__exact')
+        if not system:
+            return ()
+        units = list(
+            Unit.objects.filter(system_id=system).order_by('name')
+            .values_list('pk', 'name')[:UNIT_FILTER_MAX_CHOICES + 1]
+        )
+        return units if len(units) <= UNIT_FILTER_MAX_CHOICES else ()
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(unit_id=self.value())
+        return queryset
+
+
 @admin.register(DeviceType)
 class DeviceTypeAdmin(admin.ModelAdmin):
     list_display = ('name',)
+    search_fields = ('name',)
 
 @admin.register(Device)
 class DeviceAdmin(admin.ModelAdmin):
-    list_filter = ('device_type', 'system', 'unit')
+    list_filter = ('device_type', 'system', UnitListFilter)
     list_display = ('device_id', 'device_type', 'token', 'system', 'unit')
+    list_select_related = ('device_type', 'system', 'unit__system')
+    search_fields = ('device_id',)
+    search_help_text = 'Inicio do device_id (ex: "House 12 -"), token ou thingsboard_id exato'
+    autocomplete_fields = ('device_type', 'system', 'unit')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        # indexed lookups only: a device_id prefix (unique index) or an exact token / thingsboard_id
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        return queryset.filter(Q(device_id__startswith=term) | Q(token=term) | Q(thingsboard_id=term)), False
+
+    def delete_queryset(self, request, queryset):
+        remote = queryset.exclude(thingsboard_id__isnull=True).exclude(thingsboard_id='').count()
+        super().delete_queryset(request, queryset)
+        self._report_remote_deletions(request, remote)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        self._report_remote_deletions(request, 1 if obj.thingsboard_id else 0)
+
+    def _report_remote_deletions(self, request, remote):
+        # the signal only queues them: ThingsBoard is updated by a background worker (thingsboard_deletions)
+        if remote and getattr(settings, 'ALLOW_THINGSBOARD_DELETE', False):
+            self.message_user(
+                request,
+                f"{remote} devices serao removidos do ThingsBoard em segundo plano; acompanhe o progresso no dashboard.",
+                level=messages.INFO,
+            )
 
 
 @admin.register(GatewayIOT)
@@ -122,7 +202,24 @@ class GatewayIOTAdmin(admin.ModelAdmin):
 @admin.register(System)
 class SystemAdmin(admin.ModelAdmin):
     list_display = ('name', 'description', )
+    search_fields = ('name',)
 
 @admin.register(Unit)
 class UnitAdmin(admin.ModelAdmin):
     list_display = ('name', 'system')
+    list_filter = ('system',)
+    search_fields = ('name',)
+    ordering = ('name',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # str(unit) shows the system: joined for the changelist and the Device.unit autocomplete alike
+        return super().get_queryset(request).select_related('system')
+
+    def get_search_results(self, request, queryset, search_term):
+        # autocomplete for Device.unit: name prefix
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        return queryset.filter(name__startswith=term), False
@@ -0,0 +1,306 @@
+"""Shared helpers for the benchmark management commands.
+
+A benchmark runs against a throw-away SQLite database (registered as an extra
+Django connection alias) and local stand-ins for ThingsBoard, MQTT and
+Influx, so it never touches the configured database or real services.
+Results are appended as one JSON object per line to a results file, which
+makes runs easy to diff between commits.
+"""
+from __future__ import annotations
+
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connections
+
+
+DEFAULT_RESULTS_FILE = Path(settings.BASE_DIR) / "benchmarks" / "results.jsonl"
+DEFAULT_TEMPLATE = Path(settings.BASE_DIR) / "condominium.json"
+BENCH_SYSTEM_NAME = "Benchmark"
+
+
+def percentiles(values, points=(50, 90, 99)) -> dict:
+    """Nearest-rank percentiles in milliseconds for a list of seconds."""
+    if not values:
+        return {f"p{p}_ms": None for p in points} | {"max_ms": None, "mean_ms": None}
+    ordered = sorted(values)
+    result = {}
+    for p in points:
+        rank = max(0, min(len(ordered) - 1, math.ceil(p / 100.0 * len(ordered)) - 1))
+        result[f"p{p}_ms"] = round(ordered[rank] * 1000.0, 3)
+    result["max_ms"] = round(ordered[-1] * 1000.0, 3)
+    result["mean_ms"] = round(sum(ordered) / len(ordered) * 1000.0, 3)
+    return result
+
+
+class LatencyStats:
+    """Call counts and recent latencies per operation, reported with ``percentiles``."""
+
+    def __init__(self, samples: int = 4096):
+        self.samples = samples
+        self.counts = {}
+        self._latencies = {}
+
+    def record(self, op, seconds):
+        self.counts[op] = self.counts.get(op, 0) + 1
+        window = self._latencies.get(op)
+        if window is None:
+            window = self._latencies[op] = deque(maxlen=self.samples)
+        window.append(seconds)
+
+    def as_dict(self) -> dict:
+        return {op: {"count": count, **percentiles(list(self._latencies[op]))} for op, count in self.counts.items()}
+
+
+def git_revision() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, timeout=5,
+        )
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_metadata(label=None) -> dict:
+    return {
+        "timestamp": int(time.time()),
+        "git_revision": git_revision(),
+        "label": label,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def append_result(path, record: dict):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a", encoding="utf-8") as f:
+        f.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def import_time_profile(args, env=None, top: int = 10) -> dict:
+    """Run ``manage.py <args>`` under ``python -X importtime`` and summarise the output.
+
+    Returns the wall time of the whole command, the summed self time of every
+    import and the ``top`` top-level imports by cumulative time.
+    """
+    started = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "manage.py", *args],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - started
+    total_us, modules, top_level = 0, 0, []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+            self_us, cumulative_us = int(self_us), int(cumulative_us)
+        except ValueError:
+            continue  # header line
+        modules += 1
+        total_us += self_us
+        # nesting is encoded as two spaces per level before the module name
+        if not name[1:].startswith(" "):
+            top_level.append((cumulative_us, name.strip()))
+    top_level.sort(reverse=True)
+    return {
+        "wall_s": round(wall, 3),
+        "returncode": out.returncode,
+        "modules": modules,
+        "imports_ms": round(total_us / 1000.0, 1),
+        "top_imports_ms": {name: round(us / 1000.0, 1) for us, name in top_level[:top]},
+    }
+
+
+def last_tagged_json(path, tag: str):
+    """Last ``<tag> {json}`` line of a log file, decoded; None when absent."""
+    found = None
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if line.startswith(tag + " "):
+                    found = line[len(tag) + 1:]
+    except OSError:
+        return None
+    try:
+        return json.loads(found) if found else None
+    except ValueError:
+        return None
+
+
+class ProcessSampler:
+    """CPU time and memory of a process read from /proc (Linux only; returns None elsewhere)."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self._ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self.peak_rss = 0
+
+    def cpu_seconds(self):
+        try:
+            fields = Path(f"/proc/{self.pid}/stat").read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            return None
+        # utime and stime are fields 14 and 15 of stat; index 11/12 after the comm field
+        return (int(fields[11]) + int(fields[12])) / self._ticks
+
+    def rss_bytes(self):
+        try:
+            for line in Path(f"/proc/{self.pid}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    value = int(line.split()[1]) * 1024
+                    self.peak_rss = max(self.peak_rss, value)
+                    return value
+        except OSError:
+            return None
+        return None
+
+
+class BenchmarkSandbox:
+    """Temporary SQLite database, migrated and reachable as a Django alias."""
+
+    def __init__(self, alias: str = "benchmark", keep: bool = False):
+        self.alias = alias
+        self.keep = keep
+        self.directory = Path(tempfile.mkdtemp(prefix="iot_sim_bench_"))
+        self.db_path = self.directory / "db.sqlite3"
+
+    def __enter__(self):
+        base = dict(connections.databases["default"])
+        base.update({"ENGINE": "django.db.backends.sqlite3", "NAME": str(self.db_path), "OPTIONS": {}})
+        connections.databases[self.alias] = base
+        call_command("migrate", database=self.alias, verbosity=0, interactive=False)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            connections[self.alias].close()
+        except Exception:
+            pass
+        connections.databases.pop(self.alias, None)
+        if not self.keep:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def env(self, **extra) -> dict:
+        env = os.environ.copy()
+        for key in ("POSTGRES_HOST", "POSTGRES_DB"):
+            env.pop(key, None)
+        env["SQLITE_DB_PATH"] = str(self.db_path)
+        # the RPC audit log of the spawned simulators stays in the sandbox, not in the checkout
+        env["SIMULATOR_RPC_LOG_DIR"] = str(self.directory)
+        env.setdefault("DJANGO_SETTINGS_MODULE", "iot_simulator.settings_base")
+        env.update({k: str(v) for k, v in extra.items()})
+        return env
+
+    def spawn_manage(self, args, log_name: str, **env):
+        log = (self.directory / log_name).open("ab")
+        return subprocess.Popen(
+            [sys.executable, "manage.py", *args],
+            cwd=settings.BASE_DIR,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            env=self.env(**env),
+        )
+
+    def add_gateway(self, base_url: str, mqtt_port: int, username: str, password: str):
+        # bulk_create skips GatewayIOT.save(), which would touch the default database
+        from devices.models import GatewayIOT
+
+        GatewayIOT.objects.using(self.alias).bulk_create([GatewayIOT(
+            name="benchmark-standins",
+            base_url=base_url,
+            mqtt_port=mqtt_port,
+            auth_method=GatewayIOT.AUTH_METHOD_USER_PASSWORD,
+            username=username,
+            password=password,
+            is_active=True,
+        )])
+        connections[self.alias].close()
+
+    def device_ids(self) -> set:
+        """device_id of every device currently in the sandbox database."""
+        from devices.models import Device
+
+        try:
+            return set(Device.objects.using(self.alias).values_list("device_id", flat=True))
+        finally:
+            connections[self.alias].close()
+
+    def seed_fleet(self, count: int, template_path=DEFAULT_TEMPLATE, token_for=None, tb_id_for=None,
+                   batch_size: int = 2000):
+        """Replicate the unit template (condominium.json) until ``count`` devices exist.
+
+        Rows are bulk-inserted so the ThingsBoard reconciliation in Device.save
+        does not run; ``token_for``/``tb_id_for`` map a device name to the
+        credentials a stand-in will accept. Returns the list of device names.
+        """
+        from devices.models import Device, DeviceType, System, Unit
+
+        with open(template_path, "r", encoding="utf-8") as f:
+            template = json.load(f)
+        prefix = template.get("template_name", "Unit")
+        entries = template["devices"]
+
+        db = self.alias
+        system = System.objects.using(db).create(name=BENCH_SYSTEM_NAME)
+        types = {}
+        for entry in entries:
+            name = entry["device_type"]
+            if name not in types:
+                types[name] = DeviceType.objects.using(db).get_or_create(name=name)[0]
+
+        units_needed = math.ceil(count / len(entries))
+        Unit.objects.using(db).bulk_create(
+            [Unit(name=f"{prefix} {i}", system=system) for i in range(1, units_needed + 1)],
+            batch_size=batch_size,
+        )
+        units = {u.name: u for u in Unit.objects.using(db).filter(system=system)}
+
+        names, batch = [], []
+        for index in range(count):
+            replica, entry = divmod(index, len(entries))
+            unit_name = f"{prefix} {replica + 1}"
+            device_id = f"{unit_name} - {entries[entry]['base_name']}"
+            names.append(device_id)
+            batch.append(Device(
+                device_id=device_id,
+                device_type=types[entries[entry]["device_type"]],
+                token=token_for(device_id) if token_for else "",
+                thingsboard_id=tb_id_for(device_id) if tb_id_for else None,
+                state=entries[entry].get("state", {}),
+                system=system,
+                unit=units[unit_name],
+            ))
+            if len(batch) >= batch_size:
+                Device.objects.using(db).bulk_create(batch)
+                batch = []
+        if batch:
+            Device.objects.using(db).bulk_create(batch)
+        return names
+
+
+def stop_process(process, timeout: float = 15.0):
+    if process.poll() is not None:
+        return process.returncode
+    process.terminate()
+    try:
+        return process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        return process.wait(timeout=timeout)
@@ -0,0 +1,172 @@
+"""Database access for ``send_telemetry`` off the event loop.
+
+``sync_to_async`` runs every ORM call on one shared thread. That makes state
+reads wait behind saves, and behind ThingsBoard reconciliation inside
+``Device.save()``. ``DatabaseExecutor`` splits the work:
+
+* reads run on a pool of ``readers`` threads, each with its own connection;
+* device-state writes queue up per device (a newer state replaces a queued
+  one) and a single writer thread commits everything queued in one
+  transaction, up to ``max_batch`` states. While a transaction commits, new
+  updates gather for the next one, so batches grow with load.
+
+With SQLite the executor's connections switch the database to WAL, so
+readers are not blocked while the writer commits, and begin their
+transactions IMMEDIATE. Other connections keep their settings; the WAL mode
+itself is stored in the database file (``restore_db`` and ``backup_db``
+handle it).
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from devices.benchmarking import LatencyStats
+from devices.models import Device
+
+
+class DatabaseExecutor:
+    def __init__(self, readers: int = 4, max_batch: int = 500, alias: str = "default"):
+        if readers < 1 or max_batch < 1:
+            raise ValueError("readers and max_batch must be >= 1")
+        self.readers = readers
+        self.max_batch = max_batch
+        self.alias = alias
+        self.stats = LatencyStats()
+        self.transactions = 0
+        self.states_written = 0
+        self.merged = 0
+        self.failed = 0
+        self.max_transaction = 0
+        self._read_pool = ThreadPoolExecutor(readers, thread_name_prefix="db-read", initializer=self._configure)
+        self._write_pool = ThreadPoolExecutor(1, thread_name_prefix="db-write", initializer=self._configure)
+        self._pending = {}  # pk -> [state, enqueued_at, futures]
+        self._wakeup = None
+        self._idle = None
+        self._writer = None
+
+    def _configure(self):
+        # this thread's connection only (connections are per thread), before it is opened
+        connection = connections[self.alias]
+        if connection.vendor == "sqlite":
+            options = {
+                **connection.settings_dict.get("OPTIONS", {}),
+                "init_command": settings.SQLITE_WAL_INIT_COMMAND,
+                "transaction_mode": "IMMEDIATE",
+            }
+            connection.settings_dict = {**connection.settings_dict, "OPTIONS": options}
+
+    async def start(self):
+        if self._writer is None:
+            self._wakeup = asyncio.Event()
+            self._idle = asyncio.Event()
+            self._idle.set()
+            self._writer = asyncio.create_task(self._write_loop())
+
+    async def read(self, fn, *args):
+        """Run ``fn(*args)`` on a reader thread."""
+        enqueued = time.perf_counter()
+
+        def call():
+            started = time.perf_counter()
+            self.stats.record("read_wait", started - enqueued)
+            try:
+                return fn(*args)
+            finally:
+                self.stats.record("read", time.perf_counter() - started)
+
+        return await asyncio.get_running_loop().run_in_executor(self._read_pool, call)
+
+    async def write(self, fn, *args):
+        """Run ``fn(*args)`` on the writer thread, between state transactions."""
+        return await asyncio.get_running_loop().run_in_executor(self._write_pool, fn, *args)
+
+    def submit_state(self, pk, state) -> asyncio.Future:
+        """Queue a state write; the future resolves to True once committed, False if the transaction failed."""
+        future = asyncio.get_running_loop().create_future()
+        entry = self._pending.get(pk)
+        if entry is not None:
+            entry[0] = state
+            entry[2].append(future)
+            self.merged += 1
+        else:
+            self._pending[pk] = [state, time.perf_counter(), [future]]
+        self._idle.clear()
+        self._wakeup.set()
+        return future
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                batch = {}
+                for pk in list(self._pending)[:self.max_batch]:
+                    batch[pk] = self._pending.pop(pk)
+                started = time.perf_counter()
+                for _, enqueued, _ in batch.values():
+                    self.stats.record("queue_wait", started - enqueued)
+                try:
+                    await loop.run_in_executor(
+                        self._write_pool, self._commit, {pk: entry[0] for pk, entry in batch.items()}
+                    )
+                    ok = True
+                except Exception as exc:
+                    ok = False
+                    self.failed += 1
+                    print(f"[db-executor] transaction of {len(batch)} states failed: {type(exc).__name__}: {exc}")
+                self.stats.record("transaction", time.perf_counter() - started)
+                if ok:
+                    self.transactions += 1
+                    self.states_written += len(batch)
+                    self.max_transaction = max(self.max_transaction, len(batch))
+                for _, _, futures in batch.values():
+                    for future in futures:
+                        if not future.done():
+                            future.set_result(ok)
+            self._idle.set()
+
+    def _commit(self, states):
+        with transaction.atomic(using=self.alias):
+            rows = Device.objects.using(self.alias)
+            for pk, state in states.items():
+                rows.filter(pk=pk).update(state=state)
+
+    async def flush(self, timeout=None) -> bool:
+        """Wait until every queued state is committed; False on timeout."""
+        if self._idle is None or self._idle.is_set():
+            return True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def close(self, timeout=10.0) -> bool:
+        flushed = await self.flush(timeout)
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+        # the writer thread's connection; reader connections go away with the process
+        await self.write(lambda: connections[self.alias].close())
+        self._read_pool.shutdown(wait=False)
+        self._write_pool.shutdown(wait=False)
+        return flushed
+
+    def snapshot(self) -> dict:
+        return {
+            "readers": self.readers,
+            "pending": len(self._pending),
+            "transactions": self.transactions,
+            "states_written": self.states_written,
+            "merged": self.merged,
+            "failed": self.failed,
+            "mean_transaction": round(self.states_written / self.transactions, 1) if self.transactions else None,
+            "max_transaction": self.max_transaction,
+            **self.stats.as_dict(),
+        }
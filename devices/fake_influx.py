@@ -0,0 +1,92 @@
+"""Local stand-in for the InfluxDB v2 ``/api/v2/write`` endpoint.
+
+Accepts line protocol (optionally gzip-encoded), counts requests, lines and
+bytes, and answers 204 like Influx does. Nothing is stored.
+"""
+from __future__ import annotations
+
+import asyncio
+import gzip
+import time
+
+from aiohttp import web
+
+
+class InfluxWriteStats:
+    def __init__(self):
+        self.requests = 0
+        self.lines = 0
+        self.bytes = 0
+        self.bytes_on_wire = 0
+        self.by_measurement = {}
+        self.started_at = time.monotonic()
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "lines": self.lines,
+            "bytes": self.bytes,
+            "bytes_on_wire": self.bytes_on_wire,
+            "by_measurement": dict(self.by_measurement),
+        }
+
+
+class FakeInfluxServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency_ms = latency_ms
+        self.stats = InfluxWriteStats()
+        self._runner = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/api/v2/write", self.write)
+        app.router.add_get("/health", self.health)
+        return app
+
+    async def start(self):
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def health(self, request):
+        return web.json_response({"status": "pass"})
+
+    async def write(self, request):
+        # aiohttp inflates Content-Encoding: gzip bodies itself; Content-Length
+        # still reports the size that went over the wire
+        body = await request.read()
+        if body[:2] == b"\x1f\x8b":
+            try:
+                body = gzip.decompress(body)
+            except OSError:
+                return web.json_response({"code": "invalid", "message": "bad gzip body"}, status=400)
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000.0)
+
+        stats = self.stats
+        stats.requests += 1
+        stats.bytes_on_wire += request.content_length or len(body)
+        stats.bytes += len(body)
+        for line in body.splitlines():
+            if not line or line.startswith(b"#"):
+                continue
+            stats.lines += 1
+            measurement = line.split(b",", 1)[0].split(b" ", 1)[0].decode(errors="replace")
+            stats.by_measurement[measurement] = stats.by_measurement.get(measurement, 0) + 1
+        return web.Response(status=204)
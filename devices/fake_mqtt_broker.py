@@ -0,0 +1,397 @@
+"""Minimal in-process MQTT 3.1.1 broker used as a ThingsBoard stand-in.
+
+It speaks enough of the protocol for paho/aiomqtt clients (CONNECT,
+SUBSCRIBE, PUBLISH at QoS 0/1/2, PING, DISCONNECT) and reproduces the
+ThingsBoard device API semantics: ``v1/devices/me/...`` is private to each
+connection and identified by the MQTT username (the device token).
+
+Server-side traffic can be driven two ways:
+
+* in-process, with :meth:`FakeMqttBroker.issue_rpc`;
+* over MQTT, by connecting with the operator username and publishing to
+  ``operator/<token>/rpc/request/<id>``. Anything a device publishes on
+  ``v1/devices/me/<suffix>`` is mirrored to ``operator/<token>/<suffix>``
+  for operators subscribed to it.
+
+Other topics behave as plain pub/sub between clients.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import struct
+import time
+from collections import defaultdict
+from typing import Optional
+
+
+DEVICE_PREFIX = "v1/devices/me/"
+OPERATOR_PREFIX = "operator/"
+DEFAULT_OPERATOR_USERNAME = "operator"
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """MQTT topic filter matching with ``+`` and ``#`` wildcards."""
+    if topic_filter == topic:
+        return True
+    f_parts = topic_filter.split("/")
+    t_parts = topic.split("/")
+    for index, part in enumerate(f_parts):
+        if part == "#":
+            return True
+        if index >= len(t_parts):
+            return False
+        if part != "+" and part != t_parts[index]:
+            return False
+    return len(f_parts) == len(t_parts)
+
+
+def _encode_length(length: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        out.append(byte)
+        if not length:
+            return bytes(out)
+
+
+def _encode_str(value: str) -> bytes:
+    data = value.encode("utf-8")
+    return struct.pack("!H", len(data)) + data
+
+
+def _packet(packet_type: int, flags: int, body: bytes) -> bytes:
+    return bytes([(packet_type << 4) | flags]) + _encode_length(len(body)) + body
+
+
+class BrokerStats:
+    def __init__(self):
+        self.connections = 0
+        self.connects_total = 0
+        self.publishes_in = 0
+        self.bytes_in = 0
+        self.telemetry = 0
+        self.rpc_responses = 0
+        self.rpc_requests = 0
+        self.first_telemetry_at: Optional[float] = None
+        self.by_token = defaultdict(int)
+
+    def as_dict(self) -> dict:
+        return {
+            "connections": self.connections,
+            "connects_total": self.connects_total,
+            "publishes_in": self.publishes_in,
+            "bytes_in": self.bytes_in,
+            "telemetry": self.telemetry,
+            "rpc_requests": self.rpc_requests,
+            "rpc_responses": self.rpc_responses,
+            "devices_publishing": len(self.by_token),
+        }
+
+
+class _Session:
+    __slots__ = ("broker", "reader", "writer", "username", "client_id", "subscriptions",
+                 "is_operator", "connected", "_mid", "_closed")
+
+    def __init__(self, broker, reader, writer):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.username = None
+        self.client_id = None
+        self.subscriptions = {}
+        self.is_operator = False
+        self.connected = False
+        self._mid = itertools.count(1)
+        self._closed = False
+
+    def send(self, data: bytes):
+        if not self._closed:
+            self.writer.write(data)
+
+    def deliver(self, topic: str, payload: bytes, qos: int = 0):
+        flags = 0
+        body = _encode_str(topic)
+        if qos:
+            flags = qos << 1
+            mid = next(self._mid) % 65535 or 1
+            body += struct.pack("!H", mid)
+        self.send(_packet(PUBLISH, flags, body + payload))
+
+    def wants(self, topic: str):
+        granted = None
+        for topic_filter, qos in self.subscriptions.items():
+            if topic_matches(topic_filter, topic):
+                granted = qos if granted is None else max(granted, qos)
+        return granted
+
+    async def read_packet(self):
+        header = await self.reader.readexactly(1)
+        multiplier, length = 1, 0
+        while True:
+            byte = (await self.reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                break
+            multiplier *= 128
+        body = await self.reader.readexactly(length) if length else b""
+        return header[0] >> 4, header[0] & 0x0F, body
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            try:
+                self.writer.close()
+            except Exception:
+                pass
+
+
+class FakeMqttBroker:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 operator_username: str = DEFAULT_OPERATOR_USERNAME, allowed_tokens=None, ack_delay_ms: float = 0.0):
+        self.host = host
+        self.port = port
+        self.operator_username = operator_username
+        # None accepts any username; a set restricts device connections like ThingsBoard does
+        self.allowed_tokens = set(allowed_tokens) if allowed_tokens is not None else None
+        # PUBACK/PUBREC sent this long after the PUBLISH, like a broker across a WAN link
+        self.ack_delay = ack_delay_ms / 1000.0
+        self.stats = BrokerStats()
+        self.devices = defaultdict(set)
+        self.sessions = set()
+        self.operators = set()
+        self._server = None
+        self._rpc_ids = itertools.count(1)
+        self._pending_rpcs = {}
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for session in list(self.sessions):
+                session.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    @property
+    def connected_devices(self) -> int:
+        return sum(1 for sessions in self.devices.values() if sessions)
+
+    async def wait_for_devices(self, count: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while self.connected_devices < count:
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.2)
+        return True
+
+    def send_rpc(self, token: str, method: str, params=None, request_id=None) -> Optional[int]:
+        """Push an RPC request to a device; returns the request id or None if offline/unsubscribed."""
+        request_id = request_id if request_id is not None else next(self._rpc_ids)
+        topic = f"{DEVICE_PREFIX}rpc/request/{request_id}"
+        payload = json.dumps({"method": method, "params": params}).encode()
+        delivered = False
+        for session in self.devices.get(token, ()):
+            qos = session.wants(topic)
+            if qos is not None:
+                session.deliver(topic, payload, min(qos, 1))
+                delivered = True
+        if delivered:
+            self.stats.rpc_requests += 1
+            return request_id
+        return None
+
+    async def issue_rpc(self, token: str, method: str, params=None, timeout: float = 10.0):
+        """Send an RPC and wait for ``rpc/response/<id>``; returns (payload, round_trip_seconds).
+
+        Raises ``LookupError`` if the device is not connected and
+        ``asyncio.TimeoutError`` if no response arrives in time.
+        """
+        request_id = next(self._rpc_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending_rpcs[(token, str(request_id))] = future
+        started = time.perf_counter()
+        try:
+            if self.send_rpc(token, method, params, request_id=request_id) is None:
+                raise LookupError(f"device {token} is not connected")
+            payload = await asyncio.wait_for(future, timeout)
+            return payload, time.perf_counter() - started
+        finally:
+            self._pending_rpcs.pop((token, str(request_id)), None)
+
+    async def _handle(self, reader, writer):
+        session = _Session(self, reader, writer)
+        self.sessions.add(session)
+        try:
+            while True:
+                packet_type, flags, body = await session.read_packet()
+                if packet_type == CONNECT:
+                    if not self._on_connect(session, body):
+                        break
+                elif packet_type == PUBLISH:
+                    self._on_publish(session, flags, body)
+                elif packet_type == SUBSCRIBE:
+                    self._on_subscribe(session, body)
+                elif packet_type == UNSUBSCRIBE:
+                    mid = body[:2]
+                    offset = 2
+                    while offset < len(body):
+                        (length,) = struct.unpack_from("!H", body, offset)
+                        session.subscriptions.pop(body[offset + 2:offset + 2 + length].decode(), None)
+                        offset += 2 + length
+                    session.send(_packet(UNSUBACK, 0, mid))
+                elif packet_type == PUBREL:
+                    session.send(_packet(PUBCOMP, 0, body[:2]))
+                elif packet_type == PINGREQ:
+                    session.send(_packet(PINGRESP, 0, b""))
+                elif packet_type == DISCONNECT:
+                    break
+                # PUBACK/PUBREC/PUBCOMP from clients need no action
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._drop(session)
+
+    def _on_connect(self, session, body) -> bool:
+        (name_len,) = struct.unpack_from("!H", body, 0)
+        offset = 2 + name_len
+        level, flags = body[offset], body[offset + 1]
+        offset += 4  # level, flags, keepalive
+        if level not in (3, 4):
+            session.send(_packet(CONNACK, 0, b"\x00\x01"))
+            return False
+
+        def read_field():
+            nonlocal offset
+            (length,) = struct.unpack_from("!H", body, offset)
+            value = body[offset + 2:offset + 2 + length]
+            offset += 2 + length
+            return value
+
+        session.client_id = read_field().decode()
+        if flags & 0x04:  # will topic + message
+            read_field()
+            read_field()
+        if flags & 0x80:
+            session.username = read_field().decode()
+        if flags & 0x40:
+            read_field()
+
+        username = session.username or ""
+        session.is_operator = username == self.operator_username
+        if not session.is_operator and (
+            not username or (self.allowed_tokens is not None and username not in self.allowed_tokens)
+        ):
+            session.send(_packet(CONNACK, 0, b"\x00\x05"))  # not authorized
+            return False
+
+        if session.is_operator:
+            self.operators.add(session)
+        else:
+            self.devices[username].add(session)
+        session.connected = True
+        self.stats.connections += 1
+        self.stats.connects_total += 1
+        session.send(_packet(CONNACK, 0, b"\x00\x00"))
+        return True
+
+    def _on_subscribe(self, session, body):
+        mid = body[:2]
+        offset = 2
+        granted = bytearray()
+        while offset < len(body):
+            (length,) = struct.unpack_from("!H", body, offset)
+            topic_filter = body[offset + 2:offset + 2 + length].decode()
+            qos = min(body[offset + 2 + length] & 0x03, 1)
+            offset += 3 + length
+            session.subscriptions[topic_filter] = qos
+            granted.append(qos)
+        session.send(_packet(SUBACK, 0, mid + bytes(granted)))
+
+    def _on_publish(self, session, flags, body):
+        qos = (flags >> 1) & 0x03
+        (topic_len,) = struct.unpack_from("!H", body, 0)
+        topic = body[2:2 + topic_len].decode()
+        offset = 2 + topic_len
+        if qos:
+            mid = body[offset:offset + 2]
+            offset += 2
+            ack = _packet(PUBACK if qos == 1 else PUBREC, 0, mid)
+            if self.ack_delay > 0:
+                asyncio.get_running_loop().call_later(self.ack_delay, session.send, ack)
+            else:
+                session.send(ack)
+        payload = body[offset:]
+
+        stats = self.stats
+        stats.publishes_in += 1
+        stats.bytes_in += len(payload)
+
+        if session.is_operator:
+            self._route_operator(topic, payload)
+            return
+
+        token = session.username
+        if topic.startswith(DEVICE_PREFIX):
+            suffix = topic[len(DEVICE_PREFIX):]
+            if suffix == "telemetry":
+                stats.telemetry += 1
+                stats.by_token[token] += 1
+                if stats.first_telemetry_at is None:
+                    stats.first_telemetry_at = time.monotonic()
+            elif suffix.startswith("rpc/response/"):
+                stats.rpc_responses += 1
+                future = self._pending_rpcs.get((token, suffix.rsplit("/", 1)[-1]))
+                if future is not None and not future.done():
+                    future.set_result(payload)
+            self._fanout(f"{OPERATOR_PREFIX}{token}/{suffix}", payload, operators_only=True)
+            return
+        self._fanout(topic, payload)
+
+    def _route_operator(self, topic, payload):
+        if topic.startswith(OPERATOR_PREFIX):
+            rest = topic[len(OPERATOR_PREFIX):]
+            token, _, suffix = rest.partition("/")
+            device_topic = DEVICE_PREFIX + suffix
+            if suffix.startswith("rpc/request/"):
+                self.stats.rpc_requests += 1
+            for device_session in self.devices.get(token, ()):
+                qos = device_session.wants(device_topic)
+                if qos is not None:
+                    device_session.deliver(device_topic, payload, qos)
+            return
+        self._fanout(topic, payload)
+
+    def _fanout(self, topic, payload, operators_only=False):
+        for other in (self.operators if operators_only else self.sessions):
+            qos = other.wants(topic)
+            if qos is not None:
+                other.deliver(topic, payload, qos)
+
+    def _drop(self, session):
+        if session in self.sessions:
+            self.sessions.discard(session)
+            self.operators.discard(session)
+            if session.username and not session.is_operator:
+                self.devices[session.username].discard(session)
+            if session.connected:
+                self.stats.connections -= 1
+        session.close()
@@ -0,0 +1,309 @@
+"""Local stand-in for the ThingsBoard REST endpoints used by the simulator.
+
+Covers what ``Device.save`` and the gateway helpers call: login, user check,
+device search by name, device create/update/get/delete, credentials and
+shared-scope attributes. Devices live in memory; tokens and ids are derived
+from the device name so a pre-seeded database and the fake always agree.
+
+The HTTP device API (``/api/v1/{token}/...``) is there too, for
+``send_telemetry --transport http``: telemetry posts are counted, and
+``send_rpc`` queues an RPC for the next long-poll of the device.
+
+``FaultInjection`` adds latency, random 503s and spurious "already exists"
+answers on create, which drive the retry and 409 recovery branches of
+``Device.save``.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+
+from aiohttp import web
+
+
+def fake_device_id(name: str) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"fake-thingsboard/{name}"))
+
+
+def fake_device_token(name: str) -> str:
+    return "tok" + hashlib.sha1(name.encode("utf-8")).hexdigest()[:17]
+
+
+@dataclass
+class FaultInjection:
+    """Per-request delay and failure rates. Login is delayed but never failed."""
+
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0  # share of requests answered with 503
+    conflict_rate: float = 0.0  # share of creates answered "already exists" (the device is still created)
+    seed: int | None = None
+
+    def __post_init__(self):
+        for name in ("error_rate", "conflict_rate"):
+            value = getattr(self, name)
+            if not 0.0 <= value <= 1.0:
+                raise ValueError(f"{name} must be between 0 and 1, got {value}")
+        if self.latency_ms < 0 or self.jitter_ms < 0:
+            raise ValueError("latency_ms and jitter_ms must be >= 0")
+        self.rng = random.Random(self.seed)
+
+    def delay(self) -> float:
+        if not self.latency_ms and not self.jitter_ms:
+            return 0.0
+        return max(0.0, self.latency_ms + self.rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000.0
+
+    def fail(self) -> bool:
+        return self.error_rate > 0 and self.rng.random() < self.error_rate
+
+    def conflict(self) -> bool:
+        return self.conflict_rate > 0 and self.rng.random() < self.conflict_rate
+
+    def as_dict(self) -> dict:
+        return {
+            "latency_ms": self.latency_ms,
+            "jitter_ms": self.jitter_ms,
+            "error_rate": self.error_rate,
+            "conflict_rate": self.conflict_rate,
+        }
+
+
+class FakeThingsBoardStats:
+    def __init__(self):
+        self.requests = 0
+        self.by_endpoint = {}
+        self.injected_errors = 0
+        self.injected_conflicts = 0
+        self.telemetry_posts = 0
+        self.telemetry_samples = 0
+
+    def hit(self, endpoint: str):
+        self.requests += 1
+        self.by_endpoint[endpoint] = self.by_endpoint.get(endpoint, 0) + 1
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "by_endpoint": dict(self.by_endpoint),
+            "injected_errors": self.injected_errors,
+            "injected_conflicts": self.injected_conflicts,
+            "telemetry_posts": self.telemetry_posts,
+            "telemetry_samples": self.telemetry_samples,
+        }
+
+
+class FakeThingsBoardServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, username: str = "tenant@thingsboard.org",
+                 password: str = "tenant", faults: FaultInjection | None = None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.devices = {}  # name -> device dict
+        self.by_id = {}  # id -> name
+        self.attributes = {}
+        self.tokens = {}  # device token -> name
+        self.rpc_queues = {}  # device token -> asyncio.Queue of pending RPC requests
+        self.rpc_responses = {}  # (token, request id) -> future of the device's answer
+        self._rpc_ids = 0
+        self.stats = FakeThingsBoardStats()
+        self.faults = faults or FaultInjection()
+        self._runner = None
+        self._jwt = "fake-jwt-" + uuid.uuid4().hex
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def preload(self, names, device_type: str = "default"):
+        """Register devices up front so the simulator finds them instead of creating them."""
+        for name in names:
+            self._create(name, device_type)
+
+    def _create(self, name: str, device_type: str = "default") -> dict:
+        device_id = fake_device_id(name)
+        device = {
+            "id": {"entityType": "DEVICE", "id": device_id},
+            "createdTime": int(time.time() * 1000),
+            "name": name,
+            "type": device_type,
+            "label": None,
+        }
+        self.devices[name] = device
+        self.by_id[device_id] = name
+        self.tokens[fake_device_token(name)] = name
+        return device
+
+    def make_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._count])
+        r = app.router
+        r.add_post("/api/auth/login", self.login)
+        r.add_get("/api/auth/user", self.auth_user)
+        r.add_get("/api/tenant/devices", self.search_device)
+        r.add_post("/api/device", self.save_device)
+        r.add_get("/api/device/{device_id}", self.get_device)
+        r.add_delete("/api/device/{device_id}", self.delete_device)
+        r.add_get("/api/device/{device_id}/credentials", self.get_credentials)
+        r.add_post("/api/plugins/telemetry/DEVICE/{device_id}/{scope}", self.save_attributes)
+        r.add_post("/api/v1/{token}/telemetry", self.device_telemetry)
+        r.add_get("/api/v1/{token}/rpc", self.device_rpc_poll)
+        r.add_post("/api/v1/{token}/rpc/{request_id}", self.device_rpc_response)
+        return app
+
+    @web.middleware
+    async def _count(self, request, handler):
+        route = request.match_info.route.resource
+        self.stats.hit(f"{request.method} {route.canonical if route is not None else request.path}")
+        delay = self.faults.delay()
+        if delay:
+            await asyncio.sleep(delay)
+        if request.path == "/api/auth/login" or request.path.startswith("/api/v1/"):
+            # the device API authenticates with the token in the path
+            return await handler(request)
+        if not self._authorized(request):
+            return web.json_response({"status": 401, "message": "Authentication failed"}, status=401)
+        if self.faults.fail():
+            self.stats.injected_errors += 1
+            return web.json_response({"status": 503, "message": "Injected failure"}, status=503)
+        return await handler(request)
+
+    def _authorized(self, request) -> bool:
+        header = request.headers.get("X-Authorization", "")
+        return header == f"Bearer {self._jwt}" or header.startswith("ApiKey ")
+
+    async def start(self):
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def login(self, request):
+        body = await request.json()
+        if body.get("username") != self.username or body.get("password") != self.password:
+            return web.json_response({"status": 401, "message": "Invalid username or password"}, status=401)
+        return web.json_response({"token": self._jwt, "refreshToken": "fake-refresh"})
+
+    async def auth_user(self, request):
+        return web.json_response({"email": self.username, "authority": "TENANT_ADMIN"})
+
+    async def search_device(self, request):
+        device = self.devices.get(request.query.get("deviceName", ""))
+        if device is None:
+            return web.json_response({"status": 404, "message": "Requested item wasn't found!"}, status=404)
+        return web.json_response(device)
+
+    async def save_device(self, request):
+        body = json.loads(await request.text() or "{}")
+        name = body.get("name")
+        if not name:
+            return web.json_response({"status": 400, "message": "Device name should be specified!"}, status=400)
+        existing_id = (body.get("id") or {}).get("id")
+        if existing_id:
+            old_name = self.by_id.get(existing_id)
+            if old_name is None:
+                return web.json_response({"status": 404, "message": "Requested item wasn't found!"}, status=404)
+            device = self.devices.pop(old_name)
+            device.update({k: v for k, v in body.items() if k in ("name", "label", "type")})
+            self.devices[device["name"]] = device
+            self.by_id[existing_id] = device["name"]
+            return web.json_response(device)
+        if name in self.devices:
+            return web.json_response(
+                {"status": 400, "message": "Device with such name already exists!"}, status=400
+            )
+        device = self._create(name, body.get("type") or "default")
+        if self.faults.conflict():
+            # a concurrent writer won the race: the device exists but this caller is told it conflicted
+            self.stats.injected_conflicts += 1
+            return web.json_response(
+                {"status": 400, "message": "Device with such name already exists!"}, status=400
+            )
+        return web.json_response(device)
+
+    async def get_device(self, request):
+        name = self.by_id.get(request.match_info["device_id"])
+        if name is None:
+            return web.json_response({"status": 404, "message": "Requested item wasn't found!"}, status=404)
+        return web.json_response(self.devices[name])
+
+    async def delete_device(self, request):
+        name = self.by_id.pop(request.match_info["device_id"], None)
+        if name is None:
+            return web.json_response({"status": 404, "message": "Requested item wasn't found!"}, status=404)
+        self.devices.pop(name, None)
+        return web.Response(status=200)
+
+    async def get_credentials(self, request):
+        device_id = request.match_info["device_id"]
+        name = self.by_id.get(device_id)
+        if name is None:
+            return web.json_response({"status": 404, "message": "Requested item wasn't found!"}, status=404)
+        return web.json_response({
+            "id": {"id": fake_device_id(f"credentials/{name}")},
+            "deviceId": {"entityType": "DEVICE", "id": device_id},
+            "credentialsType": "ACCESS_TOKEN",
+            "credentialsId": fake_device_token(name),
+        })
+
+    async def save_attributes(self, request):
+        device_id = request.match_info["device_id"]
+        if device_id not in self.by_id:
+            return web.json_response({"status": 404, "message": "Requested item wasn't found!"}, status=404)
+        self.attributes[(device_id, request.match_info["scope"])] = await request.json()
+        return web.Response(status=200)
+
+    def send_rpc(self, token: str, method: str, params=None):
+        """Queue a server-side RPC for ``token``; returns a future for the device's response."""
+        self._rpc_ids += 1
+        request_id = self._rpc_ids
+        future = asyncio.get_running_loop().create_future()
+        self.rpc_responses[(token, str(request_id))] = future
+        self.rpc_queues.setdefault(token, asyncio.Queue()).put_nowait(
+            {"id": request_id, "method": method, "params": params or {}}
+        )
+        return future
+
+    async def device_telemetry(self, request):
+        if request.match_info["token"] not in self.tokens:
+            return web.Response(status=401)
+        body = await request.json()
+        self.stats.telemetry_posts += 1
+        self.stats.telemetry_samples += len(body) if isinstance(body, list) else 1
+        return web.Response(status=200)
+
+    async def device_rpc_poll(self, request):
+        token = request.match_info["token"]
+        if token not in self.tokens:
+            return web.Response(status=401)
+        queue = self.rpc_queues.setdefault(token, asyncio.Queue())
+        try:
+            timeout = int(request.query.get("timeout", "30000")) / 1000.0
+            return web.json_response(await asyncio.wait_for(queue.get(), timeout))
+        except asyncio.TimeoutError:
+            return web.Response(status=408)
+
+    async def device_rpc_response(self, request):
+        future = self.rpc_responses.pop((request.match_info["token"], request.match_info["request_id"]), None)
+        if future is None:
+            return web.Response(status=404)
+        if not future.done():
+            future.set_result(await request.json())
+        return web.Response(status=200)
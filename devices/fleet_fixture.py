@@ -0,0 +1,252 @@
+"""Streaming fleet fixtures for standing up simulator instances.
+
+``export_fleet`` writes the device types, systems, units and devices of the
+database as JSON lines, gzipped when the path ends in ``.gz``:
+
+    {"fixture": "fleet", "version": 1, "prefix": "House 1", "credentials": false}
+    {"type": "led"}
+    {"system": "Casa"}
+    {"unit": "House 1", "system": "Casa"}
+    {"device": "House 1 - Led", "type": "led", "system": "Casa", "unit": "House 1", "state": {"status": false}}
+    {"end": {"types": 1, "systems": 1, "units": 1, "devices": 1}}
+
+Device lines carry ``token`` and ``thingsboard_id`` when the fixture is
+exported with credentials, and ``unit_system`` when the unit belongs to
+another system than the device. Null fields are left out.
+
+``FleetLoader`` reads a fixture line by line and inserts the rows with
+``bulk_create`` in batches. It does not call ``Device.save()``, so nothing is
+sent to ThingsBoard. Unit names and device ids that start with the fixture's
+``prefix`` unit get the instance's own prefix instead ("House 1 - Led" ->
+"House 7 - Led"). Only devices whose name is unchanged keep their exported
+credentials; the others are left without a token, to be provisioned
+afterwards.
+
+``clear_fleet`` empties the local fleet before a load. It detaches the
+ThingsBoard delete signal: the remote devices may belong to another instance
+(a restored template) or be adopted again by name.
+"""
+from __future__ import annotations
+
+import gzip
+import json
+from datetime import datetime, timezone
+
+from django.db.models import Q
+from django.db.models.signals import post_delete
+
+from devices.models import Device, DeviceType, System, Unit
+from devices.signals import delete_device_on_thingsboard
+
+
+FIXTURE_VERSION = 1
+
+# unit of the template fleet that every simulator instance renames to its own number
+TEMPLATE_UNIT = "House 1"
+
+
+def unit_prefix(field, name):
+    """``field`` is ``name`` or starts with ``name `` (so "House 1" does not match "House 10 - ...")."""
+    return Q(**{field: name}) | Q(**{f"{field}__startswith": f"{name} "})
+
+
+def retarget(name, old, new):
+    """``name`` with a leading ``old`` unit token replaced by ``new``; other names are returned unchanged."""
+    if name == old or name.startswith(f"{old} "):
+        return new + name[len(old):]
+    return name
+
+
+def open_fixture(path, mode="r"):
+    """Text file for ``path`` ("r" or "w"); gzipped when it ends in ``.gz``."""
+    if str(path).endswith(".gz"):
+        return gzip.open(path, f"{mode}t", encoding="utf-8", compresslevel=6)
+    return open(path, mode, encoding="utf-8")
+
+
+def _line(record) -> str:
+    return json.dumps({k: v for k, v in record.items() if v is not None}, separators=(",", ":")) + "\n"
+
+
+def export_fleet(f, prefix=TEMPLATE_UNIT, credentials=False, chunk_size=2000) -> dict:
+    """Write every device of the database to the text file ``f``; returns the record counts."""
+    f.write(_line({
+        "fixture": "fleet", "version": FIXTURE_VERSION, "prefix": prefix, "credentials": credentials,
+        "exported_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }))
+    counts = {"types": 0, "systems": 0, "units": 0, "devices": 0}
+    for name, description in DeviceType.objects.order_by("pk").values_list("name", "description"):
+        f.write(_line({"type": name, "description": description}))
+        counts["types"] += 1
+    for (name,) in System.objects.order_by("pk").values_list("name"):
+        f.write(_line({"system": name}))
+        counts["systems"] += 1
+    for name, system in Unit.objects.order_by("pk").values_list("name", "system__name"):
+        f.write(_line({"unit": name, "system": system}))
+        counts["units"] += 1
+    rows = Device.objects.order_by("pk").values_list(
+        "device_id", "device_type__name", "system__name", "unit__name", "unit__system__name", "state",
+        "token", "thingsboard_id",
+    )
+    for device_id, device_type, system, unit, unit_system, state, token, tb_id in rows.iterator(chunk_size=chunk_size):
+        record = {"device": device_id, "type": device_type, "system": system, "unit": unit, "state": state or None}
+        if unit_system != system:
+            record["unit_system"] = unit_system
+        if credentials:
+            record["token"] = token or None
+            record["thingsboard_id"] = tb_id
+        f.write(_line(record))
+        counts["devices"] += 1
+    f.write(_line({"end": counts}))
+    return counts
+
+
+def clear_fleet():
+    """Delete every device and unit from the database only; returns the number of devices deleted."""
+    post_delete.disconnect(delete_device_on_thingsboard, sender=Device)
+    try:
+        deleted = Device.objects.all().delete()[0]
+        Unit.objects.all().delete()
+    finally:
+        post_delete.connect(delete_device_on_thingsboard, sender=Device)
+    return deleted
+
+
+def read_fixture(f):
+    """Header of the fixture in the text file ``f``, and an iterator over its records (header excluded)."""
+    try:
+        header = json.loads(f.readline() or "null")
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get("fixture") != "fleet":
+        raise ValueError("not a fleet fixture")
+    if header.get("version") != FIXTURE_VERSION:
+        raise ValueError(f"unsupported fleet fixture version {header.get('version')}")
+
+    def records():
+        for number, line in enumerate(f, start=2):
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    raise ValueError(f"line {number} is not JSON") from None
+
+    return header, records()
+
+
+class FleetLoader:
+    """Loads fixture records into the database; run it inside a transaction."""
+
+    def __init__(self, header, prefix=None, batch_size=1000):
+        if batch_size < 1:
+            raise ValueError("batch_size must be >= 1")
+        self.source = header.get("prefix") or TEMPLATE_UNIT
+        self.target = prefix or self.source
+        self.credentials = bool(header.get("credentials"))
+        self.batch_size = batch_size
+        self.types = {}  # name -> pk
+        self.systems = {}
+        self.units = {}  # (name, system name) -> pk
+        self._pending = {"type": {}, "system": set(), "unit": set()}
+        self._devices = []
+        self.counts = {"types": 0, "systems": 0, "units": 0, "devices": 0, "skipped": 0, "with_credentials": 0}
+
+    def load(self, records) -> dict:
+        ended = False
+        for record in records:
+            if ended:
+                raise ValueError("records after the end of the fixture")
+            if "device" in record:
+                self._add_device(record)
+            elif "type" in record:
+                self._pending["type"][record["type"]] = record.get("description")
+            elif "unit" in record:
+                self._pending["unit"].add((record["unit"], record["system"]))
+                self._pending["system"].add(record["system"])
+            elif "system" in record:
+                self._pending["system"].add(record["system"])
+            elif "end" in record:
+                ended = True
+            else:
+                raise ValueError(f"unknown fixture record {sorted(record)}")
+        if not ended:
+            raise ValueError("fixture is truncated (no end record)")
+        self._flush_catalog()
+        self._flush_devices()
+        return self.counts
+
+    def _add_device(self, record):
+        self._flush_catalog()
+        self._devices.append(record)
+        if len(self._devices) >= self.batch_size:
+            self._flush_devices()
+
+    def _flush_catalog(self):
+        types, systems, units = self._pending["type"], self._pending["system"], self._pending["unit"]
+        if types:
+            self.counts["types"] += _create_missing(
+                DeviceType, "name", [DeviceType(name=n, description=d) for n, d in types.items()])
+            self.types.update(DeviceType.objects.filter(name__in=list(types)).values_list("name", "pk"))
+            types.clear()
+        if systems:
+            self.counts["systems"] += _create_missing(System, "name", [System(name=n) for n in systems])
+            self.systems.update(System.objects.filter(name__in=list(systems)).values_list("name", "pk"))
+            systems.clear()
+        if units:
+            if self.target != self.source and any(name == self.target for name, _ in units):
+                raise ValueError(f"the fixture already has a unit {self.target!r}; choose another prefix")
+            wanted = {(retarget(name, self.source, self.target), system) for name, system in units}
+            existing = set(
+                Unit.objects.filter(name__in={n for n, _ in wanted}).values_list("name", "system__name")
+            )
+            missing = [Unit(name=n, system_id=self._pk(self.systems, s, "system")) for n, s in wanted - existing]
+            Unit.objects.bulk_create(missing, batch_size=self.batch_size)
+            self.counts["units"] += len(missing)
+            rows = Unit.objects.filter(name__in={n for n, _ in wanted}).values_list("name", "system__name", "pk")
+            self.units.update({(name, system): pk for name, system, pk in rows})
+            units.clear()
+
+    def _flush_devices(self):
+        if not self._devices:
+            return
+        names = {retarget(record["device"], self.source, self.target): record for record in self._devices}
+        existing = set(Device.objects.filter(device_id__in=list(names)).values_list("device_id", flat=True))
+        rows = []
+        for name, record in names.items():
+            if name in existing:
+                continue
+            system = record.get("system")
+            unit = record.get("unit")
+            keep = self.credentials and name == record["device"]
+            rows.append(Device(
+                device_id=name,
+                device_type_id=self._pk(self.types, record["type"], "type"),
+                token=(record.get("token") or "") if keep else "",
+                thingsboard_id=record.get("thingsboard_id") if keep else None,
+                state=record.get("state") or {},
+                system_id=self._pk(self.systems, system, "system") if system else None,
+                unit_id=self._pk(
+                    self.units, (retarget(unit, self.source, self.target), record.get("unit_system", system)), "unit"
+                ) if unit else None,
+            ))
+            if keep and record.get("token"):
+                self.counts["with_credentials"] += 1
+        Device.objects.bulk_create(rows, batch_size=self.batch_size)
+        self.counts["devices"] += len(rows)
+        self.counts["skipped"] += len(self._devices) - len(rows)
+        self._devices = []
+
+    @staticmethod
+    def _pk(mapping, key, kind):
+        try:
+            return mapping[key]
+        except KeyError:
+            raise ValueError(f"device refers to an undeclared {kind} {key!r}") from None
+
+
+def _create_missing(model, field, objs) -> int:
+    existing = set(model.objects.filter(**{f"{field}__in": [getattr(o, field) for o in objs]})
+                   .values_list(field, flat=True))
+    missing = [o for o in objs if getattr(o, field) not in existing]
+    model.objects.bulk_create(missing)
+    return len(missing)
@@ -0,0 +1,175 @@
+"""ThingsBoard HTTP device API for ``send_telemetry --transport http``.
+
+Devices post telemetry to ``POST /api/v1/{token}/telemetry``, receive RPCs
+by long-polling ``GET /api/v1/{token}/rpc`` and answer them with
+``POST /api/v1/{token}/rpc/{id}``. The whole fleet shares one aiohttp
+session whose connector keeps at most ``max_connections`` keep-alive
+sockets, so thousands of HTTP devices need a few dozen sockets, not one
+each. The long polls use a second connector of ``max_pollers`` sockets: a
+parked poll never holds a socket that a telemetry post is waiting for.
+
+RPCs are fetched by ``max_pollers`` poller tasks that take the subscribed
+devices in turn. Each poll waits up to ``poll_timeout`` seconds for an RPC,
+then the device goes to the back of the line. With more devices than
+pollers, an RPC can wait about ``devices / pollers x poll_timeout`` seconds
+before it is picked up, so size the two for the RPC latency a test needs.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from collections import deque, namedtuple
+
+
+# what the RPC handlers read from an aiomqtt message
+RpcMessage = namedtuple("RpcMessage", "topic payload")
+
+
+class HttpDeviceTransport:
+    def __init__(self, base_url: str, max_connections: int = 64, max_pollers: int = 32, poll_timeout: float = 5.0,
+                 request_timeout: float = 30.0):
+        if max_connections < 1 or max_pollers < 1 or poll_timeout <= 0:
+            raise ValueError("max_connections and max_pollers must be >= 1 and poll_timeout > 0")
+        self.base_url = base_url.rstrip("/")
+        self.max_connections = max_connections
+        self.max_pollers = max_pollers
+        self.poll_timeout = poll_timeout
+        self.request_timeout = request_timeout
+        self.session = None
+        self._poll_session = None
+        self._handlers = {}  # token -> async handler(request_id, payload bytes)
+        self._rotation = deque()
+        self._waiting = None
+        self._pollers = []
+        self.posts = 0
+        self.samples = 0
+        self.post_failures = 0
+        self.polls = 0
+        self.poll_errors = 0
+        self.rpcs = 0
+        self.responses = 0
+        self.max_post_ms = 0.0
+
+    async def start(self):
+        import aiohttp
+
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=10)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60), timeout=timeout,
+        )
+        self._poll_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_pollers, keepalive_timeout=60), timeout=timeout,
+        )
+        self._waiting = asyncio.Event()
+        self._pollers = [asyncio.create_task(self._poll_loop()) for _ in range(self.max_pollers)]
+
+    async def close(self):
+        for task in self._pollers:
+            task.cancel()
+        await asyncio.gather(*self._pollers, return_exceptions=True)
+        self._pollers = []
+        for session in (self.session, self._poll_session):
+            if session is not None:
+                await session.close()
+        self.session = self._poll_session = None
+
+    def subscribe(self, token, handler):
+        """Poll RPCs for ``token``; ``handler(request_id, payload)`` is awaited for each one."""
+        if token not in self._handlers:
+            self._rotation.append(token)
+        self._handlers[token] = handler
+        if self._waiting is not None:
+            self._waiting.set()
+
+    def unsubscribe(self, token):
+        # the token leaves the rotation the next time a poller reaches it
+        self._handlers.pop(token, None)
+
+    async def _request(self, method, path, session=None, **kwargs):
+        import aiohttp
+
+        timeout = aiohttp.ClientTimeout(total=kwargs.pop("timeout", self.request_timeout))
+        async with (session or self.session).request(method, f"{self.base_url}{path}", timeout=timeout, **kwargs) as response:
+            body = await response.read()
+            return response.status, body
+
+    async def post_telemetry(self, token, payload):
+        """Post one message (a dict or JSON text) or a list of ``{"ts": ..., "values": {...}}`` samples."""
+        started = time.monotonic()
+        data = payload if isinstance(payload, (str, bytes)) else json.dumps(payload)
+        try:
+            status, body = await self._request(
+                "POST", f"/api/v1/{token}/telemetry", data=data, headers={"Content-Type": "application/json"},
+            )
+        except Exception:
+            self.post_failures += 1
+            raise
+        if status != 200:
+            self.post_failures += 1
+            raise RuntimeError(f"telemetry post for {token[:8]}... answered {status}: {body[:200]!r}")
+        self.posts += 1
+        self.samples += len(payload) if isinstance(payload, list) else 1
+        self.max_post_ms = max(self.max_post_ms, (time.monotonic() - started) * 1000.0)
+
+    async def post_rpc_response(self, token, request_id, payload):
+        status, body = await self._request(
+            "POST", f"/api/v1/{token}/rpc/{request_id}", data=payload, headers={"Content-Type": "application/json"},
+        )
+        if status != 200:
+            raise RuntimeError(f"RPC response {request_id} for {token[:8]}... answered {status}: {body[:200]!r}")
+        self.responses += 1
+
+    async def _poll_loop(self):
+        while True:
+            if not self._rotation:
+                self._waiting.clear()
+                await self._waiting.wait()
+                continue
+            token = self._rotation.popleft()
+            handler = self._handlers.get(token)
+            if handler is None:
+                continue
+            try:
+                rpc = await self._poll(token)
+                if rpc is not None:
+                    self.rpcs += 1
+                    await handler(str(rpc.get("id")), json.dumps(rpc).encode())
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                self.poll_errors += 1
+                if self.poll_errors <= 10:
+                    print(f"[http] RPC poll for {token[:8]}... failed: {type(exc).__name__}: {exc}")
+                # an unreachable server should not turn the pollers into a busy loop
+                await asyncio.sleep(1)
+            finally:
+                if token in self._handlers:
+                    self._rotation.append(token)
+
+    async def _poll(self, token):
+        self.polls += 1
+        status, body = await self._request(
+            "GET", f"/api/v1/{token}/rpc", params={"timeout": str(int(self.poll_timeout * 1000))},
+            timeout=self.poll_timeout + self.request_timeout, session=self._poll_session,
+        )
+        if status == 408 or (status == 200 and not body.strip()):
+            return None
+        if status != 200:
+            raise RuntimeError(f"answered {status}: {body[:200]!r}")
+        return json.loads(body)
+
+    def snapshot(self) -> dict:
+        return {
+            "devices": len(self._handlers),
+            "posts": self.posts,
+            "samples": self.samples,
+            "post_failures": self.post_failures,
+            "max_post_ms": round(self.max_post_ms, 1),
+            "polls": self.polls,
+            "poll_errors": self.poll_errors,
+            "rpcs": self.rpcs,
+            "responses": self.responses,
+            "max_connections": self.max_connections,
+            "pollers": self.max_pollers,
+        }
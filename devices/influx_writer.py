@@ -0,0 +1,224 @@
+"""Bulk line-protocol output for ``backfill_telemetry``.
+
+``InfluxBatchWriter`` packs lines into batches of ``batch_lines``, gzips each
+batch on a worker thread (zlib releases the GIL) and POSTs it with
+``writers`` concurrent requests. At most ``max_pending`` full batches wait for
+a writer; past that ``add`` blocks, so memory stays bounded however much
+history is generated. ``LineProtocolFileWriter`` has the same interface and
+writes the lines to a (optionally gzipped) file instead.
+
+``telemetry_lines`` lays out one telemetry message in either schema: ``wide``
+is one point carrying every property as a field, ``narrow`` one point per
+property (the simulator's original layout). Influx stores both the same way;
+the narrow one repeats the tags and ``sent_timestamp`` on every line.
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import gzip
+import os
+import time
+
+
+def escape_tag(value) -> str:
+    return str(value).replace('\\', '\\\\').replace(',', '\\,').replace(' ', '\\ ').replace('=', '\\=')
+
+
+def format_field(value) -> str:
+    if isinstance(value, str):
+        return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return str(value)
+
+
+SCHEMA_WIDE = "wide"
+SCHEMA_NARROW = "narrow"
+SCHEMAS = (SCHEMA_WIDE, SCHEMA_NARROW)
+
+
+def telemetry_lines(head: str, fields, ts: int, schema: str = SCHEMA_WIDE) -> list:
+    """Lines of one message; ``head`` is ``measurement,tags`` and ``fields`` (name, value) pairs."""
+    if schema == SCHEMA_NARROW:
+        return [f"{head} {name}={format_field(value)},sent_timestamp={ts} {ts}" for name, value in fields]
+    if schema != SCHEMA_WIDE:
+        raise ValueError(f"schema must be one of {', '.join(SCHEMAS)}")
+    joined = ",".join(f"{name}={format_field(value)}" for name, value in fields)
+    return [f"{head} {joined},sent_timestamp={ts} {ts}"] if joined else []
+
+
+class LineWriter:
+    def __init__(self, batch_lines: int = 5000):
+        if batch_lines < 1:
+            raise ValueError("batch_lines must be >= 1")
+        self.batch_lines = batch_lines
+        self.lines = 0  # accepted by add()
+        self.written = 0  # confirmed written
+        self.bytes = 0
+        self.bytes_on_wire = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.failed_lines = 0
+        self._buffer = []
+        self._started = time.monotonic()
+
+    async def start(self):
+        pass
+
+    async def add(self, line: str):
+        self._buffer.append(line)
+        self.lines += 1
+        if len(self._buffer) >= self.batch_lines:
+            batch, self._buffer = self._buffer, []
+            await self._submit(batch)
+
+    async def extend(self, lines):
+        self._buffer.extend(lines)
+        self.lines += len(lines)
+        while len(self._buffer) >= self.batch_lines:
+            batch = self._buffer[:self.batch_lines]
+            del self._buffer[:self.batch_lines]
+            await self._submit(batch)
+
+    async def close(self):
+        if self._buffer:
+            batch, self._buffer = self._buffer, []
+            await self._submit(batch)
+
+    async def _submit(self, batch):
+        raise NotImplementedError
+
+    def snapshot(self) -> dict:
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        return {
+            "lines": self.lines,
+            "written": self.written,
+            "points_per_sec": round(self.written / elapsed, 1),
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "failed_lines": self.failed_lines,
+            "mb": round(self.bytes / 1e6, 2),
+            "mb_on_wire": round(self.bytes_on_wire / 1e6, 2),
+        }
+
+
+class InfluxBatchWriter(LineWriter):
+    def __init__(self, url, token=None, session=None, writers: int = 4, batch_lines: int = 5000,
+                 max_pending=None, compresslevel: int = 1, retries: int = 3):
+        super().__init__(batch_lines)
+        if writers < 1:
+            raise ValueError("writers must be >= 1")
+        self.url = url
+        self.token = token
+        self.session = session
+        self.writers = writers
+        self.max_pending = max_pending or writers * 2
+        self.compresslevel = compresslevel
+        self.retries = retries
+        self.retried = 0
+        self._queue = None
+        self._tasks = []
+        self._own_session = False
+
+    async def start(self):
+        if self.session is None:
+            import aiohttp
+
+            self.session = aiohttp.ClientSession()
+            self._own_session = True
+        self._queue = asyncio.Queue(self.max_pending)
+        self._tasks = [asyncio.create_task(self._write_loop()) for _ in range(self.writers)]
+
+    async def _submit(self, batch):
+        await self._queue.put(batch)
+
+    async def _write_loop(self):
+        while True:
+            batch = await self._queue.get()
+            try:
+                await self.write_batch(batch)
+            finally:
+                self._queue.task_done()
+
+    async def write_batch(self, batch) -> bool:
+        """Gzip and POST ``batch`` now, bypassing the queue; the telemetry sinks batch on their own."""
+        loop = asyncio.get_running_loop()
+        headers = {"Content-Type": "text/plain; charset=utf-8", "Content-Encoding": "gzip"}
+        if self.token:
+            headers["Authorization"] = f"Token {self.token}"
+        raw = ("\n".join(batch) + "\n").encode()
+        body = await loop.run_in_executor(
+            None, functools.partial(gzip.compress, raw, compresslevel=self.compresslevel, mtime=0)
+        )
+        if await self._post(body, headers):
+            self.written += len(batch)
+            self.bytes += len(raw)
+            self.bytes_on_wire += len(body)
+            self.batches += 1
+            return True
+        self.failed_batches += 1
+        self.failed_lines += len(batch)
+        return False
+
+    async def _post(self, body, headers) -> bool:
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.session.post(self.url, data=body, headers=headers) as response:
+                    if response.status in (200, 204):
+                        return True
+                    text = await response.text()
+                    retry = response.status == 429 or response.status >= 500
+                    if not retry or attempt == self.retries:
+                        print(f"[influx-writer] batch rejected: {response.status} {text[:200]}")
+                        return False
+            except Exception as exc:
+                if attempt == self.retries:
+                    print(f"[influx-writer] batch failed: {type(exc).__name__}: {exc}")
+                    return False
+            self.retried += 1
+            await asyncio.sleep(min(0.5 * 2 ** attempt, 10))
+        return False
+
+    async def close(self):
+        await super().close()
+        if self._queue is not None:
+            await self._queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._own_session:
+            await self.session.close()
+
+    def snapshot(self) -> dict:
+        return {**super().snapshot(), "retried": self.retried,
+                "queued_batches": self._queue.qsize() if self._queue is not None else 0}
+
+
+class LineProtocolFileWriter(LineWriter):
+    """Writes the batches to ``path``; gzipped when it ends in ``.gz``."""
+
+    def __init__(self, path, batch_lines: int = 5000, compresslevel: int = 6):
+        super().__init__(batch_lines)
+        self.path = str(path)
+        self.compresslevel = compresslevel
+        self._file = None
+
+    async def start(self):
+        if self.path.endswith(".gz"):
+            self._file = gzip.open(self.path, "wb", compresslevel=self.compresslevel)
+        else:
+            self._file = open(self.path, "wb")
+
+    async def _submit(self, batch):
+        raw = ("\n".join(batch) + "\n").encode()
+        self._file.write(raw)
+        self.written += len(batch)
+        self.bytes += len(raw)
+        self.batches += 1
+
+    async def close(self):
+        await super().close()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self.bytes_on_wire = os.path.getsize(self.path)
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+
+from devices.influx_writer import (
+    SCHEMA_WIDE, SCHEMAS, InfluxBatchWriter, LineProtocolFileWriter, escape_tag, telemetry_lines,
+)
+from devices.management.commands import send_telemetry
+from devices.management.commands.send_telemetry import TelemetryPublisher, telemetry_properties
+from devices.models import Device
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates N days of telemetry history for the fleet in the Device table, with the same per-type models "
+        "as send_telemetry --randomize, and writes it straight to InfluxDB (gzip batches, parallel writers) or to "
+        "a line-protocol file. Nothing goes through MQTT and device states in the database are not changed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=30.0, help='Days of history to generate')
+        parser.add_argument('--resolution', type=float, default=60.0, help='Seconds between samples of a device')
+        parser.add_argument('--end', type=str,
+                            help='End of the history, ISO-8601 (default: now); it starts --days earlier')
+        parser.add_argument('--device-id', type=int, nargs='+', help='Only these device pks')
+        parser.add_argument('--system', type=str, help='Only devices of this system')
+        parser.add_argument('--device-type', type=str, help='Only devices of this type')
+        parser.add_argument('--output', type=str,
+                            help='Write line protocol to this file (.gz to compress) instead of InfluxDB')
+        parser.add_argument('--influx-url', type=str, default=send_telemetry.INFLUXDB_URL,
+                            help='Influx v2 write URL, with org, bucket and precision=ms (default: from settings)')
+        parser.add_argument('--writers', type=int, default=4, help='Concurrent Influx write requests')
+        parser.add_argument('--batch-lines', type=int, default=5000, help='Lines per write request')
+        parser.add_argument('--max-pending', type=int,
+                            help='Full batches waiting for a writer before generation pauses (default: 2 x --writers)')
+        parser.add_argument('--compresslevel', type=int, default=1, choices=range(0, 10), metavar='0-9',
+                            help='gzip level of Influx batches')
+        parser.add_argument('--measurement', type=str, default='device_data')
+        parser.add_argument('--source', type=str, default='simulator', help='Value of the source tag')
+        parser.add_argument('--schema', choices=SCHEMAS, default=SCHEMA_WIDE,
+                            help='wide: one point per sample with every property as a field; narrow: one point per '
+                                 'property')
+        parser.add_argument('--seed', type=int, help='Seed for the generated values')
+        parser.add_argument('--report-interval', type=float, default=5.0, help='Seconds between progress lines')
+
+    def handle(self, *args, **options):
+        if options['days'] <= 0 or options['resolution'] <= 0:
+            raise CommandError('--days and --resolution must be > 0')
+        if options['writers'] < 1 or options['batch_lines'] < 1:
+            raise CommandError('--writers and --batch-lines must be >= 1')
+        try:
+            end = datetime.fromisoformat(options['end'].replace('Z', '+00:00')) if options['end'] else datetime.now(timezone.utc)
+        except ValueError as exc:
+            raise CommandError(f'--end: {exc}')
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=timezone.utc)
+        start = end - timedelta(days=options['days'])
+
+        fleet = self._fleet(options)
+        if not fleet:
+            raise CommandError('No devices match the filters.')
+        steps = int(options['days'] * 86400 // options['resolution'])
+        self.stdout.write(
+            f"[backfill] {len(fleet)} devices, {steps} samples each, {start.isoformat()} -> {end.isoformat()} "
+            f"every {options['resolution']:g}s -> {options['output'] or options['influx_url']}"
+        )
+        if options['output']:
+            writer = LineProtocolFileWriter(options['output'], batch_lines=options['batch_lines'])
+        else:
+            writer = InfluxBatchWriter(
+                options['influx_url'], token=send_telemetry.INFLUXDB_TOKEN, writers=options['writers'],
+                batch_lines=options['batch_lines'], max_pending=options['max_pending'],
+                compresslevel=options['compresslevel'],
+            )
+        result = asyncio.run(self._run(fleet, writer, start.timestamp(), steps, options))
+        self.stdout.write(f"[backfill] done: {json.dumps(result)}")
+        if result['failed_lines']:
+            raise CommandError(f"{result['failed_lines']} lines were not written")
+
+    def _fleet(self, options):
+        devices = Device.objects.all()
+        if options['device_id']:
+            devices = devices.filter(id__in=options['device_id'])
+        if options['system']:
+            devices = devices.filter(system__name=options['system'])
+        if options['device_type']:
+            devices = devices.filter(device_type__name__iexact=options['device_type'])
+        fleet = []
+        for device in devices.select_related('device_type').order_by('pk'):
+            dtype = device.device_type.name.lower() if device.device_type else ""
+            head = (f"{options['measurement']},sensor={escape_tag(device.thingsboard_id or device.device_id)},"
+                    f"source={escape_tag(options['source'])},direction=S2M")
+            fleet.append([head, dtype, dict(device.state or {})])
+        return fleet
+
+    async def _run(self, fleet, writer, start, steps, options):
+        rng = random.Random(options['seed'])
+        resolution = options['resolution']
+        schema = options['schema']
+        await writer.start()
+        progress = {"step": 0}
+        fields = 0
+        started = time.monotonic()
+
+        async def reporter():
+            while True:
+                await asyncio.sleep(options['report_interval'])
+                simulated = datetime.fromtimestamp(start + progress['step'] * resolution, timezone.utc)
+                print(f"[backfill] {json.dumps({**writer.snapshot(), 'simulated_until': simulated.isoformat()})}")
+
+        report_task = asyncio.create_task(reporter()) if options['report_interval'] > 0 else None
+        try:
+            for step in range(steps):
+                progress['step'] = step
+                ts = int((start + step * resolution) * 1000)
+                lines = []
+                for device in fleet:
+                    head, dtype, state = device
+                    new_state = TelemetryPublisher.random_state(dtype, state, rng)
+                    if new_state is not None:
+                        state = device[2] = new_state
+                    values = [(name, state[name]) for name in telemetry_properties(dtype, state) if name in state]
+                    fields += len(values)
+                    lines.extend(telemetry_lines(head, values, ts, schema))
+                await writer.extend(lines)
+                # lets the writers and the reporter run when no batch was full
+                await asyncio.sleep(0)
+            await writer.close()
+        finally:
+            if report_task is not None:
+                report_task.cancel()
+        elapsed = max(time.monotonic() - started, 1e-9)
+        return {**writer.snapshot(), "schema": schema, "fields": fields, "elapsed_s": round(elapsed, 2),
+                "points_per_sec": round(writer.written / elapsed, 1), "fields_per_sec": round(fields / elapsed, 1)}
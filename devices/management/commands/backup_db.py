@@ -34,6 +34,8 @@ class Command(BaseCommand):
             dest_conn = sqlite3.connect(dest_path)
             with dest_conn:
                 src_conn.backup(dest_conn)
+            # the copy keeps the source's journal mode; a template in WAL mode would need its -wal/-shm files
+            dest_conn.execute('PRAGMA journal_mode=DELETE')
             src_conn.close()
             dest_conn.close()
 
@@ -0,0 +1,159 @@
+import asyncio
+import gc
+import tracemalloc
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from devices.benchmarking import BENCH_SYSTEM_NAME, DEFAULT_RESULTS_FILE, append_result, run_metadata
+from devices.management.commands.send_telemetry import TelemetryPublisher
+from devices.models import Device
+from devices.state_store import MemoryStateStore
+from devices.telemetry_schedule import HeartbeatPolicy, RateMeter, TelemetrySchedule, TickScheduler, run_closed_loop
+
+
+SCHEDULERS = ('per-device', 'central')
+DEVICE_TYPES = ('led', 'lightbulb', 'temperature sensor', 'soil humidity sensor', 'pump', 'pool', 'irrigation',
+                'airconditioner')
+# long enough that no tick fires while memory is measured
+IDLE_PERIOD = 3600.0
+
+
+class Command(BaseCommand):
+    help = (
+        "Memory benchmark: builds the per-device structures send_telemetry keeps for a fleet (device rows, "
+        "publishers, state, schedule, tick tasks and optionally unconnected MQTT clients) and reports traced "
+        "bytes per device for each, with the per-device and the central tick scheduler."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, nargs='+', default=[1000, 10000],
+                            help='Fleet sizes to measure (one run each)')
+        parser.add_argument('--schedulers', nargs='+', choices=SCHEDULERS, default=list(SCHEDULERS),
+                            help='Tick drivers to compare')
+        parser.add_argument('--with-clients', action='store_true',
+                            help='Also build one unconnected aiomqtt client per device')
+        parser.add_argument('--output', type=str, default=str(DEFAULT_RESULTS_FILE), help='JSONL results file')
+        parser.add_argument('--label', type=str, help='Free-form label stored with each result')
+
+    def handle(self, *args, **options):
+        if any(n <= 0 for n in options['devices']):
+            raise CommandError('--devices must be positive')
+        for devices in options['devices']:
+            for scheduler in options['schedulers']:
+                result = asyncio.run(self._measure(devices, scheduler, options['with_clients']))
+                self._print(devices, scheduler, result)
+                append_result(options['output'], {
+                    "benchmark": "memory",
+                    "devices": devices,
+                    "scheduler": scheduler,
+                    "with_clients": options['with_clients'],
+                    "results": result,
+                    **run_metadata(options.get('label')),
+                })
+        self.stdout.write(f"Results appended to {options['output']}")
+
+    async def _measure(self, count, scheduler_kind, with_clients):
+        gc.collect()
+        tracemalloc.start()
+        components = {}
+        keep = []
+        last = tracemalloc.get_traced_memory()[0]
+
+        def mark(name):
+            nonlocal last
+            gc.collect()
+            current = tracemalloc.get_traced_memory()[0]
+            components[name] = current - last
+            last = current
+
+        try:
+            rows = [
+                Device(
+                    pk=i + 1,
+                    device_id=f"{BENCH_SYSTEM_NAME} - House {i // len(DEVICE_TYPES)} - {DEVICE_TYPES[i % len(DEVICE_TYPES)]} {i}",
+                    token=uuid.uuid4().hex[:20],
+                    thingsboard_id=str(uuid.uuid4()),
+                    state={"status": False},
+                )
+                for i in range(count)
+            ]
+            keep.append(rows)
+            mark("device_rows")
+
+            store = MemoryStateStore(persist_on_close=False)
+            publishers = {}
+            for i, row in enumerate(rows):
+                publishers[row.device_id] = TelemetryPublisher(
+                    row, state_store=store, device_type_name=DEVICE_TYPES[i % len(DEVICE_TYPES)]
+                )
+            keep.append(publishers)
+            mark("publishers")
+
+            for row in rows:
+                store.load(row.pk, row.state)
+            mark("state")
+
+            schedule = TelemetrySchedule(HeartbeatPolicy(IDLE_PERIOD))
+            for i, row in enumerate(rows):
+                schedule.add(row.device_id, DEVICE_TYPES[i % len(DEVICE_TYPES)])
+            mark("schedule")
+
+            meter = RateMeter()
+
+            async def send_tick(device_id):
+                await asyncio.sleep(0)
+
+            tasks = []
+            if scheduler_kind == 'central':
+                scheduler = TickScheduler(send_tick, schedule.period, meter)
+                tasks.append(asyncio.create_task(scheduler.run()))
+                for device_id in publishers:
+                    scheduler.add(device_id, delay=IDLE_PERIOD)
+            else:
+                # what telemetry_task_with_log keeps per device: a task, its closures and the loop frame
+                async def device_loop(device_id):
+                    def period():
+                        return schedule.period(device_id)
+
+                    async def send():
+                        await send_tick(device_id)
+
+                    await asyncio.sleep(IDLE_PERIOD)
+                    await run_closed_loop(send, period, meter)
+
+                tasks.extend(asyncio.create_task(device_loop(device_id)) for device_id in publishers)
+            await asyncio.sleep(0)
+            mark("ticks")
+
+            if with_clients:
+                import aiomqtt
+
+                for publisher in publishers.values():
+                    publisher.mqtt_client = aiomqtt.Client(hostname="127.0.0.1", username=publisher.token)
+                mark("mqtt_clients")
+
+            peak = tracemalloc.get_traced_memory()[1]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            tracemalloc.stop()
+            keep.clear()
+
+        total = sum(components.values())
+        return {
+            "bytes_per_device": {name: round(size / count, 1) for name, size in components.items()},
+            "total_bytes_per_device": round(total / count, 1),
+            "total_mb": round(total / 1e6, 2),
+            "peak_traced_mb": round(peak / 1e6, 2),
+        }
+
+    def _print(self, devices, scheduler, result):
+        self.stdout.write(f"[memory] {devices} devices, {scheduler} scheduler:")
+        for name, per_device in result["bytes_per_device"].items():
+            self.stdout.write(f"  {name:14} {per_device:>10.1f} B/device")
+        self.stdout.write(
+            f"  {'total':14} {result['total_bytes_per_device']:>10.1f} B/device ({result['total_mb']} MB)"
+        )
+
@@ -0,0 +1,182 @@
+import asyncio
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from devices.benchmarking import (
+    DEFAULT_RESULTS_FILE,
+    DEFAULT_TEMPLATE,
+    BENCH_SYSTEM_NAME,
+    BenchmarkSandbox,
+    append_result,
+    run_metadata,
+    stop_process,
+)
+from devices.fake_thingsboard import FakeThingsBoardServer, FaultInjection, fake_device_id, fake_device_token
+
+
+PATHS = ('import', 'rename', 'resync', 'fixture')
+
+# Re-runs the Device.save() reconciliation for every device, as send_telemetry does at startup
+RESYNC_SCRIPT = (
+    "from devices.models import Device\n"
+    "for device in Device.objects.select_related('device_type', 'system', 'unit').iterator():\n"
+    "    device.save()\n"
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Provisioning benchmark: runs the import, rename, resync (Device.save reconciliation) and fixture "
+        "(export_fleet + import_fleet) paths "
+        "against a fake ThingsBoard with optional latency/error injection and appends devices/sec to a JSONL file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--replicas', type=int, nargs='+', default=[10, 50],
+                            help='Units to import from the template (one run each); devices = replicas x template size')
+        parser.add_argument('--paths', nargs='+', choices=PATHS, default=list(PATHS),
+                            help='Provisioning paths to measure, always run in import -> rename -> resync -> fixture order')
+        parser.add_argument('--template', type=str, default=str(DEFAULT_TEMPLATE), help='Unit template JSON')
+        parser.add_argument('--latency-ms', type=float, default=0.0, help='Added latency per ThingsBoard request')
+        parser.add_argument('--jitter-ms', type=float, default=0.0, help='Uniform +/- jitter on --latency-ms')
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help='Share of ThingsBoard requests (except login) answered with 503')
+        parser.add_argument('--conflict-rate', type=float, default=0.0,
+                            help='Share of device creates answered "already exists"')
+        parser.add_argument('--seed', type=int, help='Seed for the fault injection RNG')
+        parser.add_argument('--path-timeout', type=float, default=3600.0, help='Max seconds per path')
+        parser.add_argument('--output', type=str, default=str(DEFAULT_RESULTS_FILE), help='JSONL results file')
+        parser.add_argument('--label', type=str, help='Free-form label stored with each result')
+        parser.add_argument('--keep', action='store_true', help='Keep the sandbox directory (DB and command logs)')
+
+    def handle(self, *args, **options):
+        if any(r <= 0 for r in options['replicas']):
+            raise CommandError('--replicas must be positive')
+        try:
+            FaultInjection(**self._fault_options(options))
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        for replicas in options['replicas']:
+            self.stdout.write(f"[provisioning] {replicas} units ...")
+            with BenchmarkSandbox(keep=options['keep']) as sandbox:
+                if options['keep']:
+                    self.stdout.write(f"[provisioning] sandbox: {sandbox.directory}")
+                record = asyncio.run(self._run(sandbox, replicas, options))
+            append_result(options['output'], record)
+            for path, result in record['paths'].items():
+                self.stdout.write(self.style.SUCCESS(
+                    f"[provisioning] {path}: {result['devices']} devices in {result['elapsed_s']}s "
+                    f"= {result['devices_per_sec']} devices/s, {result['requests_per_device']} TB requests/device"
+                ))
+        self.stdout.write(f"Results appended to {options['output']}")
+
+    def _fault_options(self, options):
+        return {
+            'latency_ms': options['latency_ms'],
+            'jitter_ms': options['jitter_ms'],
+            'error_rate': options['error_rate'],
+            'conflict_rate': options['conflict_rate'],
+            'seed': options.get('seed'),
+        }
+
+    async def _run(self, sandbox, replicas, options):
+        faults = FaultInjection(**self._fault_options(options))
+        tb = await FakeThingsBoardServer(faults=faults).start()
+        try:
+            await asyncio.to_thread(sandbox.add_gateway, tb.base_url, 1883, tb.username, tb.password)
+            paths = [p for p in PATHS if p in options['paths']]
+            if 'import' not in paths:
+                # rename/resync need an existing fleet: seed it directly, already known to the fake
+                names = await asyncio.to_thread(self._seed, sandbox, replicas, options['template'])
+                tb.preload(names)
+
+            results = {}
+            for path in paths:
+                results[path] = await getattr(self, f'_{path}')(sandbox, tb, replicas, options)
+        finally:
+            await tb.stop()
+
+        return {
+            "benchmark": "provisioning",
+            "replicas": replicas,
+            "faults": faults.as_dict(),
+            "paths": results,
+            **run_metadata(options.get('label')),
+        }
+
+    def _seed(self, sandbox, replicas, template):
+        with open(template, 'r', encoding='utf-8') as f:
+            size = len(json.load(f)['devices'])
+        try:
+            return sandbox.seed_fleet(replicas * size, template_path=template,
+                                      token_for=fake_device_token, tb_id_for=fake_device_id)
+        finally:
+            connections[sandbox.alias].close()
+
+    async def _import(self, sandbox, tb, replicas, options):
+        args = ['import_devices_from_json', options['template'], '--system', BENCH_SYSTEM_NAME,
+                '--replicas', str(replicas)]
+        result = await self._timed(sandbox, tb, args, 'import.log', options)
+        result['devices'] = len(await asyncio.to_thread(sandbox.device_ids))
+        return self._finish(result)
+
+    async def _rename(self, sandbox, tb, replicas, options):
+        # --sim replicas+1 can never collide with an existing "House N" name
+        before = await asyncio.to_thread(sandbox.device_ids)
+        args = ['rename_devices_for_simulator', '--sim', str(replicas + 1)]
+        result = await self._timed(sandbox, tb, args, 'rename.log', options)
+        result['devices'] = len(before - await asyncio.to_thread(sandbox.device_ids))
+        return self._finish(result)
+
+    async def _resync(self, sandbox, tb, replicas, options):
+        result = await self._timed(sandbox, tb, ['shell', '-c', RESYNC_SCRIPT], 'resync.log', options)
+        result['devices'] = len(await asyncio.to_thread(sandbox.device_ids))
+        return self._finish(result)
+
+    async def _fixture(self, sandbox, tb, replicas, options):
+        # a fresh instance from the current fleet: export, then import under an unused "House N" prefix
+        fixture = sandbox.directory / 'fleet.jsonl.gz'
+        exported = await self._timed(sandbox, tb, ['export_fleet', str(fixture)], 'export.log', options)
+        args = ['import_fleet', str(fixture), '--sim', str(replicas + 2), '--replace']
+        result = await self._timed(sandbox, tb, args, 'import_fleet.log', options)
+        result['export_s'] = exported['elapsed_s']
+        result['fixture_bytes'] = fixture.stat().st_size
+        result['devices'] = len(await asyncio.to_thread(sandbox.device_ids))
+        return self._finish(result)
+
+    async def _timed(self, sandbox, tb, args, log_name, options):
+        requests0 = tb.stats.requests
+        endpoints0 = dict(tb.stats.by_endpoint)
+        errors0, conflicts0 = tb.stats.injected_errors, tb.stats.injected_conflicts
+        started = time.monotonic()
+        process = sandbox.spawn_manage(args, log_name)
+        try:
+            returncode = await asyncio.wait_for(asyncio.to_thread(process.wait), timeout=options['path_timeout'])
+        except asyncio.TimeoutError:
+            await asyncio.to_thread(stop_process, process)
+            raise CommandError(f"{args[0]} did not finish within {options['path_timeout']}s")
+        elapsed = time.monotonic() - started
+        if returncode != 0:
+            raise CommandError(f"{args[0]} exited with code {returncode}; see {sandbox.directory / log_name}")
+        by_endpoint = {
+            endpoint: count - endpoints0.get(endpoint, 0)
+            for endpoint, count in tb.stats.by_endpoint.items()
+            if count != endpoints0.get(endpoint, 0)
+        }
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "tb_requests": tb.stats.requests - requests0,
+            "tb_by_endpoint": by_endpoint,
+            "injected_errors": tb.stats.injected_errors - errors0,
+            "injected_conflicts": tb.stats.injected_conflicts - conflicts0,
+        }
+
+    def _finish(self, result):
+        devices = result['devices']
+        elapsed = result['elapsed_s']
+        result['devices_per_sec'] = round(devices / elapsed, 2) if elapsed > 0 else None
+        result['requests_per_device'] = round(result['tb_requests'] / devices, 2) if devices else None
+        return result
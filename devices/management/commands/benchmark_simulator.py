@@ -0,0 +1,198 @@
+import asyncio
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from devices.benchmarking import (
+    DEFAULT_RESULTS_FILE,
+    BenchmarkSandbox,
+    ProcessSampler,
+    append_result,
+    import_time_profile,
+    last_tagged_json,
+    percentiles,
+    run_metadata,
+    stop_process,
+)
+from devices.fake_influx import FakeInfluxServer
+from devices.fake_mqtt_broker import FakeMqttBroker
+from devices.fake_thingsboard import FakeThingsBoardServer, fake_device_id, fake_device_token
+
+
+class Command(BaseCommand):
+    help = (
+        "End-to-end benchmark: runs send_telemetry against local MQTT/Influx/ThingsBoard stand-ins "
+        "for N devices and appends publishes/sec, RPC round-trip percentiles, CPU and RSS to a JSONL file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, nargs='+', default=[100, 1000, 10000],
+                            help='Fleet sizes to benchmark (one run each)')
+        parser.add_argument('--duration', type=float, default=30.0, help='Measurement window in seconds')
+        parser.add_argument('--warmup-timeout', type=float, default=900.0,
+                            help='Max seconds to wait for every device to connect before measuring')
+        parser.add_argument('--heartbeat-interval', type=float, default=1.0,
+                            help='Heartbeat passed to send_telemetry')
+        parser.add_argument('--rpc-rate', type=float, default=20.0,
+                            help='RPCs per second issued by the broker during the window (0 disables)')
+        parser.add_argument('--rpc-timeout', type=float, default=10.0, help='Seconds before an RPC counts as timed out')
+        parser.add_argument('--no-influx', action='store_true', help='Run send_telemetry without --use-influxdb')
+        parser.add_argument('--influx-latency-ms', type=float, default=0.0,
+                            help='Delay added by the fake Influx to every write')
+        parser.add_argument('--mqtt-ack-delay-ms', type=float, default=0.0,
+                            help='Delay of the broker\'s PUBACK to QoS 1 publishes')
+        parser.add_argument('--sim-args', type=str, default='--memory --randomize',
+                            help='Extra arguments for send_telemetry (quoted string)')
+        parser.add_argument('--output', type=str, default=str(DEFAULT_RESULTS_FILE), help='JSONL results file')
+        parser.add_argument('--label', type=str, help='Free-form label stored with each result')
+        parser.add_argument('--keep', action='store_true', help='Keep the sandbox directory (DB and simulator log)')
+        parser.add_argument('--fast-start', action='store_true', help='Pass --fast-start to send_telemetry')
+        parser.add_argument('--no-import-profile', action='store_true',
+                            help='Skip the "python -X importtime manage.py send_telemetry --help" measurement')
+
+    def handle(self, *args, **options):
+        for count in options['devices']:
+            if count <= 0:
+                raise CommandError('--devices must be positive')
+            self.stdout.write(f"[bench] {count} devices ...")
+            record = self._run(count, options)
+            append_result(options['output'], record)
+            self.stdout.write(self.style.SUCCESS(
+                f"[bench] {count} devices: {record['publishes_per_sec']} pub/s, "
+                f"rpc p50={record['rpc']['p50_ms']}ms p99={record['rpc']['p99_ms']}ms, "
+                f"startup={record['startup_all_connected_s']}s, "
+                f"cpu={record['cpu_percent']}% rss={record['rss_mb']}MB"
+            ))
+        self.stdout.write(f"Results appended to {options['output']}")
+
+    def _run(self, count, options):
+        with BenchmarkSandbox(keep=options['keep']) as sandbox:
+            names = sandbox.seed_fleet(count, token_for=fake_device_token, tb_id_for=fake_device_id)
+            record = asyncio.run(self._run_async(sandbox, names, options))
+            record["startup_phases"] = last_tagged_json(sandbox.directory / 'send_telemetry.log', '[startup]')
+            if not options['no_import_profile']:
+                record["import_profile"] = import_time_profile(['send_telemetry', '--help'], env=sandbox.env())
+            return record
+
+    async def _run_async(self, sandbox, names, options):
+        count = len(names)
+        tb = FakeThingsBoardServer()
+        tb.preload(names)
+        await tb.start()
+        influx = await FakeInfluxServer(latency_ms=options['influx_latency_ms']).start()
+        tokens = [fake_device_token(name) for name in names]
+        broker = await FakeMqttBroker(allowed_tokens=tokens, ack_delay_ms=options['mqtt_ack_delay_ms']).start()
+        await asyncio.to_thread(sandbox.add_gateway, tb.base_url, broker.port, tb.username, tb.password)
+        if options['keep']:
+            self.stdout.write(f"[bench] sandbox: {sandbox.directory}")
+
+        sim_args = ['send_telemetry', '--profile-startup', '--heartbeat-interval', str(options['heartbeat_interval'])]
+        if options['fast_start']:
+            sim_args.append('--fast-start')
+        if not options['no_influx']:
+            sim_args.append('--use-influxdb')
+        sim_args += options['sim_args'].split()
+        spawned_at = time.monotonic()
+        process = sandbox.spawn_manage(
+            sim_args, 'send_telemetry.log',
+            INFLUXDB_HOST=influx.host, INFLUXDB_PORT=influx.port, INFLUXDB_TOKEN='benchmark',
+        )
+        sampler = ProcessSampler(process.pid)
+        try:
+            startup = await self._warm_up(broker, count, process, spawned_at, options['warmup_timeout'])
+            measurement = await self._measure(broker, influx, sampler, tokens, process, options)
+        finally:
+            await asyncio.get_running_loop().run_in_executor(None, stop_process, process)
+            await broker.stop()
+            await influx.stop()
+            await tb.stop()
+
+        return {
+            "benchmark": "simulator",
+            "devices": count,
+            "heartbeat_interval": options['heartbeat_interval'],
+            "sim_args": sim_args[1:],
+            **startup,
+            **measurement,
+            "thingsboard_requests": tb.stats.requests,
+            **run_metadata(options.get('label')),
+        }
+
+    async def _warm_up(self, broker, count, process, spawned_at, timeout):
+        deadline = spawned_at + timeout
+        while broker.connected_devices < count and time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f"send_telemetry exited early with code {process.returncode}")
+            await asyncio.sleep(0.25)
+        first = broker.stats.first_telemetry_at
+        return {
+            "startup_all_connected_s": round(time.monotonic() - spawned_at, 3)
+            if broker.connected_devices >= count else None,
+            "startup_first_publish_s": round(first - spawned_at, 3) if first else None,
+            "connected_devices": broker.connected_devices,
+        }
+
+    async def _measure(self, broker, influx, sampler, tokens, process, options):
+        duration = options['duration']
+        rpc_rate = options['rpc_rate']
+        rtts, timeouts, errors = [], 0, 0
+        pending = set()
+
+        async def one_rpc(token):
+            nonlocal timeouts, errors
+            try:
+                _, rtt = await broker.issue_rpc(token, 'checkStatus', None, timeout=options['rpc_timeout'])
+                rtts.append(rtt)
+            except asyncio.TimeoutError:
+                timeouts += 1
+            except LookupError:
+                errors += 1
+
+        telemetry0 = broker.stats.telemetry
+        lines0, requests0 = influx.stats.lines, influx.stats.requests
+        cpu0 = sampler.cpu_seconds()
+        started = time.monotonic()
+        next_rpc = started
+        next_sample = started
+        while True:
+            now = time.monotonic()
+            if now - started >= duration:
+                break
+            if process.poll() is not None:
+                raise CommandError(f"send_telemetry exited during measurement with code {process.returncode}")
+            if now >= next_sample:
+                sampler.rss_bytes()
+                next_sample = now + 1.0
+            if rpc_rate > 0:
+                while next_rpc <= now:
+                    task = asyncio.ensure_future(one_rpc(random.choice(tokens)))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                    next_rpc += 1.0 / rpc_rate
+            await asyncio.sleep(0.01)
+        elapsed = time.monotonic() - started
+        cpu1 = sampler.cpu_seconds()
+        rss = sampler.rss_bytes()
+        telemetry = broker.stats.telemetry - telemetry0
+        lines, requests = influx.stats.lines - lines0, influx.stats.requests - requests0
+        if pending:
+            await asyncio.wait(pending, timeout=options['rpc_timeout'] + 1)
+
+        return {
+            "duration_s": round(elapsed, 3),
+            "publishes": telemetry,
+            "publishes_per_sec": round(telemetry / elapsed, 2),
+            "influx_lines_per_sec": round(lines / elapsed, 2),
+            "influx_requests_per_sec": round(requests / elapsed, 2),
+            "rpc": {
+                "sent": len(rtts) + timeouts + errors,
+                "ok": len(rtts),
+                "timeouts": timeouts,
+                "unreachable": errors,
+                **percentiles(rtts),
+            },
+            "cpu_percent": round((cpu1 - cpu0) / elapsed * 100.0, 1) if cpu0 is not None and cpu1 is not None else None,
+            "rss_mb": round(rss / 1048576, 1) if rss else None,
+            "peak_rss_mb": round(sampler.peak_rss / 1048576, 1) if sampler.peak_rss else None,
+        }
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from devices.fleet_fixture import TEMPLATE_UNIT, export_fleet, open_fixture
+
+
+class Command(BaseCommand):
+    help = (
+        "Exporta device types, systems, units e devices (com estado) para um fixture JSON lines "
+        "(gzip quando termina em .gz), usado pelo import_fleet para subir outras instancias do simulador."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', type=str, help='Arquivo do fixture (ex: fleet.jsonl.gz)')
+        parser.add_argument('--prefix', type=str, default=TEMPLATE_UNIT,
+                            help='Unidade que o import_fleet troca pelo prefixo da instancia (default: House 1)')
+        parser.add_argument('--with-credentials', action='store_true',
+                            help='Inclui token e thingsboard_id (reaproveitados so por devices que mantem o nome)')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Devices lidos do banco por consulta')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        with open_fixture(options['output'], 'w') as f:
+            counts = export_fleet(f, prefix=options['prefix'], credentials=options['with_credentials'],
+                                  chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{counts['devices']} devices, {counts['units']} unidades, {counts['systems']} sistemas e "
+            f"{counts['types']} tipos exportados para {options['output']} em {time.monotonic() - started:.2f}s"
+        ))
@@ -0,0 +1,67 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from devices.fleet_fixture import FleetLoader, clear_fleet, open_fixture, read_fixture
+from devices.models import Device
+from devices.thingsboard_sync import sync_devices
+
+
+class Command(BaseCommand):
+    help = (
+        "Carrega um fixture do export_fleet com bulk_create em lotes, trocando o prefixo da unidade "
+        "(ex: House 1 -> House 7), e depois sincroniza com o ThingsBoard em paralelo os devices sem token."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('fixture', type=str, help='Arquivo gerado pelo export_fleet')
+        target = parser.add_mutually_exclusive_group()
+        target.add_argument('--sim', type=int, help='Número do simulador: usa o prefixo House {sim}')
+        target.add_argument('--prefix', type=str, help='Prefixo da instancia (default: o do fixture)')
+        parser.add_argument('--replace', action='store_true',
+                            help='Apaga os devices e unidades do banco (nao do ThingsBoard) antes de carregar o fixture')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Linhas por bulk_create')
+        parser.add_argument('--no-thingsboard', action='store_true',
+                            help='So carrega o banco; o send_telemetry reconcilia com o ThingsBoard depois')
+        parser.add_argument('--tb-concurrency', type=int, default=16,
+                            help='Devices reconciliados com o ThingsBoard ao mesmo tempo')
+        parser.add_argument('--progress-interval', type=float, default=5.0,
+                            help='Segundos entre linhas de progresso da sincronizacao com o ThingsBoard')
+
+    def handle(self, *args, **options):
+        prefix = f"House {options['sim']}" if options['sim'] is not None else options['prefix']
+        started = time.monotonic()
+        try:
+            with open_fixture(options['fixture']) as f, transaction.atomic():
+                header, records = read_fixture(f)
+                loader = FleetLoader(header, prefix=prefix, batch_size=options['batch_size'])
+                if options['replace']:
+                    clear_fleet()
+                counts = loader.load(records)
+        except (OSError, ValueError, EOFError) as e:
+            self.stderr.write(f"Fixture invalido, nada foi importado: {e}")
+            return
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{counts['devices']} devices importados para {loader.target} em {elapsed:.2f}s "
+            f"({counts['devices'] / elapsed if elapsed > 0 else 0:.0f} devices/s); "
+            f"{counts['skipped']} ja existentes, {counts['with_credentials']} com credenciais do fixture"
+        ))
+        if options['no_thingsboard'] or not counts['devices']:
+            return
+        try:
+            sync = sync_devices(
+                Device.objects.filter(token=''), concurrency=options['tb_concurrency'],
+                progress=lambda snapshot: self.stdout.write(f"[tb-sync] {json.dumps(snapshot)}"),
+                progress_interval=options['progress_interval'],
+            )
+        except RuntimeError as e:
+            self.stdout.write(self.style.WARNING(f"{e}; o send_telemetry reconcilia os devices depois."))
+            return
+        if sync.failed:
+            self.stdout.write(self.style.WARNING(
+                f"{sync.failed} devices nao sincronizados com o ThingsBoard (o send_telemetry tenta de novo): "
+                f"{json.dumps(sync.errors)}"
+            ))
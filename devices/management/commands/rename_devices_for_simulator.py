@@ -1,18 +1,41 @@
-from django.core.management.base import BaseCommand
-from django.db import OperationalError
-from devices.models import Device
+import json
+import os
+import subprocess
+import sys
 import time
 
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, transaction
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
+
+from devices.fleet_fixture import TEMPLATE_UNIT, retarget, unit_prefix
+from devices.models import Device, Unit
+from devices.simulator_control import RUNTIME_DIR
+from devices.thingsboard_sync import sync_devices
+
+
 class Command(BaseCommand):
     help = "Renomeia todos os devices deste simulador para House {sim_num} (ex: House 2, House 3, ...). Use após restore do banco."
 
     def add_arguments(self, parser):
         parser.add_argument('--sim', type=int, required=True, help='Número do simulador (ex: 1, 2, 3...)')
         parser.add_argument('--force', action='store_true', help='Força renomear mesmo se já houver prefixo')
+        parser.add_argument('--no-thingsboard', action='store_true',
+                            help='Renomeia apenas no banco; o send_telemetry reconcilia com o ThingsBoard depois')
+        parser.add_argument('--thingsboard-background', action='store_true',
+                            help='Sincroniza com o ThingsBoard em um processo separado (runtime/rename_thingsboard_sync.log) '
+                                 'e retorna logo apos renomear no banco')
+        parser.add_argument('--thingsboard-only', action='store_true',
+                            help='Apenas sincroniza com o ThingsBoard os devices ja renomeados para House {sim}')
+        parser.add_argument('--tb-concurrency', type=int, default=16,
+                            help='Devices reconciliados com o ThingsBoard ao mesmo tempo')
+        parser.add_argument('--progress-interval', type=float, default=5.0,
+                            help='Segundos entre linhas de progresso da sincronizacao com o ThingsBoard')
 
     def handle(self, *args, **options):
         sim_num = options['sim']
-        force = options['force']
         # Aguarda tabela pronta (em caso de restore/migrate em andamento)
         max_wait = 60
         waited = 0
@@ -29,16 +52,72 @@ class Command(BaseCommand):
                 time.sleep(3)
                 waited += 3
 
-        count = 0
-        for device in Device.objects.all():
-            novo_nome = device.device_id.replace("House 1", f"House {sim_num}")
-            if device.device_id != novo_nome:
-                device.device_id = novo_nome
-                device.save()
-                count += 1
-                self.stdout.write(self.style.SUCCESS(f"Renomeado: {novo_nome}"))
-            novo_nome_unit = device.unit.name.replace("House 1", f"House {sim_num}")
-            if device.unit.name != novo_nome_unit:
-                device.unit.name = novo_nome_unit
-                device.unit.save()
-        self.stdout.write(self.style.SUCCESS(f"{count} devices renomeados para House {sim_num}"))
+        old, new = TEMPLATE_UNIT, f"House {sim_num}"
+        if options['thingsboard_only']:
+            self._sync_thingsboard(new, options)
+            return
+        if old == new:
+            self.stdout.write(self.style.SUCCESS(f"0 devices renomeados para {new}"))
+            return
+        started = time.monotonic()
+        with transaction.atomic():
+            devices = list(Device.objects.filter(unit_prefix('device_id', old)).values_list('device_id', flat=True))
+            units = list(Unit.objects.filter(unit_prefix('name', old)).values_list('name', 'system_id'))
+            # a clash would fail the UPDATE half-way through the unique index: refuse up front
+            taken = set(Device.objects.filter(unit_prefix('device_id', new)).values_list('device_id', flat=True))
+            clashes = sorted(taken & {retarget(device_id, old, new) for device_id in devices})
+            taken_units = set(Unit.objects.filter(unit_prefix('name', new)).values_list('name', 'system_id'))
+            clashes += sorted(name for name, system in units if (retarget(name, old, new), system) in taken_units)
+            if clashes:
+                self.stderr.write(f"Nomes ja existentes para {new}: {', '.join(clashes[:10])}. Nada foi renomeado.")
+                return
+            # set-based: one UPDATE per table, no Device.save() (and no ThingsBoard round-trip) per row
+            Unit.objects.filter(unit_prefix('name', old)).update(name=Concat(Value(new), Substr('name', len(old) + 1)))
+            # the restored ids and tokens belong to the template's ThingsBoard devices (House 1 keeps using them):
+            # drop them so the sync creates or adopts the new names instead of renaming those devices
+            count = Device.objects.filter(unit_prefix('device_id', old)).update(
+                device_id=Concat(Value(new), Substr('device_id', len(old) + 1)), thingsboard_id=None, token='',
+            )
+        if options['verbosity'] > 1:
+            for device_id in devices:
+                self.stdout.write(self.style.SUCCESS(f"Renomeado: {retarget(device_id, old, new)}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"{count} devices e {len(units)} unidades renomeados para {new} em {time.monotonic() - started:.2f}s"
+        ))
+        if not count or options['no_thingsboard']:
+            return
+        if options['thingsboard_background']:
+            self._sync_in_background(sim_num, options)
+        else:
+            self._sync_thingsboard(new, options)
+
+    def _sync_in_background(self, sim_num, options):
+        # detached, so the boot does not wait for the ThingsBoard round trips
+        RUNTIME_DIR.mkdir(parents=True, exist_ok=True)
+        log_path = RUNTIME_DIR / 'rename_thingsboard_sync.log'
+        command = [
+            sys.executable, 'manage.py', 'rename_devices_for_simulator', '--sim', str(sim_num), '--thingsboard-only',
+            '--tb-concurrency', str(options['tb_concurrency']), '--progress-interval', str(options['progress_interval']),
+        ]
+        with log_path.open('a', encoding='utf-8') as log:
+            process = subprocess.Popen(
+                command, cwd=settings.BASE_DIR, stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+                env=os.environ.copy(),
+            )
+        self.stdout.write(f"Sincronizacao com o ThingsBoard em segundo plano (pid {process.pid}, log {log_path})")
+
+    def _sync_thingsboard(self, new, options):
+        try:
+            sync = sync_devices(
+                Device.objects.filter(unit_prefix('device_id', new)), concurrency=options['tb_concurrency'],
+                progress=lambda snapshot: self.stdout.write(f"[tb-sync] {json.dumps(snapshot)}"),
+                progress_interval=options['progress_interval'],
+            )
+        except RuntimeError as e:
+            self.stdout.write(self.style.WARNING(f"{e}; o send_telemetry reconcilia os devices depois."))
+            return
+        if sync.failed:
+            self.stdout.write(self.style.WARNING(
+                f"{sync.failed} devices nao sincronizados com o ThingsBoard (o send_telemetry tenta de novo): "
+                f"{json.dumps(sync.errors)}"
+            ))
@@ -0,0 +1,90 @@
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from devices.benchmarking import append_result, run_metadata
+from devices.traffic_recorder import DEVICE_KINDS, RPC_RESPONSE, TELEMETRY, TrafficReader, replay
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays a send_telemetry --record file: every recorded telemetry publish and RPC response is sent "
+        "again from the same device token, with the recorded spacing divided by --speed. No state is "
+        "generated and nothing touches the database or InfluxDB."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='Recording written by send_telemetry --record')
+        parser.add_argument('--speed', type=float, default=1.0,
+                            help='Replay speed: 1 = recorded pace, 10 = ten times faster, 0 = as fast as possible')
+        parser.add_argument('--telemetry-only', action='store_true', help='Do not replay RPC responses')
+        parser.add_argument('--host', type=str, help='MQTT host (default: the active GatewayIOT)')
+        parser.add_argument('--port', type=int, default=1883, help='MQTT port when --host is given')
+        parser.add_argument('--info', action='store_true', help='Only print what the recording contains')
+        parser.add_argument('--output', type=str, help='Append the summary as one JSON line to this file')
+        parser.add_argument('--label', type=str, help='Free-form label stored with the result')
+
+    def handle(self, *args, **options):
+        if options['speed'] < 0:
+            raise CommandError('--speed must be >= 0')
+        try:
+            reader = TrafficReader(options['file'])
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
+        with reader:
+            info = reader.summary()
+            self.stdout.write(f"[replay] {options['file']}: {json.dumps(info)}")
+            if options['info']:
+                return
+            host, port, keepalive = self._broker(options)
+            kinds = (TELEMETRY,) if options['telemetry_only'] else DEVICE_KINDS
+            result = asyncio.run(self._run(reader, host, port, keepalive, options['speed'], kinds))
+        self.stdout.write(f"[replay] {json.dumps(result)}")
+        if options['output']:
+            append_result(options['output'], {
+                "benchmark": "replay",
+                "file": options['file'],
+                "speed": options['speed'],
+                "recording": info,
+                "results": result,
+                **run_metadata(options.get('label')),
+            })
+            self.stdout.write(f"Result appended to {options['output']}")
+
+    def _broker(self, options):
+        if options['host']:
+            return options['host'], options['port'], 60
+        from devices.management.commands import send_telemetry
+
+        try:
+            send_telemetry.configure_thingsboard_runtime()
+        except Exception as exc:
+            raise CommandError(f"No MQTT host: pass --host or activate a GatewayIOT ({exc})")
+        return send_telemetry.THINGSBOARD_HOST, send_telemetry.THINGSBOARD_MQTT_PORT, send_telemetry.THINGSBOARD_MQTT_KEEP_ALIVE
+
+    async def _run(self, reader, host, port, keepalive, speed, kinds):
+        import aiomqtt
+
+        tokens = reader.tokens()
+        clients = {token: aiomqtt.Client(hostname=host, port=port, username=token, password=None, keepalive=keepalive)
+                   for token in tokens}
+        self.stdout.write(f"[replay] connecting {len(clients)} devices to {host}:{port} ...")
+        connected = await asyncio.gather(*(client.__aenter__() for client in clients.values()), return_exceptions=True)
+        failed = [token for token, outcome in zip(clients, connected) if isinstance(outcome, BaseException)]
+        if failed:
+            for token in failed:
+                del clients[token]
+            self.stdout.write(self.style.WARNING(f"[replay] {len(failed)} devices could not connect; their traffic is skipped"))
+
+        async def publish(token, topic, payload):
+            client = clients.get(token)
+            if client is None:
+                raise LookupError(f"device {token} is not connected")
+            await client.publish(topic, payload)
+
+        try:
+            return await replay(reader, publish, speed=speed, kinds=kinds)
+        finally:
+            await asyncio.gather(*(client.__aexit__(None, None, None) for client in clients.values()),
+                                 return_exceptions=True)
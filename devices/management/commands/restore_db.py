@@ -3,7 +3,6 @@ from django.conf import settings
 import os
 import sqlite3
 import datetime
-import shutil
 
 
 class Command(BaseCommand):
@@ -35,7 +34,14 @@ class Command(BaseCommand):
             ts = datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S')
             cur_backup = f"{db_path}.pre_restore.{ts}"
             try:
-                shutil.copy2(db_path, cur_backup)
+                # sqlite backup API, not a file copy: in WAL mode recent commits are still in the -wal file
+                src_conn = sqlite3.connect(db_path)
+                backup_conn = sqlite3.connect(cur_backup)
+                with backup_conn:
+                    src_conn.backup(backup_conn)
+                backup_conn.execute('PRAGMA journal_mode=DELETE')
+                src_conn.close()
+                backup_conn.close()
                 try:
                     os.chmod(cur_backup, 0o664)
                 except Exception:
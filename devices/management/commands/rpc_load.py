@@ -0,0 +1,117 @@
+import asyncio
+import json
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+
+from devices.benchmarking import append_result, run_metadata
+from devices.fake_mqtt_broker import DEFAULT_OPERATOR_USERNAME, FakeMqttBroker
+from devices.models import Device
+from devices.rpc_load import SUPPORTED_RPCS, OperatorRpcClient, RpcTarget, run_rpc_load
+
+
+class Command(BaseCommand):
+    help = (
+        "Closed-loop RPC load generator: sends v1/devices/me/rpc/request/<id> calls (switchLed, checkStatus, "
+        "setTemperature, ...) to simulated devices through a local broker stand-in and reports round-trip "
+        "percentiles and timeouts per method and per device type."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Broker stand-in host (run_standins)')
+        parser.add_argument('--port', type=int, default=1883, help='Broker stand-in MQTT port')
+        parser.add_argument('--operator-username', default=DEFAULT_OPERATOR_USERNAME)
+        parser.add_argument('--serve', action='store_true',
+                            help='Host the broker stand-in in this process on --host/--port instead of connecting to one')
+        parser.add_argument('--wait-devices', type=float, default=60.0,
+                            help='With --serve: seconds to wait for the devices to connect before starting')
+        parser.add_argument('--methods', nargs='+', help='Restrict to these RPC methods (default: all each type supports)')
+        parser.add_argument('--system', type=str, help='Only devices of this system')
+        parser.add_argument('--device-type', type=str, help='Only devices of this type')
+        parser.add_argument('--limit', type=int, help='Use at most this many devices')
+        parser.add_argument('--concurrency', type=int, default=8, help='RPCs kept in flight')
+        parser.add_argument('--rate', type=float, default=0.0, help='Max RPCs per second in total (0 = as fast as responses allow)')
+        parser.add_argument('--duration', type=float, default=30.0, help='Seconds to run')
+        parser.add_argument('--count', type=int, help='Stop after this many RPCs')
+        parser.add_argument('--timeout', type=float, default=10.0, help='Seconds before an RPC counts as timed out')
+        parser.add_argument('--seed', type=int, help='Seed for target/method/parameter choice')
+        parser.add_argument('--output', type=str, help='Append the summary as one JSON line to this file')
+        parser.add_argument('--label', type=str, help='Free-form label stored with the result')
+
+    def handle(self, *args, **options):
+        methods = set(options['methods']) if options['methods'] else None
+        if methods:
+            known = {m for rpcs in SUPPORTED_RPCS.values() for m in rpcs}
+            unknown = methods - known
+            if unknown:
+                raise CommandError(f"Unknown RPC methods: {', '.join(sorted(unknown))}")
+        targets = self._targets(options, methods)
+        if not targets:
+            raise CommandError('No devices with a token and a supported RPC method match the filters.')
+        self.stdout.write(f"[rpc-load] {len(targets)} devices, concurrency={options['concurrency']}, "
+                          f"rate={options['rate'] or 'unbounded'}, duration={options['duration']}s")
+
+        stats = asyncio.run(self._run(targets, options))
+        summary = stats.summary()
+        self._print(summary)
+        if options['output']:
+            append_result(options['output'], {
+                "benchmark": "rpc_load",
+                "devices": len(targets),
+                "concurrency": options['concurrency'],
+                "rate": options['rate'],
+                "results": summary,
+                **run_metadata(options.get('label')),
+            })
+            self.stdout.write(f"Result appended to {options['output']}")
+
+    def _targets(self, options, methods):
+        devices = Device.objects.exclude(token='').exclude(token__isnull=True)
+        if options['system']:
+            devices = devices.filter(system__name=options['system'])
+        if options['device_type']:
+            devices = devices.filter(device_type__name__iexact=options['device_type'])
+        rows = devices.order_by('pk').values_list('token', 'device_type__name')
+        targets = [t for t in (RpcTarget.for_device(token, dtype, methods) for token, dtype in rows) if t]
+        return targets[:options['limit']] if options['limit'] else targets
+
+    async def _run(self, targets, options):
+        import aiomqtt
+
+        rng = random.Random(options['seed'])
+        run = dict(concurrency=options['concurrency'], rate=options['rate'], duration=options['duration'],
+                   count=options['count'], timeout=options['timeout'], rng=rng)
+        if options['serve']:
+            async with FakeMqttBroker(host=options['host'], port=options['port'],
+                                      operator_username=options['operator_username']) as broker:
+                self.stdout.write(f"[rpc-load] broker listening on {options['host']}:{broker.port}; waiting for devices ...")
+                if not await broker.wait_for_devices(len(targets), options['wait_devices']):
+                    self.stdout.write(self.style.WARNING(
+                        f"[rpc-load] only {broker.connected_devices}/{len(targets)} devices connected; starting anyway"
+                    ))
+
+                async def issue(token, method, params, timeout):
+                    _, rtt = await broker.issue_rpc(token, method, params, timeout=timeout)
+                    return rtt
+
+                return await run_rpc_load(issue, targets, **run)
+
+        try:
+            async with OperatorRpcClient(options['host'], options['port'], options['operator_username']) as client:
+                return await run_rpc_load(client.issue, targets, **run)
+        except (OSError, aiomqtt.MqttError) as exc:
+            raise CommandError(f"Cannot reach the broker stand-in at {options['host']}:{options['port']}: {exc}")
+
+    def _print(self, summary):
+        header = f"{'group':32} {'sent':>7} {'ok':>7} {'timeout':>7} {'offline':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+        self.stdout.write(header)
+        for key, row in summary.items():
+            self.stdout.write(
+                f"{key:32} {row['sent']:>7} {row['ok']:>7} {row['timeouts']:>7} {row['unreachable']:>7} "
+                f"{self._ms(row['p50_ms'])} {self._ms(row['p90_ms'])} {self._ms(row['p99_ms'])} {self._ms(row['max_ms'])}"
+            )
+        self.stdout.write(json.dumps(summary.get('all', {})))
+
+    @staticmethod
+    def _ms(value):
+        return f"{value:>9.2f}" if value is not None else f"{'-':>9}"
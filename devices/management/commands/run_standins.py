@@ -0,0 +1,96 @@
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from devices.fake_influx import FakeInfluxServer
+from devices.fake_mqtt_broker import DEFAULT_OPERATOR_USERNAME, FakeMqttBroker
+from devices.fake_thingsboard import FakeThingsBoardServer, FaultInjection
+from devices.models import Device, GatewayIOT
+
+
+class Command(BaseCommand):
+    help = (
+        "Run local stand-ins for ThingsBoard (REST + MQTT) and InfluxDB so send_telemetry, "
+        "benchmarks and load generators can run without external services."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--mqtt-port', type=int, default=1883)
+        parser.add_argument('--http-port', type=int, default=18080, help='Fake ThingsBoard REST port')
+        parser.add_argument('--influx-port', type=int, default=18086, help='Fake Influx write port')
+        parser.add_argument('--operator-username', default=DEFAULT_OPERATOR_USERNAME,
+                            help='MQTT username allowed to drive RPCs via operator/<token>/... topics')
+        parser.add_argument('--activate-gateway', action='store_true',
+                            help='Create/activate a GatewayIOT row pointing at the stand-ins')
+        parser.add_argument('--mqtt-ack-delay-ms', type=float, default=0.0,
+                            help='Delay of the broker\'s PUBACK to QoS 1 publishes (a WAN round trip)')
+        parser.add_argument('--stats-interval', type=float, default=10.0, help='Seconds between stats lines')
+        parser.add_argument('--tb-latency-ms', type=float, default=0.0, help='Added latency per ThingsBoard request')
+        parser.add_argument('--tb-jitter-ms', type=float, default=0.0, help='Uniform +/- jitter on --tb-latency-ms')
+        parser.add_argument('--tb-error-rate', type=float, default=0.0,
+                            help='Share of ThingsBoard requests (except login) answered with 503')
+        parser.add_argument('--tb-conflict-rate', type=float, default=0.0,
+                            help='Share of device creates answered "already exists"')
+
+    def handle(self, *args, **options):
+        try:
+            faults = FaultInjection(
+                latency_ms=options['tb_latency_ms'], jitter_ms=options['tb_jitter_ms'],
+                error_rate=options['tb_error_rate'], conflict_rate=options['tb_conflict_rate'],
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        try:
+            asyncio.run(self._serve(options, faults))
+        except KeyboardInterrupt:
+            self.stdout.write("Stand-ins stopped.")
+
+    async def _serve(self, options, faults):
+        host = options['host']
+        tb = FakeThingsBoardServer(host=host, port=options['http_port'], faults=faults)
+        # devices already in the database keep their names/tokens on the fake
+        names = await asyncio.to_thread(lambda: list(Device.objects.values_list('device_id', flat=True)))
+        tb.preload(names)
+        await tb.start()
+        influx = await FakeInfluxServer(host=host, port=options['influx_port']).start()
+        broker = await FakeMqttBroker(host=host, port=options['mqtt_port'],
+                                      operator_username=options['operator_username'],
+                                      ack_delay_ms=options['mqtt_ack_delay_ms']).start()
+
+        if options['activate_gateway']:
+            await asyncio.to_thread(self._activate_gateway, tb, broker)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"ThingsBoard REST: {tb.base_url} (user {tb.username} / {tb.password})\n"
+            f"MQTT broker: {host}:{broker.port} (operator username '{broker.operator_username}')\n"
+            f"Influx write: http://{host}:{influx.port}/api/v2/write\n"
+            f"Run send_telemetry with INFLUXDB_HOST={host} INFLUXDB_PORT={influx.port}"
+        ))
+        try:
+            while True:
+                await asyncio.sleep(options['stats_interval'])
+                self.stdout.write(json.dumps({
+                    "mqtt": broker.stats.as_dict(),
+                    "influx": {k: v for k, v in influx.stats.as_dict().items() if k != "by_measurement"},
+                    "thingsboard_requests": tb.stats.requests,
+                }))
+        finally:
+            await broker.stop()
+            await influx.stop()
+            await tb.stop()
+
+    def _activate_gateway(self, tb, broker):
+        gateway, _ = GatewayIOT.objects.get_or_create(
+            name='local-standins',
+            defaults={'base_url': tb.base_url, 'username': tb.username, 'password': tb.password},
+        )
+        gateway.base_url = tb.base_url
+        gateway.mqtt_port = broker.port
+        gateway.auth_method = GatewayIOT.AUTH_METHOD_USER_PASSWORD
+        gateway.username = tb.username
+        gateway.password = tb.password
+        gateway.is_active = True
+        gateway.save()
+        self.stdout.write(f"GatewayIOT '{gateway.name}' ativado apontando para os stand-ins.")
@@ -3,21 +3,49 @@ import json
 import random
 import os
 import asyncio
-import aiohttp
-import aiomqtt
+import contextvars
+import signal
+import sys
+import uuid
 from asgiref.sync import sync_to_async
-from collections import defaultdict
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
+from devices.db_executor import DatabaseExecutor
+from devices.http_transport import HttpDeviceTransport, RpcMessage
+from devices.influx_writer import SCHEMA_WIDE, SCHEMAS
 from devices.models import Device
+from devices.mqtt_qos import QOS_LEVELS, PublishWindow, QosPolicy, QosStats
+from devices.network_impairment import NetworkImpairment
+from devices.rpc_executor import OVERFLOW_BLOCK, OVERFLOW_POLICIES, KeyedRpcExecutor
+from devices.side_effects import AUDIT, METRICS, PERSISTENCE, SideEffectQueue
+from devices.sim_clock import REAL_CLOCK, make_clock
+from devices.state_store import STATE_STORES, STORE_DB, STORE_MEMORY, MemoryStateStore, make_state_store
+from devices.telemetry_schedule import (
+    HeartbeatPolicy,
+    RateMeter,
+    TelemetrySchedule,
+    TickScheduler,
+    parse_interval_overrides,
+    run_closed_loop,
+    run_open_loop,
+)
+from devices.telemetry_sinks import MqttSink, SinkPipeline, TelemetrySample
 from devices.thingsboard_gateway import get_active_gateway, get_gateway_connection
+from devices.trace_source import TRACE_FORMATS, TraceRouter, play_trace, read_trace
+from devices.traffic_recorder import RPC_REQUEST, RPC_RESPONSE, TELEMETRY, TrafficRecorder
+from devices.unit_physics import BACKENDS as PHYSICS_BACKENDS, UnitPhysics
 
 
+TRANSPORT_MQTT = 'mqtt'
+TRANSPORT_HTTP = 'http'
+TRANSPORTS = (TRANSPORT_MQTT, TRANSPORT_HTTP)
+
 # Resolved in Command.handle() from the active GatewayIOT.
 THINGSBOARD_HOST = ""
 THINGSBOARD_MQTT_PORT = 1883
 THINGSBOARD_MQTT_KEEP_ALIVE = 60
+THINGSBOARD_HTTP_URL = ""
 HEARTBEAT_INTERVAL = settings.HEARTBEAT_INTERVAL
 
 # INFLUX configuration
@@ -27,6 +55,47 @@ INFLUXDB_BUCKET = settings.INFLUXDB_BUCKET
 INFLUXDB_ORGANIZATION = settings.INFLUXDB_ORGANIZATION
 INFLUXDB_URL = f"http://{INFLUXDB_HOST}:{INFLUXDB_PORT}/api/v2/write?org={INFLUXDB_ORGANIZATION}&bucket={INFLUXDB_BUCKET}&precision=ms"
 INFLUXDB_TOKEN = settings.INFLUXDB_TOKEN
+SIMULATOR_FAST_START = getattr(settings, 'SIMULATOR_FAST_START', False)
+
+# Influx measurements written while handling one RPC, all sent as a single
+# multi-line POST once the handler finishes:
+#   latency  - latency_measurement line with the M2S received timestamp
+#   received - device_data line with the same timestamp
+#   state    - device_data line with the state the handler produced
+#   response - device_data line (source=simulator_response) stamped when the response is published
+RPC_INFLUX_KINDS = ('latency', 'received', 'state', 'response')
+
+
+def parse_rpc_influx_measurements(value):
+    kinds = frozenset(k.strip().lower() for k in (value or '').split(',') if k.strip())
+    unknown = kinds - set(RPC_INFLUX_KINDS) - {'all', 'none'}
+    if unknown:
+        raise ValueError(f"unknown RPC Influx measurements: {', '.join(sorted(unknown))}")
+    if 'none' in kinds:
+        return frozenset()
+    if not kinds or 'all' in kinds:
+        return frozenset(RPC_INFLUX_KINDS)
+    return kinds
+
+
+RPC_INFLUX_MEASUREMENTS = parse_rpc_influx_measurements(os.getenv('M2S_RPC_INFLUX_MEASUREMENTS', 'all'))
+
+# devices.traffic_recorder.TrafficRecorder set by --record; None when not recording
+TRAFFIC_RECORDER = None
+# source of simulated time (ticks and sent/received timestamps); --time-scale replaces it
+SIM_CLOCK = REAL_CLOCK
+# QoS per message class and the QoS 1 in-flight window (--telemetry-qos, --rpc-response-qos, --qos-*)
+QOS_POLICY = QosPolicy()
+QOS_STATS = QosStats()
+# where generated telemetry goes (devices.telemetry_sinks); --sink / --use-influxdb replace it
+TELEMETRY_SINKS = SinkPipeline([MqttSink()])
+# devices.unit_physics.UnitPhysics set by --physics; None keeps every device independent
+UNIT_PHYSICS = None
+
+# aiohttp and aiomqtt are imported where they are first used: together they
+# account for most of the import time of this module, and `--help` or an early
+# configuration error should not have to pay for them.
+MODULE_LOADED_AT = time.perf_counter()
 
 
 async def post_to_influx(session, data, device=None):
@@ -82,11 +151,41 @@ async def post_to_influx(session, data, device=None):
         raise
 
 
-DEVICE_STATE = defaultdict(dict)
+class RpcInfluxBatch:
+    """Line-protocol lines collected while one RPC is handled."""
+
+    def __init__(self, session, measurements=None, side_effects=None):
+        self.session = session
+        self.measurements = RPC_INFLUX_MEASUREMENTS if measurements is None else measurements
+        self.side_effects = side_effects
+        self.lines = []
+        self.flushed = False
+
+    def add(self, kind, line):
+        """Queue ``line``; returns False once flushed so late callers can write it on their own."""
+        if self.flushed:
+            return False
+        if kind in self.measurements:
+            self.lines.append(line)
+        return True
+
+    def flush(self):
+        self.flushed = True
+        if self.lines and self.session is not None:
+            data = "\n".join(self.lines)
+            if self.side_effects is not None:
+                self.side_effects.submit(METRICS, lambda: post_to_influx(self.session, data, None))
+            else:
+                asyncio.ensure_future(post_to_influx(self.session, data, None))
+        self.lines = []
+
+
+# batch of the RPC being handled by the current task (see TelemetryPublisher.on_message)
+_current_rpc_batch = contextvars.ContextVar('current_rpc_batch', default=None)
 
 
 def configure_thingsboard_runtime():
-    global THINGSBOARD_HOST, THINGSBOARD_MQTT_PORT, THINGSBOARD_MQTT_KEEP_ALIVE
+    global THINGSBOARD_HOST, THINGSBOARD_MQTT_PORT, THINGSBOARD_MQTT_KEEP_ALIVE, THINGSBOARD_HTTP_URL
 
     gateway = get_active_gateway(required=True)
     connection = get_gateway_connection(gateway)
@@ -96,32 +195,43 @@ def configure_thingsboard_runtime():
     THINGSBOARD_HOST = connection.mqtt_host
     THINGSBOARD_MQTT_PORT = connection.mqtt_port
     THINGSBOARD_MQTT_KEEP_ALIVE = connection.mqtt_keep_alive
+    THINGSBOARD_HTTP_URL = connection.base_url
     return gateway
 
 
-class InMemoryDeviceProxy:
-    """A tiny proxy used when the simulator runs with --memory.
-    It exposes .state and a sync .save() that updates the global DEVICE_STATE
-    so existing code that calls device.state and sync_to_async(device.save)()
-    continues to work without hitting AttributeError on None.
-    """
-    def __init__(self, device_id):
-        self.device_id = device_id
-        # Ensure a dict exists for this device
-        if device_id not in DEVICE_STATE:
-            DEVICE_STATE[device_id] = {}
-        # keep a reference so updates are reflected in DEVICE_STATE
-        self.state = DEVICE_STATE[device_id]
-
-    def save(self):
-        # Persist current state back to the global dict (no-op if same object)
-        DEVICE_STATE[self.device_id] = self.state
+def interval_setting(name):
+    """Heartbeat overrides of the ``name`` setting (a dict or the JSON of the environment variable)."""
+    try:
+        return parse_interval_overrides(getattr(settings, name, None) or {})
+    except ValueError as exc:
+        raise ValueError(f"{name}: {exc}") from None
+
+
+def append_rpc_audit_log(entry):
+    try:
+        import pathlib
+        log_dir = os.getenv('SIMULATOR_RPC_LOG_DIR')
+        log_dir = pathlib.Path(log_dir) if log_dir else pathlib.Path(__file__).resolve().parents[3] / 'deploy' / 'logs'
+        log_dir.mkdir(parents=True, exist_ok=True)
+        with (log_dir / 'simulator_rpc_received.log').open('a') as rf:
+            rf.write(json.dumps(entry) + '\n')
+    except Exception:
+        pass
+
 
 class TelemetryPublisher:
     """
     Represents a device that connects via MQTT to ThingsBoard, sends
-    telemetry periodically, and processes RPC calls.
+    telemetry periodically, and processes RPC calls. With a ``transport``
+    (devices.http_transport) it uses the HTTP device API instead.
+
+    Slotted: large fleets keep one of these per device for the whole run.
     """
+    __slots__ = (
+        'device_pk', 'token', 'device_id', 'thingsboard_id', '_device_type_name', 'randomize', 'client_id',
+        'mqtt_client', 'session', 'state_store', 'uplink', 'downlink', 'side_effects', 'rpc_executor',
+        'skip_reconcile', '_rpc_task', 'transport', 'publish_window',
+    )
     LIGHTS = ["led", "lightbulb"]
     TEMPERATURE_SENSOR = ["temperature sensor"]
     SOILHUMIDITY_SENSOR = ["soilhumidity sensor", "soil humidity sensor"]
@@ -132,21 +242,36 @@ class TelemetryPublisher:
     GARDEN = ["garden"]
     IRRIGATION = ["irrigation"]
 
-    def __init__(self, device, randomize=False, session=None, use_memory=False, device_type_name=""):
+    def __init__(self, device, randomize=False, session=None, state_store=None, device_type_name="", impairment_links=(None, None), side_effects=None, rpc_executor=None, transport=None):
         self.device_pk = device.pk
         self.token = device.token
         self.device_id = device.device_id
         # use thingsboard_id as canonical identifier for external systems (eg. Influx)
         self.thingsboard_id = getattr(device, 'thingsboard_id', None)
-        self._device_type_name = device_type_name  # sempre passado já resolvido
+        # sempre passado já resolvido; interned so the fleet shares one string per type
+        self._device_type_name = sys.intern(device_type_name)
         self.randomize = randomize
         self.client_id = self.token
         self.mqtt_client = None
         self.session = session
-        self.use_memory = use_memory
+        # StateStore shared by all publishers (see devices.state_store); a private in-memory one by default
+        self.state_store = state_store if state_store is not None else MemoryStateStore(persist_on_close=False)
+        # (uplink, downlink) ImpairedLink objects; None means a clean link
+        self.uplink, self.downlink = impairment_links
+        # SideEffectQueue for Influx/audit work of the RPC path; None runs it inline
+        self.side_effects = side_effects
+        # KeyedRpcExecutor shared by all publishers; None handles RPCs inline on the reader task
+        self.rpc_executor = rpc_executor
+        # set by create_fast(): skip the pre-connect Device.save() round-trip
+        self.skip_reconcile = False
+        self._rpc_task = None
+        # HttpDeviceTransport shared by the fleet; None talks MQTT
+        self.transport = transport
+        # devices.mqtt_qos.PublishWindow, created on the first QoS 1 publish
+        self.publish_window = None
 
     @classmethod
-    async def create(cls, device, randomize=False, session=None, use_memory=False, device_type_name=""):
+    async def create(cls, device, randomize=False, session=None, state_store=None, device_type_name="", impairment_links=(None, None), side_effects=None, rpc_executor=None, transport=None):
         # Sempre tenta garantir token válido
         await sync_to_async(device.save)()
         token = device.token
@@ -154,35 +279,60 @@ class TelemetryPublisher:
             print(f"[telemetry][ERRO] Device {device.device_id} continua sem token após save(). Não será possível conectar ao ThingsBoard.")
         else:
             print(f"[telemetry] Device {device.device_id} pronto para conectar com token {token[:8]}... (ocultado)" )
-        return cls(device, randomize=randomize, session=session, use_memory=use_memory, device_type_name=device_type_name)
+        return cls(device, randomize=randomize, session=session, state_store=state_store, device_type_name=device_type_name, impairment_links=impairment_links, side_effects=side_effects, rpc_executor=rpc_executor, transport=transport)
+
+    @classmethod
+    def create_fast(cls, device, randomize=False, session=None, state_store=None, device_type_name="", impairment_links=(None, None), side_effects=None, rpc_executor=None, transport=None):
+        """Build a publisher without the ThingsBoard reconciliation in create().
+
+        Devices that already carry a token connect straight away; the MQTT
+        auth-failure path in connect() still reconciles stale tokens.
+        """
+        pub = cls(device, randomize=randomize, session=session, state_store=state_store, device_type_name=device_type_name, impairment_links=impairment_links, side_effects=side_effects, rpc_executor=rpc_executor, transport=transport)
+        pub.skip_reconcile = bool(device.token)
+        return pub
 
     @property
     def device_type(self):
         return self._device_type_name
 
     async def connect(self, spawn_handle: bool = True):
+        import aiomqtt
+
         # Antes de tentar conectar, tente uma reconciliação rápida no banco para
         # garantir token/credentials atualizados (poderá retornar precocemente se
         # ThingsBoard estiver inacessível; nesse caso o loop de conexão continuará).
         try:
-            device = await sync_to_async(Device.objects.get)(pk=self.device_pk)
-            # chama save() para forçar a lógica de sincronização com ThingsBoard
-            await sync_to_async(device.save)()
-            await sync_to_async(device.refresh_from_db)()
-            if device.token:
-                self.token = device.token
-                self.client_id = device.token
+            if self.skip_reconcile:
+                # --fast-start: only the first connect skips it; reconnects reconcile as usual
+                self.skip_reconcile = False
+            else:
+                device = await sync_to_async(Device.objects.get)(pk=self.device_pk)
+                # chama save() para forçar a lógica de sincronização com ThingsBoard
+                await sync_to_async(device.save)()
+                await sync_to_async(device.refresh_from_db)()
+                if device.token:
+                    self.token = device.token
+                    self.client_id = device.token
         except Exception as e:
             # falhas aqui são esperadas se ThingsBoard estiver indisponível; o loop abaixo fará retries
             print(f"[telemetry] Reconciliação pré-conexão falhou (ignorado por agora): {e}")
 
+        if self.transport is not None:
+            # no connection of its own: requests go through the shared pool and the pollers fetch its RPCs
+            self.transport.subscribe(self.token, self._on_http_rpc)
+            print(f"[http] Device {self.token} polling RPCs at {self.transport.base_url}")
+            return True
+
         # Crie o client DENTRO do contexto async, pois aiomqtt precisa de um event loop rodando
         self.mqtt_client = aiomqtt.Client(
             hostname=THINGSBOARD_HOST,
             port=THINGSBOARD_MQTT_PORT,
             username=self.token,
             password=None,
-            keepalive=THINGSBOARD_MQTT_KEEP_ALIVE
+            keepalive=THINGSBOARD_MQTT_KEEP_ALIVE,
+            # paho queues QoS 1 messages beyond its own in-flight limit; keep it out of the window's way
+            max_inflight_messages=QOS_POLICY.window if QOS_POLICY.pipelined else None,
         )
         # Tentar conectar com retries exponenciais para tolerar brokers que ainda
         # não aceitaram conexões no momento inicial.
@@ -193,8 +343,7 @@ class TelemetryPublisher:
         while True:
             attempt += 1
             try:
-                self._mqtt_context = self.mqtt_client.__aenter__()
-                await asyncio.wait_for(self._mqtt_context, timeout=timeout_per_attempt)
+                await asyncio.wait_for(self.mqtt_client.__aenter__(), timeout=timeout_per_attempt)
                 # Se conectou, subscribe e continue
                 print(f"[MQTT CONNECT] Device {self.token} connected to MQTT broker")
                 await self.mqtt_client.subscribe("v1/devices/me/rpc/request/+")
@@ -202,7 +351,7 @@ class TelemetryPublisher:
                 # Only spawn a handle_rpc task if requested and not already running
                 try:
                     if spawn_handle:
-                        if not hasattr(self, '_rpc_task') or self._rpc_task.done():
+                        if self._rpc_task is None or self._rpc_task.done():
                             self._rpc_task = asyncio.create_task(self.handle_rpc())
                             print(f"[MQTT HANDLER] Device {self.token} started RPC handler task")
                 except Exception as e:
@@ -240,11 +389,16 @@ class TelemetryPublisher:
             delay = min(delay * 2, 30)
 
     async def handle_rpc(self):
+        import aiomqtt
+
         # Para aiomqtt >= 1.0.0, 'messages' é um async iterator, não um context manager.
         while True:
             try:
                 async for msg in self.mqtt_client.messages:
-                    await self.on_message(msg)
+                    if self.downlink is not None:
+                        await self.downlink.send(lambda m=msg: self._dispatch_rpc(m), len(msg.payload))
+                    else:
+                        await self._dispatch_rpc(msg)
             except aiomqtt.MqttError as me:
                 # Handle disconnects by attempting a reconnect without spawning another handle_rpc task
                 print(f"[mqtt] message iterator error: {me}; attempting reconnect...")
@@ -261,7 +415,32 @@ class TelemetryPublisher:
                 await asyncio.sleep(1)
                 continue
 
+    async def _on_http_rpc(self, request_id, payload):
+        msg = RpcMessage(f"v1/devices/me/rpc/request/{request_id}", payload)
+        if self.downlink is not None:
+            await self.downlink.send(lambda: self._dispatch_rpc(msg), len(payload))
+        else:
+            await self._dispatch_rpc(msg)
+
+    async def _dispatch_rpc(self, msg):
+        if TRAFFIC_RECORDER is not None:
+            TRAFFIC_RECORDER.record(RPC_REQUEST, self.token, msg.topic, msg.payload)
+        if self.rpc_executor is not None:
+            # queued behind this device's earlier RPCs; the reader moves on to the next message
+            await self.rpc_executor.submit(self.device_id, lambda: self.on_message(msg))
+        else:
+            await self.on_message(msg)
+
     async def on_message(self, msg):
+        batch = RpcInfluxBatch(self.session, side_effects=self.side_effects)
+        context_token = _current_rpc_batch.set(batch)
+        try:
+            await self._handle_message(msg, batch)
+        finally:
+            _current_rpc_batch.reset(context_token)
+            batch.flush()
+
+    async def _handle_message(self, msg, batch):
         sim_fast_mode = os.getenv("M2S_SIMULATOR_FAST_MODE", "0").lower() in ("1", "true", "yes")
         sim_timestamps_only = os.getenv("M2S_SIMULATOR_TIMESTAMPS_ONLY", "0").lower() in ("1", "true", "yes")
         sim_full_perf = os.getenv("M2S_SIMULATOR_PERF_FULL", "0").lower() in ("1", "true", "yes")
@@ -289,7 +468,7 @@ class TelemetryPublisher:
 
         device_id = self.device_id
         try:
-            received_timestamp = int(time.time() * 1000)
+            received_timestamp = SIM_CLOCK.timestamp_ms()
             if not sim_fast_mode:
                 print(f"[M2S RPC RECEIVED] device={device_id}, method={method}, timestamp={received_timestamp}, request_id={request_id}")
 
@@ -304,7 +483,7 @@ class TelemetryPublisher:
                     if request_id:
                         influx_tags += f",request_id=\"{request_id}\""
                     influx_data = f"latency_measurement,{influx_tags} received_timestamp={received_timestamp} {received_timestamp}"
-                    asyncio.ensure_future(post_to_influx(self.session, influx_data, None))
+                    batch.add('latency', influx_data)
                     if not sim_fast_mode:
                         print(f"[M2S] Simulator received RPC {method} at {received_timestamp} - written to InfluxDB (direction=M2S, source=simulator, request_id={request_id})")
                     # In timestamps-only mode, keep only strict timing data and skip extra device_data writes.
@@ -313,7 +492,7 @@ class TelemetryPublisher:
                         if request_id:
                             influx_tags_device += f",request_id=\"{request_id}\""
                         influx_data_device = f"device_data,{influx_tags_device} received_timestamp={received_timestamp} {received_timestamp}"
-                        asyncio.ensure_future(post_to_influx(self.session, influx_data_device, None))
+                        batch.add('received', influx_data_device)
                         if not sim_fast_mode:
                             print(f"[M2S] Simulator also wrote received_timestamp to device_data (direction=M2S, request_id={request_id})")
                 elif not sim_fast_mode:
@@ -325,51 +504,28 @@ class TelemetryPublisher:
 
             # Log RPC reception to deploy/logs/simulator_rpc_received.log for auditing
             if not sim_fast_mode:
-                try:
-                    import pathlib, getpass
-                    log_dir = pathlib.Path(__file__).resolve().parents[3] / 'deploy' / 'logs'
-                    log_dir.mkdir(parents=True, exist_ok=True)
-                    recv_log = log_dir / 'simulator_rpc_received.log'
-                    # Mask token for privacy (show first 6 chars)
-                    masked = (self.token[:6] + '...') if getattr(self, 'token', None) else None
-                    recv_entry = {
-                        'ts': received_timestamp,
-                        'device_id': device_id,
-                        'thingsboard_id': getattr(self, 'thingsboard_id', None),
-                        'masked_token': masked,
-                        'request_id': request_id,
-                        'method': method,
-                        'params': params,
-                        'topic': topic_str
-                    }
-                    with recv_log.open('a') as rf:
-                        rf.write(json.dumps(recv_entry) + '\n')
-                except Exception:
-                    pass
+                # Mask token for privacy (show first 6 chars)
+                masked = (self.token[:6] + '...') if getattr(self, 'token', None) else None
+                recv_entry = {
+                    'ts': received_timestamp,
+                    'device_id': device_id,
+                    'thingsboard_id': getattr(self, 'thingsboard_id', None),
+                    'masked_token': masked,
+                    'request_id': request_id,
+                    'method': method,
+                    'params': params,
+                    'topic': topic_str
+                }
+                await self._defer(AUDIT, lambda: asyncio.to_thread(append_rpc_audit_log, recv_entry))
 
-            # Use armazenamento em memória ou banco conforme o modo
-            # Initialize local device_type with fallback to self.device_type so it's always defined
+            # same state path for every device type, whatever the --state-store backend
             device_type = self.device_type
-            if self.use_memory:
-                # Use an in-memory proxy so existing code that expects a Device
-                # object with .state and .save() continues to work.
-                state = DEVICE_STATE[device_id]
-                device = InMemoryDeviceProxy(device_id)
-            else:
-                device = await sync_to_async(Device.objects.get)(pk=self.device_pk)
-                await sync_to_async(device.refresh_from_db)()
-                state = device.state or {}
-                # resolve device_type from device instance if possible
-                try:
-                    device_type = (device.device_type.name or "").lower()
-                except Exception:
-                    # keep the fallback already assigned from self.device_type
-                    pass
+            state = await self.state_store.get(self.device_pk)
 
             async def send_influx(data, device_obj=None):
-                # helper: forward to shared post_to_influx, prefer explicit device_obj when provided
+                # helper: queue the handler's device_data line in this RPC's batch
                 try:
-                    asyncio.ensure_future(post_to_influx(self.session, data, device_obj if device_obj is not None else device))
+                    batch.add('state', data)
                 except Exception:
                     # swallow to avoid breaking RPC handling
                     import traceback
@@ -388,13 +544,10 @@ class TelemetryPublisher:
             if device_type in self.LIGHTS or device_type == "lightbulb":
                 if method == "switchLed":
                     new_status = bool(params)
-                    if self.use_memory:
-                        DEVICE_STATE[device_id]['status'] = new_status
-                    else:
-                        device.state = {"status": new_status}
-                        await sync_to_async(device.save)()
+                    await self.state_store.set(self.device_pk, {"status": new_status})
+                    self._actuate(status=new_status)
                     telemetry = json.dumps({"status": new_status})
-                    await self.mqtt_client.publish("v1/devices/me/telemetry", telemetry)
+                    await self.publish(telemetry)
                     print(f"Device {device_id}: LED updated to {new_status} via RPC")
                     influx_tags = f"sensor={sensor_tag},source=simulator"
                     if request_id:
@@ -405,45 +558,37 @@ class TelemetryPublisher:
                     else:
                         print(f"Skipping Influx write: device {device_id} has no token")
 
-                    # Reply to the RPC request so ThingsBoard doesn't report TIMEOUT for two-way RPCs
-                    if request_id:
-                        try:
-                            resp_topic = f"v1/devices/me/rpc/response/{request_id}"
-                            resp_payload = json.dumps({"status": new_status})
-                            await self.publish_rpc_response(resp_topic, resp_payload)
-                        except Exception as e:
-                            print(f"Device {device_id}: Failed to publish RPC response: {e}")
-
+                    # Reply once so ThingsBoard doesn't report TIMEOUT for two-way RPCs
                     await self.publish_rpc_response(response_topic, json.dumps({"status": new_status}))
 
                 if method == "checkStatus":
-                    status = DEVICE_STATE[device_id].get("status", False) if self.use_memory else (device.state.get("status", False) if device and device.state else False)
+                    status = state.get("status", False)
                     await self.publish_rpc_response(response_topic, json.dumps({"status": status}))
 
-            elif device_type in self.TEMPERATURE_SENSOR or device_type == "temperature sensor":
+            elif device_type in self.TEMPERATURE_SENSOR or device_type in ("temperature sensor", "dht22"):
                 if method == "checkStatus":
-                    if self.use_memory:
-                        temperature = DEVICE_STATE[device_id].get("temperature", 25.0)
-                        temperature += random.uniform(-0.5, 0.5)
-                        temperature = max(0, temperature)
-                        DEVICE_STATE[device_id] = {"temperature": temperature}
-                        telemetry = json.dumps({"temperature": temperature})
+                    humidity = state.get("humidity")
+                    physical = self._physics_reading()
+                    if physical:
+                        # the zone the room's AC drives, as the periodic ticks report it
+                        temperature, humidity = physical["temperature"], physical["humidity"]
                     else:
-                        current_state = device.state or {}
-                        temperature = current_state.get("temperature", 25.0)
-                        temperature += random.uniform(-0.5, 0.5)
-                        temperature = max(0, temperature)
-                        new_state = {"temperature": temperature}
-                        device.state = new_state
-                        await sync_to_async(device.save)()
-                        telemetry = json.dumps(new_state)
+                        temperature = state.get("temperature", 25.0) + random.uniform(-0.5, 0.5)
+                    temperature = max(0, temperature)
+                    new_state = {"temperature": temperature}
+                    if isinstance(humidity, (int, float)):
+                        humidity = max(0, min(100, humidity))
+                        new_state["humidity"] = humidity
+                    await self.state_store.set(self.device_pk, new_state)
+                    telemetry = json.dumps(new_state)
 
                     await self.publish_rpc_response(response_topic, telemetry)
                     print(f"Device {device_id}: Sent Temperature Sensor checkStatus via RPC")
                     influx_tags = f"sensor={sensor_tag},source=simulator"
                     if request_id:
                         influx_tags += f",request_id=\"{request_id}\""
-                    data = f"device_data,{influx_tags} temperature={temperature},received_timestamp={received_timestamp} {received_timestamp}"
+                    fields = f"temperature={temperature}" + (f",humidity={new_state['humidity']}" if "humidity" in new_state else "")
+                    data = f"device_data,{influx_tags} {fields},received_timestamp={received_timestamp} {received_timestamp}"
                     if sensor_tag:
                         await send_influx(data)
                     else:
@@ -451,13 +596,12 @@ class TelemetryPublisher:
 
             elif device_type in self.SOILHUMIDITY_SENSOR or device_type == "soil humidity sensor":
                 if method == "checkStatus":
-                    current_state = device.state or {}
+                    current_state = state
                     humidity = current_state.get("humidity", 50.0)
-                    humidity += random.uniform(-2, 2)
+                    humidity = self._physics_reading().get("humidity", humidity + random.uniform(-2, 2))
                     humidity = max(0, min(100, humidity))
                     new_state = {"humidity": humidity}
-                    device.state = new_state
-                    await sync_to_async(device.save)()
+                    await self.state_store.set(self.device_pk, new_state)
                     telemetry = json.dumps(new_state)
                     await self.publish_rpc_response(response_topic, telemetry)
                     print(f"Device {device_id}: Sent Soil Humidity Sensor checkStatus via RPC")
@@ -473,10 +617,9 @@ class TelemetryPublisher:
             elif device_type in self.PUMP or device_type == "pump":
                 if method == "switchPump":
                     new_status = bool(params)
-                    device.state = {"status": new_status}
-                    await sync_to_async(device.save)()
+                    await self.state_store.set(self.device_pk, {"status": new_status})
                     telemetry = json.dumps({"status": new_status})
-                    await self.mqtt_client.publish("v1/devices/me/telemetry", telemetry)
+                    await self.publish(telemetry)
                     print(f"Device {device_id}: Pump updated to {new_status} via RPC")
                     data = f"device_data,sensor={sensor_tag},source=simulator status={float(1.0 if new_status else 0.0)},received_timestamp={received_timestamp} {received_timestamp}"
                     if sensor_tag:
@@ -485,16 +628,15 @@ class TelemetryPublisher:
                         print(f"Skipping Influx write: device {device_id} has no token")
                     await self.publish_rpc_response(response_topic, json.dumps({"status": new_status}))
                 if method == "checkStatus":
-                    telemetry = device.state.get("status", False)
+                    telemetry = state.get("status", False)
                     await self.publish_rpc_response(response_topic, json.dumps({"status": telemetry}))
 
             elif device_type in self.POOL or device_type == "pool":
                 if method == "switchPool":
                     new_status = bool(params)
-                    device.state = {"status": new_status}
-                    await sync_to_async(device.save)()
+                    await self.state_store.set(self.device_pk, {"status": new_status})
                     telemetry = json.dumps({"status": new_status})
-                    await self.mqtt_client.publish("v1/devices/me/telemetry", telemetry)
+                    await self.publish(telemetry)
                     print(f"Device {device_id}: Pool updated to {new_status} via RPC")
                     data = f"device_data,sensor={sensor_tag},source=simulator status={float(1.0 if new_status else 0.0)},received_timestamp={received_timestamp} {received_timestamp}"
                     if sensor_tag:
@@ -503,16 +645,16 @@ class TelemetryPublisher:
                         print(f"Skipping Influx write: device {device_id} has no token")
                     await self.publish_rpc_response(response_topic, json.dumps({"status": new_status}))
                 if method == "checkStatus":
-                    telemetry = device.state.get("status", False)
+                    telemetry = state.get("status", False)
                     await self.publish_rpc_response(response_topic, json.dumps({"status": telemetry}))
 
             elif device_type in self.IRRIGATION or device_type == "irrigation":
                 if method == "switchIrrigation":
                     new_status = bool(params)
-                    device.state = {"status": new_status}
-                    await sync_to_async(device.save)()
+                    await self.state_store.set(self.device_pk, {"status": new_status})
+                    self._actuate(status=new_status)
                     telemetry = json.dumps({"status": new_status})
-                    await self.mqtt_client.publish("v1/devices/me/telemetry", telemetry)
+                    await self.publish(telemetry)
                     print(f"Device {device_id}: Irrigation updated to {new_status} via RPC")
                     data = f"device_data,sensor={sensor_tag},source=simulator status={float(1.0 if new_status else 0.0)},received_timestamp={received_timestamp} {received_timestamp}"
                     if sensor_tag:
@@ -521,27 +663,31 @@ class TelemetryPublisher:
                         print(f"Skipping Influx write: device {device_id} has no token")
                     await self.publish_rpc_response(response_topic, json.dumps({"status": new_status}))
                 if method == "checkStatus":
-                    telemetry = device.state.get("status", False)
-                    await self.mqtt_client.publish(response_topic, json.dumps({"status": telemetry}))
+                    telemetry = state.get("status", False)
+                    await self.publish_rpc_response(response_topic, json.dumps({"status": telemetry}))
 
             elif device_type in self.AIR_CONDITIONER or device_type == "airconditioner":
                 if method == "checkStatus":
-                    current_state = device.state or {}
+                    current_state = state
                     temperature = current_state.get("temperature", 24.0)
                     humidity = current_state.get("humidity", 50.0)
                     status = current_state.get("status", False)
-                    # Simula pequenas variações
-                    temperature += random.uniform(-0.5, 0.5)
-                    humidity += random.uniform(-1, 1)
+                    physical = self._physics_reading()
+                    if physical:
+                        temperature, humidity = physical["temperature"], physical["humidity"]
+                    else:
+                        # Simula pequenas variações
+                        temperature += random.uniform(-0.5, 0.5)
+                        humidity += random.uniform(-1, 1)
                     temperature = max(0, temperature)
                     humidity = max(0, min(100, humidity))
                     new_state = {
                         "temperature": temperature,
                         "humidity": humidity,
-                        "status": status
+                        "status": status,
+                        **self.setpoints(current_state),
                     }
-                    device.state = new_state
-                    await sync_to_async(device.save)()
+                    await self.state_store.set(self.device_pk, new_state)
                     telemetry = json.dumps(new_state)
                     await self.publish_rpc_response(response_topic, telemetry)
                     print(f"Device {device_id}: Sent AirConditioner checkStatus via RPC")
@@ -552,20 +698,22 @@ class TelemetryPublisher:
                         print(f"Skipping Influx write: device {device_id} has no token")
                 if method == "switchStatus":
                     new_status = bool(params)
-                    current_state = device.state or {}
+                    current_state = state
                     print(f"[SIM-RPC] device={device_id} method=switchStatus request_id={request_id} sensor={sensor_tag} status_in={params}")
                     # Prepare influx tags before state dict
                     influx_tags = f"sensor={sensor_tag},source=simulator,direction=M2S"
                     if request_id:
                         influx_tags += f",request_id=\"{request_id}\""
-                    device.state = {
+                    new_state = {
                         "temperature": current_state.get("temperature", 24.0),
                         "humidity": current_state.get("humidity", 50.0),
-                        "status": new_status
+                        "status": new_status,
+                        **self.setpoints(current_state),
                     }
-                    await sync_to_async(device.save)()
-                    telemetry = json.dumps(device.state)
-                    await self.mqtt_client.publish("v1/devices/me/telemetry", telemetry)
+                    await self.state_store.set(self.device_pk, new_state)
+                    self._actuate(status=new_status)
+                    telemetry = json.dumps(new_state)
+                    await self.publish(telemetry)
                     print(f"Device {device_id}: AirConditioner status updated to {new_status} via RPC")
                     data = f"device_data,sensor={sensor_tag},source=simulator status={float(1.0 if new_status else 0.0)},received_timestamp={received_timestamp} {received_timestamp}"
                     if sensor_tag:
@@ -580,16 +728,21 @@ class TelemetryPublisher:
                     except Exception:
                         new_temperature = 24.0
                     print(f"[SIM-RPC] device={device_id} method=setTemperature request_id={request_id} sensor={sensor_tag} temp_in={params}")
-                    current_state = device.state or {}
+                    current_state = state
                     new_temperature = max(0.0, min(50.0, new_temperature))
-                    device.state = {
-                        "temperature": new_temperature,
+                    self._actuate(setpoint=new_temperature)
+                    # with --physics the room only moves towards the set point; without it the AC reports it
+                    physical = self._physics_reading()
+                    new_state = {
+                        "temperature": physical.get("temperature", new_temperature),
                         "humidity": current_state.get("humidity", 50.0),
                         "status": current_state.get("status", False),
+                        **self.setpoints(current_state),
+                        "setpoint": new_temperature,
                     }
-                    await sync_to_async(device.save)()
-                    telemetry = json.dumps(device.state)
-                    await self.mqtt_client.publish("v1/devices/me/telemetry", telemetry)
+                    await self.state_store.set(self.device_pk, new_state)
+                    telemetry = json.dumps(new_state)
+                    await self.publish(telemetry)
                     print(f"Device {device_id}: AirConditioner temperature updated to {new_temperature} via RPC")
                     data = f"device_data,sensor={sensor_tag},source=simulator temperature={new_temperature},received_timestamp={received_timestamp} {received_timestamp}"
                     if sensor_tag:
@@ -604,16 +757,20 @@ class TelemetryPublisher:
                     except Exception:
                         new_humidity = 50.0
                     print(f"[SIM-RPC] device={device_id} method=setHumidity request_id={request_id} sensor={sensor_tag} humidity_in={params}")
-                    current_state = device.state or {}
+                    current_state = state
                     new_humidity = max(0.0, min(100.0, new_humidity))
-                    device.state = {
+                    self._actuate(humidity_setpoint=new_humidity)
+                    physical = self._physics_reading()
+                    new_state = {
                         "temperature": current_state.get("temperature", 24.0),
-                        "humidity": new_humidity,
+                        "humidity": physical.get("humidity", new_humidity),
                         "status": current_state.get("status", False),
+                        **self.setpoints(current_state),
+                        "humidity_setpoint": new_humidity,
                     }
-                    await sync_to_async(device.save)()
-                    telemetry = json.dumps(device.state)
-                    await self.mqtt_client.publish("v1/devices/me/telemetry", telemetry)
+                    await self.state_store.set(self.device_pk, new_state)
+                    telemetry = json.dumps(new_state)
+                    await self.publish(telemetry)
                     print(f"Device {device_id}: AirConditioner humidity updated to {new_humidity} via RPC")
                     data = f"device_data,sensor={sensor_tag},source=simulator humidity={new_humidity},received_timestamp={received_timestamp} {received_timestamp}"
                     if sensor_tag:
@@ -627,9 +784,48 @@ class TelemetryPublisher:
         except Exception as e:
             print(f"Device {self.token}: Error processing RPC message: {e}")
 
+    @staticmethod
+    def setpoints(state):
+        """The AC set points stored in ``state``; --physics reads them back when the device is added again."""
+        if not isinstance(state, dict):
+            return {}
+        return {key: state[key] for key in ("setpoint", "humidity_setpoint") if key in state}
+
+    def _actuate(self, **changes):
+        """Tell --physics that an RPC switched this actuator or moved its set point."""
+        if UNIT_PHYSICS is not None:
+            UNIT_PHYSICS.actuate(self.device_id, SIM_CLOCK.time(), **changes)
+
+    def _physics_reading(self):
+        if UNIT_PHYSICS is None or self.device_id not in UNIT_PHYSICS:
+            return {}
+        UNIT_PHYSICS.advance(SIM_CLOCK.time())
+        return UNIT_PHYSICS.reading(self.device_id)
+
+    async def _defer(self, kind, factory, key=None):
+        """Hand a side effect to the queue, or run it right away when there is none."""
+        if self.side_effects is not None:
+            self.side_effects.submit(kind, factory, key=key)
+        else:
+            await factory()
+
     async def publish(self, payload):
+        if self.uplink is not None:
+            await self.uplink.send(lambda: self._publish_telemetry(payload), len(payload))
+        else:
+            await self._publish_telemetry(payload)
+
+    async def _publish_telemetry(self, payload):
+        if TRAFFIC_RECORDER is not None:
+            TRAFFIC_RECORDER.record(TELEMETRY, self.token, "v1/devices/me/telemetry", payload)
+        if self.transport is not None:
+            try:
+                await self.transport.post_telemetry(self.token, payload)
+            except Exception as e:
+                print(f"[http] telemetry post failed for {self.device_id}: {e}")
+            return
         try:
-            await self.mqtt_client.publish("v1/devices/me/telemetry", payload)
+            await self._mqtt_publish("v1/devices/me/telemetry", payload, QOS_POLICY.telemetry)
         except Exception as e:
             # Handle publish failure: try a reconciliation (refresh token) and reconnect once
             print(f"[mqtt] publish failed for {self.device_id}: {e}. Trying reconciliation and reconnect...")
@@ -644,215 +840,384 @@ class TelemetryPublisher:
                 # attempt reconnect
                 await self.connect()
                 # retry publish once
-                await self.mqtt_client.publish("v1/devices/me/telemetry", payload)
+                await self._mqtt_publish("v1/devices/me/telemetry", payload, QOS_POLICY.telemetry)
                 return
             except Exception as re:
                 print(f"[mqtt] reconciliação/republish falhou para {self.device_id}: {re}")
                 # swallow exception to avoid killing whole loop
                 return
 
-    async def publish_rpc_response(self, topic, payload, retries=1):
-        """Publish an RPC response, with a single reconnect+retry if the client is disconnected."""
-        try:
+    async def _mqtt_publish(self, topic, payload, qos):
+        """QoS 0: written to the socket. QoS 1: returns once in the publish window; the ack is awaited there."""
+        if not qos:
             await self.mqtt_client.publish(topic, payload)
+            return
+        if self.publish_window is None:
+            self.publish_window = PublishWindow(self._publish_acked, QOS_POLICY, QOS_STATS)
+        await self.publish_window.submit(topic, payload)
+
+    async def _publish_acked(self, topic, payload, qos, timeout):
+        import aiomqtt
+
+        # the current client: a reconnect replaces it
+        try:
+            await self.mqtt_client.publish(topic, payload, qos=qos, timeout=timeout)
+        except aiomqtt.MqttError as e:
+            # aiomqtt reports a missing PUBACK as "Operation timed out"; anything else means a broken client
+            if "timed out" in str(e):
+                raise asyncio.TimeoutError(str(e)) from e
+            raise
+
+    async def publish_samples(self, samples):
+        """Post several telemetry samples in one request of the HTTP device API; over MQTT they go one by one."""
+        if self.transport is None:
+            for sample in samples:
+                await self.publish(json.dumps(sample.payload))
+            return
+        body = [{"ts": sample.ts, "values": sample.payload} for sample in samples]
+        if TRAFFIC_RECORDER is not None:
+            for sample in samples:
+                TRAFFIC_RECORDER.record(TELEMETRY, self.token, "v1/devices/me/telemetry", json.dumps(sample.payload))
+        if self.uplink is not None:
+            await self.uplink.send(lambda: self.transport.post_telemetry(self.token, body), len(json.dumps(body)))
+        else:
+            await self.transport.post_telemetry(self.token, body)
+
+    async def publish_rpc_response(self, topic, payload):
+        """Publish an RPC response; False when it was not delivered (dropped by the uplink or failed)."""
+        if self.uplink is not None:
+            return await self.uplink.send(lambda: self._publish_rpc_response(topic, payload), len(payload))
+        return await self._publish_rpc_response(topic, payload)
+
+    async def _publish_rpc_response(self, topic, payload):
+        if TRAFFIC_RECORDER is not None:
+            TRAFFIC_RECORDER.record(RPC_RESPONSE, self.token, topic, payload)
+        if self.transport is not None:
+            try:
+                await self.transport.post_rpc_response(self.token, topic.rsplit('/', 1)[-1], payload)
+            except Exception as e:
+                print(f"[http] RPC response {topic} failed for {self.device_id}: {e}")
+                return False
+            await self._record_rpc_response()
+            return True
+        try:
+            await self._mqtt_publish(topic, payload, QOS_POLICY.rpc_response)
             print(f"Published RPC response to {topic}: {payload}")
             
             # Log the response timestamp for M2S latency measurement
-            try:
-                response_timestamp = int(time.time() * 1000)
-                raw_token = getattr(self, 'thingsboard_id', None)
-                if raw_token:
-                    sensor_tag = str(raw_token).replace('\\', '\\\\').replace(',', '\\,').replace(' ', '\\ ').replace('=', '\\=')
-                    # Write M2S received_timestamp to InfluxDB for latency calculation
-                    influx_data = f"device_data,sensor={sensor_tag},source=simulator_response received_timestamp={response_timestamp} {response_timestamp}"
-                    await post_to_influx(self.session, influx_data, None)
-            except Exception:
-                # Swallow logging errors to avoid affecting RPC response
-                import traceback
-                traceback.print_exc()
-            
+            await self._record_rpc_response()
             return True
         except Exception as e:
             print(f"Publish RPC response failed for {topic}: {e}; attempting reconnect and retry...")
             try:
                 # attempt reconnect
                 await self.connect()
-                await self.mqtt_client.publish(topic, payload)
+                await self._mqtt_publish(topic, payload, QOS_POLICY.rpc_response)
                 print(f"Published RPC response to {topic} after reconnect: {payload}")
                 
                 # Log the response timestamp for M2S latency measurement (retry case)
-                try:
-                    response_timestamp = int(time.time() * 1000)
-                    raw_token = getattr(self, 'thingsboard_id', None)
-                    if raw_token:
-                        sensor_tag = str(raw_token).replace('\\', '\\\\').replace(',', '\\,').replace(' ', '\\ ').replace('=', '\\=')
-                        # Write M2S received_timestamp to InfluxDB for latency calculation
-                        influx_data = f"device_data,sensor={sensor_tag},source=simulator_response received_timestamp={response_timestamp} {response_timestamp}"
-                        await post_to_influx(self.session, influx_data, None)
-                except Exception:
-                    # Swallow logging errors to avoid affecting RPC response
-                    import traceback
-                    traceback.print_exc()
-                
+                await self._record_rpc_response()
                 return True
             except Exception as e2:
                 print(f"Failed to publish RPC response after reconnect for {topic}: {e2}")
                 return False
 
-    async def send_telemetry_async(self, use_influxdb=False, session=None):
-        device_id = self.device_id
+    async def _record_rpc_response(self):
+        """Stamp the response time; goes into the current RPC's batch when there is one."""
+        try:
+            response_timestamp = SIM_CLOCK.timestamp_ms()
+            raw_token = getattr(self, 'thingsboard_id', None)
+            if not raw_token:
+                return
+            sensor_tag = str(raw_token).replace('\\', '\\\\').replace(',', '\\,').replace(' ', '\\ ').replace('=', '\\=')
+            # Write M2S received_timestamp to InfluxDB for latency calculation
+            influx_data = f"device_data,sensor={sensor_tag},source=simulator_response received_timestamp={response_timestamp} {response_timestamp}"
+            batch = _current_rpc_batch.get()
+            if batch is not None and batch.add('response', influx_data):
+                return
+            # outside an RPC handler, or published after it finished (delayed uplink)
+            if 'response' in RPC_INFLUX_MEASUREMENTS and self.session is not None:
+                await self._defer(METRICS, lambda: post_to_influx(self.session, influx_data, None))
+        except Exception:
+            # Swallow logging errors to avoid affecting RPC response
+            import traceback
+            traceback.print_exc()
+
+    @classmethod
+    def random_state(cls, device_type, state, rng=random):
+        """Next ``--randomize`` state of a device (also its telemetry); None for types without a generator.
+
+        Shared with ``backfill_telemetry``, which replays it over simulated history.
+        """
+        if device_type in cls.LIGHTS:
+            # OPTIMIZATION: Toggle status instead of random to ensure each message differs
+            # This prevents middleware deduplication of identical consecutive values
+            current_status = state.get('status', False) if isinstance(state, dict) else False
+            return {"status": not current_status}  # Toggle: on→off, off→on
+        if device_type in cls.AIR_CONDITIONER + cls.TEMPERATURE_SENSOR:
+            # For continuous properties, vary slightly instead of full random
+            # This ensures different values in each message (prevents deduplication)
+            current_temp = state.get('temperature', 20.0) if isinstance(state, dict) else 20.0
+            current_humidity = state.get('humidity', 60.0) if isinstance(state, dict) else 60.0
+            # Small variation (±0.5°C, ±2% RH) instead of full random range
+            temperature = round(current_temp + rng.uniform(-0.5, 0.5), 2)
+            humidity = round(current_humidity + rng.uniform(-2, 2), 2)
+            temperature = max(16.0, min(28.0, temperature))
+            humidity = max(50.0, min(80.0, humidity))
+            # Toggle boolean status property
+            current_status = state.get('status', False) if isinstance(state, dict) else False
+            return {"temperature": temperature, "humidity": humidity, "status": not current_status,
+                    **cls.setpoints(state)}
+        if device_type in cls.PUMP + cls.POOL + cls.IRRIGATION:
+            # Toggle status to ensure each message differs
+            current_status = state.get('status', False) if isinstance(state, dict) else False
+            return {"status": not current_status}
+        return None
+
+    async def send_telemetry_async(self):
         device_type = self.device_type
         telemetry = None
 
-        if self.use_memory:
-            state = DEVICE_STATE[device_id]
-        else:
-            device = await sync_to_async(Device.objects.get)(pk=self.device_pk)
-            await sync_to_async(device.refresh_from_db)()
-            state = device.state or {}
-            device_type = await sync_to_async(lambda d: d.device_type.name.lower())(device)
-
-        if self.randomize:
-            if device_type in self.LIGHTS:
-                # OPTIMIZATION: Toggle status instead of random to ensure each message differs
-                # This prevents middleware deduplication of identical consecutive values
-                current_status = state.get('status', False) if isinstance(state, dict) else False
-                new_status = not current_status  # Toggle: on→off, off→on
-                if self.use_memory:
-                    DEVICE_STATE[device_id]['status'] = new_status
-                else:
-                    device.state = {"status": new_status}
-                    await sync_to_async(device.save)()
-                telemetry = json.dumps({"status": new_status})
-            elif device_type in self.AIR_CONDITIONER + self.TEMPERATURE_SENSOR:
-                # For continuous properties, vary slightly instead of full random
-                # This ensures different values in each message (prevents deduplication)
-                current_temp = state.get('temperature', 20.0) if isinstance(state, dict) else 20.0
-                current_humidity = state.get('humidity', 60.0) if isinstance(state, dict) else 60.0
-                # Small variation (±0.5°C, ±2% RH) instead of full random range
-                temperature = round(current_temp + random.uniform(-0.5, 0.5), 2)
-                humidity = round(current_humidity + random.uniform(-2, 2), 2)
-                temperature = max(16.0, min(28.0, temperature))
-                humidity = max(50.0, min(80.0, humidity))
-                # Toggle boolean status property
-                current_status = state.get('status', False) if isinstance(state, dict) else False
-                status = not current_status
-                if self.use_memory:
-                    DEVICE_STATE[device_id] = {"temperature": temperature, "humidity": humidity, "status": status}
-                else:
-                    device.state = {"temperature": temperature, "humidity": humidity, "status": status}
-                    await sync_to_async(device.save)()
-                telemetry = json.dumps({"temperature": temperature, "humidity": humidity, "status": status})
-            elif device_type in self.PUMP:
-                # Toggle pump status to ensure each message differs
-                current_status = state.get('status', False) if isinstance(state, dict) else False
-                status = not current_status
-                if self.use_memory:
-                    DEVICE_STATE[device_id]['status'] = status
-                else:
-                    device.state = {"status": status}
-                    await sync_to_async(device.save)()
-                telemetry = json.dumps({"status": status})
-            elif device_type in self.POOL:
-                # Toggle pool status to ensure each message differs
-                current_status = state.get('status', False) if isinstance(state, dict) else False
-                status = not current_status
-                if self.use_memory:
-                    DEVICE_STATE[device_id]['status'] = status
-                else:
-                    device.state = {"status": status}
-                    await sync_to_async(device.save)()
-                telemetry = json.dumps({"status": status})
-            elif device_type in self.IRRIGATION:
-                # Toggle irrigation status to ensure each message differs
-                current_status = state.get('status', False) if isinstance(state, dict) else False
-                status = not current_status
-                if self.use_memory:
-                    DEVICE_STATE[device_id]['status'] = status
-                else:
-                    device.state = {"status": status}
-                    await sync_to_async(device.save)()
-                telemetry = json.dumps({"status": status})
+        state = await self.state_store.get(self.device_pk)
+
+        if UNIT_PHYSICS is not None and self.device_id in UNIT_PHYSICS:
+            # sensors read their zone; actuators keep the status their RPCs set
+            UNIT_PHYSICS.advance(SIM_CLOCK.time())
+            state.update(UNIT_PHYSICS.reading(self.device_id))
+            await self.state_store.set(self.device_pk, state)
+            telemetry = json.dumps(state)
+        elif self.randomize:
+            new_state = self.random_state(device_type, state)
+            if new_state is not None:
+                await self.state_store.set(self.device_pk, new_state)
+                telemetry = json.dumps(new_state)
             else:
                 telemetry = json.dumps(state)
         else:
             if device_type in self.LIGHTS:
-                status = DEVICE_STATE[device_id].get("status", False) if self.use_memory else state.get("status", False)
+                status = state.get("status", False)
                 telemetry = json.dumps({"status": status})
             else:
-                telemetry = json.dumps(DEVICE_STATE[device_id] if self.use_memory else state)
+                telemetry = json.dumps(state)
 
-        # Gerar request_id único para cada envio de telemetria
-        import uuid
-        request_id = str(uuid.uuid4())
-        sent_timestamp = int(time.time() * 1000)
         telemetry_dict = json.loads(telemetry)
-        # Para cada propriedade, gerar um request_id e registrar individualmente
-        properties = []
-        if device_type in ["temperature sensor", "dht22", "airconditioner"]:
-            properties = ["status", "temperature", "humidity"]
-        elif device_type in ["led", "lightbulb", "pump", "pool", "irrigation"]:
-            properties = ["status"]
-        elif device_type in ["soilhumidity sensor", "soil humidity sensor"]:
-            properties = ["status", "humidity"]
-        else:
-            properties = list(telemetry_dict.keys())
+        await self._emit_telemetry(telemetry_dict, telemetry_properties(device_type, telemetry_dict))
+
+    async def send_trace_sample(self, values):
+        """Publish the fields of one trace row and keep them as the device state (RPCs read them back)."""
+        state = await self.state_store.get(self.device_pk)
+        state.update(values)
+        await self.state_store.set(self.device_pk, state)
+        await self._emit_telemetry(dict(values), list(values))
 
+    async def _emit_telemetry(self, telemetry_dict, properties):
+        if not properties:
+            return
         # Use one correlation_id/timestamp per published telemetry message
-        message_request_id = str(__import__('uuid').uuid4())
-        message_sent_timestamp = int(time.time() * 1000)
-
-        for prop in properties:
-            prop_value = telemetry_dict.get(prop)
-            # Atualiza o payload para envio MQTT (apenas para o primeiro registro)
-            if prop == properties[0]:
-                telemetry_dict["request_id"] = message_request_id
-                telemetry_dict["sent_timestamp"] = message_sent_timestamp
-                await self.publish(json.dumps(telemetry_dict))
-                print(f"Device {device_id}: Telemetry sent: {telemetry_dict} at {message_sent_timestamp} (request_id={message_request_id})")
-            if use_influxdb and session is not None:
-                raw_token = getattr(self, 'thingsboard_id', None)
-                if raw_token:
-                    sensor_tag = str(raw_token).replace('\\', '\\\\').replace(',', '\\,').replace(' ', '\\ ').replace('=', '\\=')
-                else:
-                    sensor_tag = None
-                influx_tags = (
-                    f"sensor={sensor_tag},source=simulator,direction=S2M,"
-                    f"request_id=\"{message_request_id}\",correlation_id={message_request_id}"
-                )
-                data = f"device_data,{influx_tags} {prop}={prop_value},sent_timestamp={message_sent_timestamp} {message_sent_timestamp}"
-                try:
-                    device_obj = None
-                    try:
-                        device_obj = await sync_to_async(Device.objects.get)(pk=self.device_pk)
-                    except Exception:
-                        device_obj = None
-                    status_code, text = await post_to_influx(session, data, device=device_obj)
-                    if status_code != 204 and status_code != 200:
-                        print(f"Error sending data to InfluxDB: {status_code} - {text}")
-                except Exception:
-                    print("Failed to post to InfluxDB; see debug above")
+        message_request_id = str(uuid.uuid4())
+        message_sent_timestamp = SIM_CLOCK.timestamp_ms()
+        telemetry_dict["request_id"] = message_request_id
+        telemetry_dict["sent_timestamp"] = message_sent_timestamp
+        # MQTT publish, Influx points, files...: whatever --sink configured
+        await TELEMETRY_SINKS.emit(TelemetrySample(
+            self, message_sent_timestamp, message_request_id, telemetry_dict, properties,
+        ))
+
+def telemetry_properties(device_type, telemetry):
+    """Properties a device of ``device_type`` reports (Influx fields); unknown types report all keys."""
+    if device_type in ["temperature sensor", "dht22", "airconditioner"]:
+        return ["status", "temperature", "humidity"]
+    if device_type in ["led", "lightbulb", "pump", "pool", "irrigation"]:
+        return ["status"]
+    if device_type in ["soilhumidity sensor", "soil humidity sensor"]:
+        return ["status", "humidity"]
+    return list(telemetry.keys())
+
+
+def process_age():
+    """Seconds since this process was exec'd (Linux /proc only; None elsewhere)."""
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class StartupProfile:
+    """Wall-clock timings of the startup phases, printed as one `[startup]` JSON line."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.phases = {}
+        age = process_age()
+        if age is not None:
+            # interpreter start, Django setup, imports and command parsing
+            self.phases['process_to_handle'] = round(age, 3)
+        self.phases['module_to_handle'] = round(self.started - MODULE_LOADED_AT, 3)
+        self._last = self.started
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = round(now - self._last, 3)
+        self._last = now
+
+    def report(self, **extra):
+        if not self.enabled:
+            return
+        self.phases['handle_total'] = round(time.perf_counter() - self.started, 3)
+        print(f"[startup] {json.dumps({**self.phases, **extra})}")
+
 
-async def telemetry_task(publisher, use_influxdb, session):
+async def telemetry_task(publisher):
     await publisher.connect()
     while True:
-        await publisher.send_telemetry_async(use_influxdb=use_influxdb, session=session)
-        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        await publisher.send_telemetry_async()
+        await SIM_CLOCK.sleep(HEARTBEAT_INTERVAL)
 
 class Command(BaseCommand):
     help = "Sends telemetry and processes RPC calls from ThingsBoard every 5 seconds for registered devices."
+    # runtime command: model/URL checks belong to migrate/runserver and only slow down restarts
+    requires_system_checks = []
 
     def add_arguments(self, parser):
         parser.add_argument(
             '--use-influxdb',
             action='store_true',
-            help='Use InfluxDB for storing telemetry data'
+            help='Use InfluxDB for storing telemetry data (adds an influx sink when --sink lists none)'
+        )
+        parser.add_argument(
+            '--influx-schema',
+            choices=SCHEMAS,
+            default=os.getenv('SIMULATOR_INFLUX_SCHEMA', SCHEMA_WIDE),
+            help='Line-protocol layout of the influx, file and stdout sinks: wide (one point per message, every '
+                 'property a field) or narrow (one point per property, the original layout)'
+        )
+        parser.add_argument(
+            '--transport',
+            choices=TRANSPORTS,
+            default=os.getenv('SIMULATOR_TRANSPORT', TRANSPORT_MQTT),
+            help='How devices talk to ThingsBoard: mqtt (one connection each) or http (device API over a shared '
+                 'keep-alive pool, RPCs by long polling)'
+        )
+        parser.add_argument(
+            '--telemetry-qos',
+            type=int,
+            choices=QOS_LEVELS,
+            default=0,
+            help='MQTT QoS of telemetry publishes; at 1 they are pipelined through the --qos-window'
+        )
+        parser.add_argument(
+            '--rpc-response-qos',
+            type=int,
+            choices=QOS_LEVELS,
+            default=0,
+            help='MQTT QoS of RPC responses; at 1 they are pipelined through the --qos-window'
+        )
+        parser.add_argument(
+            '--qos-window',
+            type=int,
+            default=16,
+            help='QoS 1 messages per connection waiting for their PUBACK before publishing blocks'
+        )
+        parser.add_argument(
+            '--qos-ack-timeout',
+            type=float,
+            default=10.0,
+            help='Seconds to wait for a PUBACK before the message is published again'
+        )
+        parser.add_argument(
+            '--qos-retries',
+            type=int,
+            default=2,
+            help='Retransmissions of a QoS 1 message before it counts as failed'
+        )
+        parser.add_argument(
+            '--http-max-connections',
+            type=int,
+            default=64,
+            help='--transport http: sockets the whole fleet shares for telemetry and RPC responses'
+        )
+        parser.add_argument(
+            '--http-pollers',
+            type=int,
+            default=32,
+            help='--transport http: RPC long polls in flight at once, each on its own socket; devices take turns'
+        )
+        parser.add_argument(
+            '--http-poll-timeout',
+            type=float,
+            default=5.0,
+            help='--transport http: seconds each RPC long poll waits before the next device gets its turn'
+        )
+        parser.add_argument(
+            '--sink',
+            action='append',
+            metavar='NAME[:KEY=VALUE,...]',
+            help='Output of generated telemetry (repeatable): mqtt, influx, file:path=FILE, stdout or null, with '
+                 'per-sink options such as batch=, concurrency=, linger=, max_pending=, overflow=, rotate_mb=. '
+                 'Default: mqtt, or http with --transport http (plus influx with --use-influxdb). Without an mqtt '
+                 'or http sink devices do not connect'
         )
         parser.add_argument(
             '--randomize',
             action='store_true',
             help='Randomize device properties'
         )
+        parser.add_argument(
+            '--trace',
+            type=str,
+            metavar='FILE',
+            help='Publish the rows of a sensor dataset (CSV or Influx line protocol, optionally .gz) instead of '
+                 'generated telemetry; rows are routed to devices by device id or unit name'
+        )
+        parser.add_argument(
+            '--trace-format',
+            choices=TRACE_FORMATS,
+            default='auto',
+            help='Format of --trace (auto: by extension, else by the first line)'
+        )
+        parser.add_argument(
+            '--trace-speed',
+            type=float,
+            default=1.0,
+            help='Trace time scale: 1 = original schedule, 60 = one trace minute per second, 0 = as fast as possible'
+        )
+        parser.add_argument(
+            '--trace-time-column',
+            type=str,
+            help='CSV column with the row time (default: time, timestamp, _time, ts or datetime)'
+        )
+        parser.add_argument(
+            '--trace-key-column',
+            type=str,
+            help='CSV column or line-protocol tag naming the device or unit (default: device_id, else unit)'
+        )
+        parser.add_argument(
+            '--trace-loop',
+            action='store_true',
+            help='Start the trace again when it ends'
+        )
+        parser.add_argument(
+            '--trace-max-inflight',
+            type=int,
+            default=256,
+            help='Trace rows being published at the same time (rows of one device stay in order)'
+        )
+        parser.add_argument(
+            '--physics',
+            action='store_true',
+            help='Couple the devices of each room of a unit: air conditioners, lamps and irrigation switched by RPC '
+                 'drive the temperature and humidity their sensors report (replaces --randomize for those types)'
+        )
+        parser.add_argument(
+            '--physics-backend',
+            choices=PHYSICS_BACKENDS,
+            help='Array backend of --physics (default: numpy when installed, else python)'
+        )
         parser.add_argument(
             '--device-id',
             nargs='+',
@@ -872,7 +1237,175 @@ class Command(BaseCommand):
         parser.add_argument(
             '--memory',
             action='store_true',
-            help='Use in-memory storage for device state (syncs to DB on exit)'
+            help='Use in-memory storage for device state (syncs to DB on exit); same as --state-store memory'
+        )
+        parser.add_argument(
+            '--state-store',
+            choices=STATE_STORES,
+            help='Device state backend: memory (DB written on exit), write-behind (memory, flushed to the DB '
+                 'periodically) or db (every read and write hits the DB). Default: memory with --memory, else db'
+        )
+        parser.add_argument(
+            '--state-flush-interval',
+            type=float,
+            default=5.0,
+            help='Seconds between database flushes of --state-store write-behind'
+        )
+        parser.add_argument(
+            '--db-executor',
+            action='store_true',
+            help='Run state and fleet reads on a pool of reader threads and commit state writes in batches from one '
+                 'writer thread, instead of the shared sync_to_async thread'
+        )
+        parser.add_argument(
+            '--db-readers',
+            type=int,
+            default=4,
+            help='Reader threads (one DB connection each) of --db-executor'
+        )
+        parser.add_argument(
+            '--db-max-batch',
+            type=int,
+            default=500,
+            help='Most device-state updates the --db-executor writer commits in one transaction'
+        )
+        parser.add_argument(
+            '--heartbeat-interval',
+            type=float,
+            default=HEARTBEAT_INTERVAL,
+            help='Default seconds between telemetry messages per device'
+        )
+        parser.add_argument(
+            '--type-interval',
+            action='append',
+            metavar='TYPE=SECONDS',
+            help='Heartbeat interval for a device type (repeatable), e.g. --type-interval led=1'
+        )
+        parser.add_argument(
+            '--system-interval',
+            action='append',
+            metavar='SYSTEM=SECONDS',
+            help='Heartbeat interval for every device of a system (repeatable); type overrides win'
+        )
+        parser.add_argument(
+            '--target-rate',
+            type=float,
+            default=getattr(settings, 'TELEMETRY_TARGET_RATE', None),
+            help='Open-loop mode: scale all intervals so the fleet publishes this many messages/second'
+        )
+        parser.add_argument(
+            '--max-inflight-ticks',
+            type=int,
+            default=4,
+            help='Open-loop mode: pending sends per device before ticks are skipped'
+        )
+        parser.add_argument(
+            '--central-scheduler',
+            action='store_true',
+            help='Drive every device\'s telemetry ticks from one scheduler task instead of one task per device '
+                 '(less memory per device on large fleets)'
+        )
+        parser.add_argument(
+            '--time-scale',
+            type=float,
+            default=float(os.getenv('SIMULATOR_TIME_SCALE', '1')),
+            help='Simulated seconds per wall-clock second for ticks and timestamps '
+                 '(1 = real time, 60 = an hour per minute, 0 = jump to the next tick as soon as sends finish)'
+        )
+        parser.add_argument(
+            '--record',
+            type=str,
+            metavar='FILE',
+            help='Record every telemetry publish, RPC request and RPC response to FILE (replay with replay_traffic)'
+        )
+        parser.add_argument(
+            '--rate-report-interval',
+            type=float,
+            default=10.0,
+            help='Seconds between achieved-rate reports (0 disables)'
+        )
+        parser.add_argument(
+            '--impairment-file',
+            type=str,
+            default=os.getenv('SIMULATOR_IMPAIRMENT_FILE') or None,
+            help='JSON file with network impairment profiles and per-device/unit rules'
+        )
+        parser.add_argument(
+            '--impairment-profile',
+            type=str,
+            help='Name of a profile from --impairment-file applied to every device without a matching rule'
+        )
+        parser.add_argument(
+            '--rpc-influx-measurements',
+            type=str,
+            help=(
+                "Comma-separated Influx measurements written per RPC (one batched POST): "
+                "latency, received, state, response, all or none. Default: M2S_RPC_INFLUX_MEASUREMENTS or all"
+            )
+        )
+        parser.add_argument(
+            '--rpc-concurrency',
+            type=int,
+            default=64,
+            help='RPCs handled at once across all devices (per-device order is kept); 0 handles them inline per connection'
+        )
+        parser.add_argument(
+            '--rpc-queue-per-device',
+            type=int,
+            default=100,
+            help='RPCs waiting per device before --rpc-overflow applies'
+        )
+        parser.add_argument(
+            '--rpc-max-queued',
+            type=int,
+            default=10000,
+            help='RPCs waiting in total before --rpc-overflow applies'
+        )
+        parser.add_argument(
+            '--rpc-overflow',
+            choices=OVERFLOW_POLICIES,
+            default=OVERFLOW_BLOCK,
+            help='When the RPC queue is full: block the MQTT reader, drop the incoming RPC or drop the oldest waiting one'
+        )
+        parser.add_argument(
+            '--metrics-concurrency',
+            type=int,
+            default=8,
+            help='Deferred Influx writes of the RPC path running at once'
+        )
+        parser.add_argument(
+            '--persistence-concurrency',
+            type=int,
+            default=2,
+            help='Deferred device-state DB writes running at once (DB mode)'
+        )
+        parser.add_argument(
+            '--audit-concurrency',
+            type=int,
+            default=1,
+            help='Deferred audit-log appends running at once'
+        )
+        parser.add_argument(
+            '--side-effect-max-pending',
+            type=int,
+            default=10000,
+            help='Queued metrics/audit side effects before new ones are dropped (persistence is never dropped)'
+        )
+        parser.add_argument(
+            '--inline-side-effects',
+            action='store_true',
+            help='Run Influx/DB/audit work of the RPC path inline instead of queueing it (for comparison)'
+        )
+        parser.add_argument(
+            '--fast-start',
+            action='store_true',
+            default=SIMULATOR_FAST_START,
+            help='Skip the ThingsBoard reconciliation (Device.save) at startup for devices that already have a token'
+        )
+        parser.add_argument(
+            '--profile-startup',
+            action='store_true',
+            help='Print a [startup] line with the time spent in each startup phase'
         )
 
     def handle(self, *args, **options):
@@ -881,17 +1414,138 @@ class Command(BaseCommand):
         device_ids = options['device_id']
         system_name = options.get('system')
         device_type = options.get('device_type')
-        use_memory = options['memory']
-
+        state_store_kind = options['state_store'] or (STORE_MEMORY if options['memory'] else STORE_DB)
+        if options['state_flush_interval'] <= 0:
+            self.stderr.write("--state-flush-interval deve ser > 0.")
+            return
+        if options['db_readers'] < 1 or options['db_max_batch'] < 1:
+            self.stderr.write("--db-readers e --db-max-batch devem ser >= 1.")
+            return
+        fast_start = options['fast_start']
+        if options.get('rpc_influx_measurements') is not None:
+            global RPC_INFLUX_MEASUREMENTS
+            try:
+                RPC_INFLUX_MEASUREMENTS = parse_rpc_influx_measurements(options['rpc_influx_measurements'])
+            except ValueError as exc:
+                self.stderr.write(f"--rpc-influx-measurements invalido: {exc}")
+                return
+        if options['time_scale'] != 1:
+            global SIM_CLOCK
+            try:
+                SIM_CLOCK = make_clock(options['time_scale'])
+            except ValueError as exc:
+                self.stderr.write(f"--time-scale invalido: {exc}")
+                return
+            self.stdout.write(f"Tempo simulado: escala {options['time_scale']:g} (0 = o mais rapido possivel)")
+        global QOS_POLICY
+        try:
+            QOS_POLICY = QosPolicy(
+                telemetry=options['telemetry_qos'], rpc_response=options['rpc_response_qos'],
+                window=options['qos_window'], ack_timeout=options['qos_ack_timeout'], retries=options['qos_retries'],
+            )
+        except ValueError as exc:
+            self.stderr.write(f"Configuracao de QoS invalida: {exc}")
+            return
+        global TELEMETRY_SINKS
+        http = options['transport'] == TRANSPORT_HTTP
+        if min(options['http_max_connections'], options['http_pollers']) < 1 or options['http_poll_timeout'] <= 0:
+            self.stderr.write("--http-max-connections e --http-pollers devem ser >= 1 e --http-poll-timeout > 0.")
+            return
+        sink_specs = list(options.get('sink') or [options['transport']])
+        if use_influxdb and not any(spec.split(':', 1)[0].strip().lower() == 'influx' for spec in sink_specs):
+            sink_specs.append('influx')
         try:
-            gateway = configure_thingsboard_runtime()
+            TELEMETRY_SINKS = SinkPipeline.from_specs(
+                sink_specs, influx_url=INFLUXDB_URL, influx_token=INFLUXDB_TOKEN, schema=options['influx_schema'],
+            )
+        except ValueError as exc:
+            self.stderr.write(f"--sink invalido: {exc}")
+            return
+        offline = not TELEMETRY_SINKS.needs_connection
+        if sink_specs != [options['transport']]:
+            self.stdout.write(f"Sinks de telemetria: {', '.join(TELEMETRY_SINKS.names())}")
+        if options.get('record'):
+            global TRAFFIC_RECORDER
+            try:
+                TRAFFIC_RECORDER = TrafficRecorder(options['record'])
+            except OSError as exc:
+                self.stderr.write(f"Nao foi possivel criar o arquivo de gravacao: {exc}")
+                return
+        profile = StartupProfile(enabled=options['profile_startup'])
+        if getattr(settings, 'URLLC_MODE', False):
             self.stdout.write(
-                f"Usando GatewayIOT ativo '{gateway.name}' em {gateway.base_url} (mqtt={THINGSBOARD_HOST}:{THINGSBOARD_MQTT_PORT})"
+                f"[URLLC] Optimized settings applied: heartbeat={settings.HEARTBEAT_INTERVAL}s, "
+                f"mqtt_timeout={settings.URLLC_MQTT_TIMEOUT}s"
             )
-        except Exception as exc:
-            self.stderr.write(f"GatewayIOT ativo invalido/ausente: {exc}")
+
+        impairment = None
+        if options.get('impairment_file'):
+            try:
+                impairment = NetworkImpairment.from_file(
+                    options['impairment_file'], default_profile=options.get('impairment_profile')
+                )
+            except (OSError, ValueError) as exc:
+                self.stderr.write(f"Arquivo de impairment invalido: {exc}")
+                return
+            self.stdout.write(f"Network impairment ativo: {options['impairment_file']}")
+        elif options.get('impairment_profile'):
+            self.stderr.write("--impairment-profile requer --impairment-file.")
             return
 
+        try:
+            by_type = interval_setting('HEARTBEAT_INTERVALS_BY_TYPE')
+            by_type.update(parse_interval_overrides(options.get('type_interval')))
+            by_system = interval_setting('HEARTBEAT_INTERVALS_BY_SYSTEM')
+            by_system.update(parse_interval_overrides(options.get('system_interval')))
+            schedule = TelemetrySchedule(
+                HeartbeatPolicy(options['heartbeat_interval'], by_type=by_type, by_system=by_system),
+                target_rate=options.get('target_rate') or None,
+            )
+        except ValueError as exc:
+            self.stderr.write(f"Configuracao de heartbeat invalida: {exc}")
+            return
+        meter = RateMeter(target_rate=schedule.target_rate)
+        max_inflight_ticks = max(1, options['max_inflight_ticks'])
+        side_effect_limits = {
+            METRICS: options['metrics_concurrency'],
+            PERSISTENCE: options['persistence_concurrency'],
+            AUDIT: options['audit_concurrency'],
+        }
+        if min(side_effect_limits.values()) < 1:
+            self.stderr.write("Os limites de concorrencia de side effects devem ser >= 1.")
+            return
+        if options['rpc_concurrency'] > 0 and min(options['rpc_queue_per_device'], options['rpc_max_queued']) < 1:
+            self.stderr.write("--rpc-queue-per-device e --rpc-max-queued devem ser >= 1.")
+            return
+        rate_report_interval = options['rate_report_interval']
+        trace_options = None
+        if options.get('trace'):
+            if options['trace_speed'] < 0 or options['trace_max_inflight'] < 1:
+                self.stderr.write("--trace-speed deve ser >= 0 e --trace-max-inflight >= 1.")
+                return
+            trace_options = dict(fmt=options['trace_format'], time_column=options.get('trace_time_column'),
+                                 key_column=options.get('trace_key_column'))
+            try:
+                # reads the header and the first row only
+                next(iter(read_trace(options['trace'], **trace_options)), None)
+            except (OSError, ValueError) as exc:
+                self.stderr.write(f"Arquivo de trace invalido: {exc}")
+                return
+
+        if offline:
+            self.stdout.write("Nenhum sink mqtt/http: os devices nao conectam ao ThingsBoard nem recebem RPCs.")
+        else:
+            try:
+                gateway = configure_thingsboard_runtime()
+                self.stdout.write(
+                    f"Usando GatewayIOT ativo '{gateway.name}' em {gateway.base_url} "
+                    + (f"(http={THINGSBOARD_HTTP_URL})" if http else f"(mqtt={THINGSBOARD_HOST}:{THINGSBOARD_MQTT_PORT})")
+                )
+            except Exception as exc:
+                self.stderr.write(f"GatewayIOT ativo invalido/ausente: {exc}")
+                return
+        profile.mark('gateway')
+
         if device_ids:
             all_devices = Device.objects.filter(id__in=device_ids)
         elif system_name:
@@ -901,99 +1555,304 @@ class Command(BaseCommand):
         else:
             all_devices = Device.objects.all()
 
+        # one joined query for the whole fleet; the loops below never go back to the DB
+        all_devices = list(all_devices.select_related('device_type', 'system', 'unit'))
+        profile.mark('fleet_query')
         if not all_devices:
             self.stdout.write("No devices registered.")
             return
 
-        # Inicializa DEVICE_STATE a partir do banco se for usar memória
-        if use_memory:
-            device_type_map = {}
-            for device in all_devices:
-                DEVICE_STATE[device.device_id] = device.state or {}
-                # Resolva o tipo do device ANTES do contexto async
-                device_type_map[device.device_id] = device.device_type.name.lower() if device.device_type else ""
-        else:
-            device_type_map = {device.device_id: device.device_type.name.lower() if device.device_type else "" for device in all_devices}
+        def resolve_impairment_links(device):
+            if impairment is None:
+                return (None, None)
+            return impairment.links_for(
+                device.device_id,
+                unit=device.unit.name if device.unit else None,
+                system=device.system.name if device.system else None,
+                device_type=device.device_type.name if device.device_type else None,
+            )
+
+        device_type_map = {}
+        impairment_map = {}
+        trace_router = TraceRouter(telemetry_properties) if trace_options is not None else None
+        global UNIT_PHYSICS
+        UNIT_PHYSICS = None
+        if options['physics']:
+            try:
+                UNIT_PHYSICS = UnitPhysics(backend=options.get('physics_backend'))
+            except ValueError as exc:
+                self.stderr.write(f"--physics-backend invalido: {exc}")
+                return
+        for device in all_devices:
+            # Resolva o tipo do device ANTES do contexto async
+            dtype = device.device_type.name.lower() if device.device_type else ""
+            device_type_map[device.device_id] = dtype
+            schedule.add(device.device_id, dtype, device.system.name if device.system else None)
+            if impairment is not None:
+                impairment_map[device.device_id] = resolve_impairment_links(device)
+            if trace_router is not None:
+                trace_router.add(device.device_id, device.unit.name if device.unit else None, dtype)
+            if UNIT_PHYSICS is not None:
+                UNIT_PHYSICS.add(device.device_id, dtype, device.state, unit=device.unit.name if device.unit else None)
+        profile.mark('fleet_index')
+        if UNIT_PHYSICS is not None:
+            snapshot = UNIT_PHYSICS.snapshot()
+            self.stdout.write(
+                f"Fisica por unidade: {snapshot['devices']} devices em {snapshot['zones']} ambientes "
+                f"(backend {snapshot['backend']})"
+            )
+        if schedule.open_loop:
+            self.stdout.write(
+                f"Target rate {schedule.target_rate:g} msg/s over {len(device_type_map)} devices "
+                f"(expected {schedule.expected_rate():.1f} msg/s)"
+            )
+
 
         self.stdout.write("Starting async telemetry sending and waiting for RPCs...")
 
         async def main():
+            import aiohttp
+
+            # SIGTERM (simulator_control stop, benchmarks) unwinds main() like Ctrl-C does,
+            # so queued side effects drain and the state store is closed
+            try:
+                asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+            except (NotImplementedError, RuntimeError):
+                pass
+            side_effects = None
+            if not options['inline_side_effects']:
+                side_effects = SideEffectQueue(side_effect_limits, max_pending=options['side_effect_max_pending'])
+            rpc_executor = None
+            if options['rpc_concurrency'] > 0:
+                rpc_executor = KeyedRpcExecutor(
+                    max_concurrency=options['rpc_concurrency'],
+                    max_queue_per_key=options['rpc_queue_per_device'],
+                    max_queued=options['rpc_max_queued'],
+                    overflow=options['rpc_overflow'],
+                )
+            db_executor = None
+            if options['db_executor']:
+                db_executor = DatabaseExecutor(readers=options['db_readers'], max_batch=options['db_max_batch'])
+                await db_executor.start()
+
+            async def db_read(fn, *args):
+                if db_executor is not None:
+                    return await db_executor.read(fn, *args)
+                return await sync_to_async(fn)(*args)
+
+            state_store = make_state_store(state_store_kind, options['state_flush_interval'], side_effects, db_executor)
+            await state_store.start()
+            await SIM_CLOCK.start()
+            await TELEMETRY_SINKS.start()
+            http_transport = None
+            if http and not offline:
+                http_transport = HttpDeviceTransport(
+                    THINGSBOARD_HTTP_URL, max_connections=options['http_max_connections'],
+                    max_pollers=options['http_pollers'], poll_timeout=options['http_poll_timeout'],
+                )
+                await http_transport.start()
+
             async with aiohttp.ClientSession() as session:
                 publishers = {}
                 tasks = {}
 
+                async def send_tick(device_id):
+                    publisher = publishers[device_id]
+                    start = time.time()
+                    await publisher.send_telemetry_async()
+                    if not schedule.open_loop:
+                        elapsed = time.time() - start
+                        print(f"[{publisher.token}] Telemetry sent. Elapsed: {elapsed:.2f}s. Sleeping for {schedule.period(device_id):g}s.")
+
+                scheduler = None
+                if options['central_scheduler']:
+                    scheduler = TickScheduler(send_tick, schedule.period, meter, max_inflight=max_inflight_ticks, clock=SIM_CLOCK,
+                                              closed_loop=not schedule.open_loop)
+
                 async def ensure_publisher_for_device(device):
                     if device.device_id in publishers:
                         return
-                    pub = await TelemetryPublisher.create(
+                    # memory backends start from the state stored in the DB
+                    state_store.load(device.pk, device.state)
+                    # offline: nothing to reconcile with ThingsBoard
+                    factory = TelemetryPublisher.create_fast if fast_start or offline else TelemetryPublisher.create
+                    pub = factory(
                         device,
                         randomize=randomize,
                         session=session,
-                        use_memory=use_memory,
-                        device_type_name=device_type_map.get(device.device_id, "")
+                        state_store=state_store,
+                        device_type_name=device_type_map.get(device.device_id, ""),
+                        impairment_links=impairment_map.get(device.device_id, (None, None)),
+                        side_effects=side_effects,
+                        rpc_executor=rpc_executor,
+                        transport=http_transport,
                     )
+                    if not (fast_start or offline):
+                        pub = await pub
                     publishers[device.device_id] = pub
-                    tasks[device.device_id] = asyncio.create_task(telemetry_task_with_log(pub, use_influxdb, session))
+                    task = tasks[device.device_id] = asyncio.create_task(telemetry_task_with_log(pub, scheduler))
+                    if scheduler is not None or trace_router is not None:
+                        # connect-only task: do not keep a finished Task per device around
+                        task.add_done_callback(lambda _, key=device.device_id: tasks.pop(key, None))
 
                 # Initialize publishers for current devices
                 for device in all_devices:
                     await ensure_publisher_for_device(device)
+                # publishers copied what they need; drop the ORM rows and their joined type/system/unit objects
+                all_devices.clear()
+                profile.mark('publishers')
 
                 async def device_watcher():
                     # Periodically check for new devices and add publishers dynamically
                     while True:
                         await asyncio.sleep(5)
-                        db_devices = await sync_to_async(list)(Device.objects.all())
-                        known_ids = set(publishers.keys())
-                        # new devices
+                        # ids only: rows (with their FKs joined) are fetched just for new devices
+                        db_ids = await db_read(lambda: list(Device.objects.values_list('device_id', flat=True)))
+                        new_ids = [device_id for device_id in db_ids if device_id not in publishers]
+                        if not new_ids:
+                            continue
+                        db_devices = await db_read(lambda: list(
+                            Device.objects.filter(device_id__in=new_ids).select_related('device_type', 'system', 'unit')
+                        ))
                         for d in db_devices:
-                            if d.device_id not in known_ids:
-                                print(f"[watcher] New device detected: {d.device_id} -> adding publisher")
-                                # resolve type safely via sync_to_async to avoid SynchronousOnlyOperation
-                                try:
-                                    dtype = await sync_to_async(lambda inst: inst.device_type.name.lower() if inst.device_type else "")(d)
-                                except Exception:
-                                    dtype = ""
-                                device_type_map[d.device_id] = dtype
-                                await ensure_publisher_for_device(d)
+                            print(f"[watcher] New device detected: {d.device_id} -> adding publisher")
+                            dtype = d.device_type.name.lower() if d.device_type else ""
+                            device_type_map[d.device_id] = dtype
+                            schedule.add(d.device_id, dtype, d.system.name if d.system else None)
+                            if impairment is not None:
+                                impairment_map[d.device_id] = resolve_impairment_links(d)
+                            await ensure_publisher_for_device(d)
+                            if trace_router is not None:
+                                trace_router.add(d.device_id, d.unit.name if d.unit else None, dtype)
+                            if UNIT_PHYSICS is not None:
+                                UNIT_PHYSICS.add(d.device_id, dtype, d.state, unit=d.unit.name if d.unit else None)
                         # NOTE: we do not stop publishers for removed devices to keep behavior stable
 
                 watcher_task = asyncio.create_task(device_watcher())
+                background = [watcher_task]
+                if scheduler is not None:
+                    background.append(asyncio.create_task(scheduler.run()))
+
+                async def impairment_reporter():
+                    while True:
+                        await asyncio.sleep(30)
+                        print(f"[impairment] {json.dumps(impairment.summary())}")
+
+                if impairment is not None:
+                    background.append(asyncio.create_task(impairment_reporter()))
+
+                async def trace_driver():
+                    # rows for a device that is still connecting would be lost
+                    deadline = time.monotonic() + 60
+                    while awaiting_connect and time.monotonic() < deadline:
+                        await asyncio.sleep(0.1)
+
+                    async def deliver(device_id, values):
+                        await publishers[device_id].send_trace_sample(values)
+
+                    while True:
+                        print(f"[trace] playing {options['trace']} at speed {options['trace_speed']:g}")
+                        result = await play_trace(
+                            read_trace(options['trace'], **trace_options), trace_router, deliver,
+                            speed=options['trace_speed'], max_inflight=options['trace_max_inflight'], meter=meter,
+                            clock=SIM_CLOCK,
+                        )
+                        print(f"[trace] {json.dumps(result)}")
+                        if trace_router.unmatched:
+                            print(f"[trace] keys without a device or unit: {json.dumps(trace_router.unmatched)}")
+                        if not options['trace_loop']:
+                            break
+
+                if trace_router is not None:
+                    background.append(asyncio.create_task(trace_driver()))
+
+                async def rate_reporter():
+                    while True:
+                        await asyncio.sleep(rate_report_interval)
+                        print(f"[rate] {json.dumps(meter.snapshot())}")
+                        if SIM_CLOCK is not REAL_CLOCK:
+                            print(f"[clock] {json.dumps(SIM_CLOCK.snapshot())}")
+                        if side_effects is not None:
+                            print(f"[side-effects] {json.dumps(side_effects.snapshot())}")
+                        if rpc_executor is not None:
+                            print(f"[rpc-executor] {json.dumps(rpc_executor.snapshot())}")
+                        print(f"[state-store] {json.dumps(state_store.snapshot())}")
+                        if db_executor is not None:
+                            print(f"[db-executor] {json.dumps(db_executor.snapshot())}")
+                        print(f"[sinks] {json.dumps(TELEMETRY_SINKS.snapshot())}")
+                        if http_transport is not None:
+                            print(f"[http] {json.dumps(http_transport.snapshot())}")
+                        if QOS_POLICY.pipelined:
+                            print(f"[qos] {json.dumps(QOS_STATS.snapshot())}")
+                        if UNIT_PHYSICS is not None:
+                            print(f"[physics] {json.dumps(UNIT_PHYSICS.snapshot())}")
+                        if TRAFFIC_RECORDER is not None:
+                            TRAFFIC_RECORDER.flush()
+                            print(f"[record] {json.dumps(TRAFFIC_RECORDER.snapshot())}")
+
+                if rate_report_interval > 0:
+                    background.append(asyncio.create_task(rate_reporter()))
 
                 try:
-                    await asyncio.gather(*tasks.values(), watcher_task)
+                    await asyncio.gather(*(() if scheduler is not None else tasks.values()), *background)
                 except asyncio.CancelledError:
                     pass
+                finally:
+                    if rpc_executor is not None and not await rpc_executor.drain(timeout=5):
+                        print(f"[rpc-executor] shutdown with RPCs left: {json.dumps(rpc_executor.snapshot())}")
+                    if side_effects is not None and not await side_effects.drain(timeout=10):
+                        print(f"[side-effects] shutdown with work left: {json.dumps(side_effects.snapshot())}")
+                    if not await TELEMETRY_SINKS.close(timeout=10):
+                        print(f"[sinks] shutdown with samples left: {json.dumps(TELEMETRY_SINKS.snapshot())}")
+                    windows = [pub.publish_window for pub in publishers.values() if pub.publish_window is not None]
+                    if windows and not all(await asyncio.gather(*(window.drain(timeout=5) for window in windows))):
+                        print(f"[qos] shutdown with messages unacknowledged: {json.dumps(QOS_STATS.snapshot())}")
+                    if http_transport is not None:
+                        await http_transport.close()
+                    await state_store.close()
+                    await SIM_CLOCK.close()
+                    if db_executor is not None and not await db_executor.close():
+                        print(f"[db-executor] shutdown with writes left: {json.dumps(db_executor.snapshot())}")
+                    if TRAFFIC_RECORDER is not None:
+                        TRAFFIC_RECORDER.close()
+                        print(f"[record] {json.dumps(TRAFFIC_RECORDER.snapshot())} written to {TRAFFIC_RECORDER.path}")
+
+        awaiting_connect = {device.device_id for device in all_devices}
+        fleet_size = len(all_devices)
+
+        async def telemetry_task_with_log(publisher, scheduler=None):
+            if not offline:
+                await publisher.connect()
+            if publisher.device_id in awaiting_connect:
+                awaiting_connect.discard(publisher.device_id)
+                if not awaiting_connect:
+                    profile.mark('all_connected')
+                    profile.report(devices=fleet_size, fast_start=fast_start)
+            if trace_router is not None:
+                # the trace driver publishes for every device
+                return
+            if scheduler is not None:
+                # the scheduler takes over; this task ends here
+                scheduler.add(publisher.device_id, delay=None if schedule.open_loop else 0)
+                return
 
-        async def telemetry_task_with_log(publisher, use_influxdb, session):
-            await publisher.connect()
-            while True:
+            def period():
+                return schedule.period(publisher.device_id)
+
+            async def send():
                 start = time.time()
-                await publisher.send_telemetry_async(use_influxdb=use_influxdb, session=session)
-                elapsed = time.time() - start
-                print(f"[{publisher.token}] Telemetry sent. Elapsed: {elapsed:.2f}s. Sleeping for {HEARTBEAT_INTERVAL}s.")
-                await asyncio.sleep(HEARTBEAT_INTERVAL)
+                await publisher.send_telemetry_async()
+                if not schedule.open_loop:
+                    elapsed = time.time() - start
+                    print(f"[{publisher.token}] Telemetry sent. Elapsed: {elapsed:.2f}s. Sleeping for {period():g}s.")
+
+            if schedule.open_loop:
+                await run_open_loop(send, period, meter, max_inflight=max_inflight_ticks, clock=SIM_CLOCK)
+            else:
+                await run_closed_loop(send, period, meter, clock=SIM_CLOCK)
 
         try:
             asyncio.run(main())
         except KeyboardInterrupt:
+            # the state store was closed (memory states written to the DB) as main() unwound
             self.stdout.write("Stopping telemetry sending and RPC processing.")
-            # Ao encerrar, comite o estado em memória no banco
-            if use_memory:
-                self.stdout.write("Syncing in-memory device state to database...")
-                # Use bulk_update para salvar todos os estados de uma vez
-                for device in all_devices:
-                    state = DEVICE_STATE[device.device_id]
-                    device.state = state
-                Device.objects.bulk_update(all_devices, ['state'])
-                self.stdout.write("Sync complete.")
-            self.stdout.write("Stopping telemetry sending and RPC processing.")
-            # Ao encerrar, comite o estado em memória no banco
-            if use_memory:
-                self.stdout.write("Syncing in-memory device state to database...")
-                # Use bulk_update para salvar todos os estados de uma vez
-                for device in all_devices:
-                    state = DEVICE_STATE[device.device_id]
-                    device.state = state
-                Device.objects.bulk_update(all_devices, ['state'])
-                self.stdout.write("Sync complete.")
@@ -0,0 +1,25 @@
+# Generated by Django 5.1 on 2026-10-19 04:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0005_gatewayiot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['token'], name='device_token_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['thingsboard_id'], name='device_thingsboard_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['system', 'unit'], name='device_system_unit_idx'),
+        ),
+    ]
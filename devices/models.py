@@ -177,6 +177,15 @@ class Device(models.Model):
     system = models.ForeignKey(System, on_delete=models.SET_NULL, null=True, blank=True, related_name='devices')
     unit = models.ForeignKey(Unit, on_delete=models.SET_NULL, null=True, blank=True, related_name='devices')
 
+    class Meta:
+        # the dashboard counts by token, reconciliation looks devices up by thingsboard_id,
+        # and the admin filters by system and then unit
+        indexes = [
+            models.Index(fields=['token'], name='device_token_idx'),
+            models.Index(fields=['thingsboard_id'], name='device_thingsboard_id_idx'),
+            models.Index(fields=['system', 'unit'], name='device_system_unit_idx'),
+        ]
+
     def __str__(self):
         return self.device_id
 
@@ -0,0 +1,150 @@
+"""QoS 1 publishing with a bounded in-flight window.
+
+At QoS 0 a publish is written to the socket and forgotten. At QoS 1 the
+broker acknowledges every message (PUBACK); awaiting each ack before the
+next publish caps a connection at one message per round trip.
+``PublishWindow`` pipelines instead: ``submit`` only waits for a free slot
+among the ``window`` unacknowledged messages of its connection, and a
+background task waits for the ack. A message that is not acknowledged
+within ``ack_timeout`` is published again, up to ``retries`` times, and is
+then counted as failed. Delivery stays at-least-once, so the broker may see
+a retransmitted message twice. A broken connection, or a message that ran
+out of retries, makes the next ``submit`` raise, so the caller still runs
+its reconnect path.
+
+``QosStats`` is shared by every window of the fleet and reports in-flight
+depth, ack latency and retransmits.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from devices.benchmarking import percentiles
+
+
+QOS_LEVELS = (0, 1)
+
+
+@dataclass
+class QosPolicy:
+    telemetry: int = 0
+    rpc_response: int = 0
+    window: int = 16  # unacknowledged QoS 1 messages per connection
+    ack_timeout: float = 10.0
+    retries: int = 2
+
+    def __post_init__(self):
+        if self.telemetry not in QOS_LEVELS or self.rpc_response not in QOS_LEVELS:
+            raise ValueError("QoS must be 0 or 1")
+        if self.window < 1 or self.ack_timeout <= 0 or self.retries < 0:
+            raise ValueError("window must be >= 1, ack_timeout > 0 and retries >= 0")
+
+    @property
+    def pipelined(self) -> bool:
+        return 1 in (self.telemetry, self.rpc_response)
+
+
+class QosStats:
+    def __init__(self, latency_samples: int = 4096):
+        self.submitted = 0
+        self.acked = 0
+        self.retransmits = 0
+        self.failed = 0
+        self.inflight = 0
+        self.max_inflight = 0
+        self.max_window_depth = 0
+        self.window_full = 0  # submits that had to wait for a slot
+        self._latencies = deque(maxlen=latency_samples)
+
+    def ack(self, latency: float):
+        self.acked += 1
+        self._latencies.append(latency)
+
+    def snapshot(self) -> dict:
+        return {
+            "submitted": self.submitted,
+            "acked": self.acked,
+            "retransmits": self.retransmits,
+            "failed": self.failed,
+            "inflight": self.inflight,
+            "max_inflight": self.max_inflight,
+            "max_window_depth": self.max_window_depth,
+            "window_full": self.window_full,
+            "ack": percentiles(list(self._latencies)),
+        }
+
+
+class PublishWindow:
+    """QoS 1 publishes of one connection; ``publish(topic, payload, qos, timeout)`` sends one and awaits its ack."""
+
+    __slots__ = ("publish", "policy", "stats", "depth", "error", "_slots", "_tasks")
+
+    def __init__(self, publish, policy: QosPolicy, stats: QosStats):
+        self.publish = publish
+        self.policy = policy
+        self.stats = stats
+        self.depth = 0  # messages of this connection waiting for their ack
+        self.error = None  # last delivery failure, raised by the next submit
+        self._slots = asyncio.Semaphore(policy.window)
+        self._tasks = set()
+
+    async def submit(self, topic, payload):
+        """Returns once the message is in flight; its ack is awaited in the background.
+
+        Raises ``ConnectionError`` (and takes nothing) when a message of the window failed since the last call.
+        """
+        error, self.error = self.error, None
+        if error is not None:
+            raise ConnectionError(f"QoS 1 delivery failed: {type(error).__name__}: {error}") from error
+        stats = self.stats
+        stats.submitted += 1
+        if self._slots.locked():
+            stats.window_full += 1
+        await self._slots.acquire()
+        task = asyncio.create_task(self._deliver(topic, payload))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.depth += 1
+        stats.inflight += 1
+        stats.max_inflight = max(stats.max_inflight, stats.inflight)
+        stats.max_window_depth = max(stats.max_window_depth, self.depth)
+
+    async def _deliver(self, topic, payload):
+        stats, policy = self.stats, self.policy
+        try:
+            for attempt in range(policy.retries + 1):
+                if attempt:
+                    stats.retransmits += 1
+                started = time.monotonic()
+                try:
+                    await self.publish(topic, payload, 1, policy.ack_timeout)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as exc:
+                    if attempt == policy.retries or not isinstance(exc, asyncio.TimeoutError):
+                        # a broken client (or a lost message): let the next submit report it
+                        self.error = exc
+                    if attempt == policy.retries:
+                        stats.failed += 1
+                        if stats.failed <= 10:
+                            print(f"[qos] {topic}: no PUBACK after {attempt + 1} attempts ({type(exc).__name__}: {exc})")
+                        return
+                    # a broken connection fails at once; give the reconnect a moment before retrying
+                    await asyncio.sleep(min(policy.ack_timeout, 1.0))
+                    continue
+                stats.ack(time.monotonic() - started)
+                return
+        finally:
+            self.depth -= 1
+            stats.inflight -= 1
+            self._slots.release()
+
+    async def drain(self, timeout: float = 5.0) -> bool:
+        """Wait for the messages in flight; False if some were still unacknowledged after ``timeout``."""
+        if not self._tasks:
+            return True
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        return not pending
@@ -0,0 +1,239 @@
+"""In-process network impairment for the simulator transport layer.
+
+An impairment file (JSON) declares named profiles and rules that select a
+profile per device, unit, system or device type::
+
+    {
+        "profiles": {
+            "wan": {"delay_ms": 80, "jitter_ms": 20, "distribution": "normal",
+                    "loss": 0.01, "duplicate": 0.0, "reorder": 0.02,
+                    "bandwidth_kbps": 512}
+        },
+        "rules": [
+            {"match": {"unit": "House 3"}, "profile": "wan"},
+            {"match": {"device_id": "House 1 - Room 1 *"}, "uplink": "wan"}
+        ],
+        "default": null
+    }
+
+``profile`` applies to both directions; ``uplink`` (telemetry and RPC
+responses) and ``downlink`` (RPC requests) may be set separately. The first
+matching rule wins. Devices without a matching rule get no link at all, so
+unimpaired devices pay nothing on the hot path.
+"""
+from __future__ import annotations
+
+import asyncio
+import fnmatch
+import json
+import random
+from dataclasses import dataclass, field, fields
+from typing import Optional
+
+
+DISTRIBUTIONS = ("constant", "uniform", "normal", "exponential", "pareto")
+DIRECTIONS = ("uplink", "downlink")
+
+
+@dataclass(frozen=True)
+class ImpairmentProfile:
+    name: str = "custom"
+    delay_ms: float = 0.0
+    jitter_ms: float = 0.0
+    distribution: str = "constant"
+    pareto_alpha: float = 2.5
+    loss: float = 0.0
+    duplicate: float = 0.0
+    reorder: float = 0.0
+    reorder_gap_ms: float = 50.0
+    bandwidth_kbps: float = 0.0
+
+    @classmethod
+    def from_dict(cls, data: dict, name: str = "custom") -> "ImpairmentProfile":
+        known = {f.name for f in fields(cls)}
+        unknown = set(data) - known
+        if unknown:
+            raise ValueError(f"Unknown impairment keys in profile '{name}': {sorted(unknown)}")
+        profile = cls(**{"name": name, **data})
+        if profile.distribution not in DISTRIBUTIONS:
+            raise ValueError(f"Invalid distribution '{profile.distribution}' in profile '{name}'.")
+        for prob in ("loss", "duplicate", "reorder"):
+            value = getattr(profile, prob)
+            if not 0.0 <= value <= 1.0:
+                raise ValueError(f"'{prob}' must be between 0 and 1 in profile '{name}'.")
+        return profile
+
+    @property
+    def is_noop(self) -> bool:
+        return not (self.delay_ms or self.jitter_ms or self.loss or self.duplicate
+                    or self.reorder or self.bandwidth_kbps)
+
+    def sample_delay(self, rng=random) -> float:
+        """Return one delay sample in seconds."""
+        base, jitter = self.delay_ms, self.jitter_ms
+        if not jitter or self.distribution == "constant":
+            value = base
+        elif self.distribution == "uniform":
+            value = rng.uniform(base - jitter, base + jitter)
+        elif self.distribution == "normal":
+            value = rng.gauss(base, jitter)
+        elif self.distribution == "exponential":
+            value = base + rng.expovariate(1.0 / jitter)
+        else:
+            value = base + jitter * (rng.paretovariate(self.pareto_alpha) - 1.0)
+        return max(0.0, value) / 1000.0
+
+
+@dataclass
+class ImpairmentStats:
+    sent: int = 0
+    dropped: int = 0
+    duplicated: int = 0
+    reordered: int = 0
+    delayed: int = 0
+
+    def as_dict(self) -> dict:
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+
+class ImpairedLink:
+    """One direction of one device's link. Not shared between devices so the
+    bandwidth cap queues only that device's traffic."""
+
+    __slots__ = ("profile", "stats", "_rng", "_next_free", "_pending")
+
+    def __init__(self, profile: ImpairmentProfile, stats: ImpairmentStats, rng=None, pending=None):
+        self.profile = profile
+        self.stats = stats
+        self._rng = rng or random
+        self._next_free = 0.0
+        self._pending = pending if pending is not None else set()
+
+    async def send(self, deliver, size: int = 0):
+        """Run ``deliver()`` (a coroutine factory) through the impairment.
+
+        Undelayed messages are awaited inline; delayed ones are handed to the
+        event loop and the caller returns immediately, as a real network would.
+        Returns False for a dropped message, ``deliver()``'s result for an inline
+        delivery and True once a delayed one is scheduled.
+        """
+        profile, rng, stats = self.profile, self._rng, self.stats
+        stats.sent += 1
+        if profile.loss and rng.random() < profile.loss:
+            stats.dropped += 1
+            return False
+
+        copies = 1
+        if profile.duplicate and rng.random() < profile.duplicate:
+            copies = 2
+            stats.duplicated += 1
+
+        delay = profile.sample_delay(rng)
+        if profile.reorder and rng.random() < profile.reorder:
+            delay += profile.reorder_gap_ms / 1000.0
+            stats.reordered += 1
+
+        loop = asyncio.get_running_loop()
+        if profile.bandwidth_kbps:
+            now = loop.time()
+            tx_time = (size * 8) / (profile.bandwidth_kbps * 1000.0)
+            start = max(now, self._next_free)
+            self._next_free = start + tx_time
+            delay += (start - now) + tx_time
+
+        if delay <= 0 and copies == 1:
+            return await deliver()
+
+        stats.delayed += 1
+        for _ in range(copies):
+            loop.call_later(delay, self._spawn, deliver)
+        return True
+
+    def _spawn(self, deliver):
+        task = asyncio.ensure_future(deliver())
+        self._pending.add(task)
+        task.add_done_callback(self._finish)
+
+    def _finish(self, task):
+        self._pending.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[impairment] delayed delivery failed: {task.exception()}")
+
+
+@dataclass
+class ImpairmentRule:
+    match: dict
+    uplink: Optional[ImpairmentProfile] = None
+    downlink: Optional[ImpairmentProfile] = None
+
+    def matches(self, attrs: dict) -> bool:
+        for key, pattern in self.match.items():
+            value = attrs.get(key)
+            if value is None or not fnmatch.fnmatchcase(str(value).lower(), str(pattern).lower()):
+                return False
+        return True
+
+
+@dataclass
+class NetworkImpairment:
+    profiles: dict = field(default_factory=dict)
+    rules: list = field(default_factory=list)
+    default: Optional[ImpairmentProfile] = None
+    seed: Optional[int] = None
+    stats: dict = field(default_factory=lambda: {d: ImpairmentStats() for d in DIRECTIONS})
+
+    def __post_init__(self):
+        self._rng = random.Random(self.seed)
+        self._pending = set()
+
+    @classmethod
+    def from_dict(cls, data: dict, default_profile: Optional[str] = None) -> "NetworkImpairment":
+        profiles = {
+            name: ImpairmentProfile.from_dict(spec, name=name)
+            for name, spec in (data.get("profiles") or {}).items()
+        }
+
+        def resolve(value, where):
+            if value is None:
+                return None
+            if isinstance(value, dict):
+                return ImpairmentProfile.from_dict(value, name=where)
+            if value not in profiles:
+                raise ValueError(f"Unknown impairment profile '{value}' referenced by {where}.")
+            return profiles[value]
+
+        rules = []
+        for index, spec in enumerate(data.get("rules") or []):
+            where = f"rule #{index + 1}"
+            both = resolve(spec.get("profile"), where)
+            rules.append(ImpairmentRule(
+                match=spec.get("match") or {},
+                uplink=resolve(spec.get("uplink"), where) or both,
+                downlink=resolve(spec.get("downlink"), where) or both,
+            ))
+
+        default = resolve(default_profile or data.get("default"), "default")
+        return cls(profiles=profiles, rules=rules, default=default, seed=data.get("seed"))
+
+    @classmethod
+    def from_file(cls, path: str, default_profile: Optional[str] = None) -> "NetworkImpairment":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f), default_profile=default_profile)
+
+    def links_for(self, device_id, unit=None, system=None, device_type=None):
+        """Return ``(uplink, downlink)`` links for a device; either may be None."""
+        attrs = {"device_id": device_id, "unit": unit, "system": system, "device_type": device_type}
+        uplink = downlink = self.default
+        for rule in self.rules:
+            if rule.matches(attrs):
+                uplink, downlink = rule.uplink, rule.downlink
+                break
+        return self._link(uplink, "uplink"), self._link(downlink, "downlink")
+
+    def _link(self, profile, direction):
+        if profile is None or profile.is_noop:
+            return None
+        return ImpairedLink(profile, self.stats[direction], rng=self._rng, pending=self._pending)
+
+    def summary(self) -> dict:
+        return {direction: stats.as_dict() for direction, stats in self.stats.items()}
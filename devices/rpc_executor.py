@@ -0,0 +1,154 @@
+"""Bounded, per-device ordered execution of incoming RPCs.
+
+``KeyedRpcExecutor`` is shared by every publisher. RPCs with different keys
+(device ids) run in parallel up to ``max_concurrency``; RPCs with the same key
+run one at a time in arrival order. After each RPC its key goes to the back
+of the ready line, so one busy device cannot starve the others.
+
+When a device already has ``max_queue_per_key`` RPCs waiting, or the
+executor holds ``max_queued`` in total, the overflow policy decides:
+
+* ``block`` - ``submit`` waits for room (back-pressure on the MQTT reader).
+* ``drop-newest`` - the incoming RPC is discarded.
+* ``drop-oldest`` - the oldest waiting RPC of that device is discarded.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_NEWEST = "drop-newest"
+OVERFLOW_DROP_OLDEST = "drop-oldest"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST)
+
+
+class KeyedRpcExecutor:
+    def __init__(self, max_concurrency: int = 64, max_queue_per_key: int = 100, max_queued: int = 10000,
+                 overflow: str = OVERFLOW_BLOCK):
+        if max_concurrency < 1 or max_queue_per_key < 1 or max_queued < 1:
+            raise ValueError("executor limits must be >= 1")
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"unknown overflow policy: {overflow}")
+        self.max_concurrency = max_concurrency
+        self.max_queue_per_key = max_queue_per_key
+        self.max_queued = max_queued
+        self.overflow = overflow
+        self._queues = {}  # key -> deque of (factory, enqueued_at)
+        self._ready = deque()  # keys with work that are not running
+        self._active = set()  # keys with an RPC running
+        self._queued = 0
+        self._tasks = set()
+        self._room = None  # asyncio.Condition, created on first use inside the loop
+        # metrics
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.max_depth = 0
+        self.max_key_depth = 0
+        self.max_wait = 0.0
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    @property
+    def running(self) -> int:
+        return len(self._active)
+
+    def _full(self, key) -> bool:
+        return self._queued >= self.max_queued or len(self._queues.get(key, ())) >= self.max_queue_per_key
+
+    async def submit(self, key, factory) -> bool:
+        """Queue ``factory`` (returns an awaitable) behind earlier RPCs of ``key``; False if dropped."""
+        if self._full(key):
+            if self.overflow == OVERFLOW_DROP_NEWEST:
+                self.dropped += 1
+                return False
+            if self.overflow == OVERFLOW_DROP_OLDEST and self._queues.get(key):
+                self._queues[key].popleft()
+                self._queued -= 1
+                self.dropped += 1
+            else:
+                # block, or drop-oldest with nothing of this key to drop (global limit reached)
+                self.blocked += 1
+                if self._room is None:
+                    self._room = asyncio.Condition()
+                async with self._room:
+                    await self._room.wait_for(lambda: not self._full(key))
+
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+        queue.append((factory, time.monotonic()))
+        self._queued += 1
+        self.submitted += 1
+        self.max_depth = max(self.max_depth, self._queued)
+        self.max_key_depth = max(self.max_key_depth, len(queue))
+        if key not in self._active and len(queue) == 1:
+            self._ready.append(key)
+        self._dispatch()
+        return True
+
+    def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while self._ready and len(self._active) < self.max_concurrency:
+            key = self._ready.popleft()
+            queue = self._queues.get(key)
+            if not queue or key in self._active:
+                continue
+            factory, enqueued_at = queue.popleft()
+            self._queued -= 1
+            self._active.add(key)
+            task = loop.create_task(self._run(key, factory, enqueued_at))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key, factory, enqueued_at):
+        self.max_wait = max(self.max_wait, time.monotonic() - enqueued_at)
+        try:
+            await factory()
+            self.completed += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            self.failed += 1
+            print(f"[rpc-executor] RPC for {key} failed: {type(exc).__name__}: {exc}")
+        finally:
+            self._active.discard(key)
+            if self._queues.get(key):
+                self._ready.append(key)
+            else:
+                self._queues.pop(key, None)
+            self._dispatch()
+            if self._room is not None:
+                async with self._room:
+                    self._room.notify_all()
+
+    async def drain(self, timeout=None) -> bool:
+        """Wait until no RPC is queued or running; False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queued or self._active:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.01)
+        return True
+
+    def snapshot(self) -> dict:
+        return {
+            "queued": self._queued,
+            "running": len(self._active),
+            "keys_waiting": len(self._queues),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "blocked": self.blocked,
+            "max_depth": self.max_depth,
+            "max_key_depth": self.max_key_depth,
+            "max_wait_ms": round(self.max_wait * 1000.0, 1),
+        }
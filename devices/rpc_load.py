@@ -0,0 +1,200 @@
+"""Server-side RPC load for the M2S path of ``send_telemetry``.
+
+``run_rpc_load`` keeps ``concurrency`` requests in flight (closed loop),
+optionally paced to a global rate, against a list of ``RpcTarget`` devices.
+Requests go out through an *issuer*: ``FakeMqttBroker.issue_rpc`` when the
+broker runs in-process, or ``OperatorRpcClient`` when talking to a
+``run_standins`` broker over its ``operator/<token>/...`` bridge.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+
+from devices.benchmarking import percentiles
+from devices.fake_mqtt_broker import DEFAULT_OPERATOR_USERNAME, OPERATOR_PREFIX
+
+
+def _switch(rng):
+    return rng.random() < 0.5
+
+
+# RPC methods TelemetryPublisher.on_message answers, per device type, with a parameter factory
+SUPPORTED_RPCS = {
+    "led": {"checkStatus": None, "switchLed": _switch},
+    "lightbulb": {"checkStatus": None, "switchLed": _switch},
+    "temperature sensor": {"checkStatus": None},
+    "soilhumidity sensor": {"checkStatus": None},
+    "soil humidity sensor": {"checkStatus": None},
+    "pump": {"checkStatus": None, "switchPump": _switch},
+    "pool": {"checkStatus": None, "switchPool": _switch},
+    "irrigation": {"checkStatus": None, "switchIrrigation": _switch},
+    "airconditioner": {
+        "checkStatus": None,
+        "switchStatus": _switch,
+        "setTemperature": lambda rng: round(rng.uniform(16.0, 30.0), 1),
+        "setHumidity": lambda rng: round(rng.uniform(30.0, 70.0), 1),
+    },
+}
+
+
+@dataclass(frozen=True)
+class RpcTarget:
+    token: str
+    device_type: str
+    methods: tuple
+
+    @classmethod
+    def for_device(cls, token: str, device_type: str, methods=None):
+        """Target restricted to ``methods`` (all supported ones when None); None if nothing applies."""
+        device_type = (device_type or "").lower()
+        supported = SUPPORTED_RPCS.get(device_type, {})
+        chosen = tuple(m for m in supported if methods is None or m in methods)
+        return cls(token, device_type, chosen) if token and chosen else None
+
+    def next_call(self, rng):
+        method = rng.choice(self.methods)
+        factory = SUPPORTED_RPCS[self.device_type][method]
+        return method, factory(rng) if factory else None
+
+
+class RpcLatencyStats:
+    """Round-trip times and failures grouped by method and by device type."""
+
+    def __init__(self):
+        self.rtts = defaultdict(list)
+        self.failures = defaultdict(lambda: {"timeouts": 0, "unreachable": 0, "errors": 0})
+        self.started = time.monotonic()
+
+    def _keys(self, target, method):
+        return ("all", f"method:{method}", f"type:{target.device_type}")
+
+    def ok(self, target, method, rtt):
+        for key in self._keys(target, method):
+            self.rtts[key].append(rtt)
+
+    def fail(self, target, method, kind):
+        for key in self._keys(target, method):
+            self.failures[key][kind] += 1
+
+    def summary(self) -> dict:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        result = {}
+        for key in sorted(set(self.rtts) | set(self.failures)):
+            rtts = self.rtts.get(key, [])
+            failures = dict(self.failures.get(key) or {"timeouts": 0, "unreachable": 0, "errors": 0})
+            sent = len(rtts) + sum(failures.values())
+            result[key] = {
+                "sent": sent,
+                "ok": len(rtts),
+                **failures,
+                "per_sec": round(sent / elapsed, 2),
+                **percentiles(rtts),
+            }
+        return result
+
+
+async def run_rpc_load(issue, targets, *, concurrency=8, rate=0.0, duration=None, count=None,
+                       timeout=10.0, stats=None, rng=None):
+    """Issue RPCs until ``duration`` seconds or ``count`` requests, whichever comes first.
+
+    ``issue(token, method, params, timeout)`` must return the round-trip time
+    and raise ``asyncio.TimeoutError`` / ``LookupError`` on timeout / offline
+    device. With ``rate`` > 0 request starts are spaced on a shared schedule
+    so the total never exceeds ``rate`` per second.
+    """
+    if not targets:
+        raise ValueError("no RPC targets")
+    if duration is None and count is None:
+        raise ValueError("duration or count is required")
+    stats = stats if stats is not None else RpcLatencyStats()
+    rng = rng or random.Random()
+    deadline = time.monotonic() + duration if duration else None
+    issued = itertools.count()
+    interval = 1.0 / rate if rate and rate > 0 else 0.0
+    next_slot = time.monotonic()
+
+    async def worker():
+        nonlocal next_slot
+        while True:
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            if count is not None and next(issued) >= count:
+                return
+            if interval:
+                slot, next_slot = next_slot, max(next_slot, time.monotonic()) + interval
+                wait = slot - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            target = rng.choice(targets)
+            method, params = target.next_call(rng)
+            try:
+                rtt = await issue(target.token, method, params, timeout)
+            except asyncio.TimeoutError:
+                stats.fail(target, method, "timeouts")
+            except LookupError:
+                stats.fail(target, method, "unreachable")
+                await asyncio.sleep(0.01)
+            except Exception:
+                stats.fail(target, method, "errors")
+            else:
+                stats.ok(target, method, rtt)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return stats
+
+
+class OperatorRpcClient:
+    """Issues RPCs through a stand-in broker's operator bridge over MQTT."""
+
+    def __init__(self, host: str, port: int, username: str = DEFAULT_OPERATOR_USERNAME):
+        self.host = host
+        self.port = port
+        self.username = username
+        self._client = None
+        self._reader = None
+        self._pending = {}
+        self._ids = itertools.count(1)
+
+    async def __aenter__(self):
+        import aiomqtt
+
+        self._client = aiomqtt.Client(self.host, self.port, username=self.username)
+        await self._client.__aenter__()
+        await self._client.subscribe(f"{OPERATOR_PREFIX}+/rpc/response/+")
+        self._reader = asyncio.create_task(self._read())
+        return self
+
+    async def __aexit__(self, *exc):
+        if self._reader is not None:
+            self._reader.cancel()
+        await self._client.__aexit__(*exc)
+
+    async def _read(self):
+        async for msg in self._client.messages:
+            parts = str(msg.topic).split("/")
+            # operator/<token>/rpc/response/<id>
+            future = self._pending.get((parts[1], parts[-1]))
+            if future is not None and not future.done():
+                future.set_result(msg.payload)
+
+    async def issue(self, token, method, params=None, timeout=10.0):
+        request_id = str(next(self._ids))
+        key = (token, request_id)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        started = time.perf_counter()
+        try:
+            await self._client.publish(
+                f"{OPERATOR_PREFIX}{token}/rpc/request/{request_id}",
+                json.dumps({"method": method, "params": params}),
+            )
+            await asyncio.wait_for(future, timeout)
+            return time.perf_counter() - started
+        finally:
+            self._pending.pop(key, None)
@@ -0,0 +1,156 @@
+"""Deferred side effects of the simulator's RPC path.
+
+An RPC is answered from a fast lane that only mutates state and publishes
+the response; Influx writes, database persistence and audit logging are
+submitted here and run afterwards with their own concurrency limits:
+
+* ``METRICS`` - time-series writes (Influx); highest priority so measurement
+  timestamps land close to when they were taken.
+* ``PERSISTENCE`` - database writes of device state. Submitted with a key
+  (the device pk): a newer submission replaces a pending one, and two
+  effects with the same key never run at the same time.
+* ``AUDIT`` - log files; lowest priority, first to be dropped.
+
+When more than ``max_pending`` effects wait, new METRICS/AUDIT effects are
+dropped (and counted); PERSISTENCE effects are always accepted.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import time
+from collections import OrderedDict
+
+
+METRICS = "metrics"
+PERSISTENCE = "persistence"
+AUDIT = "audit"
+# dispatch order: earlier classes get free slots first
+KINDS = (METRICS, PERSISTENCE, AUDIT)
+
+DEFAULT_LIMITS = {METRICS: 8, PERSISTENCE: 2, AUDIT: 1}
+
+
+class SideEffectStats:
+    __slots__ = ("submitted", "coalesced", "done", "failed", "dropped", "max_lag")
+
+    def __init__(self):
+        self.submitted = 0
+        self.coalesced = 0
+        self.done = 0
+        self.failed = 0
+        self.dropped = 0
+        self.max_lag = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "done": self.done,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "max_lag_ms": round(self.max_lag * 1000.0, 1),
+        }
+
+
+class SideEffectQueue:
+    """Runs submitted coroutine factories in priority order within per-kind limits.
+
+    Must be used from a running event loop; ``submit`` never blocks.
+    """
+
+    def __init__(self, limits=None, max_concurrency=None, max_pending: int = 10000):
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits or {})
+        for kind, limit in self.limits.items():
+            if kind not in KINDS:
+                raise ValueError(f"unknown side-effect kind: {kind}")
+            if limit < 1:
+                raise ValueError(f"{kind} concurrency must be >= 1")
+        self.max_concurrency = max_concurrency or sum(self.limits.values())
+        self.max_pending = max_pending
+        self.stats = {kind: SideEffectStats() for kind in KINDS}
+        self._pending = {kind: OrderedDict() for kind in KINDS}
+        self._running = {kind: 0 for kind in KINDS}
+        self._running_keys = set()
+        self._tasks = set()
+        self._seq = itertools.count()
+        self._idle = None
+
+    @property
+    def pending(self) -> int:
+        return sum(len(q) for q in self._pending.values())
+
+    @property
+    def running(self) -> int:
+        return sum(self._running.values())
+
+    def submit(self, kind, factory, key=None) -> bool:
+        """Queue ``factory`` (a callable returning an awaitable); False if it was dropped."""
+        stats = self.stats[kind]
+        queue = self._pending[kind]
+        if key is not None and (kind, key) in queue:
+            # keep the original place in line, run the newest version
+            queue[(kind, key)] = (factory, queue[(kind, key)][1])
+            stats.coalesced += 1
+            return True
+        if kind != PERSISTENCE and self.pending >= self.max_pending:
+            stats.dropped += 1
+            return False
+        stats.submitted += 1
+        queue[(kind, key) if key is not None else next(self._seq)] = (factory, time.monotonic())
+        self._dispatch()
+        return True
+
+    def _dispatch(self):
+        for kind in KINDS:
+            queue = self._pending[kind]
+            while queue and self._running[kind] < self.limits[kind] and self.running < self.max_concurrency:
+                entry_key = next((k for k in queue if k not in self._running_keys), None)
+                if entry_key is None:
+                    break
+                factory, queued_at = queue.pop(entry_key)
+                self._running[kind] += 1
+                if isinstance(entry_key, tuple):
+                    self._running_keys.add(entry_key)
+                task = asyncio.get_running_loop().create_task(self._run(kind, entry_key, factory, queued_at))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, kind, entry_key, factory, queued_at):
+        stats = self.stats[kind]
+        stats.max_lag = max(stats.max_lag, time.monotonic() - queued_at)
+        try:
+            await factory()
+            stats.done += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            stats.failed += 1
+            print(f"[side-effects] {kind} failed: {type(exc).__name__}: {exc}")
+        finally:
+            self._running[kind] -= 1
+            self._running_keys.discard(entry_key)
+            self._dispatch()
+            if self._idle is not None and not self.pending and not self.running:
+                self._idle.set()
+
+    async def drain(self, timeout=None) -> bool:
+        """Wait until nothing is pending or running; False on timeout."""
+        if not self.pending and not self.running:
+            return True
+        self._idle = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._idle = None
+
+    def snapshot(self) -> dict:
+        return {
+            "pending": {kind: len(self._pending[kind]) for kind in KINDS},
+            "running": dict(self._running),
+            **{kind: self.stats[kind].as_dict() for kind in KINDS},
+        }
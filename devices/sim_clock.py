@@ -0,0 +1,180 @@
+"""Simulated time for ``send_telemetry``.
+
+The telemetry schedule, the state generators and every
+``sent_timestamp``/``received_timestamp`` read time and sleep through a clock
+instead of ``time.time()`` and ``asyncio.sleep`` directly. ``--time-scale``
+picks it:
+
+* ``1`` - ``RealClock``, wall time (the default).
+* ``N`` - ``ScaledClock``: simulated time runs N times faster than wall time
+  and starts at the wall time of the moment the run started.
+* ``0`` - ``SteppedClock``: simulated time jumps to the next deadline as soon
+  as the event loop has nothing left to run. A day of ticks runs as fast as
+  the sends (and the sinks behind them) complete. Work waiting on I/O does
+  not hold the clock back; a closed-loop device still sends one tick at a
+  time because its next sleep starts after its send returns.
+
+Timestamps stay consistent with each other: every device's sleeps,
+``sent_timestamp`` values and Influx points follow the same clock. Operational
+timers (reconnect back-off, the device watcher, reports) keep using wall time.
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class RealClock:
+    speed = 1.0
+
+    def time(self) -> float:
+        """Epoch seconds."""
+        return time.time()
+
+    def monotonic(self) -> float:
+        """Seconds for deadlines; only differences are meaningful."""
+        return time.monotonic()
+
+    def timestamp_ms(self) -> int:
+        return int(self.time() * 1000)
+
+    async def sleep(self, delay):
+        await asyncio.sleep(delay)
+
+    def call_later(self, delay, callback, *args):
+        """Run ``callback(*args)`` after ``delay`` clock seconds; returns a handle with ``cancel()``."""
+        return asyncio.get_running_loop().call_later(delay, callback, *args)
+
+    async def start(self):
+        """Start background work; called from inside the event loop."""
+
+    async def close(self):
+        pass
+
+    def snapshot(self) -> dict:
+        return {"speed": self.speed, "now": round(self.time(), 3)}
+
+
+class ScaledClock(RealClock):
+    def __init__(self, speed: float, start: float | None = None):
+        if speed <= 0:
+            raise ValueError("time scale must be > 0 (use SteppedClock for 0)")
+        self.speed = float(speed)
+        self._real_start = time.monotonic()
+        self._epoch_start = time.time() if start is None else start
+
+    def monotonic(self) -> float:
+        return (time.monotonic() - self._real_start) * self.speed
+
+    def time(self) -> float:
+        return self._epoch_start + self.monotonic()
+
+    async def sleep(self, delay):
+        await asyncio.sleep(max(delay, 0) / self.speed)
+
+    def call_later(self, delay, callback, *args):
+        return asyncio.get_running_loop().call_later(max(delay, 0) / self.speed, callback, *args)
+
+
+class _Timer:
+    __slots__ = ("callback", "args", "cancelled")
+
+    def __init__(self, callback, args):
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class SteppedClock(RealClock):
+    speed = 0.0
+
+    def __init__(self, start: float | None = None):
+        self._now = 0.0
+        self._epoch_start = time.time() if start is None else start
+        self._timers = []  # (deadline, seq, _Timer)
+        self._seq = itertools.count()
+        self._added = None
+        self._task = None
+        self.steps = 0
+        # loop passes allowed per step before time moves on anyway (busy tasks cannot stall the clock)
+        self.max_passes = 100
+
+    def monotonic(self) -> float:
+        return self._now
+
+    def time(self) -> float:
+        return self._epoch_start + self._now
+
+    def call_later(self, delay, callback, *args):
+        timer = _Timer(callback, args)
+        heapq.heappush(self._timers, (self._now + max(delay, 0), next(self._seq), timer))
+        if self._added is not None:
+            self._added.set()
+        return timer
+
+    async def sleep(self, delay):
+        future = asyncio.get_running_loop().create_future()
+        timer = self.call_later(delay, _resolve, future)
+        try:
+            await future
+        finally:
+            timer.cancel()
+
+    async def start(self):
+        if self._task is None:
+            self._added = asyncio.Event()
+            self._task = asyncio.create_task(self._advance())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _advance(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # let what the last step woke (and the tasks it created) run until it waits again
+            for _ in range(self.max_passes):
+                await asyncio.sleep(0)
+                # the loop's queue of runnable callbacks (CPython); other loops get one pass per step
+                if not getattr(loop, "_ready", None):
+                    break
+            while self._timers and self._timers[0][2].cancelled:
+                heapq.heappop(self._timers)
+            if not self._timers:
+                self._added.clear()
+                await self._added.wait()
+                continue
+            deadline = self._timers[0][0]
+            self._now = max(self._now, deadline)
+            self.steps += 1
+            while self._timers and self._timers[0][0] <= deadline:
+                _, _, timer = heapq.heappop(self._timers)
+                if not timer.cancelled:
+                    timer.callback(*timer.args)
+
+    def snapshot(self) -> dict:
+        return {**super().snapshot(), "steps": self.steps, "timers": len(self._timers)}
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+REAL_CLOCK = RealClock()
+
+
+def make_clock(speed: float = 1.0, start: float | None = None) -> RealClock:
+    if speed < 0:
+        raise ValueError("time scale must be >= 0")
+    if speed == 0:
+        return SteppedClock(start)
+    if speed == 1 and start is None:
+        return REAL_CLOCK
+    return ScaledClock(speed, start)
@@ -0,0 +1,260 @@
+"""Device state storage for ``send_telemetry``.
+
+Telemetry generation and every RPC handler read and write device state
+through one ``StateStore``, keyed by device pk. ``--state-store`` picks the
+backend:
+
+* ``memory`` - one dict per device; the database is written once, on shutdown.
+* ``write-behind`` - the same dicts, plus a background task that writes the
+  states changed since the last flush every ``flush_interval`` seconds, in
+  one bulk update.
+* ``db`` - reads and writes go to the device row. Writes are committed in
+  batches by a ``DatabaseExecutor`` when there is one, else run as coalesced
+  PERSISTENCE side effects; reads return the pending state until it lands.
+
+With a ``DatabaseExecutor`` every backend runs its reads on the executor's
+reader threads and its writes on its writer thread.
+
+``get`` returns a copy: handlers build the new state from it and ``set`` it.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+
+from devices.benchmarking import LatencyStats
+from devices.models import Device
+from devices.side_effects import PERSISTENCE
+
+
+STORE_MEMORY = "memory"
+STORE_WRITE_BEHIND = "write-behind"
+STORE_DB = "db"
+STATE_STORES = (STORE_MEMORY, STORE_WRITE_BEHIND, STORE_DB)
+
+
+def read_device_state(pk):
+    return Device.objects.filter(pk=pk).values_list('state', flat=True).first()
+
+
+def write_device_state(pk, state):
+    # state-only write: Device.save() would run the full ThingsBoard reconciliation
+    Device.objects.filter(pk=pk).update(state=state)
+
+
+def write_device_states(states):
+    """Write ``{pk: state}`` with bulk UPDATEs instead of one query per device."""
+    rows = [Device(pk=pk, state=state) for pk, state in states.items()]
+    Device.objects.bulk_update(rows, ['state'], batch_size=500)
+
+
+class StateStore:
+    name = ""
+
+    def __init__(self, db_executor=None):
+        self.db_executor = db_executor
+        self.stats = LatencyStats()
+
+    def load(self, pk, state):
+        """Seed ``pk`` with the state read at startup; keeps a state that is already there."""
+
+    async def get(self, pk) -> dict:
+        started = time.perf_counter()
+        try:
+            return await self._get(pk)
+        finally:
+            self.stats.record("read", time.perf_counter() - started)
+
+    async def set(self, pk, state):
+        started = time.perf_counter()
+        try:
+            await self._set(pk, state)
+        finally:
+            self.stats.record("write", time.perf_counter() - started)
+
+    async def start(self):
+        """Start background work; called from inside the event loop."""
+
+    async def close(self):
+        """Persist what the backend still holds in memory."""
+
+    def snapshot(self) -> dict:
+        return {"backend": self.name, **self.stats.as_dict()}
+
+    async def _get(self, pk) -> dict:
+        raise NotImplementedError
+
+    async def _set(self, pk, state):
+        raise NotImplementedError
+
+    async def _db_read(self, fn, *args):
+        if self.db_executor is not None:
+            return await self.db_executor.read(fn, *args)
+        return await sync_to_async(fn)(*args)
+
+    async def _db_write(self, fn, *args):
+        if self.db_executor is not None:
+            return await self.db_executor.write(fn, *args)
+        return await sync_to_async(fn)(*args)
+
+
+class MemoryStateStore(StateStore):
+    name = STORE_MEMORY
+
+    def __init__(self, persist_on_close: bool = True, db_executor=None):
+        super().__init__(db_executor)
+        self.persist_on_close = persist_on_close
+        self._states = {}
+
+    def load(self, pk, state):
+        self._states.setdefault(pk, dict(state or {}))
+
+    async def _get(self, pk) -> dict:
+        return dict(self._states.get(pk) or {})
+
+    async def _set(self, pk, state):
+        self._states[pk] = dict(state)
+
+    async def _write(self, states, op):
+        started = time.perf_counter()
+        await self._db_write(write_device_states, states)
+        self.stats.record(op, time.perf_counter() - started)
+
+    async def close(self):
+        if self.persist_on_close and self._states:
+            print(f"[state-store] syncing {len(self._states)} in-memory device states to the database")
+            await self._write(dict(self._states), "close")
+
+
+class WriteBehindStateStore(MemoryStateStore):
+    name = STORE_WRITE_BEHIND
+
+    def __init__(self, flush_interval: float = 5.0, db_executor=None):
+        if flush_interval <= 0:
+            raise ValueError("flush interval must be > 0")
+        super().__init__(db_executor=db_executor)
+        self.flush_interval = flush_interval
+        self.flushed = 0
+        self.failed_flushes = 0
+        self._dirty = set()
+        self._task = None
+
+    async def _set(self, pk, state):
+        self._states[pk] = dict(state)
+        self._dirty.add(pk)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Write the states changed since the last flush; returns how many."""
+        if not self._dirty:
+            return 0
+        dirty, self._dirty = self._dirty, set()
+        # set() replaces the dict of a device, so these stay as they are during the write
+        try:
+            await self._write({pk: self._states[pk] for pk in dirty}, "flush")
+        except Exception as exc:
+            self._dirty |= dirty
+            self.failed_flushes += 1
+            print(f"[state-store] flush of {len(dirty)} states failed: {type(exc).__name__}: {exc}")
+            return 0
+        self.flushed += len(dirty)
+        return len(dirty)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def snapshot(self) -> dict:
+        return {**super().snapshot(), "dirty": len(self._dirty), "flushed": self.flushed,
+                "failed_flushes": self.failed_flushes}
+
+
+class DatabaseStateStore(StateStore):
+    name = STORE_DB
+
+    def __init__(self, side_effects=None, db_executor=None):
+        super().__init__(db_executor)
+        self.side_effects = side_effects
+        # state written but not yet persisted, with a version so a newer write is not cleared
+        self._pending = {}
+        self._versions = {}
+        self.failed_writes = 0
+
+    async def _get(self, pk) -> dict:
+        pending = self._pending.get(pk)
+        if pending is not None:
+            return dict(pending)
+        return dict(await self._db_read(read_device_state, pk) or {})
+
+    async def _set(self, pk, state):
+        self._pending[pk] = dict(state)
+        version = self._versions[pk] = self._versions.get(pk, 0) + 1
+        if self.db_executor is not None:
+            self._submit(pk, version)
+        elif self.side_effects is not None:
+            self.side_effects.submit(PERSISTENCE, lambda: self._persist(pk), key=pk)
+        else:
+            await self._persist(pk)
+
+    async def _persist(self, pk):
+        version, state = self._versions.get(pk), self._pending.get(pk)
+        if state is None:
+            return
+        started = time.perf_counter()
+        await sync_to_async(write_device_state)(pk, state)
+        self.stats.record("persist", time.perf_counter() - started)
+        self._committed(pk, version)
+
+    def _submit(self, pk, version, attempt=0):
+        committed = self.db_executor.submit_state(pk, self._pending[pk])
+        committed.add_done_callback(lambda f: self._executor_done(pk, version, attempt, f.result()))
+
+    def _executor_done(self, pk, version, attempt, ok):
+        if ok:
+            self._committed(pk, version)
+            return
+        self.failed_writes += 1
+        # the batch failed: submit the state again, unless a newer write already went in its place
+        delay = min(0.5 * 2 ** attempt, 10.0)
+        asyncio.get_running_loop().call_later(delay, self._retry, pk, version, attempt + 1)
+
+    def _retry(self, pk, version, attempt):
+        if self._versions.get(pk) == version and pk in self._pending:
+            self._submit(pk, version, attempt)
+
+    def _committed(self, pk, version):
+        # a newer write keeps its pending state until that one is committed
+        if self._versions.get(pk) == version:
+            self._pending.pop(pk, None)
+
+    async def close(self):
+        if self._pending:
+            # states still waiting for a retry
+            print(f"[state-store] syncing {len(self._pending)} unpersisted device states to the database")
+            await self._db_write(write_device_states, dict(self._pending))
+            self._pending.clear()
+
+    def snapshot(self) -> dict:
+        return {**super().snapshot(), "unpersisted": len(self._pending), "failed_writes": self.failed_writes}
+
+
+def make_state_store(kind, flush_interval: float = 5.0, side_effects=None, db_executor=None) -> StateStore:
+    if kind == STORE_MEMORY:
+        return MemoryStateStore(db_executor=db_executor)
+    if kind == STORE_WRITE_BEHIND:
+        return WriteBehindStateStore(flush_interval, db_executor=db_executor)
+    if kind == STORE_DB:
+        return DatabaseStateStore(side_effects, db_executor=db_executor)
+    raise ValueError(f"unknown state store: {kind}")
@@ -19,6 +19,8 @@ document.addEventListener('DOMContentLoaded', function () {
     const devicesTotalTarget = document.getElementById('devices-total');
     const devicesWithTokenTarget = document.getElementById('devices-with-token');
     const devicesWithoutTokenTarget = document.getElementById('devices-without-token');
+    const tbDeletionsTarget = document.getElementById('tb-deletions');
+    const tbDeletionsPendingTarget = document.getElementById('tb-deletions-pending');
     const gatewaysTotalTarget = document.getElementById('gateways-total');
     const gatewaysActiveTarget = document.getElementById('gateways-active');
     const gatewayNameTarget = document.getElementById('gateway-name');
@@ -63,6 +65,12 @@ document.addEventListener('DOMContentLoaded', function () {
             if (gatewaysActiveTarget) gatewaysActiveTarget.textContent = payload.stats.gateways_active;
         }
 
+        if (payload.thingsboard_deletions && tbDeletionsTarget) {
+            const remaining = payload.thingsboard_deletions.pending + payload.thingsboard_deletions.inflight;
+            tbDeletionsPendingTarget.textContent = remaining;
+            tbDeletionsTarget.hidden = remaining === 0;
+        }
+
         if (payload.active_gateway) {
             if (gatewayNameTarget) gatewayNameTarget.textContent = payload.active_gateway.name;
             if (gatewayAuthTarget) gatewayAuthTarget.textContent = payload.active_gateway.auth_method;
@@ -0,0 +1,281 @@
+"""Heartbeat interval resolution and fleet-wide rate targeting for send_telemetry.
+
+Intervals are resolved per device as: device type override, then system
+override, then the global default. In target-rate mode every resolved
+interval is multiplied by one common factor so that the sum of per-device
+rates equals the requested fleet rate; relative speeds between types are kept.
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import json
+import random
+import time
+
+from devices.sim_clock import REAL_CLOCK
+
+
+def parse_interval_overrides(values) -> dict:
+    """Parse ``["led=1", "airconditioner=30"]`` (or a JSON object string) into a dict."""
+    if isinstance(values, dict):
+        values = [json.dumps(values)]
+    elif isinstance(values, str):
+        values = [values]
+    result = {}
+    for value in values or []:
+        value = value.strip()
+        if not value:
+            continue
+        if value.startswith("{"):
+            try:
+                parsed = json.loads(value)
+            except ValueError as exc:
+                raise ValueError(f"Invalid interval override JSON: {exc}") from None
+            if not isinstance(parsed, dict):
+                raise ValueError("Interval override JSON must be an object of name: seconds.")
+            items = parsed.items()
+        else:
+            if "=" not in value:
+                raise ValueError(f"Invalid interval override '{value}'; expected name=seconds.")
+            items = [value.rsplit("=", 1)]
+        for name, seconds in items:
+            try:
+                seconds = float(seconds)
+            except (TypeError, ValueError):
+                raise ValueError(f"Interval for '{name}' must be a number of seconds.") from None
+            if seconds <= 0:
+                raise ValueError(f"Interval for '{name}' must be positive.")
+            result[str(name).strip().lower()] = seconds
+    return result
+
+
+class HeartbeatPolicy:
+    def __init__(self, default_interval, by_type=None, by_system=None):
+        if default_interval <= 0:
+            raise ValueError("Heartbeat interval must be positive.")
+        self.default_interval = float(default_interval)
+        self.by_type = {k.lower(): float(v) for k, v in (by_type or {}).items()}
+        self.by_system = {k.lower(): float(v) for k, v in (by_system or {}).items()}
+
+    def interval_for(self, device_type="", system=None) -> float:
+        device_type = (device_type or "").lower()
+        if device_type in self.by_type:
+            return self.by_type[device_type]
+        if system and system.lower() in self.by_system:
+            return self.by_system[system.lower()]
+        return self.default_interval
+
+
+class TelemetrySchedule:
+    """Per-device periods for the running fleet.
+
+    Without a target rate the period is the policy interval. With one, the
+    periods are scaled so that ``sum(1 / period) == target_rate``; adding a
+    device rescales everyone, and running loops pick up the new period on
+    their next tick.
+    """
+
+    def __init__(self, policy: HeartbeatPolicy, target_rate=None):
+        if target_rate is not None and target_rate <= 0:
+            raise ValueError("Target rate must be positive.")
+        self.policy = policy
+        self.target_rate = target_rate
+        self._base = {}
+        self._natural_rate = 0.0
+        self._scale = 1.0
+
+    @property
+    def open_loop(self) -> bool:
+        return self.target_rate is not None
+
+    def add(self, device_id, device_type="", system=None):
+        previous = self._base.get(device_id)
+        if previous is not None:
+            self._natural_rate -= 1.0 / previous
+        base = self.policy.interval_for(device_type, system)
+        self._base[device_id] = base
+        self._natural_rate += 1.0 / base
+        if self.target_rate:
+            self._scale = self._natural_rate / self.target_rate
+
+    def period(self, device_id) -> float:
+        return self._base.get(device_id, self.policy.default_interval) * self._scale
+
+    def expected_rate(self) -> float:
+        return self._natural_rate / self._scale
+
+
+class RateMeter:
+    """Counts telemetry sends and reports achieved vs. target rate."""
+
+    def __init__(self, target_rate=None):
+        self.target_rate = target_rate
+        self.sent = 0
+        self.failed = 0
+        self.late = 0
+        self.skipped = 0
+        self._window_start = time.monotonic()
+        self._window_sent = 0
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        elapsed = max(now - self._window_start, 1e-9)
+        achieved = (self.sent - self._window_sent) / elapsed
+        self._window_start, self._window_sent = now, self.sent
+        data = {
+            "achieved_rate": round(achieved, 2),
+            "sent": self.sent,
+            "failed": self.failed,
+            "late_ticks": self.late,
+            "skipped_ticks": self.skipped,
+        }
+        if self.target_rate:
+            data["target_rate"] = self.target_rate
+            data["achieved_ratio"] = round(achieved / self.target_rate, 4)
+        return data
+
+
+async def run_closed_loop(send, period_fn, meter: RateMeter, clock=REAL_CLOCK):
+    """Send, then sleep for the period (the historical send_telemetry behaviour)."""
+    while True:
+        try:
+            await send()
+            meter.sent += 1
+        except Exception as exc:
+            meter.failed += 1
+            print(f"[schedule] telemetry send failed: {exc}")
+        await clock.sleep(period_fn())
+
+
+async def run_open_loop(send, period_fn, meter: RateMeter, max_inflight=4, rng=random, clock=REAL_CLOCK):
+    """Fire sends at absolute deadlines so slow sends do not stretch the period.
+
+    Each tick runs as its own task. A device with ``max_inflight`` sends
+    still pending skips the tick instead of piling up more work; a tick that
+    fires more than one period late is counted as late and the schedule is
+    re-anchored rather than bursting to catch up.
+    """
+    inflight = set()
+
+    async def tick():
+        try:
+            await send()
+            meter.sent += 1
+        except Exception as exc:
+            meter.failed += 1
+            print(f"[schedule] telemetry send failed: {exc}")
+
+    period = period_fn()
+    next_at = clock.monotonic() + rng.uniform(0, period)
+    while True:
+        delay = next_at - clock.monotonic()
+        if delay > 0:
+            await clock.sleep(delay)
+        if len(inflight) >= max_inflight:
+            meter.skipped += 1
+        else:
+            task = asyncio.ensure_future(tick())
+            inflight.add(task)
+            task.add_done_callback(inflight.discard)
+        period = period_fn()
+        next_at += period
+        now = clock.monotonic()
+        if now - next_at > period:
+            meter.late += 1
+            next_at = now
+
+
+class TickScheduler:
+    """Drives the telemetry ticks of a whole fleet from one task and a heap of deadlines.
+
+    The loops above keep one task per device for the whole run. Here a device
+    costs one heap entry, and a task exists only while one of its sends is
+    running. ``send(key)`` and ``period_fn(key)`` are shared by every device.
+    By default ticks follow ``run_open_loop`` (absolute deadlines,
+    ``max_inflight`` per device, late ticks re-anchored). With ``closed_loop``
+    the next tick is due one period after the send returns, like
+    ``run_closed_loop``. Deadlines are in ``clock`` time.
+    """
+
+    def __init__(self, send, period_fn, meter: RateMeter, max_inflight=4, closed_loop=False, rng=random,
+                 clock=REAL_CLOCK):
+        self.send = send
+        self.period_fn = period_fn
+        self.meter = meter
+        self.max_inflight = max_inflight
+        self.closed_loop = closed_loop
+        self.rng = rng
+        self.clock = clock
+        self._heap = []  # (due, seq, key)
+        self._seq = itertools.count()
+        self._inflight = {}  # key -> sends running; only keys with work in flight
+        self._tasks = set()
+        self._waiter = None
+
+    def add(self, key, delay=None):
+        """Start ticking ``key``; the first tick is spread over one period unless ``delay`` is given."""
+        if delay is None:
+            delay = self.rng.uniform(0, self.period_fn(key))
+        self._push(self.clock.monotonic() + delay, key)
+
+    def _push(self, due, key):
+        entry = (due, next(self._seq), key)
+        heapq.heappush(self._heap, entry)
+        waiter = self._waiter
+        if waiter is not None and not waiter.done() and self._heap[0] is entry:
+            waiter.set_result(None)  # new earliest deadline
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            delay = self._heap[0][0] - self.clock.monotonic() if self._heap else None
+            if delay is None or delay > 0:
+                self._waiter = loop.create_future()
+                timer = self.clock.call_later(delay, _wake, self._waiter) if delay is not None else None
+                try:
+                    await self._waiter
+                finally:
+                    if timer is not None:
+                        timer.cancel()
+                    self._waiter = None
+                continue
+            due, _, key = heapq.heappop(self._heap)
+            self._fire(loop, due, key)
+
+    def _fire(self, loop, due, key):
+        if self._inflight.get(key, 0) >= self.max_inflight:
+            self.meter.skipped += 1
+        else:
+            self._inflight[key] = self._inflight.get(key, 0) + 1
+            task = loop.create_task(self._tick(key))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if not self.closed_loop:
+            period = self.period_fn(key)
+            next_at = due + period
+            now = self.clock.monotonic()
+            if now - next_at > period:
+                self.meter.late += 1
+                next_at = now
+            self._push(next_at, key)
+
+    async def _tick(self, key):
+        try:
+            await self.send(key)
+            self.meter.sent += 1
+        except Exception as exc:
+            self.meter.failed += 1
+            print(f"[schedule] telemetry send failed: {exc}")
+        finally:
+            left = self._inflight.pop(key) - 1
+            if left:
+                self._inflight[key] = left
+            if self.closed_loop:
+                self._push(self.clock.monotonic() + self.period_fn(key), key)
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
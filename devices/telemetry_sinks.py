@@ -0,0 +1,450 @@
+"""Outputs of generated telemetry for ``send_telemetry --sink``.
+
+Every message a device generates (a ``--randomize`` step or a trace row)
+becomes one ``TelemetrySample`` that the ``SinkPipeline`` hands to each
+configured sink in turn:
+
+* ``mqtt`` - published from the device's connection (the default).
+* ``http`` - a batch's samples of one device in one multi-sample post of the
+  ThingsBoard HTTP device API (``--transport http``).
+* ``influx`` - ``device_data`` points, POSTed in gzip batches. ``schema=wide``
+  (the default) writes one point per sample, ``schema=narrow`` one per
+  property.
+* ``file`` - Influx line protocol (either schema) or NDJSON, gzipped for ``.gz`` paths and
+  rotated by size with ``rotate_mb``.
+* ``stdout`` - the same lines on standard output.
+* ``null`` - counted and dropped; measures generation on its own.
+
+A sink is given as ``name[:key=value,...]``. Besides its own options
+(``path``, ``format``, ...) every sink takes a delivery policy:
+
+* ``concurrency`` - writes running at once. ``0`` writes inline: the device
+  waits for the write, and its tick timing includes it.
+* ``batch`` - most samples per write; ``linger`` - seconds a write waits for
+  its batch to fill.
+* ``max_pending`` - samples queued for the sink; when they are all taken,
+  ``overflow`` decides: ``block`` the device, ``drop-newest`` or
+  ``drop-oldest``.
+
+A queued sink only slows generation down through its own queue, so a slow
+transport shows up in its snapshot (queued, dropped) instead of in the
+rate of every device.
+"""
+from __future__ import annotations
+
+import asyncio
+import gzip
+import json
+import os
+import sys
+from collections import namedtuple
+
+from devices.influx_writer import SCHEMA_WIDE, SCHEMAS, InfluxBatchWriter, escape_tag, telemetry_lines
+from devices.rpc_executor import OVERFLOW_BLOCK, OVERFLOW_DROP_NEWEST, OVERFLOW_POLICIES
+
+
+# device: the TelemetryPublisher (device_id, thingsboard_id, publish());
+# payload: the MQTT message, request_id and sent_timestamp included;
+# properties: the payload keys the device reports
+TelemetrySample = namedtuple("TelemetrySample", "device ts request_id payload properties")
+
+FORMAT_LINE = "line"
+FORMAT_NDJSON = "ndjson"
+FILE_FORMATS = (FORMAT_LINE, FORMAT_NDJSON)
+
+
+def sample_lines(sample, measurement: str = "device_data", schema: str = SCHEMA_WIDE) -> list:
+    """The sample as line protocol, tagged like the live Influx writes."""
+    head = (
+        f"{measurement},sensor={escape_tag(sample.device.thingsboard_id)},source=simulator,direction=S2M,"
+        f"request_id=\"{sample.request_id}\",correlation_id={sample.request_id}"
+    )
+    fields = [(name, sample.payload[name]) for name in sample.properties if name in sample.payload]
+    return telemetry_lines(head, fields, sample.ts, schema)
+
+
+def check_schema(sink, schema):
+    if schema not in SCHEMAS:
+        raise ValueError(f"{sink} sink: schema must be one of {', '.join(SCHEMAS)}")
+    return schema
+
+
+def sample_json(sample) -> str:
+    return json.dumps({
+        "device_id": sample.device.device_id,
+        "sensor": sample.device.thingsboard_id,
+        "ts": sample.ts,
+        "request_id": sample.request_id,
+        "values": {name: sample.payload[name] for name in sample.properties if name in sample.payload},
+    })
+
+
+class Sink:
+    name = "sink"
+    # policy defaults of the sink type; overridden by the spec
+    defaults = {}
+    needs_connection = False
+
+    def __init__(self, concurrency: int = 0, batch: int = 1, linger: float = 0.0, max_pending: int = 10000,
+                 overflow: str = OVERFLOW_BLOCK):
+        if concurrency < 0 or batch < 1 or max_pending < 1 or linger < 0:
+            raise ValueError(f"{self.name} sink: concurrency and linger must be >= 0, batch and max_pending >= 1")
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"{self.name} sink: overflow must be one of {', '.join(OVERFLOW_POLICIES)}")
+        self.concurrency = concurrency
+        self.batch = batch
+        self.linger = linger
+        self.max_pending = max_pending
+        self.overflow = overflow
+        self.accepted = 0
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self.writes = 0
+        self.failed_writes = 0
+        self._queue = None
+        self._tasks = []
+
+    async def start(self):
+        if self.concurrency > 0 and self._queue is None:
+            self._queue = asyncio.Queue(self.max_pending)
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def emit(self, sample):
+        self.accepted += 1
+        if self._queue is None:
+            # inline sink (or not started): the caller waits for the write
+            await self._write_batch([sample])
+            return
+        if self._queue.full() and self.overflow != OVERFLOW_BLOCK:
+            self.dropped += 1
+            if self.overflow == OVERFLOW_DROP_NEWEST:
+                return
+            self._queue.get_nowait()
+            self._queue.task_done()
+        await self._queue.put(sample)
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.linger
+            while len(batch) < self.batch:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._write_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write_batch(self, samples):
+        try:
+            await self.write(samples)
+        except Exception as exc:
+            self.failed += len(samples)
+            self.failed_writes += 1
+            if self.failed_writes <= 10:
+                print(f"[sinks] {self.name} write of {len(samples)} samples failed: {type(exc).__name__}: {exc}")
+            return
+        self.written += len(samples)
+        self.writes += 1
+
+    async def write(self, samples):
+        raise NotImplementedError
+
+    async def close(self, timeout: float = 10.0) -> bool:
+        """Write what is queued (at most ``timeout`` seconds) and release the sink; False if samples were left."""
+        drained = True
+        if self._queue is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                drained = False
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._tasks = []
+        await self.finish()
+        return drained
+
+    async def finish(self):
+        """Release files and connections; runs after the queue is drained."""
+
+    def snapshot(self) -> dict:
+        return {
+            "accepted": self.accepted,
+            "written": self.written,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "writes": self.writes,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+
+class MqttSink(Sink):
+    name = "mqtt"
+    needs_connection = True
+
+    async def write(self, samples):
+        for sample in samples:
+            await sample.device.publish(json.dumps(sample.payload))
+            print(f"Device {sample.device.device_id}: Telemetry sent: {sample.payload} at {sample.ts} "
+                  f"(request_id={sample.request_id})")
+
+
+class HttpSink(Sink):
+    name = "http"
+    defaults = {"concurrency": 8, "batch": 500, "linger": 0.5}
+    needs_connection = True
+
+    async def write(self, samples):
+        by_device = {}
+        for sample in samples:
+            by_device.setdefault(sample.device, []).append(sample)
+        outcomes = await asyncio.gather(*(device.publish_samples(group) for device, group in by_device.items()),
+                                        return_exceptions=True)
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                raise outcome
+
+
+class InfluxSink(Sink):
+    name = "influx"
+    defaults = {"concurrency": 2, "batch": 1000, "linger": 1.0}
+
+    def __init__(self, url, token=None, session=None, measurement: str = "device_data", compresslevel: int = 1,
+                 schema: str = SCHEMA_WIDE, **policy):
+        super().__init__(**policy)
+        if not url:
+            raise ValueError("influx sink: no url")
+        self.measurement = measurement
+        self.schema = check_schema(self.name, schema)
+        # write_batch() only: the sink's own workers do the batching
+        self.writer = InfluxBatchWriter(url, token=token, session=session, compresslevel=compresslevel)
+        self._own_session = False
+
+    async def start(self):
+        if self.writer.session is None:
+            import aiohttp
+
+            self.writer.session = aiohttp.ClientSession()
+            self._own_session = True
+        await super().start()
+
+    async def write(self, samples):
+        lines = [line for sample in samples for line in sample_lines(sample, self.measurement, self.schema)]
+        if not await self.writer.write_batch(lines):
+            raise RuntimeError("InfluxDB did not accept the batch")
+
+    async def finish(self):
+        if self._own_session:
+            await self.writer.session.close()
+            self._own_session = False
+
+    def snapshot(self) -> dict:
+        return {**super().snapshot(), "schema": self.schema, "points": self.writer.written,
+                "retried": self.writer.retried, "mb": round(self.writer.bytes / 1e6, 2),
+                "mb_on_wire": round(self.writer.bytes_on_wire / 1e6, 2)}
+
+
+class FileSink(Sink):
+    """Appends to ``path``; with ``rotate_mb`` the parts are ``<name>-0001.<ext>``, ``<name>-0002.<ext>``, ..."""
+
+    name = "file"
+    defaults = {"concurrency": 1, "batch": 1000, "linger": 1.0}
+
+    def __init__(self, path=None, format=None, rotate_mb: float = 0.0, measurement: str = "device_data",
+                 compresslevel: int = 6, schema: str = SCHEMA_WIDE, **policy):
+        super().__init__(**policy)
+        if not path:
+            raise ValueError("file sink: no path")
+        if self.concurrency > 1:
+            raise ValueError("file sink: concurrency must be 0 or 1 (one file is written in order)")
+        lowered = str(path).lower().removesuffix(".gz")
+        self.format = format or (FORMAT_NDJSON if lowered.endswith((".ndjson", ".jsonl", ".json")) else FORMAT_LINE)
+        if self.format not in FILE_FORMATS:
+            raise ValueError(f"file sink: format must be one of {', '.join(FILE_FORMATS)}")
+        self.path = str(path)
+        self.rotate_bytes = int(rotate_mb * 1e6)
+        self.measurement = measurement
+        self.schema = check_schema(self.name, schema)
+        self.compresslevel = compresslevel
+        self.files = 0
+        self.bytes = 0
+        self._file = None
+        self._file_bytes = 0
+
+    def _part_path(self, number):
+        if not self.rotate_bytes:
+            return self.path
+        head, base = os.path.split(self.path)
+        stem, dot, ext = base.partition(".")
+        return os.path.join(head, f"{stem}-{number:04d}{dot}{ext}")
+
+    def _open(self):
+        self.files += 1
+        path = self._part_path(self.files)
+        if path.endswith(".gz"):
+            self._file = gzip.open(path, "ab", compresslevel=self.compresslevel)
+        else:
+            self._file = open(path, "ab")
+        self._file_bytes = 0
+
+    def _append(self, raw):
+        # worker thread: gzip and disk I/O stay off the event loop
+        if self._file is not None and self.rotate_bytes and self._file_bytes >= self.rotate_bytes:
+            self._file.close()
+            self._file = None
+        if self._file is None:
+            self._open()
+        self._file.write(raw)
+        self._file_bytes += len(raw)
+
+    async def write(self, samples):
+        if self.format == FORMAT_NDJSON:
+            lines = [sample_json(sample) for sample in samples]
+        else:
+            lines = [line for sample in samples for line in sample_lines(sample, self.measurement, self.schema)]
+        raw = ("\n".join(lines) + "\n").encode()
+        await asyncio.get_running_loop().run_in_executor(None, self._append, raw)
+        self.bytes += len(raw)
+
+    async def finish(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def snapshot(self) -> dict:
+        return {**super().snapshot(), "files": self.files, "mb": round(self.bytes / 1e6, 2)}
+
+
+class StdoutSink(Sink):
+    name = "stdout"
+    defaults = {"concurrency": 1, "batch": 100}
+
+    def __init__(self, format: str = FORMAT_NDJSON, measurement: str = "device_data", schema: str = SCHEMA_WIDE,
+                 **policy):
+        super().__init__(**policy)
+        if format not in FILE_FORMATS:
+            raise ValueError(f"stdout sink: format must be one of {', '.join(FILE_FORMATS)}")
+        self.format = format
+        self.measurement = measurement
+        self.schema = check_schema(self.name, schema)
+
+    async def write(self, samples):
+        if self.format == FORMAT_NDJSON:
+            lines = [sample_json(sample) for sample in samples]
+        else:
+            lines = [line for sample in samples for line in sample_lines(sample, self.measurement, self.schema)]
+        sys.stdout.write("\n".join(lines) + "\n")
+
+
+class NullSink(Sink):
+    name = "null"
+
+    async def emit(self, sample):
+        self.accepted += 1
+        self.written += 1
+
+
+SINK_TYPES = {cls.name: cls for cls in (MqttSink, HttpSink, InfluxSink, FileSink, StdoutSink, NullSink)}
+
+# how each spec option is parsed
+OPTION_TYPES = {
+    "concurrency": int,
+    "batch": int,
+    "linger": float,
+    "max_pending": int,
+    "overflow": str,
+    "url": str,
+    "path": str,
+    "format": str,
+    "rotate_mb": float,
+    "measurement": str,
+    "compresslevel": int,
+    "schema": str,
+}
+
+
+def parse_sink_spec(spec):
+    """``"file:path=/tmp/t.lp.gz,batch=500"`` -> ``("file", {"path": "/tmp/t.lp.gz", "batch": 500})``."""
+    name, _, rest = spec.partition(":")
+    name = name.strip().lower()
+    if name not in SINK_TYPES:
+        raise ValueError(f"unknown sink {name!r} (choose from {', '.join(SINK_TYPES)})")
+    options = {}
+    for item in rest.split(","):
+        if not item.strip():
+            continue
+        key, sep, value = item.partition("=")
+        key = key.strip().replace("-", "_")
+        if not sep or key not in OPTION_TYPES:
+            raise ValueError(f"{name} sink: unknown option {item.strip()!r}")
+        try:
+            options[key] = OPTION_TYPES[key](value.strip())
+        except ValueError:
+            raise ValueError(f"{name} sink: invalid value for {key}: {value.strip()!r}") from None
+    return name, options
+
+
+def make_sink(spec, influx_url=None, influx_token=None, schema=None):
+    """``schema`` is the default of the sinks writing line protocol; a ``schema=`` in the spec wins."""
+    name, options = parse_sink_spec(spec)
+    cls = SINK_TYPES[name]
+    if cls is InfluxSink:
+        options.setdefault("url", influx_url)
+        options["token"] = influx_token
+    if schema and cls in (InfluxSink, FileSink, StdoutSink):
+        options.setdefault("schema", schema)
+    try:
+        return cls(**{**cls.defaults, **options})
+    except TypeError:
+        raise ValueError(f"{name} sink does not take {', '.join(sorted(options))}") from None
+
+
+class SinkPipeline:
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+
+    @classmethod
+    def from_specs(cls, specs, influx_url=None, influx_token=None, schema=None):
+        return cls(make_sink(spec, influx_url, influx_token, schema) for spec in specs)
+
+    @property
+    def needs_connection(self) -> bool:
+        """Whether devices have to connect to ThingsBoard (MQTT or HTTP) for some sink."""
+        return any(sink.needs_connection for sink in self.sinks)
+
+    def names(self):
+        """Sink labels; repeated types are numbered (``file``, ``file#2``)."""
+        labels, seen = [], {}
+        for sink in self.sinks:
+            seen[sink.name] = seen.get(sink.name, 0) + 1
+            labels.append(sink.name if seen[sink.name] == 1 else f"{sink.name}#{seen[sink.name]}")
+        return labels
+
+    async def start(self):
+        for sink in self.sinks:
+            await sink.start()
+
+    async def emit(self, sample):
+        for sink in self.sinks:
+            await sink.emit(sample)
+
+    async def close(self, timeout: float = 10.0) -> bool:
+        drained = True
+        for sink in self.sinks:
+            drained = await sink.close(timeout) and drained
+        return drained
+
+    def snapshot(self) -> dict:
+        return {label: sink.snapshot() for label, sink in zip(self.names(), self.sinks)}
@@ -1,10 +1,67 @@
-from unittest.mock import patch
+import asyncio
+import gzip
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from io import StringIO
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import skipUnless
+from unittest.mock import AsyncMock, patch
 
+import aiohttp
+import aiomqtt
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, override_settings
 from django.urls import reverse
 
-from devices.models import GatewayIOT
+from devices.benchmarking import percentiles
+from devices.db_executor import DatabaseExecutor
+from devices.fake_influx import FakeInfluxServer
+from devices.fake_mqtt_broker import FakeMqttBroker, topic_matches
+from devices.fake_thingsboard import FakeThingsBoardServer, FaultInjection, fake_device_token
+from devices.http_transport import HttpDeviceTransport
+from devices.influx_writer import SCHEMA_NARROW, InfluxBatchWriter
+from devices.management.commands import send_telemetry
+from devices.models import Device, DeviceType, GatewayIOT, System, Unit
+from devices.mqtt_qos import PublishWindow, QosPolicy, QosStats
+from devices.network_impairment import ImpairmentProfile, NetworkImpairment
+from devices.rpc_executor import OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST, KeyedRpcExecutor
+from devices.rpc_load import OperatorRpcClient, RpcTarget, run_rpc_load
+from devices.side_effects import AUDIT, METRICS, PERSISTENCE, SideEffectQueue
+from devices.sim_clock import REAL_CLOCK, ScaledClock, SteppedClock, make_clock
+from devices.state_store import DatabaseStateStore, MemoryStateStore, WriteBehindStateStore
+from devices.telemetry_schedule import (
+	HeartbeatPolicy,
+	RateMeter,
+	TelemetrySchedule,
+	TickScheduler,
+	parse_interval_overrides,
+	run_closed_loop,
+	run_open_loop,
+)
+from devices.telemetry_sinks import (
+	FileSink,
+	HttpSink,
+	NullSink,
+	Sink,
+	SinkPipeline,
+	TelemetrySample,
+	make_sink,
+	parse_sink_spec,
+	sample_lines,
+)
+from devices.thingsboard_deletions import ThingsBoardDeletionQueue
+from devices.thingsboard_sync import SyncItem, ThingsBoardSync
+from devices.trace_source import TraceRouter, TraceSample, line_protocol_samples, play_trace, read_trace
+from devices.traffic_recorder import RPC_REQUEST, RPC_RESPONSE, TELEMETRY, TrafficReader, TrafficRecorder, replay
+from devices.unit_physics import BACKEND_NUMPY, BACKEND_PYTHON, PhysicsParams, UnitPhysics, np
 
 
 class DashboardViewTests(TestCase):
@@ -117,3 +174,1804 @@ class GatewayIOTModelTests(TestCase):
 
 		self.assertFalse(first.is_active)
 		self.assertTrue(second.is_active)
+
+
+class NetworkImpairmentTests(SimpleTestCase):
+	CONFIG = {
+		'seed': 7,
+		'profiles': {
+			'lossy': {'loss': 1.0},
+			'slow': {'delay_ms': 20, 'jitter_ms': 5, 'distribution': 'uniform'},
+		},
+		'rules': [
+			{'match': {'unit': 'House 2'}, 'profile': 'lossy'},
+			{'match': {'device_id': 'House 1 - Room 1 *'}, 'uplink': 'slow'},
+		],
+	}
+
+	def test_rules_select_links_per_unit_and_direction(self):
+		impairment = NetworkImpairment.from_dict(self.CONFIG)
+		up, down = impairment.links_for('House 2 - Pump', unit='House 2')
+		self.assertEqual(up.profile.name, 'lossy')
+		self.assertEqual(down.profile.name, 'lossy')
+		up, down = impairment.links_for('House 1 - Room 1 - LightBulb', unit='House 1')
+		self.assertEqual(up.profile.name, 'slow')
+		self.assertIsNone(down)
+		self.assertEqual(impairment.links_for('House 1 - Pump', unit='House 1'), (None, None))
+
+	def test_default_profile_applies_to_unmatched_devices(self):
+		impairment = NetworkImpairment.from_dict(self.CONFIG, default_profile='slow')
+		up, down = impairment.links_for('House 9 - Pump', unit='House 9')
+		self.assertEqual(up.profile.name, 'slow')
+		self.assertEqual(down.profile.name, 'slow')
+
+	def test_invalid_profiles_are_rejected(self):
+		with self.assertRaises(ValueError):
+			ImpairmentProfile.from_dict({'loss': 2})
+		with self.assertRaises(ValueError):
+			ImpairmentProfile.from_dict({'distribution': 'cauchy'})
+		with self.assertRaises(ValueError):
+			NetworkImpairment.from_dict({'rules': [{'match': {}, 'profile': 'missing'}]})
+
+	def test_loss_drops_and_delay_defers_delivery(self):
+		impairment = NetworkImpairment.from_dict(self.CONFIG)
+		lossy, _ = impairment.links_for('x', unit='House 2')
+		slow, _ = impairment.links_for('House 1 - Room 1 - AC', unit='House 1')
+		delivered = []
+
+		async def deliver():
+			delivered.append(asyncio.get_running_loop().time())
+
+		async def scenario():
+			self.assertFalse(await lossy.send(deliver, 10))
+			start = asyncio.get_running_loop().time()
+			self.assertTrue(await slow.send(deliver, 10))
+			self.assertEqual(delivered, [])
+			await asyncio.sleep(0.05)
+			return start
+
+		start = asyncio.run(scenario())
+		self.assertEqual(len(delivered), 1)
+		self.assertGreaterEqual(delivered[0] - start, 0.014)
+		self.assertEqual(impairment.summary()['uplink']['dropped'], 1)
+		self.assertEqual(impairment.summary()['uplink']['delayed'], 1)
+
+	def test_rpc_response_reports_a_dropped_uplink(self):
+		lossy = NetworkImpairment.from_dict(self.CONFIG).links_for('House 2 - Led', unit='House 2')
+		device = SimpleNamespace(pk=1, token='tok', device_id='House 2 - Led', thingsboard_id=None)
+		publisher = send_telemetry.TelemetryPublisher(device, device_type_name='led', impairment_links=lossy)
+		publisher.mqtt_client = SimpleNamespace(publish=AsyncMock())
+		with patch('sys.stdout', new=StringIO()):
+			delivered = asyncio.run(publisher.publish_rpc_response('v1/devices/me/rpc/response/1', '{}'))
+		self.assertFalse(delivered)
+		publisher.mqtt_client.publish.assert_not_called()
+
+	def test_bandwidth_cap_serializes_messages(self):
+		profile = ImpairmentProfile.from_dict({'bandwidth_kbps': 8})
+		link = NetworkImpairment(default=profile).links_for('dev')[0]
+		delivered = []
+
+		async def deliver():
+			delivered.append(asyncio.get_running_loop().time())
+
+		async def scenario():
+			start = asyncio.get_running_loop().time()
+			await link.send(deliver, 10)
+			await link.send(deliver, 10)
+			await asyncio.sleep(0.05)
+			return start
+
+		start = asyncio.run(scenario())
+		# 10 bytes at 8 kbit/s = 10 ms each, queued back to back
+		self.assertAlmostEqual(delivered[0] - start, 0.01, delta=0.008)
+		self.assertAlmostEqual(delivered[1] - start, 0.02, delta=0.008)
+
+
+class TelemetryScheduleTests(SimpleTestCase):
+	def test_type_overrides_win_over_system_and_default(self):
+		policy = HeartbeatPolicy(5, by_type={'LED': 1}, by_system={'condo': 10})
+		self.assertEqual(policy.interval_for('led', 'Condo'), 1)
+		self.assertEqual(policy.interval_for('pump', 'condo'), 10)
+		self.assertEqual(policy.interval_for('pump', 'other'), 5)
+
+	def test_parse_interval_overrides(self):
+		self.assertEqual(
+			parse_interval_overrides(['led=0.5', '{"Pump": 30}']),
+			{'led': 0.5, 'pump': 30.0},
+		)
+		with self.assertRaises(ValueError):
+			parse_interval_overrides(['led'])
+		with self.assertRaises(ValueError):
+			parse_interval_overrides(['led=0'])
+
+	def test_heartbeat_settings_are_validated_by_send_telemetry(self):
+		with override_settings(HEARTBEAT_INTERVALS_BY_TYPE='{"Led": 2}', HEARTBEAT_INTERVALS_BY_SYSTEM={'Casa': 4}):
+			self.assertEqual(send_telemetry.interval_setting('HEARTBEAT_INTERVALS_BY_TYPE'), {'led': 2.0})
+			self.assertEqual(send_telemetry.interval_setting('HEARTBEAT_INTERVALS_BY_SYSTEM'), {'casa': 4.0})
+		for broken in ('{"led": 1', '{"led": null}', '[1]'):
+			with override_settings(HEARTBEAT_INTERVALS_BY_TYPE=broken):
+				with self.assertRaisesRegex(ValueError, 'HEARTBEAT_INTERVALS_BY_TYPE'):
+					send_telemetry.interval_setting('HEARTBEAT_INTERVALS_BY_TYPE')
+
+	def test_target_rate_scales_periods_and_keeps_ratios(self):
+		schedule = TelemetrySchedule(HeartbeatPolicy(5, by_type={'led': 1}), target_rate=200)
+		for i in range(100):
+			schedule.add(f'led-{i}', 'led')
+			schedule.add(f'pump-{i}', 'pump')
+		self.assertAlmostEqual(schedule.expected_rate(), 200)
+		self.assertAlmostEqual(schedule.period('pump-0') / schedule.period('led-0'), 5)
+
+	def test_open_loop_holds_rate_with_slow_sends(self):
+		meter = RateMeter(target_rate=100)
+
+		async def slow_send():
+			await asyncio.sleep(0.05)
+
+		async def scenario():
+			task = asyncio.ensure_future(run_open_loop(slow_send, lambda: 0.01, meter, max_inflight=10))
+			await asyncio.sleep(0.3)
+			task.cancel()
+
+		asyncio.run(scenario())
+		# a closed loop would manage ~5 sends in 0.3s; the open loop keeps ticking
+		self.assertGreater(meter.sent, 15)
+
+	def test_central_scheduler_ticks_every_device_from_one_task(self):
+		meter = RateMeter()
+		sent = {}
+
+		async def send(key):
+			sent[key] = sent.get(key, 0) + 1
+
+		async def scenario():
+			scheduler = TickScheduler(send, lambda key: 0.02 if key == 'fast' else 0.1, meter)
+			runner = asyncio.ensure_future(scheduler.run())
+			scheduler.add('fast')
+			scheduler.add('slow')
+			await asyncio.sleep(0.31)
+			runner.cancel()
+			return len(asyncio.all_tasks())
+
+		tasks_left = asyncio.run(scenario())
+		self.assertGreaterEqual(sent['fast'], 12)
+		self.assertIn(sent['slow'], (3, 4))
+		self.assertLessEqual(tasks_left, 3)
+
+	def test_central_scheduler_skips_ticks_and_closed_loop_waits_for_send(self):
+		async def scenario(closed_loop):
+			meter = RateMeter()
+
+			async def slow_send(key):
+				await asyncio.sleep(0.05)
+
+			scheduler = TickScheduler(slow_send, lambda key: 0.01, meter, max_inflight=1, closed_loop=closed_loop)
+			runner = asyncio.ensure_future(scheduler.run())
+			scheduler.add('dev', delay=0)
+			await asyncio.sleep(0.22)
+			runner.cancel()
+			return meter
+
+		open_loop = asyncio.run(scenario(False))
+		self.assertGreater(open_loop.skipped, 5)
+		closed = asyncio.run(scenario(True))
+		self.assertEqual(closed.skipped, 0)
+		self.assertIn(closed.sent, (3, 4))
+
+
+class StandInTests(SimpleTestCase):
+	def test_topic_matching(self):
+		self.assertTrue(topic_matches('v1/devices/me/rpc/request/+', 'v1/devices/me/rpc/request/7'))
+		self.assertTrue(topic_matches('operator/#', 'operator/tok/telemetry'))
+		self.assertFalse(topic_matches('v1/devices/me/rpc/request/+', 'v1/devices/me/rpc/request'))
+		self.assertFalse(topic_matches('a/+', 'a/b/c'))
+
+	def test_broker_routes_rpc_to_device_and_collects_response(self):
+		async def scenario():
+			async with FakeMqttBroker(allowed_tokens={'tok-1'}) as broker:
+				async with aiomqtt.Client('127.0.0.1', broker.port, username='tok-1') as client:
+					await client.subscribe('v1/devices/me/rpc/request/+')
+					await client.publish('v1/devices/me/telemetry', '{"status": true}')
+
+					async def responder():
+						async for msg in client.messages:
+							request_id = str(msg.topic).rsplit('/', 1)[-1]
+							body = json.loads(msg.payload)
+							await client.publish(f'v1/devices/me/rpc/response/{request_id}', json.dumps({'echo': body['method']}))
+							return
+
+					task = asyncio.ensure_future(responder())
+					payload, rtt = await broker.issue_rpc('tok-1', 'checkStatus', timeout=5)
+					await task
+					with self.assertRaises(LookupError):
+						await broker.issue_rpc('tok-2', 'checkStatus', timeout=1)
+					return json.loads(payload), rtt, broker.stats.as_dict()
+
+		payload, rtt, stats = asyncio.run(scenario())
+		self.assertEqual(payload, {'echo': 'checkStatus'})
+		self.assertGreater(rtt, 0)
+		self.assertEqual(stats['telemetry'], 1)
+		self.assertEqual(stats['rpc_responses'], 1)
+
+	def test_broker_rejects_unknown_tokens(self):
+		async def scenario():
+			async with FakeMqttBroker(allowed_tokens={'tok-1'}) as broker:
+				with self.assertRaises(aiomqtt.MqttError):
+					async with aiomqtt.Client('127.0.0.1', broker.port, username='nope', timeout=5):
+						pass
+
+		asyncio.run(scenario())
+
+	def test_fake_influx_counts_plain_and_gzip_lines(self):
+		async def scenario():
+			async with FakeInfluxServer() as influx:
+				url = f'http://127.0.0.1:{influx.port}/api/v2/write'
+				async with aiohttp.ClientSession() as session:
+					async with session.post(url, data='m,a=1 v=1 1\nm,a=2 v=2 2') as resp:
+						self.assertEqual(resp.status, 204)
+					body = gzip.compress(b'other v=1 1')
+					async with session.post(url, data=body, headers={'Content-Encoding': 'gzip'}) as resp:
+						self.assertEqual(resp.status, 204)
+				return influx.stats.as_dict()
+
+		stats = asyncio.run(scenario())
+		self.assertEqual(stats['lines'], 3)
+		self.assertEqual(stats['by_measurement'], {'m': 2, 'other': 1})
+
+	def test_percentiles(self):
+		result = percentiles([0.001 * i for i in range(1, 101)])
+		self.assertEqual(result['p50_ms'], 50.0)
+		self.assertEqual(result['p99_ms'], 99.0)
+		self.assertEqual(result['max_ms'], 100.0)
+
+
+class StartupTests(SimpleTestCase):
+	def test_runtime_command_skips_system_checks(self):
+		self.assertEqual(send_telemetry.Command.requires_system_checks, [])
+
+	def test_network_libraries_are_not_imported_with_the_command(self):
+		code = (
+			'import sys, django; django.setup(); '
+			'import devices.management.commands.send_telemetry; '
+			'print(sorted(m for m in ("aiohttp", "aiomqtt") if m in sys.modules))'
+		)
+		out = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, capture_output=True, text=True)
+		self.assertEqual(out.returncode, 0, out.stderr)
+		self.assertEqual(out.stdout.strip(), '[]')
+
+	def test_startup_profile_reports_phases(self):
+		profile = send_telemetry.StartupProfile(enabled=True)
+		profile.mark('gateway')
+		profile.mark('fleet_query')
+		with patch('sys.stdout', new=StringIO()) as out:
+			profile.report(devices=3)
+		line = out.getvalue().strip()
+		self.assertTrue(line.startswith('[startup] '))
+		phases = json.loads(line[len('[startup] '):])
+		self.assertEqual(phases['devices'], 3)
+		for key in ('gateway', 'fleet_query', 'handle_total', 'module_to_handle'):
+			self.assertIn(key, phases)
+
+
+class FakeThingsBoardTests(SimpleTestCase):
+	def _call(self, faults, calls):
+		async def scenario():
+			async with FakeThingsBoardServer(faults=faults) as tb:
+				async with aiohttp.ClientSession(base_url=tb.base_url) as session:
+					async with session.post('/api/auth/login', json={'username': tb.username, 'password': tb.password}) as resp:
+						headers = {'X-Authorization': f"Bearer {(await resp.json())['token']}"}
+					results = []
+					for method, path, body in calls:
+						async with session.request(method, path, json=body, headers=headers) as resp:
+							results.append((resp.status, await resp.json(content_type=None)))
+					return results, tb.stats.as_dict()
+
+		return asyncio.run(scenario())
+
+	def test_injected_conflict_still_creates_the_device(self):
+		results, stats = self._call(FaultInjection(conflict_rate=1.0), [
+			('POST', '/api/device', {'name': 'House 1 - Led', 'type': 'led'}),
+			('GET', '/api/tenant/devices?deviceName=House 1 - Led', None),
+		])
+		self.assertEqual(results[0][0], 400)
+		self.assertIn('already exists', results[0][1]['message'])
+		self.assertEqual(results[1][0], 200)
+		self.assertEqual(results[1][1]['name'], 'House 1 - Led')
+		self.assertEqual(stats['injected_conflicts'], 1)
+
+	def test_error_rate_spares_login(self):
+		results, stats = self._call(FaultInjection(error_rate=1.0), [
+			('GET', '/api/auth/user', None),
+		])
+		self.assertEqual(results[0][0], 503)
+		self.assertEqual(stats['injected_errors'], 1)
+
+	def test_rates_are_validated(self):
+		with self.assertRaises(ValueError):
+			FaultInjection(error_rate=1.5)
+		with self.assertRaises(ValueError):
+			FaultInjection(latency_ms=-1)
+
+
+class RpcLoadTests(SimpleTestCase):
+	def test_targets_only_get_methods_their_type_answers(self):
+		target = RpcTarget.for_device('tok', 'Led', methods={'switchLed', 'setTemperature'})
+		self.assertEqual(target.methods, ('switchLed',))
+		self.assertIsNone(RpcTarget.for_device('tok', 'gas sensor'))
+		self.assertIsNone(RpcTarget.for_device('', 'led'))
+		method, params = RpcTarget.for_device('tok', 'airconditioner', methods={'setTemperature'}).next_call(random.Random(1))
+		self.assertEqual(method, 'setTemperature')
+		self.assertTrue(16.0 <= params <= 30.0)
+
+	def test_load_through_operator_bridge(self):
+		async def device(port, token, ready):
+			async with aiomqtt.Client('127.0.0.1', port, username=token) as client:
+				await client.subscribe('v1/devices/me/rpc/request/+')
+				ready.set()
+				async for msg in client.messages:
+					request_id = str(msg.topic).rsplit('/', 1)[-1]
+					await client.publish(f'v1/devices/me/rpc/response/{request_id}', msg.payload)
+
+		async def scenario():
+			async with FakeMqttBroker(allowed_tokens={'tok-a', 'tok-b'}) as broker:
+				ready = [asyncio.Event(), asyncio.Event()]
+				devices = [
+					asyncio.ensure_future(device(broker.port, 'tok-a', ready[0])),
+					asyncio.ensure_future(device(broker.port, 'tok-b', ready[1])),
+				]
+				await asyncio.gather(*(event.wait() for event in ready))
+				targets = [RpcTarget.for_device('tok-a', 'led'), RpcTarget.for_device('tok-b', 'pump')]
+				async with OperatorRpcClient('127.0.0.1', broker.port) as client:
+					stats = await run_rpc_load(client.issue, targets, concurrency=3, count=30, timeout=5)
+				for task in devices:
+					task.cancel()
+				await asyncio.gather(*devices, return_exceptions=True)
+				return stats.summary()
+
+		summary = asyncio.run(scenario())
+		self.assertEqual(summary['all']['sent'], 30)
+		self.assertEqual(summary['all']['ok'], 30)
+		self.assertEqual(summary['type:led']['ok'] + summary['type:pump']['ok'], 30)
+		self.assertIn('method:checkStatus', summary)
+
+
+class RpcInfluxBatchTests(SimpleTestCase):
+	def _publisher(self):
+		device = SimpleNamespace(pk=1, token='tok-led', device_id='House 1 - Led', thingsboard_id='tb-led')
+		publisher = send_telemetry.TelemetryPublisher(device, session=object(), device_type_name='led')
+		publisher.mqtt_client = SimpleNamespace(publish=AsyncMock())
+		return publisher
+
+	def _rpc(self, publisher, method, params=None, request_id=7):
+		msg = SimpleNamespace(
+			topic=f'v1/devices/me/rpc/request/{request_id}',
+			payload=json.dumps({'method': method, 'params': params}).encode(),
+		)
+		with patch.object(send_telemetry, 'post_to_influx', new=AsyncMock()) as post, \
+				patch.dict(os.environ, {'M2S_SIMULATOR_FAST_MODE': '1'}):
+			async def scenario():
+				await publisher.on_message(msg)
+				await asyncio.sleep(0)
+			with patch('sys.stdout', new=StringIO()):
+				asyncio.run(scenario())
+		return post
+
+	def test_one_influx_write_per_rpc_with_every_measurement(self):
+		publisher = self._publisher()
+		post = self._rpc(publisher, 'switchLed', True)
+		self.assertEqual(post.await_count, 1)
+		lines = post.await_args.args[1].split('\n')
+		self.assertEqual(len(lines), 4)
+		self.assertTrue(lines[0].startswith('latency_measurement,'))
+		self.assertIn('source=simulator_response', lines[-1])
+
+	def test_switch_led_publishes_a_single_response(self):
+		publisher = self._publisher()
+		self._rpc(publisher, 'switchLed', True, request_id=9)
+		topics = [c.args[0] for c in publisher.mqtt_client.publish.await_args_list]
+		self.assertEqual(topics.count('v1/devices/me/rpc/response/9'), 1)
+		self.assertEqual(topics.count('v1/devices/me/telemetry'), 1)
+
+	def test_measurement_selection(self):
+		self.assertEqual(send_telemetry.parse_rpc_influx_measurements('latency, response'), {'latency', 'response'})
+		self.assertEqual(send_telemetry.parse_rpc_influx_measurements('none'), frozenset())
+		self.assertEqual(len(send_telemetry.parse_rpc_influx_measurements('')), 4)
+		with self.assertRaises(ValueError):
+			send_telemetry.parse_rpc_influx_measurements('latency,bogus')
+		batch = send_telemetry.RpcInfluxBatch(session=None, measurements={'response'})
+		batch.add('latency', 'a v=1')
+		batch.add('response', 'b v=1')
+		self.assertEqual(batch.lines, ['b v=1'])
+		batch.flush()
+		self.assertFalse(batch.add('response', 'c v=1'))
+
+
+class SideEffectQueueTests(SimpleTestCase):
+	def test_priority_and_per_kind_limits(self):
+		async def scenario():
+			queue = SideEffectQueue({METRICS: 1, PERSISTENCE: 1, AUDIT: 1}, max_concurrency=1)
+			order = []
+			gate = asyncio.Event()
+
+			def effect(name):
+				async def run():
+					order.append(name)
+					await gate.wait()
+				return run
+
+			queue.submit(AUDIT, effect('audit'))  # takes the only slot right away
+			queue.submit(AUDIT, effect('audit-2'))
+			queue.submit(PERSISTENCE, effect('persist'))
+			queue.submit(METRICS, effect('metrics'))
+			await asyncio.sleep(0)
+			self.assertEqual(queue.running, 1)
+			gate.set()
+			self.assertTrue(await queue.drain(timeout=1))
+			return order
+
+		self.assertEqual(asyncio.run(scenario()), ['audit', 'metrics', 'persist', 'audit-2'])
+
+	def test_keyed_effects_coalesce_and_never_overlap(self):
+		async def scenario():
+			queue = SideEffectQueue({PERSISTENCE: 4})
+			active, seen, overlap = set(), [], []
+
+			def write(value):
+				async def run():
+					if 'pk-1' in active:
+						overlap.append(value)
+					active.add('pk-1')
+					await asyncio.sleep(0.01)
+					seen.append(value)
+					active.discard('pk-1')
+				return run
+
+			queue.submit(PERSISTENCE, write(1), key=1)
+			await asyncio.sleep(0)  # 1 is running
+			queue.submit(PERSISTENCE, write(2), key=1)
+			queue.submit(PERSISTENCE, write(3), key=1)  # replaces 2 while it waits
+			await queue.drain(timeout=1)
+			return seen, overlap, queue.stats[PERSISTENCE].as_dict()
+
+		seen, overlap, stats = asyncio.run(scenario())
+		self.assertEqual(seen, [1, 3])
+		self.assertEqual(overlap, [])
+		self.assertEqual(stats['coalesced'], 1)
+
+	def test_overflow_drops_metrics_but_not_persistence(self):
+		async def scenario():
+			queue = SideEffectQueue({METRICS: 1, PERSISTENCE: 1}, max_concurrency=1, max_pending=1)
+			gate = asyncio.Event()
+			queue.submit(AUDIT, gate.wait)
+			accepted = [
+				queue.submit(METRICS, gate.wait),
+				queue.submit(METRICS, gate.wait),
+				queue.submit(PERSISTENCE, gate.wait, key='pk'),
+			]
+			gate.set()
+			await queue.drain(timeout=1)
+			return accepted, queue.snapshot()
+
+		accepted, snapshot = asyncio.run(scenario())
+		self.assertEqual(accepted, [True, False, True])
+		self.assertEqual(snapshot[METRICS]['dropped'], 1)
+		self.assertEqual(snapshot[PERSISTENCE]['done'], 1)
+
+	def test_failures_are_counted_not_raised(self):
+		async def boom():
+			raise RuntimeError('influx down')
+
+		async def scenario():
+			queue = SideEffectQueue()
+			queue.submit(METRICS, boom)
+			await queue.drain(timeout=1)
+			return queue.stats[METRICS].failed
+
+		with patch('sys.stdout', new=StringIO()):
+			self.assertEqual(asyncio.run(scenario()), 1)
+
+
+class KeyedRpcExecutorTests(SimpleTestCase):
+	def test_same_device_in_order_other_devices_in_parallel(self):
+		async def scenario():
+			executor = KeyedRpcExecutor(max_concurrency=2)
+			log, running, peak = [], set(), []
+
+			def rpc(key, n):
+				async def run():
+					running.add((key, n))
+					peak.append(len(running))
+					await asyncio.sleep(0.01)
+					log.append((key, n))
+					running.discard((key, n))
+				return run
+
+			for n in range(3):
+				for key in ('a', 'b', 'c'):
+					await executor.submit(key, rpc(key, n))
+			self.assertTrue(await executor.drain(timeout=2))
+			return log, max(peak), executor.snapshot()
+
+		log, peak, snapshot = asyncio.run(scenario())
+		for key in ('a', 'b', 'c'):
+			self.assertEqual([n for k, n in log if k == key], [0, 1, 2])
+		self.assertEqual(peak, 2)
+		self.assertEqual(snapshot['completed'], 9)
+		self.assertEqual(snapshot['queued'], 0)
+
+	def test_busy_device_does_not_starve_others(self):
+		async def scenario():
+			executor = KeyedRpcExecutor(max_concurrency=1)
+			log = []
+
+			def rpc(key):
+				async def run():
+					log.append(key)
+				return run
+
+			gate = asyncio.Event()
+			await executor.submit('hot', gate.wait)
+			for _ in range(3):
+				await executor.submit('hot', rpc('hot'))
+			await executor.submit('cold', rpc('cold'))
+			await executor.submit('cold', rpc('cold'))
+			gate.set()
+			await executor.drain(timeout=1)
+			return log
+
+		self.assertEqual(asyncio.run(scenario()), ['cold', 'hot', 'cold', 'hot', 'hot'])
+
+	def test_drop_newest_and_drop_oldest(self):
+		async def scenario(policy):
+			executor = KeyedRpcExecutor(max_concurrency=1, max_queue_per_key=2, overflow=policy)
+			gate = asyncio.Event()
+			seen = []
+
+			def rpc(n):
+				async def run():
+					seen.append(n)
+				return run
+
+			await executor.submit('dev', gate.wait)  # running
+			accepted = [await executor.submit('dev', rpc(n)) for n in range(4)]
+			gate.set()
+			await executor.drain(timeout=1)
+			return accepted, seen, executor.dropped
+
+		self.assertEqual(asyncio.run(scenario(OVERFLOW_DROP_NEWEST)), ([True, True, False, False], [0, 1], 2))
+		self.assertEqual(asyncio.run(scenario(OVERFLOW_DROP_OLDEST)), ([True, True, True, True], [2, 3], 2))
+
+	def test_block_waits_for_room(self):
+		async def scenario():
+			executor = KeyedRpcExecutor(max_concurrency=1, max_queue_per_key=1)
+			gate = asyncio.Event()
+			await executor.submit('dev', gate.wait)
+			await executor.submit('dev', gate.wait)
+			blocked = asyncio.create_task(executor.submit('dev', gate.wait))
+			await asyncio.sleep(0.01)
+			self.assertFalse(blocked.done())
+			gate.set()
+			self.assertTrue(await asyncio.wait_for(blocked, 1))
+			await executor.drain(timeout=1)
+			return executor.snapshot()
+
+		snapshot = asyncio.run(scenario())
+		self.assertEqual(snapshot['blocked'], 1)
+		self.assertEqual(snapshot['completed'], 3)
+
+	def test_publisher_hands_rpcs_to_executor(self):
+		async def scenario():
+			executor = KeyedRpcExecutor()
+			publisher = SimpleNamespace(device_id='dev-1', rpc_executor=executor, on_message=AsyncMock())
+			await send_telemetry.TelemetryPublisher._dispatch_rpc(publisher, 'msg')
+			await executor.drain(timeout=1)
+			return publisher.on_message, executor.completed
+
+		on_message, completed = asyncio.run(scenario())
+		on_message.assert_awaited_once_with('msg')
+		self.assertEqual(completed, 1)
+
+
+class StateStoreTests(SimpleTestCase):
+	def test_memory_store_returns_copies_and_keeps_loaded_state(self):
+		async def scenario():
+			store = MemoryStateStore(persist_on_close=False)
+			store.load(1, {'status': True})
+			state = await store.get(1)
+			state['status'] = False  # not written back
+			store.load(1, {'status': None})  # already known: ignored
+			return await store.get(1), await store.get(2), store.snapshot()
+
+		state, missing, snapshot = asyncio.run(scenario())
+		self.assertEqual(state, {'status': True})
+		self.assertEqual(missing, {})
+		self.assertEqual(snapshot['backend'], 'memory')
+		self.assertEqual(snapshot['read']['count'], 3)
+
+	def test_write_behind_flushes_only_changed_states(self):
+		written = []
+
+		async def scenario():
+			store = WriteBehindStateStore(flush_interval=60)
+			store.load(1, {'status': False})
+			store.load(2, {'status': False})
+			await store.set(1, {'status': True})
+			await store.set(1, {'status': False})
+			first = await store.flush()
+			second = await store.flush()
+			await store.set(2, {'status': True})
+			await store.close()
+			return first, second, store.snapshot()
+
+		with patch('devices.state_store.write_device_states', side_effect=lambda states: written.append(dict(states))):
+			first, second, snapshot = asyncio.run(scenario())
+		self.assertEqual((first, second), (1, 0))
+		self.assertEqual(written, [{1: {'status': False}}, {2: {'status': True}}])
+		self.assertEqual(snapshot['flushed'], 2)
+		self.assertEqual(snapshot['flush']['count'], 2)
+
+	def test_db_store_reads_pending_state_until_persisted(self):
+		rows = {1: {'status': False}}
+
+		async def scenario():
+			queue = SideEffectQueue()
+			store = DatabaseStateStore(side_effects=queue)
+			before = await store.get(1)
+			await store.set(1, {'status': True})  # starts writing right away
+			await store.set(1, {'status': False})
+			await store.set(1, {'status': None})  # replaces the write still waiting
+			pending = await store.get(1)
+			await queue.drain(timeout=1)
+			return before, pending, store.snapshot(), queue.stats[PERSISTENCE].as_dict()
+
+		with patch('devices.state_store.read_device_state', side_effect=rows.get), \
+				patch('devices.state_store.write_device_state', side_effect=rows.__setitem__):
+			before, pending, snapshot, persistence = asyncio.run(scenario())
+		self.assertEqual(before, {'status': False})
+		self.assertEqual(pending, {'status': None})
+		self.assertEqual(rows[1], {'status': None})
+		self.assertEqual(snapshot['unpersisted'], 0)
+		self.assertEqual(persistence['coalesced'], 1)
+
+	def test_every_device_type_uses_the_store(self):
+		store = MemoryStateStore(persist_on_close=False)
+		store.load(3, {'status': False})
+		device = SimpleNamespace(pk=3, token='tok-pump', device_id='House 1 - Pump', thingsboard_id='tb-pump')
+		publisher = send_telemetry.TelemetryPublisher(device, session=None, state_store=store, device_type_name='pump')
+		publisher.mqtt_client = SimpleNamespace(publish=AsyncMock())
+		msg = SimpleNamespace(topic='v1/devices/me/rpc/request/1', payload=json.dumps({'method': 'switchPump', 'params': True}).encode())
+
+		async def scenario():
+			await publisher.on_message(msg)
+			return await store.get(3)
+
+		with patch.object(send_telemetry.Device.objects, 'get', side_effect=AssertionError('DB read')), \
+				patch.dict(os.environ, {'M2S_SIMULATOR_FAST_MODE': '1'}), patch('sys.stdout', new=StringIO()):
+			state = asyncio.run(scenario())
+		self.assertEqual(state, {'status': True})
+		publisher.mqtt_client.publish.assert_any_await('v1/devices/me/rpc/response/1', json.dumps({'status': True}))
+
+
+class DatabaseExecutorTests(SimpleTestCase):
+	def test_writer_merges_queued_states_into_one_transaction(self):
+		import threading
+		batches, release = [], threading.Event()
+
+		def commit(states):
+			batches.append(dict(states))
+			if len(batches) == 1:
+				release.wait(2)  # hold the first transaction while more updates queue up
+
+		async def scenario():
+			executor = DatabaseExecutor(readers=1, max_batch=10)
+			await executor.start()
+			first = executor.submit_state(1, {'status': True})
+			await asyncio.sleep(0.05)
+			later = [executor.submit_state(pk, {'n': n}) for n, pk in enumerate([2, 3, 2])]
+			release.set()
+			results = await asyncio.gather(first, *later)
+			snapshot = executor.snapshot()
+			await executor.close()
+			return results, snapshot
+
+		with patch.object(DatabaseExecutor, '_commit', side_effect=commit), \
+				patch('devices.db_executor.connections'):
+			results, snapshot = asyncio.run(scenario())
+		self.assertEqual(batches, [{1: {'status': True}}, {2: {'n': 2}, 3: {'n': 1}}])
+		self.assertEqual(results, [True] * 4)
+		self.assertEqual((snapshot['transactions'], snapshot['states_written'], snapshot['merged']), (2, 3, 1))
+		self.assertEqual(snapshot['max_transaction'], 2)
+
+	def test_failed_transaction_resolves_false_and_reads_run_on_pool(self):
+		import threading
+
+		async def scenario():
+			executor = DatabaseExecutor(readers=2)
+			await executor.start()
+			thread = await executor.read(lambda: threading.current_thread().name)
+			ok = await executor.submit_state(1, {})
+			snapshot = executor.snapshot()
+			await executor.close()
+			return thread, ok, snapshot
+
+		with patch.object(DatabaseExecutor, '_commit', side_effect=RuntimeError('disk I/O error')), \
+				patch('devices.db_executor.connections'), patch('sys.stdout', new=StringIO()):
+			thread, ok, snapshot = asyncio.run(scenario())
+		self.assertTrue(thread.startswith('db-read'))
+		self.assertFalse(ok)
+		self.assertEqual(snapshot['failed'], 1)
+		self.assertEqual(snapshot['read']['count'], 1)
+
+	def test_db_store_keeps_pending_state_until_the_writer_commits(self):
+		async def scenario():
+			executor = DatabaseExecutor(readers=1)
+			await executor.start()
+			store = DatabaseStateStore(db_executor=executor)
+			await store.set(7, {'status': True})
+			pending = store.snapshot()['unpersisted']
+			await executor.flush(timeout=1)
+			await asyncio.sleep(0)  # done callbacks
+			committed = store.snapshot()['unpersisted']
+			await executor.close()
+			return pending, committed
+
+		with patch.object(DatabaseExecutor, '_commit'), patch('devices.db_executor.connections'):
+			self.assertEqual(asyncio.run(scenario()), (1, 0))
+
+	def test_db_store_submits_a_failed_state_again(self):
+		async def scenario():
+			executor = DatabaseExecutor(readers=1)
+			await executor.start()
+			store = DatabaseStateStore(db_executor=executor)
+			await store.set(7, {'status': True})
+			for _ in range(60):
+				await asyncio.sleep(0.05)
+				if not store.snapshot()['unpersisted']:
+					break
+			snapshot = store.snapshot()
+			await executor.close()
+			return snapshot
+
+		commits = []
+
+		def commit(states):
+			commits.append(dict(states))
+			if len(commits) == 1:
+				raise RuntimeError('database is locked')
+
+		with patch.object(DatabaseExecutor, '_commit', side_effect=commit), \
+				patch('devices.db_executor.connections'), patch('sys.stdout', new=StringIO()):
+			snapshot = asyncio.run(scenario())
+		self.assertEqual(commits, [{7: {'status': True}}] * 2)
+		self.assertEqual((snapshot['unpersisted'], snapshot['failed_writes']), (0, 1))
+
+	def test_only_executor_connections_use_wal_and_immediate_transactions(self):
+		from django.db import connections
+
+		async def scenario():
+			executor = DatabaseExecutor(readers=1)
+			await executor.start()
+			options = await executor.read(lambda: dict(connections['default'].settings_dict['OPTIONS']))
+			await executor.close()
+			return options
+
+		options = asyncio.run(scenario())
+		self.assertEqual(options['transaction_mode'], 'IMMEDIATE')
+		self.assertIn('journal_mode=WAL', options['init_command'])
+		self.assertNotIn('transaction_mode', connections['default'].settings_dict['OPTIONS'])
+
+
+class TrafficRecorderTests(SimpleTestCase):
+	def setUp(self):
+		handle, self.path = tempfile.mkstemp(suffix='.rec')
+		os.close(handle)
+		self.addCleanup(os.remove, self.path)
+
+	def test_round_trip_defines_each_token_once_and_ignores_a_truncated_tail(self):
+		recorder = TrafficRecorder(self.path, flush_bytes=64)
+		recorder.record(TELEMETRY, 'tok-a', 'v1/devices/me/telemetry', '{"status": true}')
+		recorder.record(RPC_REQUEST, 'tok-b', 'v1/devices/me/rpc/request/7', b'{"method": "checkStatus"}')
+		recorder.record(RPC_RESPONSE, 'tok-b', 'v1/devices/me/rpc/response/7', '{"status": false}')
+		recorder.record(TELEMETRY, 'tok-a', 'v1/devices/me/telemetry', '{"status": false}')
+		recorder.close()
+		self.assertEqual(recorder.snapshot(), {'records': 4, 'devices': 2, 'bytes': os.path.getsize(self.path)})
+		with open(self.path, 'ab') as f:
+			f.write(b'\x01partial')  # interrupted mid-record
+
+		with TrafficReader(self.path) as reader:
+			events = list(reader)
+			self.assertEqual(reader.tokens(), ['tok-a', 'tok-b'])
+			self.assertEqual(reader.summary()['rpc_request'], 1)
+		self.assertEqual([(e.kind, e.token, e.topic) for e in events], [
+			(TELEMETRY, 'tok-a', 'v1/devices/me/telemetry'),
+			(RPC_REQUEST, 'tok-b', 'v1/devices/me/rpc/request/7'),
+			(RPC_RESPONSE, 'tok-b', 'v1/devices/me/rpc/response/7'),
+			(TELEMETRY, 'tok-a', 'v1/devices/me/telemetry'),
+		])
+		self.assertEqual(events[3].payload, b'{"status": false}')
+		self.assertTrue(all(a.at <= b.at for a, b in zip(events, events[1:])))
+
+	def test_rejects_files_that_are_not_recordings(self):
+		with open(self.path, 'wb') as f:
+			f.write(b'{"not": "a recording"}')
+		with self.assertRaises(ValueError):
+			TrafficReader(self.path)
+
+	def test_replay_keeps_spacing_scaled_by_speed_and_skips_rpc_requests(self):
+		Event = SimpleNamespace
+		events = [Event(kind=TELEMETRY, at=0.0, token='a', topic='t', payload=b'1'),
+				Event(kind=RPC_REQUEST, at=0.1, token='a', topic='r', payload=b'2'),
+				Event(kind=RPC_RESPONSE, at=0.2, token='a', topic='s', payload=b'3')]
+		sent = []
+
+		async def scenario(speed):
+			loop = asyncio.get_running_loop()
+			started = loop.time()
+
+			async def publish(token, topic, payload):
+				sent.append((topic, round(loop.time() - started, 2)))
+
+			return await replay(events, publish, speed=speed)
+
+		result = asyncio.run(scenario(2.0))
+		self.assertEqual([topic for topic, _ in sent], ['t', 's'])
+		self.assertAlmostEqual(sent[1][1], 0.1, delta=0.03)
+		self.assertEqual((result['sent'], result['skipped'], result['failed']), (2, 1, 0))
+
+	def test_publisher_records_telemetry_and_rpc_responses(self):
+		publisher = send_telemetry.TelemetryPublisher(SimpleNamespace(
+			pk=1, token='tok', device_id='house - led 1', thingsboard_id='tb-1', state={}, device_type=None,
+		), device_type_name='led')
+		publisher.mqtt_client = AsyncMock()
+		recorder = TrafficRecorder(self.path)
+
+		async def scenario():
+			await publisher._publish_telemetry('{"status": true}')
+			await publisher._publish_rpc_response('v1/devices/me/rpc/response/3', '{"status": true}')
+
+		with patch.object(send_telemetry, 'TRAFFIC_RECORDER', recorder), \
+				patch.object(send_telemetry.TelemetryPublisher, '_record_rpc_response', AsyncMock()), \
+				patch('sys.stdout', new=StringIO()):
+			asyncio.run(scenario())
+		recorder.close()
+		with TrafficReader(self.path) as reader:
+			self.assertEqual([(e.kind, e.token) for e in reader], [(TELEMETRY, 'tok'), (RPC_RESPONSE, 'tok')])
+
+
+class TraceSourceTests(SimpleTestCase):
+	def _write(self, suffix, text, compress=False):
+		handle, path = tempfile.mkstemp(suffix=suffix)
+		os.close(handle)
+		self.addCleanup(os.remove, path)
+		with (gzip.open(path, 'wt') if compress else open(path, 'w')) as f:
+			f.write(text)
+		return path
+
+	def test_csv_rows_become_samples_lazily(self):
+		path = self._write('.csv.gz', (
+			'timestamp,device_id,temperature,status,note\n'
+			'2024-01-01T00:00:00Z,house - ac 1,21.5,true,\n'
+			'1704067205000,house - ac 1,22,false,door open\n'
+		), compress=True)
+		samples = read_trace(path)
+		self.assertFalse(isinstance(samples, list))
+		first, second = list(samples)
+		self.assertEqual(first, TraceSample(1704067200.0, 'house - ac 1', {'temperature': 21.5, 'status': True}))
+		self.assertEqual(second.ts, 1704067205.0)  # epoch milliseconds
+		self.assertEqual(second.values, {'temperature': 22, 'status': False, 'note': 'door open'})
+
+	def test_csv_without_a_key_column_is_rejected(self):
+		path = self._write('.csv', 'time,temperature\n0,20\n')
+		with self.assertRaises(ValueError):
+			next(iter(read_trace(path)))
+
+	def test_line_protocol_tags_fields_and_escapes(self):
+		lines = [
+			'# comment',
+			'weather,unit=House\\ 1,site=a temperature=20.5,humidity=61i,status=t,label="a, b" 1704067200000000000',
+			'weather,site=a temperature=1 1704067201000000000',  # no key tag
+		]
+		self.assertEqual(list(line_protocol_samples(lines)), [
+			TraceSample(1704067200.0, 'House 1', {'temperature': 20.5, 'humidity': 61, 'status': True, 'label': 'a, b'}),
+		])
+
+	def test_unit_rows_fan_out_to_the_fields_each_device_reports(self):
+		router = TraceRouter(send_telemetry.telemetry_properties)
+		router.add('h1 - led', 'House 1', 'led')
+		router.add('h1 - ac', 'House 1', 'airconditioner')
+		router.add('h2 - led', 'House 2', 'led')
+		routed = router.route(TraceSample(0, 'house 1', {'status': True, 'temperature': 23}))
+		self.assertEqual(routed, [('h1 - led', {'status': True}), ('h1 - ac', {'status': True, 'temperature': 23})])
+		self.assertEqual(router.route(TraceSample(0, 'h2 - led', {'x': 1})), [('h2 - led', {'x': 1})])
+		self.assertEqual(router.route(TraceSample(0, 'House 9', {'status': True})), [])
+		self.assertEqual(router.unmatched, {'House 9': 1})
+
+	def test_play_trace_scales_time_and_keeps_each_device_in_order(self):
+		router = TraceRouter()
+		router.add('a')
+		router.add('b')
+		samples = [TraceSample(100.0, 'a', {'n': 1}), TraceSample(100.0, 'a', {'n': 2}),
+				TraceSample(100.0, 'b', {'n': 3}), TraceSample(110.0, 'a', {'n': 4}), TraceSample(110.0, 'zz', {'n': 5})]
+		delivered = []
+
+		async def scenario():
+			loop = asyncio.get_running_loop()
+			started = loop.time()
+
+			async def deliver(device_id, values):
+				if values['n'] == 1:
+					await asyncio.sleep(0.02)  # a slow first publish must not let n=2 overtake it
+				delivered.append((device_id, values['n'], loop.time() - started))
+
+			return await play_trace(iter(samples), router, deliver, speed=100)
+
+		result = asyncio.run(scenario())
+		self.assertEqual([n for device_id, n, _ in delivered if device_id == 'a'], [1, 2, 4])
+		self.assertAlmostEqual(delivered[-1][2], 0.1, delta=0.05)  # 10 trace seconds at speed 100
+		self.assertEqual((result['samples'], result['sent'], result['unrouted']), (5, 4, 1))
+
+	def test_trace_sample_updates_state_and_publishes_only_its_fields(self):
+		store = MemoryStateStore(persist_on_close=False)
+		store.load(1, {'status': False, 'temperature': 20})
+		publisher = send_telemetry.TelemetryPublisher(SimpleNamespace(
+			pk=1, token='tok', device_id='house - ac', thingsboard_id='tb-1', state={}, device_type=None,
+		), state_store=store, device_type_name='airconditioner')
+		publisher.mqtt_client = AsyncMock()
+
+		async def scenario():
+			await publisher.send_trace_sample({'temperature': 24.5})
+			return await store.get(1)
+
+		with patch('sys.stdout', new=StringIO()):
+			state = asyncio.run(scenario())
+		self.assertEqual(state, {'status': False, 'temperature': 24.5})
+		payload = json.loads(publisher.mqtt_client.publish.call_args.args[1])
+		self.assertEqual(payload['temperature'], 24.5)
+		self.assertNotIn('status', payload)
+
+
+class SimClockTests(SimpleTestCase):
+	def test_make_clock_picks_the_clock_for_the_scale(self):
+		self.assertIs(make_clock(1), REAL_CLOCK)
+		self.assertIsInstance(make_clock(60), ScaledClock)
+		self.assertIsInstance(make_clock(0), SteppedClock)
+		with self.assertRaises(ValueError):
+			make_clock(-1)
+
+	def test_scaled_clock_sleeps_and_advances_faster_than_wall_time(self):
+		clock = ScaledClock(100, start=1000.0)
+
+		async def scenario():
+			loop = asyncio.get_running_loop()
+			started = loop.time()
+			await clock.sleep(5)  # 50 ms of wall time
+			return loop.time() - started, clock.time()
+
+		wall, now = asyncio.run(scenario())
+		self.assertAlmostEqual(wall, 0.05, delta=0.04)
+		self.assertGreaterEqual(now, 1005.0)
+
+	def test_stepped_clock_runs_a_day_of_closed_loop_ticks_without_waiting(self):
+		clock = SteppedClock(start=0.0)
+		meter = RateMeter()
+		stamps = []
+
+		async def send():
+			stamps.append(clock.timestamp_ms())
+
+		async def scenario():
+			await clock.start()
+			loops = [asyncio.create_task(run_closed_loop(send, lambda: 60.0, meter, clock=clock)) for _ in range(3)]
+			while clock.monotonic() < 86400:
+				await asyncio.sleep(0.001)
+			for task in loops:
+				task.cancel()
+			await asyncio.gather(*loops, return_exceptions=True)
+			await clock.close()
+
+		started = time.monotonic()
+		asyncio.run(scenario())
+		self.assertLess(time.monotonic() - started, 5)
+		self.assertGreaterEqual(meter.sent, 3 * 1440)
+		self.assertEqual(stamps, sorted(stamps))
+		self.assertEqual(stamps[3] - stamps[0], 60000)  # each device ticks every simulated minute
+
+	def test_central_scheduler_follows_a_stepped_clock(self):
+		clock = SteppedClock(start=0.0)
+		fired = []
+
+		async def send(key):
+			fired.append((key, clock.monotonic()))
+
+		async def scenario():
+			await clock.start()
+			scheduler = TickScheduler(send, lambda key: 10.0 if key == 'a' else 25.0, RateMeter(), clock=clock)
+			runner = asyncio.create_task(scheduler.run())
+			scheduler.add('a', delay=0)
+			scheduler.add('b', delay=0)
+			while clock.monotonic() < 50:
+				await asyncio.sleep(0.001)
+			runner.cancel()
+			await clock.close()
+
+		asyncio.run(scenario())
+		self.assertEqual([t for key, t in fired if key == 'a'][:6], [0.0, 10.0, 20.0, 30.0, 40.0, 50.0])
+		self.assertEqual([t for key, t in fired if key == 'b'][:3], [0.0, 25.0, 50.0])
+
+
+class BackfillTests(SimpleTestCase):
+	def test_influx_writer_sends_gzip_batches_from_parallel_writers(self):
+		async def scenario():
+			async with FakeInfluxServer() as influx:
+				writer = InfluxBatchWriter(f'http://127.0.0.1:{influx.port}/api/v2/write', writers=3, batch_lines=100)
+				await writer.start()
+				for i in range(1050):
+					await writer.add(f'device_data,sensor=s{i % 7} status=True {i}')
+				await writer.close()
+				return writer.snapshot(), influx.stats.as_dict()
+
+		snapshot, stats = asyncio.run(scenario())
+		self.assertEqual((snapshot['written'], snapshot['batches'], snapshot['failed_lines']), (1050, 11, 0))
+		self.assertEqual(stats['lines'], 1050)
+		self.assertEqual(stats['requests'], 11)
+		self.assertLess(stats['bytes_on_wire'], stats['bytes'])
+
+	def test_generation_pauses_while_every_writer_is_busy(self):
+		posted = []
+
+		async def scenario():
+			gate = asyncio.Event()
+			writer = InfluxBatchWriter('http://influx.invalid/write', session=object(), writers=1, batch_lines=10,
+									max_pending=1)
+
+			async def slow_post(body, headers):
+				posted.append(len(gzip.decompress(body).splitlines()))
+				await gate.wait()
+				return True
+
+			writer._post = slow_post
+			await writer.start()
+			generating = asyncio.create_task(writer.extend([f'm v={i} {i}' for i in range(40)]))
+			await asyncio.sleep(0.05)
+			blocked = not generating.done()
+			queued = writer.snapshot()['queued_batches']
+			gate.set()
+			await generating
+			await writer.close()
+			return blocked, queued, writer.snapshot()
+
+		blocked, queued, snapshot = asyncio.run(scenario())
+		self.assertTrue(blocked)  # one batch posting, one queued, the third waits for room
+		self.assertEqual(queued, 1)
+		self.assertEqual((snapshot['written'], posted), (40, [10, 10, 10, 10]))
+
+	def test_command_writes_history_for_every_device_to_a_file(self):
+		from django.core.management import call_command
+		from devices.management.commands.backfill_telemetry import Command as BackfillCommand
+
+		handle, path = tempfile.mkstemp(suffix='.lp.gz')
+		os.close(handle)
+		self.addCleanup(os.remove, path)
+		fleet = [
+			['device_data,sensor=tb-led,source=simulator,direction=S2M', 'led', {'status': False}],
+			['device_data,sensor=tb-ac,source=simulator,direction=S2M', 'airconditioner', {}],
+			['device_data,sensor=tb-gas,source=simulator,direction=S2M', 'gas sensor', {}],
+		]
+		with patch.object(BackfillCommand, '_fleet', return_value=fleet):
+			call_command('backfill_telemetry', days=1, resolution=3600, output=path, seed=3,
+						end='2024-01-02T00:00:00Z', report_interval=0, stdout=StringIO())
+		with gzip.open(path, 'rt') as f:
+			lines = f.read().splitlines()
+		self.assertEqual(len(lines), 48)  # the gas sensor has no generator and no state: nothing to write
+		led = [line for line in lines if 'sensor=tb-led' in line]
+		self.assertEqual([line.split(' ')[1].split(',')[0] for line in led[:3]], ['status=True', 'status=False', 'status=True'])
+		self.assertTrue(led[0].endswith(' 1704067200000'))
+		self.assertTrue(led[-1].endswith(f' {1704067200000 + 23 * 3600000}'))
+		self.assertIn('temperature=', lines[1])
+
+
+class TelemetrySinkTests(SimpleTestCase):
+	device = SimpleNamespace(device_id='house - ac', thingsboard_id='tb 1')
+
+	def sample(self, n):
+		payload = {'temperature': 20 + n, 'status': True, 'request_id': f'r{n}', 'sent_timestamp': 1000 + n}
+		return TelemetrySample(self.device, 1000 + n, f'r{n}', payload, ['status', 'temperature'])
+
+	def test_specs_merge_sink_defaults_with_their_options(self):
+		self.assertEqual(parse_sink_spec('file:path=/tmp/t.lp,batch=50,rotate-mb=1.5'),
+						 ('file', {'path': '/tmp/t.lp', 'batch': 50, 'rotate_mb': 1.5}))
+		influx = make_sink('influx:linger=0.2', influx_url='http://influx/write', influx_token='t')
+		self.assertEqual((influx.concurrency, influx.batch, influx.linger), (2, 1000, 0.2))
+		self.assertEqual(make_sink('mqtt').concurrency, 0)
+		for spec in ('kafka', 'file', 'null:path=x', 'mqtt:batch=many', 'stdout:overflow=spill', 'file:path=x,concurrency=2'):
+			with self.assertRaises(ValueError, msg=spec):
+				make_sink(spec)
+		self.assertFalse(SinkPipeline([NullSink(), make_sink('file:path=x')]).needs_connection)
+
+	def test_file_sink_batches_and_rotates_line_protocol_and_ndjson(self):
+		directory = tempfile.mkdtemp()
+		self.addCleanup(__import__('shutil').rmtree, directory)
+		lines = FileSink(os.path.join(directory, 'tel.lp.gz'), rotate_mb=0.0005, concurrency=1, batch=4, linger=0.01)
+		ndjson = FileSink(os.path.join(directory, 'tel.ndjson'), concurrency=1, batch=100)
+		pipeline = SinkPipeline([lines, ndjson, NullSink()])
+
+		async def scenario():
+			await pipeline.start()
+			for n in range(10):
+				await pipeline.emit(self.sample(n))
+			self.assertTrue(await pipeline.close())
+
+		asyncio.run(scenario())
+		parts = sorted(name for name in os.listdir(directory) if name.endswith('.lp.gz'))
+		self.assertGreater(len(parts), 1)
+		self.assertEqual(parts[0], 'tel-0001.lp.gz')
+		written = []
+		for name in parts:
+			with gzip.open(os.path.join(directory, name), 'rt') as f:
+				written += f.read().splitlines()
+		self.assertEqual(len(written), 10)
+		self.assertEqual(written[0], 'device_data,sensor=tb\\ 1,source=simulator,direction=S2M,request_id="r0",'
+									 'correlation_id=r0 status=True,temperature=20,sent_timestamp=1000 1000')
+		with open(os.path.join(directory, 'tel.ndjson')) as f:
+			rows = [json.loads(line) for line in f]
+		self.assertEqual(rows[3], {'device_id': 'house - ac', 'sensor': 'tb 1', 'ts': 1003, 'request_id': 'r3',
+								   'values': {'status': True, 'temperature': 23}})
+		self.assertEqual(pipeline.snapshot()['null'], {'accepted': 10, 'written': 10, 'failed': 0, 'dropped': 0,
+													   'writes': 0, 'queued': 0})
+
+	def test_narrow_schema_writes_one_point_per_property(self):
+		sample = self.sample(1)
+		self.assertEqual(len(sample_lines(sample)), 1)
+		self.assertEqual(sample_lines(sample, schema=SCHEMA_NARROW), [
+			'device_data,sensor=tb\\ 1,source=simulator,direction=S2M,request_id="r1",correlation_id=r1 '
+			'status=True,sent_timestamp=1001 1001',
+			'device_data,sensor=tb\\ 1,source=simulator,direction=S2M,request_id="r1",correlation_id=r1 '
+			'temperature=21,sent_timestamp=1001 1001',
+		])
+		pipeline = SinkPipeline.from_specs(['file:path=x', 'stdout:schema=wide', 'null'], schema=SCHEMA_NARROW)
+		self.assertEqual([getattr(sink, 'schema', None) for sink in pipeline.sinks], ['narrow', 'wide', None])
+		with self.assertRaises(ValueError):
+			make_sink('influx:schema=tall', influx_url='http://influx/write')
+
+	def test_a_slow_queued_sink_drops_instead_of_stalling_generation(self):
+		gate = asyncio.Event()
+
+		class SlowSink(Sink):
+			name = 'slow'
+
+			async def write(self, samples):
+				await gate.wait()
+
+		slow = SlowSink(concurrency=1, batch=2, max_pending=3, overflow=OVERFLOW_DROP_NEWEST)
+
+		async def scenario():
+			await slow.start()
+			for n in range(10):
+				await asyncio.wait_for(slow.emit(self.sample(n)), 1)
+				await asyncio.sleep(0)
+			gate.set()
+			await slow.close()
+			return slow.snapshot()
+
+		snapshot = asyncio.run(scenario())
+		# the worker holds the first sample, three wait; the rest are dropped at once
+		self.assertEqual((snapshot['accepted'], snapshot['written'], snapshot['dropped']), (10, 4, 6))
+
+	def test_publisher_hands_one_sample_per_message_to_the_sinks(self):
+		sink = NullSink()
+		publisher = send_telemetry.TelemetryPublisher(SimpleNamespace(
+			pk=1, token='tok', device_id='house - led', thingsboard_id='tb-1', state={}, device_type=None,
+		), randomize=True, device_type_name='led')
+		publisher.mqtt_client = AsyncMock()
+		with patch.object(send_telemetry, 'TELEMETRY_SINKS', SinkPipeline([sink])):
+			asyncio.run(publisher.send_telemetry_async())
+		publisher.mqtt_client.publish.assert_not_called()
+		self.assertEqual(sink.written, 1)
+
+
+class HttpTransportTests(SimpleTestCase):
+	def test_pollers_take_devices_in_turn(self):
+		names = ['House - Led 1', 'House - Led 2', 'House - Led 3']
+		received = []
+
+		async def scenario():
+			async with FakeThingsBoardServer() as tb:
+				tb.preload(names)
+				transport = HttpDeviceTransport(tb.base_url, max_connections=2, max_pollers=1, poll_timeout=0.05)
+				await transport.start()
+
+				async def handler(request_id, payload):
+					received.append(json.loads(payload)['method'])
+					await transport.post_rpc_response(fake_device_token(names[2]), request_id, '{"ok": true}')
+
+				for name in names:
+					transport.subscribe(fake_device_token(name), handler if name == names[2] else AsyncMock())
+				answer = await asyncio.wait_for(tb.send_rpc(fake_device_token(names[2]), 'checkStatus'), 2)
+				with self.assertRaises(RuntimeError):
+					await transport.post_telemetry('unknown-token', {'status': True})
+				await transport.close()
+				return answer, transport.snapshot()
+
+		answer, snapshot = asyncio.run(scenario())
+		self.assertEqual((answer, received), ({'ok': True}, ['checkStatus']))
+		self.assertEqual((snapshot['rpcs'], snapshot['responses'], snapshot['post_failures']), (1, 1, 1))
+
+	def test_parked_polls_do_not_hold_the_telemetry_sockets(self):
+		names = ['House - Led 1', 'House - Led 2']
+
+		async def scenario():
+			async with FakeThingsBoardServer() as tb:
+				tb.preload(names)
+				transport = HttpDeviceTransport(tb.base_url, max_connections=1, max_pollers=2, poll_timeout=1.0)
+				await transport.start()
+				for name in names:
+					transport.subscribe(fake_device_token(name), AsyncMock())
+				await asyncio.sleep(0.1)  # both pollers are parked on a long poll
+				started = time.monotonic()
+				await asyncio.wait_for(transport.post_telemetry(fake_device_token(names[0]), {'status': True}), 2)
+				elapsed = time.monotonic() - started
+				await transport.close()
+				return elapsed
+
+		self.assertLess(asyncio.run(scenario()), 0.5)
+
+	def test_publisher_posts_sample_batches_and_answers_rpcs(self):
+		name = 'House - Led'
+		token = fake_device_token(name)
+		store = MemoryStateStore(persist_on_close=False)
+		store.load(1, {'status': False})
+
+		async def scenario():
+			async with FakeThingsBoardServer() as tb:
+				tb.preload([name])
+				transport = HttpDeviceTransport(tb.base_url, max_pollers=1, poll_timeout=0.1)
+				await transport.start()
+				publisher = send_telemetry.TelemetryPublisher(SimpleNamespace(
+					pk=1, token=token, device_id=name, thingsboard_id='tb-1', state={}, device_type=None,
+				), randomize=True, state_store=store, device_type_name='led', transport=transport)
+				publisher.skip_reconcile = True
+				await publisher.connect()
+				sinks = SinkPipeline([HttpSink(concurrency=1, batch=10, linger=0.05)])
+				await sinks.start()
+				with patch.object(send_telemetry, 'TELEMETRY_SINKS', sinks):
+					for _ in range(5):
+						await publisher.send_telemetry_async()
+					await sinks.close()
+				answer = await asyncio.wait_for(tb.send_rpc(token, 'checkStatus'), 2)
+				await transport.close()
+				return answer, tb.stats.as_dict()
+
+		with patch.dict(os.environ, {'M2S_SIMULATOR_FAST_MODE': '1'}), patch('sys.stdout', new=StringIO()):
+			answer, stats = asyncio.run(scenario())
+		self.assertEqual(answer, {'status': True})  # five toggles from False
+		self.assertEqual((stats['telemetry_posts'], stats['telemetry_samples']), (1, 5))
+
+
+class MqttQosTests(SimpleTestCase):
+	def test_window_pipelines_publishes_up_to_its_size(self):
+		stats = QosStats()
+
+		async def acked_after_50ms(topic, payload, qos, timeout):
+			await asyncio.sleep(0.05)
+
+		async def scenario():
+			window = PublishWindow(acked_after_50ms, QosPolicy(telemetry=1, window=4), stats)
+			started = time.monotonic()
+			for n in range(12):
+				await window.submit('v1/devices/me/telemetry', str(n))
+			submitted = time.monotonic() - started
+			await window.drain()
+			return submitted, time.monotonic() - started
+
+		submitted, total = asyncio.run(scenario())
+		# three rounds of four in flight, not twelve round trips
+		self.assertLess(total, 0.4)
+		self.assertGreater(submitted, 0.08)  # the last four waited for two rounds of acks
+		snapshot = stats.snapshot()
+		self.assertEqual((snapshot['acked'], snapshot['max_window_depth'], snapshot['inflight']), (12, 4, 0))
+		self.assertEqual(snapshot['window_full'], 2)  # the 5th and 9th found the window full
+		self.assertGreaterEqual(snapshot['ack']['p50_ms'], 45)
+
+	def test_unacknowledged_messages_are_retransmitted_then_failed(self):
+		stats = QosStats()
+		attempts = {}
+
+		async def flaky(topic, payload, qos, timeout):
+			attempts[payload] = attempts.get(payload, 0) + 1
+			if payload == 'lost' or attempts[payload] == 1:
+				raise asyncio.TimeoutError()
+
+		async def scenario():
+			window = PublishWindow(flaky, QosPolicy(telemetry=1, ack_timeout=0.01, retries=2), stats)
+			await window.submit('t', 'late')
+			await window.submit('t', 'lost')
+			await window.drain()
+
+		with patch('sys.stdout', new=StringIO()):
+			asyncio.run(scenario())
+		self.assertEqual(attempts, {'late': 2, 'lost': 3})
+		snapshot = stats.snapshot()
+		self.assertEqual((snapshot['acked'], snapshot['retransmits'], snapshot['failed']), (1, 3, 1))
+		with self.assertRaises(ValueError):
+			QosPolicy(telemetry=2)
+
+	def test_broken_connection_is_raised_by_the_next_submit(self):
+		stats = QosStats()
+
+		async def disconnected(topic, payload, qos, timeout):
+			raise aiomqtt.MqttError('Disconnected')
+
+		async def scenario():
+			window = PublishWindow(disconnected, QosPolicy(telemetry=1, ack_timeout=0.01, retries=0), stats)
+			await window.submit('t', 'first')
+			await window.drain()
+			with self.assertRaises(ConnectionError):
+				await window.submit('t', 'second')
+			await window.submit('t', 'third')  # reported once; the caller reconnects and goes on
+			await window.drain()
+
+		with patch('sys.stdout', new=StringIO()):
+			asyncio.run(scenario())
+		self.assertEqual((stats.submitted, stats.failed), (2, 2))
+
+	def test_publisher_reconnects_when_the_window_reports_a_failure(self):
+		publisher = send_telemetry.TelemetryPublisher(SimpleNamespace(
+			pk=1, token='tok-1', device_id='house - led', thingsboard_id='tb-1', state={}, device_type=None,
+		), device_type_name='led')
+		broken = SimpleNamespace(publish=AsyncMock(side_effect=aiomqtt.MqttError('Disconnected')))
+		healthy = SimpleNamespace(publish=AsyncMock())
+		publisher.mqtt_client = broken
+
+		async def reconnect(*args, **kwargs):
+			publisher.mqtt_client = healthy
+
+		async def scenario():
+			await publisher.publish('{"n": 1}')
+			await publisher.publish_window.drain()
+			await publisher.publish('{"n": 2}')
+			await publisher.publish_window.drain()
+
+		device = SimpleNamespace(token='tok-1', save=lambda: None, refresh_from_db=lambda: None)
+		with patch.object(send_telemetry, 'QOS_POLICY', QosPolicy(telemetry=1, ack_timeout=0.01, retries=0)), \
+				patch.object(send_telemetry, 'QOS_STATS', QosStats()), \
+				patch.object(send_telemetry.Device.objects, 'get', return_value=device), \
+				patch.object(send_telemetry.TelemetryPublisher, 'connect', side_effect=reconnect) as connect, patch('sys.stdout', new=StringIO()):
+			asyncio.run(scenario())
+		connect.assert_awaited_once()
+		healthy.publish.assert_awaited_once_with('v1/devices/me/telemetry', '{"n": 2}', qos=1, timeout=0.01)
+
+	def test_publisher_pipelines_qos1_telemetry_over_a_slow_broker(self):
+		publisher = send_telemetry.TelemetryPublisher(SimpleNamespace(
+			pk=1, token='tok-1', device_id='house - led', thingsboard_id='tb-1', state={}, device_type=None,
+		), device_type_name='led')
+		publisher.skip_reconcile = True
+		stats = QosStats()
+
+		async def scenario():
+			async with FakeMqttBroker(allowed_tokens={'tok-1'}, ack_delay_ms=50) as broker:
+				with patch.object(send_telemetry, 'THINGSBOARD_HOST', '127.0.0.1'), \
+						patch.object(send_telemetry, 'THINGSBOARD_MQTT_PORT', broker.port):
+					await publisher.connect(spawn_handle=False)
+				started = time.monotonic()
+				for n in range(16):
+					await publisher.publish(json.dumps({'n': n}))
+				await publisher.publish_window.drain()
+				elapsed = time.monotonic() - started
+				await publisher.mqtt_client.__aexit__(None, None, None)
+				return elapsed, broker.stats.as_dict()
+
+		with patch.object(send_telemetry, 'QOS_POLICY', QosPolicy(telemetry=1, window=8)), \
+				patch.object(send_telemetry, 'QOS_STATS', stats), patch('sys.stdout', new=StringIO()):
+			elapsed, broker_stats = asyncio.run(scenario())
+		self.assertEqual((broker_stats['telemetry'], stats.acked), (16, 16))
+		self.assertLess(elapsed, 0.5)  # one PUBACK at a time would take 16 x 50 ms
+
+
+class UnitPhysicsTests(SimpleTestCase):
+	house = [
+		('House 1 - Room 1 - AirConditioner1', 'AirConditioner', {'temperature': 24.0, 'status': False}),
+		('House 1 - Room 1 - LightBulb', 'LightBulb', {'status': False}),
+		('House 1 - Room 2 - AirConditioner2', 'AirConditioner', {'temperature': 24.0, 'status': False}),
+		('House 1 - Garden - SoilHumiditySensor', 'Soil Humidity Sensor', {'humidity': 50.0}),
+		('House 1 - Garden - Irrigation', 'Irrigation', {'status': False}),
+		('House 1 - Pool - Pump', 'Pump', {'status': False}),
+	]
+
+	def physics(self, backend=BACKEND_PYTHON, houses=1):
+		physics = UnitPhysics(PhysicsParams(noise=0.0), backend=backend)
+		for n in range(1, houses + 1):
+			for device_id, dtype, state in self.house:
+				physics.add(device_id.replace('House 1', f'House {n}'), dtype, state, unit=f'House {n}')
+		return physics
+
+	def test_actuators_drive_the_sensors_of_their_own_zone(self):
+		physics = self.physics()
+		self.assertNotIn('House 1 - Pool - Pump', physics)  # not modelled: keeps --randomize
+		self.assertEqual(physics.snapshot()['zones'], 3)
+		physics.advance(0)
+		physics.actuate('House 1 - Room 1 - AirConditioner1', 0, status=True, setpoint=20.0)
+		physics.actuate('House 1 - Garden - Irrigation', 0, status=True)
+		physics.advance(3600)
+		cooled = physics.reading('House 1 - Room 1 - AirConditioner1')
+		other = physics.reading('House 1 - Room 2 - AirConditioner2')
+		soil = physics.reading('House 1 - Garden - SoilHumiditySensor')['humidity']
+		self.assertLess(cooled['temperature'], 21.5)  # its set point, held up by the outdoors
+		self.assertGreater(other['temperature'], 23.0)
+		self.assertLess(cooled['humidity'], other['humidity'])
+		self.assertGreater(soil, 80.0)
+		self.assertEqual(physics.reading('House 1 - Garden - Irrigation'), {})
+		physics.actuate('House 1 - Garden - Irrigation', 3600, status=False)
+		physics.advance(3 * 3600)
+		self.assertLess(physics.reading('House 1 - Garden - SoilHumiditySensor')['humidity'], soil)
+
+	@skipUnless(np is not None, 'numpy is not installed')
+	def test_numpy_and_list_backends_agree(self):
+		fleets = [self.physics(backend, houses=50) for backend in (BACKEND_NUMPY, BACKEND_PYTHON)]
+		for physics in fleets:
+			physics.advance(0)
+			for n in range(1, 51, 3):
+				physics.actuate(f'House {n} - Room 2 - AirConditioner2', 0, status=True, setpoint=18 + n % 5)
+				physics.actuate(f'House {n} - Room 1 - LightBulb', 0, status=True)
+			for t in range(60, 7200, 600):
+				physics.advance(t)
+		numpy_fleet, list_fleet = fleets
+		for device_id in numpy_fleet._devices:
+			for name, value in numpy_fleet.reading(device_id).items():
+				self.assertAlmostEqual(value, list_fleet.reading(device_id)[name], places=6, msg=device_id)
+
+	def test_rpc_switch_reaches_the_next_telemetry(self):
+		physics = self.physics()
+		now = [1_700_000_000.0]
+		clock = SimpleNamespace(time=lambda: now[0], timestamp_ms=lambda: int(now[0] * 1000))
+		store = MemoryStateStore(persist_on_close=False)
+		publishers = []
+		for pk, device_id in enumerate(('House 1 - Room 1 - AirConditioner1', 'House 1 - Room 2 - AirConditioner2')):
+			store.load(pk, {'temperature': 24.0, 'status': False})
+			device = SimpleNamespace(pk=pk, token=f'tok-{pk}', device_id=device_id, thingsboard_id=None)
+			publisher = send_telemetry.TelemetryPublisher(device, randomize=True, state_store=store,
+														  device_type_name='airconditioner')
+			publisher.mqtt_client = SimpleNamespace(publish=AsyncMock())
+			publishers.append(publisher)
+		msg = SimpleNamespace(topic='v1/devices/me/rpc/request/7',
+							  payload=json.dumps({'method': 'switchStatus', 'params': True}).encode())
+
+		async def scenario():
+			for publisher in publishers:
+				await publisher.send_telemetry_async()
+			await publishers[0].on_message(msg)
+			now[0] += 1800
+			for publisher in publishers:
+				await publisher.send_telemetry_async()
+			return await store.get(0), await store.get(1)
+
+		with patch.object(send_telemetry, 'UNIT_PHYSICS', physics), patch.object(send_telemetry, 'SIM_CLOCK', clock), \
+				patch.object(send_telemetry, 'TELEMETRY_SINKS', SinkPipeline([NullSink()])), \
+				patch.dict(os.environ, {'M2S_SIMULATOR_FAST_MODE': '1'}), patch('sys.stdout', new=StringIO()):
+			cooled, idle = asyncio.run(scenario())
+		self.assertTrue(cooled['status'])
+		self.assertFalse(idle['status'])  # --randomize no longer toggles modelled actuators
+		self.assertLess(cooled['temperature'], idle['temperature'] - 1.0)
+		self.assertEqual(physics.snapshot()['steps'], 2)
+
+	def test_sensor_rpc_reads_the_zone_its_ac_drives(self):
+		physics = UnitPhysics(PhysicsParams(noise=0.0), backend=BACKEND_PYTHON)
+		now = [1_700_000_000.0]
+		clock = SimpleNamespace(time=lambda: now[0], timestamp_ms=lambda: int(now[0] * 1000))
+		store = MemoryStateStore(persist_on_close=False)
+		devices = [
+			('House 1 - Room 1 - AirConditioner1', 'airconditioner', {'temperature': 24.0, 'status': False}),
+			('House 1 - Room 1 - TemperatureSensor', 'temperature sensor', {'temperature': 24.0}),
+			('House 1 - Room 2 - TemperatureSensor', 'temperature sensor', {'temperature': 24.0}),
+		]
+		publishers = []
+		for pk, (device_id, dtype, state) in enumerate(devices):
+			physics.add(device_id, dtype, state, unit='House 1')
+			store.load(pk, dict(state))
+			device = SimpleNamespace(pk=pk, token=f'tok-{pk}', device_id=device_id, thingsboard_id=None)
+			publisher = send_telemetry.TelemetryPublisher(device, randomize=True, state_store=store,
+														  device_type_name=dtype)
+			publisher.mqtt_client = SimpleNamespace(publish=AsyncMock())
+			publishers.append(publisher)
+
+		def rpc(method, params=None):
+			return SimpleNamespace(topic='v1/devices/me/rpc/request/1',
+								   payload=json.dumps({'method': method, 'params': params}).encode())
+
+		async def scenario():
+			ac, cooled_sensor, idle_sensor = publishers
+			await ac.on_message(rpc('setTemperature', 18))
+			await ac.on_message(rpc('switchStatus', True))
+			now[0] += 1800
+			await cooled_sensor.on_message(rpc('checkStatus'))
+			await idle_sensor.on_message(rpc('checkStatus'))
+			return [await store.get(pk) for pk in range(3)]
+
+		with patch.object(send_telemetry, 'UNIT_PHYSICS', physics), patch.object(send_telemetry, 'SIM_CLOCK', clock), \
+				patch.dict(os.environ, {'M2S_SIMULATOR_FAST_MODE': '1'}), patch('sys.stdout', new=StringIO()):
+			ac, cooled, idle = asyncio.run(scenario())
+		self.assertEqual(cooled, physics.reading('House 1 - Room 1 - TemperatureSensor'))
+		self.assertLess(cooled['temperature'], idle['temperature'] - 1.0)
+		self.assertLess(cooled['humidity'], idle['humidity'])
+		# the set point survives a restart; the room temperature is not replaced by it
+		self.assertEqual((ac['setpoint'], ac['status']), (18.0, True))
+		self.assertNotEqual(ac['temperature'], 18.0)
+		restarted = UnitPhysics(PhysicsParams(noise=0.0), backend=BACKEND_PYTHON)
+		restarted.add('House 1 - Room 1 - AirConditioner1', 'airconditioner', ac, unit='House 1')
+		self.assertEqual(restarted._setpoint, [18.0])
+
+
+class ThingsBoardSyncTests(SimpleTestCase):
+	def test_renames_in_place_and_creates_missing_devices(self):
+		async def scenario():
+			async with FakeThingsBoardServer(faults=FaultInjection(error_rate=0.2, seed=4)) as tb:
+				tb.preload(['House 1 - Led'])
+				tb_id = tb.devices['House 1 - Led']['id']['id']
+				sync = ThingsBoardSync(f'{tb.base_url}/api', {'X-Authorization': 'ApiKey test'}, concurrency=2,
+										retries=8)
+				results = await sync.run([
+					SyncItem(1, 'House 2 - Led', 'led', 'Casa - House 2', tb_id, {'properties': {}}),
+					SyncItem(2, 'House 2 - AC', 'airconditioner', 'Casa - House 2', None, {'properties': {}}),
+				])
+				return sorted(results), sync.snapshot(), dict(tb.devices), dict(tb.attributes)
+
+		results, snapshot, devices, attributes = asyncio.run(scenario())
+		self.assertEqual(sorted(devices), ['House 2 - AC', 'House 2 - Led'])
+		self.assertEqual(devices['House 2 - Led']['label'], 'Casa - House 2')
+		self.assertEqual([r.token for r in results], [fake_device_token('House 2 - Led'), fake_device_token('House 2 - AC')])
+		self.assertEqual((snapshot['renamed'], snapshot['created'], snapshot['failed']), (1, 1, 0))
+		self.assertGreater(snapshot['retried'], 0)
+		# shared attributes only go to the device that was created
+		self.assertEqual([key[0] for key in attributes], [results[1].thingsboard_id])
+
+
+class RenameDevicesForSimulatorTests(TestCase):
+	def test_renames_whole_unit_names_in_one_pass(self):
+		from django.core.management import call_command
+
+		led = DeviceType.objects.create(name='led')
+		system = System.objects.create(name='Casa')
+		units = [Unit.objects.create(name=name, system=system) for name in ('House 1', 'House 10')]
+		Device.objects.bulk_create([
+			Device(device_id=f'{unit.name} - Led', device_type=led, token='t', system=system, unit=unit)
+			for unit in units
+		])
+		call_command('rename_devices_for_simulator', sim=2, no_thingsboard=True, stdout=StringIO())
+		self.assertEqual(sorted(Device.objects.values_list('device_id', flat=True)), ['House 10 - Led', 'House 2 - Led'])
+		self.assertEqual(sorted(Unit.objects.values_list('name', flat=True)), ['House 10', 'House 2'])
+		self.assertEqual(Device.objects.get(device_id='House 2 - Led').unit.name, 'House 2')
+
+		with patch('sys.stdout', new=StringIO()):  # Device.save() reports the missing gateway
+			Device.objects.create(device_id='House 1 - Led', device_type=led, token='t')
+		stderr = StringIO()
+		call_command('rename_devices_for_simulator', sim=2, no_thingsboard=True, stdout=StringIO(), stderr=stderr)
+		self.assertIn('House 2 - Led', stderr.getvalue())
+		self.assertTrue(Device.objects.filter(device_id='House 1 - Led').exists())  # nothing renamed on a clash
+
+	def test_thingsboard_background_detaches_the_sync(self):
+		from django.core.management import call_command
+
+		led = DeviceType.objects.create(name='led')
+		Device.objects.bulk_create([Device(device_id='House 1 - Led', device_type=led, token='t')])
+		command = 'devices.management.commands.rename_devices_for_simulator'
+		with tempfile.TemporaryDirectory() as runtime, patch(f'{command}.RUNTIME_DIR', new=Path(runtime)), \
+				patch(f'{command}.subprocess.Popen') as popen, patch(f'{command}.sync_devices') as sync:
+			popen.return_value.pid = 4321
+			stdout = StringIO()
+			call_command('rename_devices_for_simulator', sim=3, thingsboard_background=True, stdout=stdout)
+		sync.assert_not_called()
+		args, kwargs = popen.call_args
+		self.assertEqual(args[0][2:6], ['rename_devices_for_simulator', '--sim', '3', '--thingsboard-only'])
+		self.assertTrue(kwargs['start_new_session'])
+		self.assertIn('pid 4321', stdout.getvalue())
+		self.assertTrue(Device.objects.filter(device_id='House 3 - Led').exists())
+
+	def test_renamed_devices_do_not_take_over_the_template_devices(self):
+		from django.core.management import call_command
+		from devices.thingsboard_sync import sync_items
+
+		led = DeviceType.objects.create(name='led')
+		Device.objects.bulk_create([Device(device_id='House 1 - Led', device_type=led, token='tok-1', thingsboard_id='tb-1')])
+		call_command('rename_devices_for_simulator', sim=2, no_thingsboard=True, stdout=StringIO())
+		device = Device.objects.get(device_id='House 2 - Led')
+		self.assertEqual((device.thingsboard_id, device.token), (None, ''))
+
+		async def scenario(items):
+			async with FakeThingsBoardServer() as tb:
+				tb.preload(['House 1 - Led'])  # the template instance's device is still live
+				template_id = tb.devices['House 1 - Led']['id']['id']
+				sync = ThingsBoardSync(f'{tb.base_url}/api', {'X-Authorization': 'ApiKey test'})
+				results = await sync.run(items)
+				return results, template_id, dict(tb.devices)
+
+		results, template_id, devices = asyncio.run(scenario(sync_items(Device.objects.all())))
+		self.assertEqual(sorted(devices), ['House 1 - Led', 'House 2 - Led'])
+		self.assertEqual(devices['House 1 - Led']['id']['id'], template_id)
+		self.assertNotEqual(results[0].thingsboard_id, template_id)
+		self.assertEqual(results[0].token, fake_device_token('House 2 - Led'))
+
+
+class FleetFixtureTests(TestCase):
+	def _fleet(self):
+		led = DeviceType.objects.create(name='led')
+		system = System.objects.create(name='Casa')
+		template = Unit.objects.create(name='House 1', system=system)
+		shared = Unit.objects.create(name='Garage', system=system)
+		Device.objects.bulk_create([
+			Device(device_id='House 1 - Led', device_type=led, token='tok-1', thingsboard_id='tb-1',
+				state={'status': True}, system=system, unit=template),
+			Device(device_id='Garage - Led', device_type=led, token='tok-2', thingsboard_id='tb-2',
+				system=system, unit=shared),
+		])
+
+	def _export(self, **options):
+		from django.core.management import call_command
+
+		handle, path = tempfile.mkstemp(suffix='.jsonl.gz')
+		os.close(handle)
+		self.addCleanup(os.remove, path)
+		call_command('export_fleet', path, stdout=StringIO(), **options)
+		return path
+
+	def test_import_retargets_the_template_unit_and_keeps_only_matching_credentials(self):
+		from django.core.management import call_command
+
+		self._fleet()
+		path = self._export(with_credentials=True)
+		call_command('import_fleet', path, sim=7, replace=True, no_thingsboard=True, stdout=StringIO())
+		rows = {d.device_id: d for d in Device.objects.select_related('unit')}
+		self.assertEqual(sorted(rows), ['Garage - Led', 'House 7 - Led'])
+		self.assertEqual(rows['House 7 - Led'].unit.name, 'House 7')
+		self.assertEqual(rows['House 7 - Led'].state, {'status': True})
+		# the renamed device is a new ThingsBoard device; the unchanged one keeps its credentials
+		self.assertEqual((rows['House 7 - Led'].token, rows['House 7 - Led'].thingsboard_id), ('', None))
+		self.assertEqual((rows['Garage - Led'].token, rows['Garage - Led'].thingsboard_id), ('tok-2', 'tb-2'))
+
+		stdout = StringIO()
+		call_command('import_fleet', path, sim=7, no_thingsboard=True, stdout=stdout)
+		self.assertIn('0 devices importados', stdout.getvalue())
+		self.assertEqual(Device.objects.count(), 2)
+
+	def test_truncated_fixture_imports_nothing(self):
+		from django.core.management import call_command
+
+		self._fleet()
+		with gzip.open(self._export(), 'rt') as f:
+			lines = f.read().splitlines()
+		handle, path = tempfile.mkstemp(suffix='.jsonl')
+		os.close(handle)
+		self.addCleanup(os.remove, path)
+		with open(path, 'w') as f:
+			f.write('\n'.join(lines[:-1]) + '\n')  # no end record
+		stderr = StringIO()
+		call_command('import_fleet', path, sim=7, replace=True, no_thingsboard=True, stdout=StringIO(), stderr=stderr)
+		self.assertIn('truncated', stderr.getvalue())
+		self.assertEqual(sorted(Device.objects.values_list('device_id', flat=True)), ['Garage - Led', 'House 1 - Led'])
+
+
+class ThingsBoardDeletionTests(TestCase):
+	def test_queue_deletes_in_the_background_with_retries(self):
+		names = [f'House 1 - Led {i}' for i in range(30)]
+
+		async def scenario():
+			async with FakeThingsBoardServer(faults=FaultInjection(error_rate=0.1, seed=2)) as tb:
+				tb.preload(names)
+				ids = [tb.devices[name]['id']['id'] for name in names]
+				client = lambda: ThingsBoardSync(f'{tb.base_url}/api', {'X-Authorization': 'ApiKey test'}, retries=8)
+				queue = ThingsBoardDeletionQueue(concurrency=4, idle_timeout=0.1, client_factory=client)
+				for tb_id in ids + ['gone']:
+					queue.enqueue(tb_id)
+				drained = await asyncio.to_thread(queue.drain, 10)
+				await asyncio.sleep(0.3)  # the worker thread stops once idle
+				return drained, queue.snapshot(), dict(tb.devices)
+
+		with patch('sys.stdout', new=StringIO()):
+			drained, snapshot, devices = asyncio.run(scenario())
+		self.assertTrue(drained)
+		self.assertEqual(devices, {})
+		self.assertEqual((snapshot['deleted'], snapshot['missing'], snapshot['failed']), (30, 1, 0))
+		self.assertGreater(snapshot['retried'], 0)
+		self.assertFalse(snapshot['running'])
+
+	def test_queue_keeps_deletions_while_the_gateway_is_unavailable(self):
+		names = [f'House 1 - Led {i}' for i in range(5)]
+
+		async def scenario():
+			async with FakeThingsBoardServer() as tb:
+				tb.preload(names)
+				attempts = []
+
+				def client():
+					attempts.append(None)
+					if len(attempts) == 1:
+						raise RuntimeError('login failed')
+					return ThingsBoardSync(f'{tb.base_url}/api', {'X-Authorization': 'ApiKey test'})
+
+				queue = ThingsBoardDeletionQueue(concurrency=2, idle_timeout=0.1, client_factory=client)
+				for name in names:
+					queue.enqueue(tb.devices[name]['id']['id'], name)
+				drained = await asyncio.to_thread(queue.drain, 10)
+				return drained, len(attempts), queue.snapshot(), dict(tb.devices)
+
+		with patch('sys.stdout', new=StringIO()):
+			drained, attempts, snapshot, devices = asyncio.run(scenario())
+		self.assertTrue(drained)
+		self.assertEqual(attempts, 2)
+		self.assertEqual(devices, {})
+		self.assertEqual((snapshot['deleted'], snapshot['failed']), (5, 0))
+		self.assertEqual(snapshot['last_error'], 'RuntimeError: login failed')
+
+	@override_settings(ALLOW_THINGSBOARD_DELETE=True)
+	def test_delete_queues_remote_devices_on_commit(self):
+		led = DeviceType.objects.create(name='led')
+		Device.objects.bulk_create([
+			Device(device_id='House 1 - Led', device_type=led, token='t', thingsboard_id='tb-1'),
+			Device(device_id='House 1 - Lamp', device_type=led, token=''),
+		])
+		with patch('devices.signals.DELETIONS') as deletions:
+			with self.captureOnCommitCallbacks(execute=False) as callbacks:
+				Device.objects.all().delete()
+			deletions.enqueue.assert_not_called()  # nothing leaves before the commit
+			for callback in callbacks:
+				callback()
+		deletions.enqueue.assert_called_once_with('tb-1', 'House 1 - Led')
+
+
+class DeviceAdminScalingTests(TestCase):
+	def setUp(self):
+		self.user = get_user_model().objects.create_user(
+			username='admin', password='secret123', is_staff=True, is_superuser=True,
+		)
+		self.client.force_login(self.user)
+		self.led = DeviceType.objects.create(name='led')
+		self.casa = System.objects.create(name='Casa')
+
+	def _fleet(self, houses):
+		units = Unit.objects.bulk_create([Unit(name=f'House {n}', system=self.casa) for n in range(1, houses + 1)])
+		Device.objects.bulk_create([
+			Device(device_id=f'{unit.name} - Led', device_type=self.led, system=self.casa, unit=unit,
+			       token=f'tok-{unit.pk}')
+			for unit in units
+		])
+
+	def _queries(self, url, **params):
+		from django.db import connection
+
+		executed = []
+
+		def count(execute, sql, params_, many, context):
+			executed.append(sql)
+			return execute(sql, params_, many, context)
+
+		with connection.execute_wrapper(count):
+			response = self.client.get(url, params)
+		self.assertEqual(response.status_code, 200)
+		return response, len(executed)
+
+	def test_changelist_and_add_form_queries_do_not_grow_with_the_fleet(self):
+		changelist, add = reverse('admin:devices_device_changelist'), reverse('admin:devices_device_add')
+		self._fleet(5)
+		self._queries(add)  # per-process caches (content types) fill on the first request
+		_, small = self._queries(changelist)
+		_, small_add = self._queries(add)
+		extra = Unit.objects.bulk_create([Unit(name=f'Extra {n}', system=self.casa) for n in range(300)])
+		Device.objects.bulk_create([
+			Device(device_id=f'{unit.name} - Led', device_type=self.led, system=self.casa, unit=unit) for unit in extra
+		])
+		response, large = self._queries(changelist)
+		_, large_add = self._queries(add)
+		self.assertEqual((large, large_add), (small, small_add))
+		# no unit list until a system is picked
+		self.assertNotContains(response, 'unit__id__exact')
+
+	def test_search_matches_prefix_token_and_unit_filter_follows_system(self):
+		self._fleet(12)
+		url = reverse('admin:devices_device_changelist')
+		response, _ = self._queries(url, q='House 1 -')
+		self.assertEqual([d.device_id for d in response.context['cl'].result_list], ['House 1 - Led'])
+		token = Device.objects.get(device_id='House 7 - Led').token
+		response, _ = self._queries(url, q=token)
+		self.assertEqual([d.device_id for d in response.context['cl'].result_list], ['House 7 - Led'])
+		response, _ = self._queries(url, system__id__exact=self.casa.pk)
+		self.assertContains(response, 'unit__id__exact')
+		unit = Unit.objects.get(name='House 3')
+		response, _ = self._queries(url, system__id__exact=self.casa.pk, unit__id__exact=unit.pk)
+		self.assertEqual([d.device_id for d in response.context['cl'].result_list], ['House 3 - Led'])
@@ -0,0 +1,216 @@
+"""Background deletion of ThingsBoard devices.
+
+Deleting a ``Device`` used to send a blocking ``requests.delete`` from the
+``post_delete`` signal, one per row, so an admin bulk delete of a few
+thousand devices held the request for minutes. The signal now queues the
+``thingsboard_id`` on commit (a rolled back delete sends nothing) and
+returns. A worker thread deletes the queued devices over one pooled aiohttp
+session, with at most ``concurrency`` requests in flight and the retries of
+``ThingsBoardSync``. The thread starts with the first deletion and stops
+after ``idle_timeout`` seconds without work; the gateway is looked up again
+each time it starts. While that fails (no gateway, a login error) the
+queued devices are kept and the lookup is retried with backoff.
+
+The queue lives in the process: an ``atexit`` hook waits up to
+``exit_timeout`` seconds for what is still queued, and devices left after
+that stay in ThingsBoard. ``snapshot()`` reports progress; the dashboard
+status shows it and the worker prints ``[tb-delete]`` lines.
+"""
+from __future__ import annotations
+
+import asyncio
+import atexit
+import json
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+from devices.thingsboard_sync import ThingsBoardSync
+
+
+def gateway_client(concurrency: int, retries: int) -> ThingsBoardSync:
+    """Client for the active gateway; raises RuntimeError when there is none (blocking: ORM and login)."""
+    from django.db import connections
+
+    from devices.thingsboard_gateway import get_active_gateway, get_gateway_connection, get_management_headers
+
+    try:
+        gateway = get_active_gateway(required=True)
+        api_url = f"{get_gateway_connection(gateway).base_url}/api"
+        headers = get_management_headers(gateway=gateway)
+    except Exception as exc:
+        raise RuntimeError(f"GatewayIOT ativo nao configurado/valido: {exc}") from exc
+    finally:
+        connections.close_all()  # this thread's connections only
+    return ThingsBoardSync(
+        api_url, headers, refresh_headers=lambda: get_management_headers(gateway=gateway, force_refresh=True),
+        concurrency=concurrency, retries=retries,
+    )
+
+
+class ThingsBoardDeletionQueue:
+    def __init__(self, concurrency: int = 8, retries: int = 4, idle_timeout: float = 30.0,
+                 exit_timeout: float = 30.0, progress_interval: float = 5.0, client_factory=None):
+        """``client_factory()`` returns the ``ThingsBoardSync`` to delete with (default: the active gateway)."""
+        if concurrency < 1:
+            raise ValueError("concurrency must be >= 1")
+        self.concurrency = concurrency
+        self.retries = retries
+        self.idle_timeout = idle_timeout
+        self.exit_timeout = exit_timeout
+        self.progress_interval = progress_interval
+        self.client_factory = client_factory or (lambda: gateway_client(self.concurrency, self.retries))
+        self.queued = 0
+        self.deleted = 0
+        self.missing = 0  # already gone from ThingsBoard
+        self.failed = 0
+        self.inflight = 0
+        self.last_error = None
+        self._requests = 0
+        self._retried = 0
+        self._client = None
+        self._pending = deque()  # (thingsboard_id, device name)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._loop = None
+        self._ready = None
+        self._started = None
+        self._done_at_start = 0
+
+    def enqueue(self, thingsboard_id, name=None):
+        """Queue one remote device for deletion; thread-safe and non-blocking."""
+        with self._lock:
+            self._pending.append((thingsboard_id, name))
+            self.queued += 1
+            if self._thread is None:
+                self._start()
+            elif self._loop is not None:
+                self._loop.call_soon_threadsafe(self._ready.set)
+
+    def _start(self):
+        # called with the lock held
+        self._started = time.monotonic()
+        self._done_at_start = self.deleted + self.missing + self.failed
+        self._thread = threading.Thread(target=self._run, name="tb-delete", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            asyncio.run(self._main())
+        finally:
+            with self._lock:
+                self._thread = self._loop = None
+                if self._pending:
+                    # queued while the workers were stopping
+                    self._start()
+
+    async def _connect(self) -> ThingsBoardSync:
+        attempt = 0
+        while True:
+            try:
+                return await asyncio.to_thread(self.client_factory)
+            except Exception as exc:
+                delay = min(0.5 * 2 ** attempt, 30.0)
+                attempt += 1
+                with self._lock:
+                    self.last_error = f"{type(exc).__name__}: {exc}"
+                    pending = len(self._pending)
+                print(f"[tb-delete] {pending} deletions kept, retrying in {delay:.1f}s: {self.last_error}")
+                await asyncio.sleep(delay)
+
+    async def _main(self):
+        client = await self._connect()
+        self._ready = asyncio.Event()
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+        self._client = client
+        client.open()
+        reporter = asyncio.create_task(self._report())
+        try:
+            await asyncio.gather(*(self._worker(client) for _ in range(self.concurrency)))
+        finally:
+            with self._lock:
+                self._loop = None  # later deletions restart the thread (see _run)
+            reporter.cancel()
+            await client.close()
+            self._requests += client.requests
+            self._retried += client.retried
+            self._client = None
+        print(f"[tb-delete] {json.dumps(self.snapshot())}")
+
+    async def _worker(self, client):
+        while True:
+            self._ready.clear()  # before looking, so an enqueue after the look wakes us
+            with self._lock:
+                item = self._pending.popleft() if self._pending else None
+                if item is not None:
+                    self.inflight += 1
+            if item is None:
+                try:
+                    await asyncio.wait_for(self._ready.wait(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    with self._lock:
+                        if not self._pending:
+                            return
+                continue
+            thingsboard_id, name = item
+            try:
+                if await client.delete(thingsboard_id):
+                    self.deleted += 1
+                else:
+                    self.missing += 1
+            except Exception as exc:
+                self.failed += 1
+                self.last_error = f"{name or thingsboard_id}: {type(exc).__name__}: {exc}"
+                if self.failed <= 10:
+                    print(f"[tb-delete] {self.last_error}")
+            finally:
+                self.inflight -= 1
+
+    async def _report(self):
+        last = None
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            snapshot = self.snapshot()
+            if snapshot != last and (snapshot["pending"] or snapshot["inflight"]):
+                print(f"[tb-delete] {json.dumps(snapshot)}")
+            last = snapshot
+
+    def drain(self, timeout: float = 30.0) -> bool:
+        """Block until the queue is empty; False if devices were still queued after ``timeout``."""
+        deadline = time.monotonic() + timeout
+        while self._pending or self.inflight:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _drain_at_exit(self):
+        if self._pending or self.inflight:
+            print(f"[tb-delete] waiting up to {self.exit_timeout:.0f}s for {len(self._pending) + self.inflight} deletions")
+            if not self.drain(self.exit_timeout):
+                print(f"[tb-delete] {len(self._pending)} devices left in ThingsBoard")
+
+    def snapshot(self) -> dict:
+        client = self._client
+        done = self.deleted + self.missing + self.failed - self._done_at_start
+        elapsed = time.monotonic() - self._started if self._started is not None else 0.0
+        return {
+            "queued": self.queued,
+            "pending": len(self._pending),
+            "inflight": self.inflight,
+            "deleted": self.deleted,
+            "missing": self.missing,
+            "failed": self.failed,
+            "requests": self._requests + (client.requests if client else 0),
+            "retried": self._retried + (client.retried if client else 0),
+            "running": self._thread is not None,
+            "deletions_per_sec": round(done / elapsed, 1) if elapsed > 0 and self._thread is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+DELETIONS = ThingsBoardDeletionQueue(concurrency=getattr(settings, "THINGSBOARD_DELETE_CONCURRENCY", 8))
+atexit.register(DELETIONS._drain_at_exit)
@@ -0,0 +1,266 @@
+"""Concurrent ThingsBoard reconciliation for bulk device changes.
+
+``Device.save()`` reconciles one device at a time with blocking requests:
+search by name, create, credentials, label and shared attributes.
+``ThingsBoardSync`` does the same work for a whole list of devices over one
+aiohttp session, with at most ``concurrency`` devices in flight. It never
+touches the database. ``run`` returns the ``thingsboard_id`` and token of
+every device, so the caller stores them with one bulk update instead of a
+``save()`` per device.
+
+A device that already has a ``thingsboard_id`` is renamed in place: its
+name and label are posted with its id. Callers only pass an id when the
+remote device belongs to this instance; rows copied from another instance
+(a restored template, an imported fixture) have theirs cleared first. A
+device without one, or whose remote device is gone, is looked up by name
+and created when missing, as ``Device.save()`` does.
+
+``sync_devices`` is the Django side: it builds the items from a ``Device``
+queryset (``sync_items``), runs the sync against the active gateway and
+stores the results.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import time
+from collections import namedtuple
+from urllib.parse import quote_plus
+
+
+# label: "System - Unit" as Device.save() writes it; attributes: the shared RPC metadata ({} for none)
+SyncItem = namedtuple("SyncItem", "pk name device_type label thingsboard_id attributes")
+SyncResult = namedtuple("SyncResult", "pk thingsboard_id token")
+
+
+def device_label(system, unit) -> str:
+    if system and unit:
+        return f"{system} - {unit}"
+    return system or unit or ""
+
+
+class ThingsBoardSync:
+    def __init__(self, api_url, headers, refresh_headers=None, concurrency: int = 16, retries: int = 4,
+                 timeout: float = 10.0):
+        """``refresh_headers()`` returns fresh management headers after a 401 (it may block; it runs on a thread)."""
+        if concurrency < 1 or retries < 0:
+            raise ValueError("concurrency must be >= 1 and retries >= 0")
+        self.api_url = api_url.rstrip("/")
+        self.headers = dict(headers)
+        self.refresh_headers = refresh_headers
+        self.concurrency = concurrency
+        self.retries = retries
+        self.timeout = timeout
+        self.session = None
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.renamed = 0
+        self.created = 0
+        self.adopted = 0
+        self.requests = 0
+        self.retried = 0
+        self.errors = {}  # device name -> last error, first 20
+        self._started = None
+
+    def open(self):
+        """Start the pooled session (at most ``concurrency`` connections); ``run`` opens and closes its own."""
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def run(self, items, progress=None, progress_interval: float = 5.0) -> list:
+        """Reconcile ``items``; ``progress(snapshot)`` is called every ``progress_interval`` seconds and at the end."""
+        items = list(items)
+        self.total += len(items)
+        self._started = time.monotonic()
+        queue = asyncio.Queue()
+        for item in items:
+            queue.put_nowait(item)
+        results = []
+
+        async def worker():
+            while True:
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    results.append(await self.sync(item))
+                except Exception as exc:
+                    self.failed += 1
+                    if len(self.errors) < 20:
+                        self.errors[item.name] = f"{type(exc).__name__}: {exc}"
+                finally:
+                    self.done += 1
+
+        async def reporter():
+            while True:
+                await asyncio.sleep(progress_interval)
+                progress(self.snapshot())
+
+        self.open()
+        report_task = asyncio.create_task(reporter()) if progress is not None and progress_interval > 0 else None
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(items)) or 1)))
+        finally:
+            if report_task is not None:
+                report_task.cancel()
+            await self.close()
+        if progress is not None:
+            progress(self.snapshot())
+        return results
+
+    async def _request(self, method, path, **kwargs):
+        """``(status, body)``; body is the decoded JSON, or the text when it is not JSON. Retries 401, 5xx and I/O errors."""
+        import aiohttp
+
+        refreshed = False
+        attempt = 0
+        while True:
+            self.requests += 1
+            try:
+                async with self.session.request(method, f"{self.api_url}{path}", headers=self.headers,
+                                                **kwargs) as response:
+                    text = await response.text()
+                    status = response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt >= self.retries:
+                    raise
+            else:
+                if status == 401 and not refreshed and self.refresh_headers is not None:
+                    refreshed = True
+                    self.headers = dict(await asyncio.to_thread(self.refresh_headers))
+                    continue
+                if status < 500 or attempt >= self.retries:
+                    try:
+                        return status, json.loads(text) if text else None
+                    except ValueError:
+                        return status, text
+            attempt += 1
+            self.retried += 1
+            await asyncio.sleep(min(0.5 * 2 ** attempt, 10) + random.uniform(0, 0.25))
+
+    async def sync(self, item) -> SyncResult:
+        device = None
+        if item.thingsboard_id:
+            status, body = await self._request("GET", f"/device/{item.thingsboard_id}")
+            if status == 200 and isinstance(body, dict):
+                device = body
+            elif status != 404:
+                raise RuntimeError(f"device lookup answered {status}")
+        fresh = device is None
+        if device is not None and (device.get("name") != item.name or (device.get("label") or "") != item.label):
+            status, body = await self._request("POST", "/device", json={**device, "name": item.name, "label": item.label})
+            if status == 200:
+                self.renamed += 1
+            elif _already_exists(status, body):
+                # another device already has the new name: use it, as Device.save() would
+                fresh = True
+            else:
+                raise RuntimeError(f"rename answered {status}: {str(body)[:200]}")
+        tb_id = await self._ensure(item) if fresh else item.thingsboard_id
+
+        status, body = await self._request("GET", f"/device/{tb_id}/credentials")
+        if status != 200 or not isinstance(body, dict) or not body.get("credentialsId"):
+            raise RuntimeError(f"credentials answered {status}")
+        token = body["credentialsId"]
+        if fresh and item.attributes:
+            status, body = await self._request("POST", f"/plugins/telemetry/DEVICE/{tb_id}/SHARED_SCOPE",
+                                               json=item.attributes)
+            if status not in (200, 201):
+                raise RuntimeError(f"shared attributes answered {status}")
+        return SyncResult(item.pk, tb_id, token)
+
+    async def delete(self, thingsboard_id) -> bool:
+        """Delete a remote device; False when it was already gone."""
+        status, body = await self._request("DELETE", f"/device/{thingsboard_id}")
+        if status == 404:
+            return False
+        if status != 200:
+            raise RuntimeError(f"delete answered {status}: {str(body)[:200]}")
+        return True
+
+    async def _ensure(self, item) -> str:
+        """Id of the remote device named ``item.name``, created (with its label) when there is none."""
+        for _ in range(3):
+            status, body = await self._request("GET", f"/tenant/devices?deviceName={quote_plus(item.name)}")
+            if status == 200 and isinstance(body, dict) and (body.get("id") or {}).get("id"):
+                self.adopted += 1
+                if (body.get("label") or "") != item.label:
+                    await self._request("POST", "/device", json={**body, "label": item.label})
+                return body["id"]["id"]
+            payload = {"name": item.name, "type": item.device_type or "default", "label": item.label}
+            status, body = await self._request("POST", "/device", json=payload)
+            if status in (200, 201) and isinstance(body, dict) and (body.get("id") or {}).get("id"):
+                self.created += 1
+                return body["id"]["id"]
+            if not _already_exists(status, body):
+                raise RuntimeError(f"create answered {status}: {str(body)[:200]}")
+            # created concurrently by someone else: search again
+        raise RuntimeError("device conflicts on create but is not found by name")
+
+    def snapshot(self) -> dict:
+        elapsed = time.monotonic() - self._started if self._started is not None else 0.0
+        return {
+            "done": self.done,
+            "total": self.total,
+            "failed": self.failed,
+            "renamed": self.renamed,
+            "created": self.created,
+            "adopted": self.adopted,
+            "requests": self.requests,
+            "retried": self.retried,
+            "elapsed_s": round(elapsed, 2),
+            "devices_per_sec": round(self.done / elapsed, 1) if elapsed > 0 else None,
+        }
+
+
+def sync_items(devices) -> list:
+    """``SyncItem`` of every device of the ``devices`` queryset."""
+    from devices.models import DEVICE_RPC_METADATA
+
+    return [
+        SyncItem(
+            device.pk, device.device_id, device.device_type.name,
+            device_label(device.system.name if device.system else None, device.unit.name if device.unit else None),
+            device.thingsboard_id, DEVICE_RPC_METADATA.get(device.device_type.name.lower(), {}),
+        )
+        for device in devices.select_related("device_type", "system", "unit")
+    ]
+
+
+def sync_devices(devices, concurrency: int = 16, progress=None, progress_interval: float = 5.0) -> ThingsBoardSync:
+    """Reconcile the ``devices`` queryset with ThingsBoard; raises RuntimeError when no gateway is usable."""
+    from devices.models import Device
+    from devices.thingsboard_gateway import get_active_gateway, get_gateway_connection, get_management_headers
+
+    try:
+        gateway = get_active_gateway(required=True)
+        api_url = f"{get_gateway_connection(gateway).base_url}/api"
+        headers = get_management_headers(gateway=gateway)
+    except Exception as exc:
+        raise RuntimeError(f"GatewayIOT ativo nao configurado/valido: {exc}") from exc
+    items = sync_items(devices)
+    sync = ThingsBoardSync(
+        api_url, headers, refresh_headers=lambda: get_management_headers(gateway=gateway, force_refresh=True),
+        concurrency=concurrency,
+    )
+    results = asyncio.run(sync.run(items, progress=progress, progress_interval=progress_interval))
+    # ids and tokens in bulk; Device.save() would reconcile every row again
+    Device.objects.bulk_update(
+        [Device(pk=result.pk, thingsboard_id=result.thingsboard_id, token=result.token) for result in results],
+        ["thingsboard_id", "token"], batch_size=500,
+    )
+    return sync
+
+
+def _already_exists(status, body) -> bool:
+    return status == 409 or (status == 400 and "already exists" in str(body))
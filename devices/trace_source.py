@@ -0,0 +1,289 @@
+"""Trace-driven telemetry for ``send_telemetry --trace``.
+
+Instead of the ``--randomize`` random walks, devices publish the rows of a
+recorded sensor dataset. The dataset flows through a chain of generators,
+so only the row being routed (plus the file buffer) is held in memory,
+whatever the size of the file:
+
+    read_lines -> csv_samples / line_protocol_samples -> play_trace
+
+Formats:
+
+* CSV with a header row. One column holds the time, one the device key;
+  every other non-empty column is a field.
+* Influx line protocol. The key is a tag, the fields are the fields and the
+  time is the line timestamp (nanoseconds).
+
+A key is matched against device ids first, then against unit names; a row
+for a unit goes to every device of the unit that reports one of its fields
+(see ``TraceRouter``). Files ending in ``.gz`` are decompressed on the fly.
+"""
+from __future__ import annotations
+
+import asyncio
+import csv
+import gzip
+from collections import namedtuple
+from datetime import datetime
+
+from devices.sim_clock import REAL_CLOCK
+
+
+FORMAT_CSV = "csv"
+FORMAT_LINE = "line"
+TRACE_FORMATS = ("auto", FORMAT_CSV, FORMAT_LINE)
+TIME_COLUMNS = ("time", "timestamp", "_time", "ts", "datetime")
+KEY_COLUMNS = ("device_id", "unit")
+
+# ts is in seconds; absolute (epoch) or relative, only differences matter
+TraceSample = namedtuple("TraceSample", "ts key values")
+
+
+def read_lines(path, chunk_size: int = 1 << 20):
+    """Text lines of ``path`` read through a ``chunk_size`` buffer."""
+    if str(path).endswith(".gz"):
+        f = gzip.open(path, "rt", encoding="utf-8", newline="")
+    else:
+        f = open(path, "r", encoding="utf-8", newline="", buffering=chunk_size)
+    with f:
+        yield from f
+
+
+def detect_format(path) -> str:
+    name = str(path).lower().removesuffix(".gz")
+    if name.endswith(".csv"):
+        return FORMAT_CSV
+    if name.endswith((".lp", ".line", ".influx")):
+        return FORMAT_LINE
+    for line in read_lines(path):
+        line = line.strip()
+        if line and not line.startswith("#"):
+            # a CSV header has no "field=value" part
+            return FORMAT_LINE if "=" in line else FORMAT_CSV
+    return FORMAT_CSV
+
+
+def parse_time(value) -> float:
+    """Seconds from an epoch number (s, ms, us or ns, told apart by magnitude) or an ISO-8601 string."""
+    try:
+        number = float(value)
+    except ValueError:
+        return datetime.fromisoformat(value.strip().replace("Z", "+00:00")).timestamp()
+    for scale in (1e18, 1e15, 1e12):
+        if abs(number) >= scale / 1e2:
+            return number / (scale / 1e9)
+    return number
+
+
+def parse_value(text):
+    text = text.strip()
+    low = text.lower()
+    if low in ("true", "t"):
+        return True
+    if low in ("false", "f"):
+        return False
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def csv_samples(lines, time_column=None, key_column=None):
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    header = [name.strip() for name in header]
+    time_index = _column(header, time_column, TIME_COLUMNS, "time")
+    key_index = _column(header, key_column, KEY_COLUMNS, "key")
+    fields = [(i, name) for i, name in enumerate(header) if i not in (time_index, key_index)]
+    for row in reader:
+        if len(row) <= max(time_index, key_index) or not row[time_index].strip():
+            continue
+        values = {name: parse_value(row[i]) for i, name in fields if i < len(row) and row[i].strip()}
+        if values:
+            yield TraceSample(parse_time(row[time_index]), row[key_index].strip(), values)
+
+
+def _column(header, wanted, candidates, what):
+    names = [wanted] if wanted else candidates
+    lowered = [name.lower() for name in header]
+    for name in names:
+        if name.lower() in lowered:
+            return lowered.index(name.lower())
+    raise ValueError(f"trace has no {what} column (looked for {', '.join(names)}; header: {', '.join(header)})")
+
+
+def line_protocol_samples(lines, key_column=None):
+    keys = (key_column,) if key_column else KEY_COLUMNS
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = _split(line, " ")
+        if len(parts) < 2:
+            continue
+        tags = dict(_pair(item) for item in _split(parts[0], ",")[1:])
+        key = next((tags[k] for k in keys if k in tags), None)
+        if key is None:
+            continue
+        values = {}
+        for item in _split(parts[1], ","):
+            name, raw = _pair(item)
+            if raw.startswith('"'):
+                values[name] = raw[1:-1].replace('\\"', '"')
+            else:
+                values[name] = parse_value(raw[:-1] if raw[-1:] in ("i", "u") and raw[:-1].lstrip("-").isdigit() else raw)
+        ts = parse_time(parts[2]) if len(parts) > 2 else 0.0
+        yield TraceSample(ts, key, values)
+
+
+def _split(text, separator):
+    """Split on ``separator`` outside double quotes, honouring backslash escapes."""
+    parts, current, quoted, escaped = [], [], False, False
+    for char in text:
+        if escaped:
+            current.append(char)
+            escaped = False
+        elif char == "\\":
+            current.append(char)
+            escaped = True
+        elif char == '"':
+            current.append(char)
+            quoted = not quoted
+        elif char == separator and not quoted:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append("".join(current))
+    return parts
+
+
+def _pair(item):
+    name, _, value = item.partition("=")
+    return _unescape(name), value if value.startswith('"') else _unescape(value)
+
+
+def _unescape(text):
+    return text.replace("\\ ", " ").replace("\\,", ",").replace("\\=", "=").replace("\\\\", "\\")
+
+
+def read_trace(path, fmt="auto", time_column=None, key_column=None, chunk_size: int = 1 << 20):
+    if fmt == "auto":
+        fmt = detect_format(path)
+    lines = read_lines(path, chunk_size)
+    if fmt == FORMAT_CSV:
+        return csv_samples(lines, time_column, key_column)
+    if fmt == FORMAT_LINE:
+        return line_protocol_samples(lines, key_column)
+    raise ValueError(f"unknown trace format: {fmt}")
+
+
+class TraceRouter:
+    """Maps trace keys to devices: a device id, else a unit name (case-insensitive)."""
+
+    def __init__(self, properties_for=None):
+        # properties_for(device_type, values) -> names the device reports; None sends every field
+        self.properties_for = properties_for
+        self._devices = {}
+        self._units = {}
+        self.unmatched = {}
+
+    def add(self, device_id, unit=None, device_type=""):
+        self._devices[device_id] = device_type
+        if unit:
+            self._units.setdefault(unit.lower(), []).append(device_id)
+
+    def route(self, sample):
+        """``[(device_id, values), ...]`` for one sample."""
+        if sample.key in self._devices:
+            return [(sample.key, sample.values)]
+        members = self._units.get(sample.key.lower())
+        if members is None:
+            if len(self.unmatched) < 100 or sample.key in self.unmatched:
+                self.unmatched[sample.key] = self.unmatched.get(sample.key, 0) + 1
+            return []
+        routed = []
+        for device_id in members:
+            values = sample.values
+            if self.properties_for is not None:
+                wanted = self.properties_for(self._devices[device_id], values)
+                values = {name: values[name] for name in wanted if name in values}
+            if values:
+                routed.append((device_id, values))
+        return routed
+
+
+async def play_trace(samples, router, deliver, speed: float = 1.0, max_inflight: int = 256, meter=None,
+                     clock=REAL_CLOCK):
+    """Deliver every routed sample through ``deliver(device_id, values)``.
+
+    The first sample is sent at once and the others at their offset from it
+    divided by ``speed`` (0 = as fast as possible), in ``clock`` time; rows out
+    of time order go out immediately. Samples of one device are delivered in file order; at
+    most ``max_inflight`` deliveries run at a time.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    clock_started = clock.monotonic()
+    first = None
+    stats = {"samples": 0, "sent": 0, "failed": 0, "unrouted": 0}
+    max_late = 0.0
+    running = set()
+    last = {}  # device_id -> its latest delivery task
+
+    async def run(device_id, values, previous):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await deliver(device_id, values)
+            stats["sent"] += 1
+            if meter is not None:
+                meter.sent += 1
+        except Exception as exc:
+            stats["failed"] += 1
+            if meter is not None:
+                meter.failed += 1
+            if stats["failed"] <= 10:
+                print(f"[trace] delivery to {device_id} failed: {type(exc).__name__}: {exc}")
+
+    def finished(task, device_id):
+        running.discard(task)
+        if last.get(device_id) is task:
+            del last[device_id]
+
+    for sample in samples:
+        stats["samples"] += 1
+        if first is None:
+            first = sample.ts
+        if speed > 0:
+            delay = clock_started + max(sample.ts - first, 0.0) / speed - clock.monotonic()
+            if delay > 0:
+                await clock.sleep(delay)
+            else:
+                max_late = max(max_late, -delay)
+        routed = router.route(sample)
+        if not routed:
+            stats["unrouted"] += 1
+            continue
+        for device_id, values in routed:
+            while len(running) >= max_inflight:
+                await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            task = loop.create_task(run(device_id, values, last.get(device_id)))
+            running.add(task)
+            last[device_id] = task
+            task.add_done_callback(lambda t, d=device_id: finished(t, d))
+    if running:
+        await asyncio.wait(running)
+    elapsed = max(loop.time() - started, 1e-9)
+    return {
+        **stats,
+        "elapsed_s": round(elapsed, 3),
+        "per_sec": round(stats["sent"] / elapsed, 1),
+        "max_late_ms": round(max_late * 1000.0, 1),
+    }
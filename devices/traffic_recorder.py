@@ -0,0 +1,191 @@
+"""Record and replay of the simulator's MQTT traffic.
+
+``send_telemetry --record FILE`` appends every telemetry publish, every RPC
+request received and every RPC response to a compact binary file;
+``replay_traffic FILE`` reads it back through ``mmap`` and re-publishes the
+device-side traffic with the original spacing (or faster), without any state
+generation, database or Influx work.
+
+File layout: ``MAGIC`` followed by records, each a ``HEADER`` plus data.
+
+* kind ``DEFINE`` - ``ref`` is a new token id, the data is the token.
+* other kinds - ``at`` is seconds since the recording started, ``ref`` the
+  token id, and the data is ``topic_len`` bytes of topic then ``data_len``
+  bytes of payload.
+
+Tokens repeat on every record, so they are written once and referenced by id.
+"""
+from __future__ import annotations
+
+import asyncio
+import mmap
+import struct
+import time
+from collections import namedtuple
+
+
+MAGIC = b"IOTSIMREC1\n"
+HEADER = struct.Struct("<BdIHI")  # kind, at, ref, topic_len, data_len
+
+DEFINE = 0
+TELEMETRY = 1
+RPC_REQUEST = 2
+RPC_RESPONSE = 3
+KIND_NAMES = {TELEMETRY: "telemetry", RPC_REQUEST: "rpc_request", RPC_RESPONSE: "rpc_response"}
+# what a device sends; RPC requests come from the server side and are not replayed
+DEVICE_KINDS = (TELEMETRY, RPC_RESPONSE)
+
+TrafficEvent = namedtuple("TrafficEvent", "kind at token topic payload")
+
+
+class TrafficRecorder:
+    """Buffered append-only writer; one instance per recording."""
+
+    def __init__(self, path, flush_bytes: int = 1 << 16):
+        self.path = path
+        self.flush_bytes = flush_bytes
+        self.records = 0
+        self.bytes = 0  # written to the file so far
+        self._ids = {}
+        self._buffer = bytearray(MAGIC)
+        self._started = time.monotonic()
+        self._file = open(path, "wb")
+
+    def record(self, kind, token, topic, payload):
+        token = token or ""
+        ref = self._ids.get(token)
+        if ref is None:
+            ref = self._ids[token] = len(self._ids)
+            data = token.encode()
+            self._buffer += HEADER.pack(DEFINE, 0.0, ref, 0, len(data))
+            self._buffer += data
+        topic = str(topic).encode()
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self._buffer += HEADER.pack(kind, time.monotonic() - self._started, ref, len(topic), len(payload))
+        self._buffer += topic
+        self._buffer += payload
+        self.records += 1
+        if len(self._buffer) >= self.flush_bytes:
+            self.flush()
+
+    def flush(self):
+        if self._buffer and self._file is not None:
+            self._file.write(self._buffer)
+            self.bytes += len(self._buffer)
+            self._buffer = bytearray()
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def snapshot(self) -> dict:
+        return {"records": self.records, "devices": len(self._ids), "bytes": self.bytes + len(self._buffer)}
+
+
+class TrafficReader:
+    """Iterates a recording through a read-only memory map."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            self._file.close()
+            raise ValueError(f"{path} is not a traffic recording")
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a traffic recording")
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        data = self._map
+        tokens = {}
+        offset, end = len(MAGIC), len(data)
+        while offset + HEADER.size <= end:
+            kind, at, ref, topic_len, data_len = HEADER.unpack_from(data, offset)
+            offset += HEADER.size
+            if offset + topic_len + data_len > end:
+                break  # truncated tail (recording interrupted mid-write)
+            if kind == DEFINE:
+                tokens[ref] = data[offset:offset + data_len].decode()
+            else:
+                topic = data[offset:offset + topic_len].decode()
+                payload = data[offset + topic_len:offset + topic_len + data_len]
+                yield TrafficEvent(kind, at, tokens.get(ref, ""), topic, payload)
+            offset += topic_len + data_len
+
+    def tokens(self) -> list:
+        """Device tokens in order of first appearance, read from the DEFINE records only."""
+        data = self._map
+        found = []
+        offset, end = len(MAGIC), len(data)
+        while offset + HEADER.size <= end:
+            kind, _, _, topic_len, data_len = HEADER.unpack_from(data, offset)
+            offset += HEADER.size
+            if kind == DEFINE and offset + data_len <= end:
+                found.append(data[offset:offset + data_len].decode())
+            offset += topic_len + data_len
+        return found
+
+    def summary(self) -> dict:
+        counts = {name: 0 for name in KIND_NAMES.values()}
+        last = 0.0
+        for event in self:
+            name = KIND_NAMES.get(event.kind, "unknown")
+            counts[name] = counts.get(name, 0) + 1
+            last = event.at
+        return {"devices": len(self.tokens()), "duration_s": round(last, 3), **counts}
+
+
+async def replay(events, publish, speed: float = 1.0, kinds=DEVICE_KINDS):
+    """Re-publish ``events`` through ``publish(token, topic, payload)``.
+
+    With ``speed`` > 0 event ``at`` times are divided by it and honoured
+    (a late publish is not made up for by sending the next ones early);
+    with ``speed`` == 0 everything is sent as fast as ``publish`` allows.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    sent = skipped = failed = 0
+    max_late = 0.0
+    for event in events:
+        if event.kind not in kinds:
+            skipped += 1
+            continue
+        if speed > 0:
+            due = started + event.at / speed
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                max_late = max(max_late, -delay)
+        try:
+            await publish(event.token, event.topic, event.payload)
+            sent += 1
+        except Exception as exc:
+            failed += 1
+            if failed <= 10:
+                print(f"[replay] publish to {event.topic} failed: {type(exc).__name__}: {exc}")
+    elapsed = max(loop.time() - started, 1e-9)
+    return {
+        "sent": sent,
+        "skipped": skipped,
+        "failed": failed,
+        "elapsed_s": round(elapsed, 3),
+        "per_sec": round(sent / elapsed, 1),
+        "max_late_ms": round(max_late * 1000.0, 1),
+    }
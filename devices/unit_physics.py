@@ -0,0 +1,311 @@
+"""Coupled room-level physics for ``send_telemetry --physics``.
+
+With ``--randomize`` every device follows its own random walk, so switching
+an air conditioner on does nothing to the temperature it reports.
+``UnitPhysics`` groups the devices of each unit into zones and evolves one
+state per zone from the actuators in it. A device's zone is its id without
+the last `` - `` part: ``House 3 - Room 1 - AirConditioner1`` and
+``House 3 - Room 1 - LightBulb`` share ``House 3 - Room 1``.
+
+* Air temperature relaxes towards the outdoor temperature (a daily cycle)
+  plus the heat of the lamps that are on. Every air conditioner that is on
+  pulls it towards its set point (``setTemperature``), and the air humidity
+  towards its humidity set point (``setHumidity``).
+* Soil humidity dries out towards ``soil_dry`` and rises towards
+  ``soil_wet`` while an irrigation valve of the zone is on.
+
+Each quantity follows ``x' = sum_i k_i (target_i - x)``, integrated exactly
+over the step (``x_eq + (x - x_eq) exp(-k dt)``), so a long simulated step is
+as stable as a short one. The whole fleet is stepped at once: the first
+device that reads its values in a tick advances every zone by the simulated
+time since the last step, with array operations (numpy when it is installed,
+else plain lists), and the other devices of the tick read the result.
+Sensors report their zone's values plus a little gaussian noise.
+"""
+from __future__ import annotations
+
+import math
+import random
+import time
+from dataclasses import dataclass
+
+try:
+    import numpy as np
+except ImportError:  # the list backend runs the same model, zone by zone
+    np = None
+
+
+BACKEND_NUMPY = "numpy"
+BACKEND_PYTHON = "python"
+BACKENDS = (BACKEND_NUMPY, BACKEND_PYTHON)
+
+# actuator kinds
+AC = 0
+LAMP = 1
+IRRIGATION = 2
+
+# zone quantities
+TEMPERATURE = 0
+HUMIDITY = 1
+SOIL = 2
+
+# device type -> (actuator kind or None, (state key, zone quantity) pairs the device reports)
+DEVICE_ROLES = {
+    "airconditioner": (AC, (("temperature", TEMPERATURE), ("humidity", HUMIDITY))),
+    "led": (LAMP, ()),
+    "lightbulb": (LAMP, ()),
+    "irrigation": (IRRIGATION, ()),
+    "temperature sensor": (None, (("temperature", TEMPERATURE), ("humidity", HUMIDITY))),
+    "dht22": (None, (("temperature", TEMPERATURE), ("humidity", HUMIDITY))),
+    "soilhumidity sensor": (None, (("humidity", SOIL),)),
+    "soil humidity sensor": (None, (("humidity", SOIL),)),
+}
+
+
+@dataclass
+class PhysicsParams:
+    outdoor_temperature: float = 26.0  # daily mean, degC
+    outdoor_swing: float = 4.0  # +/- around the mean
+    warmest_hour: float = 15.0  # local time
+    utc_offset: float = -3.0  # hours; sets local time for the daily cycle
+    outdoor_humidity: float = 70.0
+    envelope_tau: float = 3600.0  # seconds for a room to follow the outdoors
+    ac_tau: float = 900.0  # seconds for one air conditioner to reach its set point
+    ac_setpoint: float = 22.0
+    ac_humidity: float = 50.0
+    lamp_heat: float = 0.3  # degC a lamp that is on adds to the room's equilibrium
+    soil_initial: float = 50.0
+    soil_dry: float = 20.0
+    soil_dry_tau: float = 6 * 3600.0
+    soil_wet: float = 90.0
+    irrigation_tau: float = 1200.0
+    noise: float = 0.05  # standard deviation of the sensor readings
+    min_step: float = 1.0  # simulated seconds; reads closer together share a step
+
+    def __post_init__(self):
+        if min(self.envelope_tau, self.ac_tau, self.soil_dry_tau, self.irrigation_tau) <= 0:
+            raise ValueError("time constants must be > 0")
+        if self.noise < 0 or self.min_step < 0:
+            raise ValueError("noise and min_step must be >= 0")
+
+    def outdoor(self, now: float) -> float:
+        hour = (now / 3600.0 + self.utc_offset) % 24.0
+        return self.outdoor_temperature + self.outdoor_swing * math.cos(2 * math.pi * (hour - self.warmest_hour) / 24.0)
+
+
+def zone_of(device_id: str) -> str:
+    head, sep, _ = device_id.rpartition(" - ")
+    return head if sep else device_id
+
+
+class UnitPhysics:
+    def __init__(self, params: PhysicsParams | None = None, backend: str | None = None, seed=None):
+        if backend is None:
+            backend = BACKEND_NUMPY if np is not None else BACKEND_PYTHON
+        if backend not in BACKENDS:
+            raise ValueError(f"backend must be one of {', '.join(BACKENDS)}")
+        if backend == BACKEND_NUMPY and np is None:
+            raise ValueError("the numpy backend needs numpy installed")
+        self.params = params or PhysicsParams()
+        self.backend = backend
+        self._rng = np.random.default_rng(seed) if backend == BACKEND_NUMPY else random.Random(seed)
+        self._zones = {}  # (unit, zone) -> index
+        self._seeded = set()  # (zone index, quantity) taken from a device state
+        self._devices = {}  # device_id -> (actuator index or None, ((state key, probe index), ...))
+        # lists while devices are added; numpy arrays between adds with the numpy backend
+        self._state = [[], [], []]  # TEMPERATURE, HUMIDITY, SOIL x zone
+        self._act_zone = []
+        self._act_kind = []
+        self._on = []
+        self._setpoint = []
+        self._humidity_setpoint = []
+        self._probe_zone = []
+        self._probe_quantity = []
+        self._readings = []
+        self._compiled = False
+        self._last = None
+        self.steps = 0
+        self.step_seconds = 0.0
+        self.max_step_ms = 0.0
+
+    def __contains__(self, device_id):
+        return device_id in self._devices
+
+    def __len__(self):
+        return len(self._devices)
+
+    def add(self, device_id, device_type, state=None, unit=None) -> bool:
+        """Put a device in its zone; False for types the model does not cover (they keep ``--randomize``)."""
+        role = DEVICE_ROLES.get((device_type or "").lower())
+        if role is None:
+            return False
+        self._decompile()
+        state = state if isinstance(state, dict) else {}
+        kind, reports = role
+        key = (unit, zone_of(device_id))
+        zone = self._zones.get(key)
+        if zone is None:
+            zone = self._zones[key] = len(self._zones)
+            p = self.params
+            for quantity, value in ((TEMPERATURE, p.outdoor_temperature), (HUMIDITY, p.outdoor_humidity),
+                                    (SOIL, p.soil_initial)):
+                self._state[quantity].append(value)
+        actuator = None
+        if kind is not None:
+            actuator = len(self._act_zone)
+            self._act_zone.append(zone)
+            self._act_kind.append(kind)
+            self._on.append(1.0 if state.get("status") else 0.0)
+            self._setpoint.append(float(state.get("setpoint", self.params.ac_setpoint)))
+            self._humidity_setpoint.append(float(state.get("humidity_setpoint", self.params.ac_humidity)))
+        probes = []
+        for name, quantity in reports:
+            # the first device of a zone that knows a value starts the zone from it
+            if isinstance(state.get(name), (int, float)) and (zone, quantity) not in self._seeded:
+                self._state[quantity][zone] = float(state[name])
+                self._seeded.add((zone, quantity))
+            probes.append((name, len(self._probe_zone)))
+            self._probe_zone.append(zone)
+            self._probe_quantity.append(quantity)
+        self._devices[device_id] = (actuator, tuple(probes))
+        return True
+
+    def _compile(self):
+        if self.backend == BACKEND_NUMPY:
+            self._state = np.array(self._state, dtype=float).reshape(3, len(self._zones))
+            self._act_zone = np.array(self._act_zone, dtype=np.intp)
+            self._act_kind = np.array(self._act_kind, dtype=np.intp)
+            self._on = np.array(self._on, dtype=float)
+            self._setpoint = np.array(self._setpoint, dtype=float)
+            self._humidity_setpoint = np.array(self._humidity_setpoint, dtype=float)
+            self._probe_zone = np.array(self._probe_zone, dtype=np.intp)
+            self._probe_quantity = np.array(self._probe_quantity, dtype=np.intp)
+        self._compiled = True
+
+    def _decompile(self):
+        """Back to lists so a device can be added; the values reached so far are kept."""
+        if not self._compiled:
+            return
+        if self.backend == BACKEND_NUMPY:
+            for name in ("_state", "_act_zone", "_act_kind", "_on", "_setpoint", "_humidity_setpoint",
+                         "_probe_zone", "_probe_quantity"):
+                setattr(self, name, getattr(self, name).tolist())
+        self._compiled = False
+
+    def advance(self, now: float):
+        """Step every zone up to ``now`` (clock seconds), unless the last step is closer than ``min_step``."""
+        if self._compiled and self._last is not None and now - self._last < self.params.min_step:
+            return
+        if not self._compiled:
+            self._compile()
+        dt = max(0.0, now - self._last) if self._last is not None else 0.0
+        started = time.perf_counter()
+        outdoor = self.params.outdoor(now)
+        if self.backend == BACKEND_NUMPY:
+            self._step_numpy(dt, outdoor)
+        else:
+            self._step_python(dt, outdoor)
+        elapsed = time.perf_counter() - started
+        self._last = now
+        self.steps += 1
+        self.step_seconds += elapsed
+        self.max_step_ms = max(self.max_step_ms, elapsed * 1000.0)
+
+    def _step_numpy(self, dt, outdoor):
+        p = self.params
+        zones = len(self._zones)
+        kind, zone, on = self._act_kind, self._act_zone, self._on
+        cooling = on * (kind == AC)
+        acs = np.bincount(zone, weights=cooling, minlength=zones)
+        ac_target = np.bincount(zone, weights=cooling * self._setpoint, minlength=zones)
+        ac_humidity = np.bincount(zone, weights=cooling * self._humidity_setpoint, minlength=zones)
+        lamps = np.bincount(zone, weights=on * (kind == LAMP), minlength=zones)
+        valves = np.bincount(zone, weights=on * (kind == IRRIGATION), minlength=zones)
+
+        k_env = 1.0 / p.envelope_tau
+        k_air = k_env + acs / p.ac_tau
+        decay = np.exp(-k_air * dt)
+        temperature_eq = (k_env * (outdoor + p.lamp_heat * lamps) + ac_target / p.ac_tau) / k_air
+        humidity_eq = (k_env * p.outdoor_humidity + ac_humidity / p.ac_tau) / k_air
+        k_soil = 1.0 / p.soil_dry_tau + valves / p.irrigation_tau
+        soil_eq = (p.soil_dry / p.soil_dry_tau + valves * p.soil_wet / p.irrigation_tau) / k_soil
+
+        state = self._state
+        state[TEMPERATURE] = temperature_eq + (state[TEMPERATURE] - temperature_eq) * decay
+        state[HUMIDITY] = humidity_eq + (state[HUMIDITY] - humidity_eq) * decay
+        state[SOIL] = soil_eq + (state[SOIL] - soil_eq) * np.exp(-k_soil * dt)
+        values = state[self._probe_quantity, self._probe_zone]
+        if p.noise:
+            values = values + self._rng.normal(0.0, p.noise, len(values))
+        self._readings = np.round(values, 2).tolist()
+
+    def _step_python(self, dt, outdoor):
+        p = self.params
+        zones = len(self._zones)
+        acs, ac_target, ac_humidity = [0.0] * zones, [0.0] * zones, [0.0] * zones
+        lamps, valves = [0.0] * zones, [0.0] * zones
+        for zone, kind, on, setpoint, humidity in zip(self._act_zone, self._act_kind, self._on, self._setpoint,
+                                                      self._humidity_setpoint):
+            if not on:
+                continue
+            if kind == AC:
+                acs[zone] += on
+                ac_target[zone] += on * setpoint
+                ac_humidity[zone] += on * humidity
+            elif kind == LAMP:
+                lamps[zone] += on
+            else:
+                valves[zone] += on
+
+        k_env = 1.0 / p.envelope_tau
+        temperature, humidity, soil = self._state
+        for zone in range(zones):
+            k_air = k_env + acs[zone] / p.ac_tau
+            decay = math.exp(-k_air * dt)
+            eq = (k_env * (outdoor + p.lamp_heat * lamps[zone]) + ac_target[zone] / p.ac_tau) / k_air
+            temperature[zone] = eq + (temperature[zone] - eq) * decay
+            eq = (k_env * p.outdoor_humidity + ac_humidity[zone] / p.ac_tau) / k_air
+            humidity[zone] = eq + (humidity[zone] - eq) * decay
+            k_soil = 1.0 / p.soil_dry_tau + valves[zone] / p.irrigation_tau
+            eq = (p.soil_dry / p.soil_dry_tau + valves[zone] * p.soil_wet / p.irrigation_tau) / k_soil
+            soil[zone] = eq + (soil[zone] - eq) * math.exp(-k_soil * dt)
+        gauss, noise = self._rng.gauss, p.noise
+        self._readings = [
+            round(self._state[quantity][zone] + (gauss(0.0, noise) if noise else 0.0), 2)
+            for quantity, zone in zip(self._probe_quantity, self._probe_zone)
+        ]
+
+    def reading(self, device_id) -> dict:
+        """The values a device reports from its zone at the last step; ``{}`` for a pure actuator."""
+        _, probes = self._devices[device_id]
+        if not self._compiled:
+            return {}
+        return {name: self._readings[index] for name, index in probes}
+
+    def actuate(self, device_id, now: float, status=None, setpoint=None, humidity_setpoint=None):
+        """An RPC changed an actuator: the zones run up to ``now`` with the old setting first."""
+        actuator = self._devices.get(device_id, (None,))[0]
+        if actuator is None:
+            return
+        if self._last is not None:
+            self.advance(now)
+        if status is not None:
+            self._on[actuator] = 1.0 if status else 0.0
+        if setpoint is not None:
+            self._setpoint[actuator] = float(setpoint)
+        if humidity_setpoint is not None:
+            self._humidity_setpoint[actuator] = float(humidity_setpoint)
+
+    def snapshot(self) -> dict:
+        temperatures = [value for quantity, value in zip(self._probe_quantity, self._readings) if quantity == TEMPERATURE]
+        return {
+            "backend": self.backend,
+            "devices": len(self._devices),
+            "zones": len(self._zones),
+            "actuators_on": int(sum(self._on)),
+            "steps": self.steps,
+            "step_ms": round(self.step_seconds / self.steps * 1000.0, 3) if self.steps else 0.0,
+            "max_step_ms": round(self.max_step_ms, 3),
+            "outdoor": round(self.params.outdoor(self._last), 2) if self._last is not None else None,
+            "mean_temperature": round(sum(temperatures) / len(temperatures), 2) if temperatures else None,
+        }
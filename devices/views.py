@@ -9,6 +9,7 @@ from django.views.decorators.csrf import csrf_exempt
 from .models import Device, System, Unit, DeviceType, GatewayIOT
 from .rpc_handlers import RPC_HANDLER_REGISTRY
 from .simulator_control import read_recent_logs, start_simulator, stop_simulator, get_runtime_status
+from .thingsboard_deletions import DELETIONS
 from .thingsboard_gateway import get_active_gateway, test_gateway_connection
 
 
@@ -37,6 +38,7 @@ def dashboard(request):
             'units_total': Unit.objects.count(),
             'device_types_total': DeviceType.objects.count(),
         },
+        'thingsboard_deletions': DELETIONS.snapshot(),
         'active_gateway': {
             'id': active_gateway.id,
             'name': active_gateway.name,
@@ -74,6 +76,7 @@ def dashboard_status(request):
             'gateways_total': GatewayIOT.objects.count(),
             'gateways_active': GatewayIOT.objects.filter(is_active=True).count(),
         },
+        'thingsboard_deletions': DELETIONS.snapshot(),
         'active_gateway': {
             'id': active_gateway.id,
             'name': active_gateway.name,
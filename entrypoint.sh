@@ -213,8 +213,13 @@ if [ -n "$1" ]; then
 	SIMULATOR_NUMBER="$1"
 fi
 
-echo "Renomeando devices para este simulador $SIMULATOR_NUMBER..."
-python manage.py rename_devices_for_simulator --sim "$SIMULATOR_NUMBER" || echo "[entrypoint][WARN] Falha ao renomear devices."
+if [ -n "${SIMULATOR_FLEET_FIXTURE:-}" ]; then
+	echo "Carregando fleet de $SIMULATOR_FLEET_FIXTURE para este simulador $SIMULATOR_NUMBER..."
+	python manage.py import_fleet "$SIMULATOR_FLEET_FIXTURE" --sim "$SIMULATOR_NUMBER" --replace || echo "[entrypoint][WARN] Falha ao importar o fleet."
+else
+	echo "Renomeando devices para este simulador $SIMULATOR_NUMBER..."
+	python manage.py rename_devices_for_simulator --sim "$SIMULATOR_NUMBER" --thingsboard-background || echo "[entrypoint][WARN] Falha ao renomear devices."
+fi
 
 # Configura token do InfluxDB (opcional) via env
 if [ -n "$INFLUXDB_TOKEN" ]; then
@@ -76,6 +76,15 @@ WSGI_APPLICATION = 'iot_simulator.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# SQLite pragmas for concurrent readers and one writer (WAL). send_telemetry --db-executor opens its own
+# connections with them (see devices/db_executor.py); SQLITE_WAL applies them to every connection.
+SQLITE_WAL_INIT_COMMAND = (
+    'PRAGMA journal_mode=WAL;'
+    'PRAGMA synchronous=NORMAL;'
+    'PRAGMA temp_store=MEMORY;'
+    'PRAGMA cache_size=-16000'
+)
+
 # Database: support optional Postgres via env, fallback to sqlite
 if os.getenv('POSTGRES_HOST') or os.getenv('POSTGRES_DB'):
     DATABASES = {
@@ -94,8 +103,19 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': sqlite_path,
+            'OPTIONS': {
+                # seconds a connection waits for a lock before "database is locked"
+                'timeout': float(os.getenv('SQLITE_BUSY_TIMEOUT', '20')),
+            },
         }
     }
+    # SQLITE_WAL opens every connection of the process this way (see SQLITE_WAL_INIT_COMMAND)
+    if os.getenv('SQLITE_WAL', '0').lower() in ('1', 'true', 'yes', 'on'):
+        DATABASES['default']['OPTIONS'].update({
+            'init_command': SQLITE_WAL_INIT_COMMAND,
+            # take the write lock when a transaction starts instead of failing to upgrade later
+            'transaction_mode': 'IMMEDIATE',
+        })
 
 
 # Password validation
@@ -152,6 +172,12 @@ THINGSBOARD_PASSWORD = os.getenv('THINGSBOARD_PASSWORD', '')
 THINGSBOARD_MQTT_PORT = int(os.getenv('THINGSBOARD_MQTT_PORT', '1883'))
 THINGSBOARD_MQTT_KEEP_ALIVE = int(os.getenv('THINGSBOARD_MQTT_KEEP_ALIVE', '60'))
 HEARTBEAT_INTERVAL = int(os.getenv('HEARTBEAT_INTERVAL', '5'))
+# Per-device-type / per-system heartbeat overrides (seconds), e.g. '{"led": 1, "airconditioner": 30}'.
+# Kept as the raw JSON (or a dict): send_telemetry parses and validates it, so a typo does not break every command.
+HEARTBEAT_INTERVALS_BY_TYPE = os.getenv('HEARTBEAT_INTERVALS_BY_TYPE', '')
+HEARTBEAT_INTERVALS_BY_SYSTEM = os.getenv('HEARTBEAT_INTERVALS_BY_SYSTEM', '')
+# Fleet-wide telemetry target (messages/second); empty keeps the per-device intervals as-is
+TELEMETRY_TARGET_RATE = float(os.getenv('TELEMETRY_TARGET_RATE', '0') or 0) or None
 
 # URLLC Optimized Settings
 URLLC_MODE = os.getenv('URLLC_MODE', 'False').lower() in ('1', 'true', 'yes')
@@ -162,8 +188,11 @@ URLLC_HTTP_TIMEOUT = int(os.getenv('URLLC_HTTP_TIMEOUT', '3'))  # Lower HTTP tim
 # Apply URLLC settings if enabled
 if URLLC_MODE:
     HEARTBEAT_INTERVAL = URLLC_HEARTBEAT_INTERVAL
-    print(f"[URLLC] Optimized settings applied: heartbeat={HEARTBEAT_INTERVAL}s, mqtt_timeout={URLLC_MQTT_TIMEOUT}s")
 
 ALLOW_THINGSBOARD_DELETE = os.getenv('ALLOW_THINGSBOARD_DELETE', 'True').lower() in ('1', 'true', 'yes')
+# Remote deletions run in the background, this many at a time (devices/thingsboard_deletions.py)
+THINGSBOARD_DELETE_CONCURRENCY = int(os.getenv('THINGSBOARD_DELETE_CONCURRENCY', '8'))
 SIMULATOR_RANDOMIZE_DEFAULT = os.getenv('SIMULATOR_RANDOMIZE_DEFAULT', 'True').lower() in ('1', 'true', 'yes', 'on')
+# Skip the startup ThingsBoard reconciliation for devices that already have a token
+SIMULATOR_FAST_START = os.getenv('SIMULATOR_FAST_START', 'False').lower() in ('1', 'true', 'yes', 'on')
 SIMULATOR_MEMORY_DEFAULT = os.getenv('SIMULATOR_MEMORY_DEFAULT', 'True').lower() in ('1', 'true', 'yes', 'on')
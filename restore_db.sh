@@ -24,7 +24,8 @@ fi
 echo "[restore_db.sh] chamando python manage.py restore_db --keep-current-backup"
 if [ "$FORCE" -eq 1 ]; then
   echo "[restore_db.sh] force mode: removing existing target DB if present"
-  rm -f "$TARGET_DB_CONF_PATH" || true
+  # WAL mode leaves -wal/-shm files next to the database; stale ones would be replayed into the restored file
+  rm -f "$TARGET_DB_CONF_PATH" "$TARGET_DB_CONF_PATH-wal" "$TARGET_DB_CONF_PATH-shm" || true
 fi
 cd "$BASE_DIR" || true
 python manage.py restore_db --keep-current-backup || {
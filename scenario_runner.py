@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 """
 Executa cenários de disponibilidade definidos em CSV:
-start,end,status,stage   (coluna stage é opcional)
+start,end,status,stage,impairment   (colunas stage e impairment são opcionais)
+
+A coluna impairment nomeia um perfil do arquivo passado em --impairment-file;
+o simulador daquele intervalo roda com esse perfil aplicado a todos os devices.
 """
 import argparse
 import csv
@@ -20,13 +23,14 @@ def load_intervals(path):
     ints = []
     for r in rows:
         start, end, status = r["start"], r["end"], r["status"].lower()
-        stage = r.get("stage", "").strip() or "Unnamed stage"
+        stage = (r.get("stage") or "").strip() or "Unnamed stage"
+        impairment = (r.get("impairment") or "").strip() or None
         if status not in {"up", "down"}:
             sys.exit("CSV inválido: status deve ser 'up' ou 'down'.")
         s, e = parse_ts(start), parse_ts(end)
         if e < s:
             sys.exit(f"Intervalo invertido: {start}-{end}")
-        ints.append((s, e, status, stage))
+        ints.append((s, e, status, stage, impairment))
     return ints
 
 def send_once(cmd):
@@ -52,29 +56,35 @@ def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--scenario-file", required=True)
     ap.add_argument("--rate", type=float, default=1.0)
+    ap.add_argument("--impairment-file", help="JSON com perfis de impairment de rede (ver devices/network_impairment.py)")
     args = ap.parse_args()
 
     base_cmd = [sys.executable, "manage.py", "send_telemetry",
                 "--use-influx", "--randomize"]
 
     intervals = load_intervals(args.scenario_file)
+    if any(i[4] for i in intervals) and not args.impairment_file:
+        sys.exit("CSV usa a coluna impairment: informe --impairment-file.")
     t0 = time.time()
     print(f"[{time.strftime('%H:%M:%S')}] ▶️  Executando {len(intervals)} intervalos para devices")
 
     try:
-        for start, end, status, stage in intervals:
+        for start, end, status, stage, impairment in intervals:
             # Aguarda o início do intervalo
             while time.time() - t0 < start:
                 remaining = start - (time.time() - t0)
                 print(f"[{time.strftime('%H:%M:%S')}] ⏳ Aguardando início do intervalo {stage} ({remaining:.1f}s restantes)")
                 time.sleep(0.5)
 
-            print(f"[{time.strftime('%H:%M:%S')}] -- {stage}: {status.upper()} {start}s → {end}s")
+            print(f"[{time.strftime('%H:%M:%S')}] -- {stage}: {status.upper()} {start}s → {end}s" + (f" (impairment={impairment})" if impairment else ""))
 
             # Executa dentro do intervalo
             process = None
             if status == "up":
-                process = send_in_background(base_cmd)
+                cmd = list(base_cmd)
+                if impairment:
+                    cmd += ["--impairment-file", args.impairment_file, "--impairment-profile", impairment]
+                process = send_in_background(cmd)
             elif status == "down":
                 print(f"[{time.strftime('%H:%M:%S')}] 🔴 Status DOWN...")
 